@@ -0,0 +1,11 @@
+#
+# data diff benchmarks: run with python -m benchmarks.datadiff --help
+#
+
+import os
+import sys
+
+# the benchmarks import the packages in src like an installed copy would
+SRC_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+if SRC_PATH not in sys.path:
+    sys.path.insert(0, SRC_PATH)
@@ -0,0 +1,229 @@
+#
+# data diff benchmark runner
+#
+# Generates the table pairs of a suite as SQLite files, runs each engine on
+# each pair in a fresh process, checks the counts against the generator and
+# records wall time, rows per second and peak RSS.  The results are compared
+# to a baseline file, and a run that is slower or larger than its baseline by
+# more than the tolerance fails.
+#
+#   python -m benchmarks.datadiff --suite smoke
+#   python -m benchmarks.datadiff --suite 10m --engine stream --engine checksum --save-baseline
+#
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from typing import Dict, List, Tuple
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import click
+
+import benchmarks
+from benchmarks.datagen import DIVERGENCES, KEY_TYPES, BenchmarkCase, generate_case, read_expected
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows; peak RSS is then not measured
+    resource = None
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIR = os.path.join(BENCHMARK_DIR, 'data')
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baselines.json')
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_REPEAT = 3
+
+# sample mode extrapolates its counts, so it cannot be checked against the generator
+ENGINES = [ 'rows', 'stream', 'checksum', 'partition', 'fingerprint', 'spill', 'serverhash' ]
+# rows mode loads both tables into memory, which does not fit at the large sizes
+STREAMING_ENGINES = [ engine for engine in ENGINES if engine != 'rows' ]
+
+# suite name: (rows per table, engines run by default)
+SUITES = {
+    'smoke': (50000, ENGINES),
+    '1m': (1000000, ENGINES),
+    '10m': (10000000, STREAMING_ENGINES),
+    '100m': (100000000, STREAMING_ENGINES),
+}
+
+
+# every key type with scattered updates, and the other divergences on int keys
+def get_suite_cases(rows:int, width:int = 4, fraction:float = 0.01) -> List[BenchmarkCase]:
+    cases = [ BenchmarkCase(rows, keytype, 'scattered', width, fraction) for keytype in KEY_TYPES ]
+    cases.extend(BenchmarkCase(rows, 'int', divergence, width, fraction)
+                 for divergence in DIVERGENCES if divergence != 'scattered')
+    return cases
+
+# peak resident set size of this process in bytes
+def get_peak_rss() -> int:
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+# Diff the table pair in casedir with one engine.  This runs in its own
+# process, so the peak RSS is that of this engine alone.
+# returns the counts, the seconds the diff took and the peak RSS
+def run_engine(casedir:str, mode:str, options:Dict) -> Tuple[Tuple[int, int, int, int], float, int]:
+    from datacompare.parallel import DatabaseConnector
+    from maindata import diff_table, make_table_diff, read_database_from_env
+    expected = read_expected(casedir)
+    envs = [ os.path.join(casedir, 'db' + str(side) + '.env') for side in (1, 2) ]
+    db1 = read_database_from_env(envs[0])
+    db2 = read_database_from_env(envs[1])
+    connectors = None
+    if mode == 'partition':
+        connectors = (DatabaseConnector(envs[0], db1), DatabaseConnector(envs[1], db2))
+    tablename = expected['table']
+    # the engines report their progress on stdout
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        tablediff = make_table_diff(db1, db2, mode, options=options)
+        counts = diff_table(tablediff, tablename, tablename, mode, options, connectors)
+        seconds = time.perf_counter() - start
+    return tuple(counts), seconds, get_peak_rss()
+
+def run_engine_process(casedir:str, mode:str, options:Dict) -> Tuple[Tuple[int, int, int, int], float, int]:
+    # spawn rather than fork, so the child does not start with the RSS of this process
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run_engine, casedir, mode, options).result()
+
+# Run every engine on every case, repeat times.  The fastest run is kept,
+# since the slower ones measure the noise of the machine, and the highest
+# peak RSS.
+# returns a list of result dicts, one per case and engine
+def run_benchmarks(cases:List[BenchmarkCase], engines:List[str], datadir:str, options:Dict = None,
+                   repeat:int = 1, log=print) -> List[Dict]:
+    results = []
+    for case in cases:
+        start = time.perf_counter()
+        casedir = generate_case(case, datadir)
+        expected = read_expected(casedir)
+        log(case.get_name() + ': data ready in ' + format(time.perf_counter() - start, '.1f') + 's')
+        for mode in engines:
+            runs = [ run_engine_process(casedir, mode, options or {}) for i in range(repeat) ]
+            counts = runs[0][0]
+            seconds = min(run[1] for run in runs)
+            peakrss = max(run[2] for run in runs) if runs[0][2] is not None else None
+            result = {
+                'name': case.get_name() + '/' + mode,
+                'case': case.get_name(),
+                'engine': mode,
+                'rows': expected['rows'],
+                'seconds': seconds,
+                'rows_per_second': expected['rows'] / seconds if seconds > 0 else None,
+                'peak_rss_mb': peakrss / 2 ** 20 if peakrss is not None else None,
+                'counts': list(counts),
+                'correct': all(list(run[0]) == expected['counts'] for run in runs),
+            }
+            log(format_result(result))
+            results.append(result)
+    return results
+
+def format_result(result:Dict) -> str:
+    line = '  ' + result['engine'].ljust(12) + format(result['seconds'], '9.3f') + 's'
+    if result['rows_per_second'] is not None:
+        line += format(result['rows_per_second'], '14,.0f') + ' rows/s'
+    if result['peak_rss_mb'] is not None:
+        line += format(result['peak_rss_mb'], '10.1f') + ' MB peak RSS'
+    if not result['correct']:
+        line += '  WRONG COUNTS ' + str(result['counts'])
+    return line
+
+def round_value(value:float, digits:int = 0) -> float:
+    return round(value, digits) if value is not None else None
+
+def read_baselines(path:str) -> Dict[str, Dict]:
+    if not os.path.exists(path):
+        return dict()
+    with open(path) as file:
+        return json.load(file)
+
+# add the results to the baseline file, replacing the earlier baselines of the same runs
+def save_baselines(path:str, results:List[Dict]):
+    baselines = read_baselines(path)
+    for result in results:
+        baselines[result['name']] = {'rows_per_second': round_value(result['rows_per_second']),
+                                     'peak_rss_mb': round_value(result['peak_rss_mb'], 1)}
+    with open(path, 'w') as file:
+        json.dump(baselines, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+# Returns a message for each run with wrong counts, or with a throughput below
+# or a peak RSS above its baseline by more than tolerance (a fraction).  Runs
+# without a baseline are only checked for their counts.
+def compare_to_baselines(results:List[Dict], baselines:Dict[str, Dict], tolerance:float) -> List[str]:
+    failures = []
+    for result in results:
+        if not result['correct']:
+            failures.append(result['name'] + ': wrong counts ' + str(result['counts']))
+        baseline = baselines.get(result['name'])
+        if baseline is None:
+            continue
+        if result['rows_per_second'] is not None and baseline.get('rows_per_second') is not None:
+            floor = baseline['rows_per_second'] * (1 - tolerance)
+            if result['rows_per_second'] < floor:
+                failures.append(result['name'] + ': ' + format(result['rows_per_second'], ',.0f') + ' rows/s, baseline '
+                                + format(baseline['rows_per_second'], ',.0f'))
+        if result['peak_rss_mb'] is not None and baseline.get('peak_rss_mb') is not None:
+            ceiling = baseline['peak_rss_mb'] * (1 + tolerance)
+            if result['peak_rss_mb'] > ceiling:
+                failures.append(result['name'] + ': ' + format(result['peak_rss_mb'], '.1f') + ' MB peak RSS, baseline '
+                                + format(baseline['peak_rss_mb'], '.1f'))
+    return failures
+
+
+@click.command()
+@click.option('--suite', type=click.Choice(list(SUITES)), default='smoke',
+              help='row count and default engines of the cases')
+@click.option('--rows', type=int, default=None, help='row count of DB1, overriding the suite')
+@click.option('--engine', 'engines', multiple=True, type=click.Choice(ENGINES),
+              help='engine to run (repeatable, default: the engines of the suite)')
+@click.option('--key-type', 'keytypes', multiple=True, type=click.Choice(KEY_TYPES),
+              help='only run the cases with this key type (repeatable)')
+@click.option('--divergence', 'divergences', multiple=True, type=click.Choice(DIVERGENCES),
+              help='only run the cases with this divergence (repeatable)')
+@click.option('--width', type=int, default=4, help='number of columns besides the key')
+@click.option('--fraction', type=float, default=0.01, help='share of the rows that differ')
+@click.option('--batch-size', 'batchsize', type=int, default=None, help='batch size of the streaming engines')
+@click.option('--jobs', '-j', type=int, default=1, help='worker threads of partition mode')
+@click.option('--repeat', type=int, default=DEFAULT_REPEAT, help='runs of each engine, the fastest is kept')
+@click.option('--data-dir', 'datadir', default=DEFAULT_DATA_DIR, help='where the generated databases are kept')
+@click.option('--baseline', 'baselinepath', default=DEFAULT_BASELINE, help='baseline file to compare to')
+@click.option('--save-baseline', 'savebaseline', is_flag=True, default=False,
+              help='store the results as the new baselines instead of comparing')
+@click.option('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+              help='allowed throughput drop and RSS growth, as a fraction of the baseline')
+@click.option('--output', default=None, metavar='FILE', help='write the results to a JSON file')
+def datadiff_benchmark(suite, rows, engines, keytypes, divergences, width, fraction, batchsize, jobs,
+                       repeat, datadir, baselinepath, savebaseline, tolerance, output):
+    suiterows, suiteengines = SUITES[suite]
+    cases = get_suite_cases(rows or suiterows, width, fraction)
+    if keytypes:
+        cases = [ case for case in cases if case.keytype in keytypes ]
+    if divergences:
+        cases = [ case for case in cases if case.divergence in divergences ]
+    options = {'jobs': jobs}
+    if batchsize is not None:
+        options['batchsize'] = batchsize
+    results = run_benchmarks(cases, list(engines) or suiteengines, datadir, options, repeat)
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if savebaseline:
+        save_baselines(baselinepath, [ result for result in results if result['correct'] ])
+        failures = [ result['name'] + ': wrong counts ' + str(result['counts']) for result in results if not result['correct'] ]
+    else:
+        failures = compare_to_baselines(results, read_baselines(baselinepath), tolerance)
+    if len(failures) > 0:
+        raise click.ClickException(str(len(failures)) + ' benchmark regressions:\n' + '\n'.join(failures))
+
+
+if __name__ == '__main__':
+    datadiff_benchmark()
@@ -0,0 +1,181 @@
+#
+# synthetic table pairs for the data diff benchmarks
+#
+# Each case is a pair of SQLite files holding the same table, with DB2 changed
+# by one divergence pattern.  Every value is computed from the row number, so a
+# case is the same on every machine and run, and the generator knows the
+# counts a correct diff must return.
+#
+
+from typing import Dict, List, Tuple
+import json
+import os
+import sqlite3
+import uuid
+
+TABLE_NAME = 'bench'
+KEY_TYPES = [ 'int', 'composite', 'uuid', 'varchar' ]
+DIVERGENCES = [ 'none', 'scattered', 'missing', 'tail' ]
+INSERT_BATCH_ROWS = 10000
+
+# the payload column types, repeated to the column width of a case
+PAYLOAD_TYPES = [ 'INTEGER', 'VARCHAR(32)', 'REAL', 'TEXT' ]
+COMPOSITE_GROUP_ROWS = 1000
+
+
+# A table pair to diff.  rows is the row count of DB1, width the number of
+# columns besides the key, and fraction the share of the rows that the
+# divergence changes (updated rows, the missing key range or the tail inserts).
+class BenchmarkCase:
+    def __init__(self, rows:int, keytype:str = 'int', divergence:str = 'scattered', width:int = 4,
+                 fraction:float = 0.01):
+        if keytype not in KEY_TYPES:
+            raise ValueError('unknown key type ' + keytype)
+        if divergence not in DIVERGENCES:
+            raise ValueError('unknown divergence ' + divergence)
+        if width < 1:
+            raise ValueError('width must be at least 1')
+        self.rows = rows
+        self.keytype = keytype
+        self.divergence = divergence
+        self.width = width
+        self.fraction = fraction
+
+    def get_name(self) -> str:
+        return '-'.join([ self.keytype, self.divergence, str(self.rows), 'w' + str(self.width), 'f' + repr(self.fraction) ])
+
+    def __repr__(self) -> str:
+        return self.get_name()
+
+    def get_key_columns(self) -> List[Tuple[str, str]]:
+        if self.keytype == 'composite':
+            return [ ('region', 'INTEGER'), ('seq', 'INTEGER') ]
+        if self.keytype == 'uuid':
+            return [ ('id', 'CHAR(36)') ]
+        if self.keytype == 'varchar':
+            return [ ('id', 'VARCHAR(40)') ]
+        return [ ('id', 'INTEGER') ]
+
+    def get_columns(self) -> List[Tuple[str, str]]:
+        payload = [ ('c' + str(col), PAYLOAD_TYPES[col % len(PAYLOAD_TYPES)]) for col in range(self.width) ]
+        return self.get_key_columns() + payload
+
+    def get_create_statement(self) -> str:
+        columns = [ name + ' ' + coltype for name, coltype in self.get_columns() ]
+        keycols = [ name for name, coltype in self.get_key_columns() ]
+        return 'CREATE TABLE ' + TABLE_NAME + ' (' + ', '.join(columns) + ', PRIMARY KEY (' + ', '.join(keycols) + '))'
+
+    # the key of row number rownum, and its position in [0, 1) in key order
+    def get_key(self, rownum:int) -> Tuple[tuple, float]:
+        if self.keytype == 'composite':
+            return (rownum // COMPOSITE_GROUP_ROWS, rownum % COMPOSITE_GROUP_ROWS), rownum / self.rows
+        if self.keytype == 'uuid':
+            # random looking keys, so inserts land all over the key range
+            value = (rownum * 0x9E3779B97F4A7C15F39CC0605CEDC835 + 0x1234567) % 2 ** 128
+            return (str(uuid.UUID(int=value)),), value / 2 ** 128
+        if self.keytype == 'varchar':
+            return ('customer-' + format(rownum, '012d'),), rownum / self.rows
+        return (rownum,), rownum / self.rows
+
+    def get_payload(self, rownum:int, changed:bool = False) -> tuple:
+        values = []
+        for col in range(self.width):
+            coltype = PAYLOAD_TYPES[col % len(PAYLOAD_TYPES)]
+            if coltype == 'INTEGER':
+                values.append((rownum * 2654435761 + col) % 2 ** 31)
+            elif coltype == 'VARCHAR(32)':
+                values.append(None if rownum % 17 == 0 else 'v' + format((rownum * 40503 + col) % 2 ** 32, 'x'))
+            elif coltype == 'REAL':
+                values.append(rownum * 0.25 + col)
+            else:
+                values.append(format((rownum * 11400714819323198485 + col) % 2 ** 64, '016x') * 4)
+        if changed:
+            values[0] = values[0] + 1
+        return tuple(values)
+
+    def is_missing(self, position:float) -> bool:
+        return self.divergence == 'missing' and abs(position - 0.5) * 2 < self.fraction
+
+    def is_changed(self, rownum:int) -> bool:
+        return self.divergence == 'scattered' and (rownum * 2654435761) % 2 ** 32 < self.fraction * 2 ** 32
+
+    def get_tail_rows(self) -> int:
+        return int(self.rows * self.fraction) if self.divergence == 'tail' else 0
+
+    # writes the rows of DB1 and DB2 in batches, and returns the counts the diff
+    # must find as (same, diff, only1, only2)
+    def write_rows(self, conn1:sqlite3.Connection, conn2:sqlite3.Connection) -> Tuple[int, int, int, int]:
+        placeholders = ', '.join([ '?' ] * len(self.get_columns()))
+        insert = 'INSERT INTO ' + TABLE_NAME + ' VALUES (' + placeholders + ')'
+        samecount = diffcount = only1count = 0
+        batch1, batch2 = [], []
+        for rownum in range(self.rows + self.get_tail_rows()):
+            key, position = self.get_key(rownum)
+            if rownum >= self.rows:
+                batch2.append(key + self.get_payload(rownum))
+            elif self.is_missing(position):
+                batch1.append(key + self.get_payload(rownum))
+                only1count += 1
+            else:
+                changed = self.is_changed(rownum)
+                batch1.append(key + self.get_payload(rownum))
+                batch2.append(key + self.get_payload(rownum, changed))
+                if changed:
+                    diffcount += 1
+                else:
+                    samecount += 1
+            if len(batch1) >= INSERT_BATCH_ROWS or len(batch2) >= INSERT_BATCH_ROWS:
+                conn1.executemany(insert, batch1)
+                conn2.executemany(insert, batch2)
+                batch1, batch2 = [], []
+        conn1.executemany(insert, batch1)
+        conn2.executemany(insert, batch2)
+        return samecount, diffcount, only1count, self.get_tail_rows()
+
+
+def get_case_dir(datadir:str, case:BenchmarkCase) -> str:
+    return os.path.join(datadir, case.get_name())
+
+def write_env_file(path:str, dbpath:str):
+    with open(path, 'w') as file:
+        file.write('type=sqlite\ndatabase=' + os.path.abspath(dbpath) + '\n')
+
+def read_expected(casedir:str) -> Dict:
+    with open(os.path.join(casedir, 'expected.json')) as file:
+        return json.load(file)
+
+# Write the SQLite files and credentials files of a case under datadir, or
+# reuse them from an earlier run.  expected.json is written last, so a case
+# whose generation was interrupted is generated again.
+# returns the case directory
+def generate_case(case:BenchmarkCase, datadir:str) -> str:
+    casedir = get_case_dir(datadir, case)
+    if os.path.exists(os.path.join(casedir, 'expected.json')):
+        return casedir
+    os.makedirs(casedir, exist_ok=True)
+    conns = []
+    for side in (1, 2):
+        dbpath = os.path.join(casedir, 'db' + str(side) + '.sqlite')
+        if os.path.exists(dbpath):
+            os.remove(dbpath)
+        write_env_file(os.path.join(casedir, 'db' + str(side) + '.env'), dbpath)
+        conn = sqlite3.connect(dbpath)
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute(case.get_create_statement())
+        conns.append(conn)
+    try:
+        counts = case.write_rows(conns[0], conns[1])
+        for conn in conns:
+            conn.commit()
+            # the row estimates of sqlite_stat1 feed the progress ETA and partition sizing
+            conn.execute('ANALYZE')
+            conn.commit()
+    finally:
+        for conn in conns:
+            conn.close()
+    expected = {'case': case.get_name(), 'table': TABLE_NAME, 'rows': case.rows + case.get_tail_rows(),
+                'counts': list(counts)}
+    with open(os.path.join(casedir, 'expected.json'), 'w') as file:
+        json.dump(expected, file, indent=2)
+    return casedir
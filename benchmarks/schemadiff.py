@@ -0,0 +1,286 @@
+#
+# schema import and compare benchmark
+#
+# Times each step of schemadiff on synthetic schemas of growing size and fits
+# the growth exponent of each step (1 is linear, 2 quadratic).  A step whose
+# time at the next size is predicted to exceed --budget is not run at the
+# larger sizes, and its estimate is reported instead.  The results are
+# compared to a baseline file: a step fails when its exponent grows or it gets
+# slower than its baseline by more than the tolerance.
+#
+#   python -m benchmarks.schemadiff --sizes 100,1000,10000,100000 --plot growth.png
+#
+
+from typing import Callable, Dict, List
+import json
+import math
+import os
+import time
+
+import click
+
+import benchmarks
+from benchmarks.datadiff import read_baselines, round_value
+from benchmarks.schemagen import (SCHEMA_NAME, SchemaShape, import_mysql, import_postgres, make_catalog,
+                                  make_mysql_rows, make_postgres_rows)
+from dbdiff.schema.compare import SchemaCompare, TopoSort
+
+try:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as pyplot
+except ImportError:
+    pyplot = None
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'schema_baselines.json')
+DEFAULT_SIZES = '100,1000,10000,100000'
+DEFAULT_BUDGET = 60.0
+DEFAULT_TOLERANCE = 0.5
+# allowed growth of the fitted exponent over its baseline
+EXPONENT_TOLERANCE = 0.25
+# times below these are mostly timer and interpreter noise
+MIN_FIT_SECONDS = 0.002
+MIN_COMPARED_SECONDS = 0.05
+
+STEPS = [ 'import mysql', 'import postgres', 'postgres constraints (information_schema)', 'diff_table_list',
+          'diff_procedure_list', 'diff_columns', 'diff_indexes', 'diff_constraints', 'TopoSort.sort' ]
+
+
+# least squares slope of log(seconds) over log(size), from the points that
+# are long enough to measure; None with fewer than two such points
+def fit_exponent(points:Dict[int, float]) -> float:
+    logs = [ (math.log(size), math.log(seconds)) for size, seconds in sorted(points.items())
+             if seconds >= MIN_FIT_SECONDS ]
+    if len(logs) < 2:
+        return None
+    meanx = sum(x for x, y in logs) / len(logs)
+    meany = sum(y for x, y in logs) / len(logs)
+    variance = sum((x - meanx) ** 2 for x, y in logs)
+    if variance == 0:
+        return None
+    return sum((x - meanx) * (y - meany) for x, y in logs) / variance
+
+# the time of a step at size, extrapolated from its measured points; a step
+# with one point is taken to be linear
+def predict_seconds(points:Dict[int, float], size:int) -> float:
+    lastsize = max(points)
+    exponent = fit_exponent(points)
+    if exponent is None:
+        exponent = 1.0
+    return max(points[lastsize], MIN_FIT_SECONDS) * (size / lastsize) ** max(exponent, 1.0)
+
+# best time of repeat runs of run(setup()), where only run is timed
+def time_step(setup:Callable, run:Callable, repeat:int) -> float:
+    best = None
+    for i in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+def diff_table_pairs(db1, db2, both, method:str):
+    for tablename1, tablename2 in both:
+        getattr(db1.get_table(tablename1), method)(db2.get_table(tablename2))
+
+
+# Run the steps at every size.  results maps each step to the seconds it took
+# at each size ('seconds'), the predicted seconds at the sizes it was skipped
+# at ('estimates') and the fitted exponent.
+def run_benchmarks(sizes:List[int], shapeargs:Dict = None, repeat:int = 1, budget:float = DEFAULT_BUDGET,
+                   steps:List[str] = None, log=print) -> Dict[str, Dict]:
+    steps = steps or STEPS
+    results = { step: {'seconds': dict(), 'estimates': dict(), 'exponent': None} for step in steps }
+    skipped = set()
+
+    def measure(step:str, size:int, setup:Callable, run:Callable):
+        if step not in results:
+            return
+        points = results[step]['seconds']
+        if step in skipped:
+            results[step]['estimates'][size] = predict_seconds(points, size)
+            return
+        points[size] = time_step(setup, run, repeat)
+        nextsizes = [ nextsize for nextsize in sizes if nextsize > size ]
+        if len(nextsizes) > 0 and predict_seconds(points, nextsizes[0]) > budget:
+            skipped.add(step)
+
+    for size in sorted(sizes):
+        start = time.perf_counter()
+        shape = SchemaShape(size, **(shapeargs or {}))
+        catalog1 = make_catalog(shape, 1)
+        catalog2 = make_catalog(shape, 2)
+        log(str(size) + ' tables, ' + str(catalog1.get_column_count()) + ' columns')
+
+        rows = make_mysql_rows(catalog1, 'bench')
+        measure('import mysql', size, lambda: None, lambda state: import_mysql(rows, 'bench'))
+        rows = make_postgres_rows(catalog1, 'bench', infoschema=True)
+        measure('postgres constraints (information_schema)', size, lambda: import_postgres(rows, 'bench'),
+                lambda db: db.fetch_constraints_infoschema('bench', SCHEMA_NAME))
+        # the compare steps run on the Postgres pair, so its import always runs
+        rows = make_postgres_rows(catalog1, 'bench')
+        dbs = [ None ]
+        def import_db1(state):
+            dbs[0] = import_postgres(rows, 'bench')
+        if 'import postgres' in results and 'import postgres' not in skipped:
+            measure('import postgres', size, lambda: None, import_db1)
+        else:
+            measure('import postgres', size, None, None)
+            import_db1(None)
+        db1 = dbs[0]
+        db2 = import_postgres(make_postgres_rows(catalog2, 'bench'), 'bench')
+        rows = catalog1 = catalog2 = None
+
+        compare = SchemaCompare(db1, db2)
+        both = None
+        def diff_table_list(state):
+            nonlocal both
+            both = compare.diff_table_list()[0]
+        measure('diff_table_list', size, lambda: None, diff_table_list)
+        if both is None:
+            # the per table steps need the table pairs, which are matched by
+            # name here rather than with the step that was skipped
+            tablenames2 = set(db2.get_table_list())
+            both = [ (tablename, tablename) for tablename in db1.get_table_list() if tablename in tablenames2 ]
+        measure('diff_procedure_list', size, lambda: None, lambda state: compare.diff_procedure_list())
+        for method in ('diff_columns', 'diff_indexes', 'diff_constraints'):
+            measure(method, size, lambda: None, lambda state: diff_table_pairs(db1, db2, both, method))
+        tables = [ db1.get_table(tablename) for tablename in db1.get_table_list() ]
+        measure('TopoSort.sort', size, lambda: None, lambda state: TopoSort.sort(tables))
+        log('  done in ' + format(time.perf_counter() - start, '.1f') + 's')
+
+    for step, result in results.items():
+        result['exponent'] = fit_exponent(result['seconds'])
+    return results
+
+def format_seconds(seconds:float) -> str:
+    if seconds < 1:
+        return format(seconds * 1000, '.1f') + 'ms'
+    return format(seconds, '.2f') + 's'
+
+# the growth curves as a table, one row per step
+def format_results(results:Dict[str, Dict], sizes:List[int]) -> str:
+    sizes = sorted(sizes)
+    width = max(len(step) for step in results) + 2
+    lines = [ 'step'.ljust(width) + ''.join(str(size).rjust(14) for size in sizes) + '    growth' ]
+    for step, result in results.items():
+        line = step.ljust(width)
+        for size in sizes:
+            if size in result['seconds']:
+                line += format_seconds(result['seconds'][size]).rjust(14)
+            elif size in result['estimates']:
+                line += ('~' + format_seconds(result['estimates'][size])).rjust(14)
+            else:
+                line += '-'.rjust(14)
+        if result['exponent'] is not None:
+            line += '    n^' + format(result['exponent'], '.2f')
+        lines.append(line)
+    return '\n'.join(lines)
+
+# plot the growth curves on log-log axes, with linear and quadratic guides
+def plot_results(results:Dict[str, Dict], path:str):
+    figure, axes = pyplot.subplots(figsize=(10, 6))
+    for step, result in results.items():
+        points = sorted(result['seconds'].items())
+        if len(points) > 0:
+            line, = axes.plot([ size for size, seconds in points ], [ seconds for size, seconds in points ], marker='o', label=step)
+            estimates = sorted(result['estimates'].items())
+            if len(estimates) > 0:
+                axes.plot([ points[-1][0] ] + [ size for size, seconds in estimates ],
+                          [ points[-1][1] ] + [ seconds for size, seconds in estimates ], linestyle=':', color=line.get_color())
+    sizes = sorted(set(size for result in results.values() for size in result['seconds']))
+    if len(sizes) > 1:
+        base = min(seconds for result in results.values() for seconds in result['seconds'].values() if seconds > 0)
+        for exponent, label in ((1, 'linear'), (2, 'quadratic')):
+            axes.plot(sizes, [ base * (size / sizes[0]) ** exponent for size in sizes ], color='grey',
+                      linestyle='--', linewidth=0.8, label=label)
+    axes.set_xscale('log')
+    axes.set_yscale('log')
+    axes.set_xlabel('tables')
+    axes.set_ylabel('seconds')
+    axes.legend(fontsize='small')
+    figure.tight_layout()
+    figure.savefig(path)
+
+def save_baselines(path:str, results:Dict[str, Dict], shape:Dict):
+    steps = dict()
+    for step, result in results.items():
+        steps[step] = {'exponent': round_value(result['exponent'], 3),
+                       'seconds': { str(size): round_value(seconds, 4) for size, seconds in sorted(result['seconds'].items()) }}
+    with open(path, 'w') as file:
+        json.dump({'shape': shape, 'steps': steps}, file, indent=2)
+        file.write('\n')
+
+# Returns a message for each step whose exponent is above its baseline by more
+# than EXPONENT_TOLERANCE, or whose time at a size is above its baseline by
+# more than tolerance (a fraction).  Times too short to measure are skipped.
+def compare_to_baselines(results:Dict[str, Dict], baselines:Dict[str, Dict], tolerance:float) -> List[str]:
+    failures = []
+    for step, result in results.items():
+        baseline = baselines.get(step)
+        if baseline is None:
+            continue
+        if result['exponent'] is not None and baseline.get('exponent') is not None:
+            if result['exponent'] > baseline['exponent'] + EXPONENT_TOLERANCE:
+                failures.append(step + ': grows as n^' + format(result['exponent'], '.2f') + ', baseline n^'
+                                + format(baseline['exponent'], '.2f'))
+        for size, seconds in sorted(result['seconds'].items()):
+            baseseconds = baseline.get('seconds', {}).get(str(size))
+            if baseseconds is None or baseseconds < MIN_COMPARED_SECONDS:
+                continue
+            if seconds > baseseconds * (1 + tolerance):
+                failures.append(step + ' at ' + str(size) + ' tables: ' + format_seconds(seconds) + ', baseline '
+                                + format_seconds(baseseconds))
+    return failures
+
+
+@click.command()
+@click.option('--sizes', default=DEFAULT_SIZES, help='comma separated table counts')
+@click.option('--columns', type=int, default=15, help='columns per table')
+@click.option('--indexes', type=int, default=2, help='secondary indexes per table')
+@click.option('--foreign-keys', 'foreignkeys', type=int, default=1, help='foreign keys per table')
+@click.option('--routines', type=int, default=None, help='routines per schema (default: a tenth of the tables)')
+@click.option('--step', 'steps', multiple=True, type=click.Choice(STEPS), help='step to run (repeatable, default: all)')
+@click.option('--repeat', type=int, default=1, help='runs of each step, the fastest is kept')
+@click.option('--budget', type=float, default=DEFAULT_BUDGET,
+              help='seconds a step may take; larger sizes predicted to exceed it are skipped')
+@click.option('--baseline', 'baselinepath', default=DEFAULT_BASELINE, help='baseline file to compare to')
+@click.option('--save-baseline', 'savebaseline', is_flag=True, default=False,
+              help='store the results as the new baselines instead of comparing')
+@click.option('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+              help='allowed slowdown, as a fraction of the baseline time')
+@click.option('--output', default=None, metavar='FILE', help='write the results to a JSON file')
+@click.option('--plot', 'plotpath', default=None, metavar='FILE', help='plot the growth curves (needs matplotlib)')
+def schemadiff_benchmark(sizes, columns, indexes, foreignkeys, routines, steps, repeat, budget,
+                         baselinepath, savebaseline, tolerance, output, plotpath):
+    if plotpath is not None and pyplot is None:
+        raise click.ClickException('--plot requires matplotlib')
+    sizes = [ int(size) for size in sizes.split(',') ]
+    shapeargs = {'columns': columns, 'indexes': indexes, 'foreignkeys': foreignkeys, 'routines': routines}
+    # the baselines only apply to the same shape
+    shape = dict(shapeargs)
+    results = run_benchmarks(sizes, shapeargs, repeat, budget, list(steps) or None)
+    click.echo(format_results(results, sizes))
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump({'shape': shape, 'steps': results}, file, indent=2)
+    if plotpath is not None:
+        plot_results(results, plotpath)
+    if savebaseline:
+        save_baselines(baselinepath, results, shape)
+        return
+    baselines = read_baselines(baselinepath)
+    if len(baselines) == 0:
+        return
+    if baselines.get('shape') != shape:
+        click.echo('baseline is for ' + str(baselines.get('shape')) + ', not compared')
+        return
+    failures = compare_to_baselines(results, baselines['steps'], tolerance)
+    if len(failures) > 0:
+        raise click.ClickException(str(len(failures)) + ' benchmark regressions:\n' + '\n'.join(failures))
+
+
+if __name__ == '__main__':
+    schemadiff_benchmark()
@@ -0,0 +1,310 @@
+#
+# synthetic schemas for the schema import and compare benchmarks
+#
+# A shape (table count, columns, indexes and foreign keys per table, routine
+# count) is expanded into the catalog of two databases that mostly match.
+# The catalog is turned into the rows the MySQL and Postgres catalog queries
+# return, and a fake connection hands those rows to the real import_schema,
+# so the benchmark times the catalog-to-object assembly without a server.
+#
+
+from typing import Dict, List, Tuple
+import random
+
+from dbdiff.schema.mysql import MySQLDatabase
+from dbdiff.schema.postgres import PostgresDatabase
+
+SCHEMA_NAME = 'public'
+
+# column types as (MySQL COLUMN_TYPE, Postgres data_type, Postgres udt_name)
+PAYLOAD_TYPES = [
+    ('int', 'integer', 'int4'),
+    ('varchar(64)', 'character varying', 'varchar'),
+    ('bigint', 'bigint', 'int8'),
+    ('decimal(12,2)', 'numeric', 'numeric'),
+    ('datetime', 'timestamp without time zone', 'timestamp'),
+    ('text', 'text', 'text'),
+    ('tinyint(1)', 'boolean', 'bool'),
+]
+KEY_TYPE = ('bigint', 'bigint', 'int8')
+
+
+# the size of a synthetic schema.  columns includes the primary key and the
+# foreign key columns; divergence is the share of the tables that differ
+# between the two databases (only in one of them, changed columns or a
+# missing index)
+class SchemaShape:
+    def __init__(self, tables:int, columns:int = 15, indexes:int = 2, foreignkeys:int = 1, routines:int = None,
+                 divergence:float = 0.02, seed:int = 0):
+        if columns < foreignkeys + 2:
+            raise ValueError('columns must leave room for the key, the foreign key columns and one more column')
+        self.tables = tables
+        self.columns = columns
+        self.indexes = min(indexes, columns - foreignkeys - 1)
+        self.foreignkeys = foreignkeys
+        self.routines = routines if routines is not None else tables // 10
+        self.divergence = divergence
+        self.seed = seed
+
+    def __repr__(self) -> str:
+        return ('SchemaShape(tables=' + str(self.tables) + ', columns=' + str(self.columns) + ', indexes='
+                + str(self.indexes) + ', foreignkeys=' + str(self.foreignkeys) + ', routines=' + str(self.routines) + ')')
+
+
+class TableSpec:
+    def __init__(self, name:str):
+        self.name = name
+        # (name, (mysql type, postgres data_type, udt_name), nullable)
+        self.columns: List[Tuple[str, tuple, bool]] = []
+        # (name, unique, column names)
+        self.indexes: List[Tuple[str, bool, List[str]]] = []
+        # (name, column names, referenced table, referenced column names)
+        self.foreignkeys: List[Tuple[str, List[str], str, List[str]]] = []
+        self.unique: str = None
+        self.check: Tuple[str, str] = None
+
+    def get_position(self, colname:str) -> int:
+        for position, column in enumerate(self.columns, start=1):
+            if column[0] == colname:
+                return position
+        raise ValueError('no column ' + colname + ' in ' + self.name)
+
+
+# the tables and routines of one side
+class SchemaCatalog:
+    def __init__(self, tables:List[TableSpec], routines:List[Tuple[str, str, str]]):
+        self.tables = tables
+        self.routines = routines
+
+    def get_column_count(self) -> int:
+        return sum(len(table.columns) for table in self.tables)
+
+
+# a hash of the table number in [0, 1), so the divergent tables are spread out
+def table_fraction(tablenum:int) -> float:
+    return (tablenum * 2654435761) % 2 ** 32 / 2 ** 32
+
+# 1 or 2 when the table is only in that side, else None; table 0 is in both so
+# every foreign key has a table to fall back to
+def get_only_side(shape:SchemaShape, tablenum:int) -> int:
+    fraction = table_fraction(tablenum)
+    if tablenum == 0 or fraction >= shape.divergence:
+        return None
+    return 1 if fraction < shape.divergence / 2 else 2
+
+# Build the catalog of side 1 or 2.  Table numbers are mapped to names through
+# a shuffle, so the tables are not listed in foreign key order, and each
+# foreign key references an earlier table number that is in both databases,
+# which keeps the graph acyclic.
+def make_catalog(shape:SchemaShape, side:int) -> SchemaCatalog:
+    rng = random.Random(shape.seed)
+    names = list(range(shape.tables))
+    rng.shuffle(names)
+    tablenames = [ 'tbl_' + format(num, '06d') for num in names ]
+    tables = []
+    for tablenum in range(shape.tables):
+        only = get_only_side(shape, tablenum)
+        if only is not None and only != side:
+            continue
+        fraction = table_fraction(tablenum)
+        changed = side == 2 and shape.divergence <= fraction < shape.divergence * 2
+        dropindex = side == 2 and shape.divergence * 2 <= fraction < shape.divergence * 3
+        table = TableSpec(tablenames[tablenum])
+        table.columns.append(('id', KEY_TYPE, False))
+        for fknum in range(shape.foreignkeys if tablenum > 0 else 0):
+            reftablenum = (tablenum * 40503 + fknum * 7919) % tablenum
+            while get_only_side(shape, reftablenum) is not None:
+                reftablenum -= 1
+            colname = 'ref' + str(fknum) + '_id'
+            table.columns.append((colname, KEY_TYPE, True))
+            table.foreignkeys.append(('fk_' + table.name + '_' + str(fknum), [ colname ], tablenames[reftablenum], [ 'id' ]))
+        for colnum in range(shape.columns - len(table.columns)):
+            coltype = PAYLOAD_TYPES[(tablenum + colnum) % len(PAYLOAD_TYPES)]
+            if changed and colnum == 0:
+                coltype = PAYLOAD_TYPES[(tablenum + colnum + 1) % len(PAYLOAD_TYPES)]
+            table.columns.append(('c' + str(colnum), coltype, colnum % 3 != 0))
+        if changed:
+            table.columns.append(('added', PAYLOAD_TYPES[0], True))
+        for indexnum in range(shape.indexes - (1 if dropindex else 0)):
+            unique = indexnum == 0 and tablenum % 4 == 0
+            name = ('uq_' if unique else 'ix_') + table.name + '_' + str(indexnum)
+            table.indexes.append((name, unique, [ 'c' + str(indexnum) ]))
+            if unique:
+                table.unique = name
+        # Postgres lists the NOT NULL of c0 as a check constraint
+        table.check = (table.name + '_c0_check', 'c0')
+        tables.append(table)
+    routines = []
+    for routinenum in range(shape.routines):
+        if side == 2 and routinenum % 50 == 1:
+            continue
+        routinetype = 'FUNCTION' if routinenum % 3 == 0 else 'PROCEDURE'
+        routines.append(('routine_' + format(routinenum, '06d'), routinetype, 'BEGIN SELECT ' + str(routinenum) + '; END'))
+    return SchemaCatalog(tables, routines)
+
+
+# the rows of the MySQL information_schema queries of MySQLDatabase.import_schema,
+# keyed by the table name in the query
+def make_mysql_rows(catalog:SchemaCatalog, dbname:str) -> List[Tuple[str, List[Dict]]]:
+    tables, columns, statistics, constraints, keycolumns = [], [], [], [], []
+    for table in sorted(catalog.tables, key=lambda table: table.name):
+        tables.append({'TABLE_CATALOG': 'def', 'TABLE_SCHEMA': dbname, 'TABLE_NAME': table.name, 'TABLE_TYPE': 'BASE TABLE',
+                       'ENGINE': 'InnoDB', 'TABLE_ROWS': 1000, 'DATA_LENGTH': 16384, 'INDEX_LENGTH': 16384,
+                       'TABLE_COLLATION': 'utf8mb4_bin'})
+        for position, (colname, coltype, nullable) in enumerate(table.columns, start=1):
+            columns.append({'TABLE_NAME': table.name, 'COLUMN_NAME': colname, 'COLUMN_TYPE': coltype[0],
+                            'COLUMN_KEY': 'PRI' if colname == 'id' else '', 'IS_NULLABLE': 'YES' if nullable else 'NO',
+                            'COLUMN_DEFAULT': None, 'ORDINAL_POSITION': position})
+        # MySQL names every primary key PRIMARY and indexes every foreign key
+        indexes = [ ('PRIMARY', True, [ 'id' ]) ] + table.indexes + [ (name, False, cols) for name, cols, ref, refcols in table.foreignkeys ]
+        for name, unique, colnames in sorted(indexes):
+            for seq, colname in enumerate(colnames, start=1):
+                statistics.append({'TABLE_NAME': table.name, 'INDEX_NAME': name, 'NON_UNIQUE': 0 if unique else 1,
+                                   'COLUMN_NAME': colname, 'COLLATION': 'A', 'SUB_PART': None,
+                                   'NULLABLE': '' if colname == 'id' else 'YES', 'SEQ_IN_INDEX': seq})
+        keys = [ ('PRIMARY', 'PRIMARY KEY', [ 'id' ], None, None) ]
+        if table.unique is not None:
+            keys.append((table.unique, 'UNIQUE', [ 'c0' ], None, None))
+        keys.extend((name, 'FOREIGN KEY', cols, ref, refcols) for name, cols, ref, refcols in table.foreignkeys)
+        for name, contype, colnames, reftable, refcolnames in sorted(keys):
+            constraints.append({'TABLE_NAME': table.name, 'CONSTRAINT_NAME': name, 'CONSTRAINT_TYPE': contype})
+            for position, colname in enumerate(colnames, start=1):
+                keycolumns.append({'CONSTRAINT_NAME': name, 'TABLE_NAME': table.name, 'COLUMN_NAME': colname,
+                                   'ORDINAL_POSITION': position,
+                                   'POSITION_IN_UNIQUE_CONSTRAINT': position if reftable is not None else None,
+                                   'REFERENCED_TABLE_NAME': reftable,
+                                   'REFERENCED_COLUMN_NAME': refcolnames[position - 1] if reftable is not None else None})
+    routines = [ {'ROUTINE_NAME': name, 'ROUTINE_TYPE': routinetype, 'ROUTINE_DEFINITION': definition}
+                 for name, routinetype, definition in catalog.routines ]
+    return [ ('INFORMATION_SCHEMA.TABLES', tables), ('INFORMATION_SCHEMA.COLUMNS', columns),
+             ('INFORMATION_SCHEMA.STATISTICS', statistics), ('INFORMATION_SCHEMA.TABLE_CONSTRAINTS', constraints),
+             ('INFORMATION_SCHEMA.KEY_COLUMN_USAGE', keycolumns), ('INFORMATION_SCHEMA.ROUTINES', routines) ]
+
+# the rows of the Postgres catalog queries of PostgresDatabase.import_schema,
+# keyed by a fragment of the query; with infoschema, the information_schema
+# constraint views of fetch_constraints_infoschema are returned instead of the
+# pg_constraint rows
+def make_postgres_rows(catalog:SchemaCatalog, dbname:str, schema:str = SCHEMA_NAME,
+                       infoschema:bool = False) -> List[Tuple[str, List[Dict]]]:
+    tables, columns, indexes, primarykeys, uniques, foreignkeys = [], [], [], [], [], []
+    constraints, tableusage, columnusage, checks = [], [], [], []
+    for table in catalog.tables:
+        tables.append({'table_catalog': dbname, 'table_schema': schema, 'table_name': table.name, 'table_type': 'BASE TABLE',
+                       'is_insertable_into': 'YES', 'is_typed': 'NO'})
+        for position, (colname, coltype, nullable) in enumerate(table.columns, start=1):
+            columns.append({'table_catalog': dbname, 'table_schema': schema, 'table_name': table.name,
+                            'column_name': colname, 'ordinal_position': position, 'column_default': None,
+                            'is_nullable': 'YES' if nullable else 'NO', 'data_type': coltype[1],
+                            'character_maximum_length': 64 if coltype[2] == 'varchar' else None, 'udt_name': coltype[2]})
+        pkname = table.name + '_pkey'
+        indexes.append({'schemaname': schema, 'tablename': table.name, 'indexname': pkname, 'tablespace': None,
+                        'indexdef': 'CREATE UNIQUE INDEX ' + pkname + ' ON ' + schema + '.' + table.name + ' USING btree (id)'})
+        for name, unique, colnames in table.indexes:
+            indexdef = ('CREATE UNIQUE INDEX ' if unique else 'CREATE INDEX ') + name + ' ON ' + schema + '.' + table.name
+            indexes.append({'schemaname': schema, 'tablename': table.name, 'indexname': name, 'tablespace': None,
+                            'indexdef': indexdef + ' USING btree (' + ', '.join(colnames) + ')'})
+        keys = [ (pkname, 'PRIMARY KEY', [ 'id' ], None, None) ]
+        primarykeys.append({'constraint_name': pkname, 'table_name': table.name, 'table_schema': schema, 'columns': [ 1 ]})
+        if table.unique is not None:
+            keys.append((table.unique, 'UNIQUE', [ 'c0' ], None, None))
+            uniques.append({'constraint_name': table.unique, 'table_name': table.name, 'table_schema': schema,
+                            'columns': [ table.get_position('c0') ]})
+        for name, colnames, reftable, refcolnames in table.foreignkeys:
+            keys.append((name, 'FOREIGN KEY', colnames, reftable, refcolnames))
+            foreignkeys.append({'constraint_name': name, 'table_name': table.name, 'table_schema': schema,
+                                'ref_table_name': reftable, 'ref_table_namespace': schema,
+                                'columns': [ table.get_position(colname) for colname in colnames ],
+                                # every foreign key references the id column, which is column 1
+                                'ref_columns': [ 1 for colname in refcolnames ]})
+        checkname, checkcolumn = table.check
+        keys.append((checkname, 'CHECK', [ checkcolumn ], None, None))
+        checks.append({'constraint_catalog': dbname, 'constraint_schema': schema, 'constraint_name': checkname,
+                       'check_clause': checkcolumn + ' IS NOT NULL'})
+        for name, contype, colnames, reftable, refcolnames in keys:
+            constraints.append({'constraint_catalog': dbname, 'constraint_schema': schema, 'constraint_name': name,
+                                'constraint_type': contype, 'table_catalog': dbname, 'table_schema': schema,
+                                'table_name': table.name, 'is_deferrable': 'NO', 'initially_deferred': 'NO'})
+            # the usage views name the referenced table and columns of a foreign key
+            usagetable = reftable if reftable is not None else table.name
+            tableusage.append({'table_catalog': dbname, 'table_schema': schema, 'table_name': usagetable,
+                               'constraint_catalog': dbname, 'constraint_schema': schema, 'constraint_name': name})
+            for colname in (refcolnames if reftable is not None else colnames):
+                columnusage.append({'table_catalog': dbname, 'table_schema': schema, 'table_name': usagetable,
+                                    'column_name': colname, 'constraint_catalog': dbname, 'constraint_schema': schema,
+                                    'constraint_name': name})
+    routines = [ {'specific_catalog': dbname, 'specific_schema': schema, 'specific_name': name + '_' + str(num),
+                  'routine_catalog': dbname, 'routine_schema': schema, 'routine_name': name,
+                  'routine_type': routinetype, 'routine_definition': definition}
+                 for num, (name, routinetype, definition) in enumerate(catalog.routines) ]
+    if infoschema:
+        constraintrows = [ ('pg_constraint', []) ]
+    else:
+        constraintrows = [ ("contype ='p'", primarykeys), ("contype ='u'", uniques), ("contype ='f'", foreignkeys) ]
+    for rows in (constraints, tableusage, columnusage, checks):
+        rows.sort(key=lambda row: row['constraint_name'])
+    return [ ('information_schema.tables', tables), ('information_schema.columns', columns),
+             ('pg_indexes', indexes) ] + constraintrows + [
+             ('information_schema.table_constraints', constraints),
+             ('information_schema.constraint_table_usage', tableusage),
+             ('information_schema.constraint_column_usage', columnusage),
+             ('information_schema.check_constraints', checks),
+             ('information_schema.routines', routines) ]
+
+
+# A connection whose cursors answer each catalog query with prepared rows.
+# The rows are chosen by the first key that appears in the query text.
+class CatalogConnection:
+    def __init__(self, rows:List[Tuple[str, List[Dict]]]):
+        self.rows = rows
+        self.queries = 0
+
+    def get_rows(self, sql:str) -> List[Dict]:
+        self.queries += 1
+        for key, rows in self.rows:
+            if key in sql:
+                return rows
+        raise ValueError('no catalog rows for query ' + ' '.join(sql.split()))
+
+    def cursor(self, **kwargs):
+        return CatalogCursor(self)
+
+    def close(self):
+        pass
+
+class CatalogCursor:
+    def __init__(self, conn:CatalogConnection):
+        self.conn = conn
+        self.rows = []
+
+    def execute(self, sql:str, params:tuple = None):
+        self.rows = self.conn.get_rows(sql)
+
+    def fetchall(self) -> List[Dict]:
+        return self.rows
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+# PostgresDatabase.cursor asks psycopg for dict rows; the catalog rows already are dicts
+class CatalogPostgresDatabase(PostgresDatabase):
+    def cursor(self):
+        return self.conn.cursor()
+
+def import_mysql(rows:List[Tuple[str, List[Dict]]], dbname:str) -> MySQLDatabase:
+    db = MySQLDatabase(dbname)
+    db.conn = CatalogConnection(rows)
+    db.import_schema(dbname)
+    return db
+
+def import_postgres(rows:List[Tuple[str, List[Dict]]], dbname:str, schema:str = SCHEMA_NAME) -> PostgresDatabase:
+    db = CatalogPostgresDatabase(dbname)
+    db.conn = CatalogConnection(rows)
+    db.import_schema(dbname, schema)
+    return db
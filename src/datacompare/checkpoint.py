@@ -0,0 +1,154 @@
+#
+# checkpoint journal for resuming long data diff runs
+#
+
+from typing import Dict, List, Tuple
+from datacompare.keyrange import KeyRange
+from datacompare.rowdigest import pack_key, unpack_key
+import base64
+import json
+import os
+import threading
+import time
+
+# rows streamed between two checkpoints of a streaming diff
+DEFAULT_CHECKPOINT_ROWS = 100000
+# journal records written between two fsyncs
+DEFAULT_SYNC_RECORDS = 100
+# maximum seconds between two fsyncs
+DEFAULT_SYNC_SECONDS = 5.0
+
+
+def encode_key(key:tuple) -> str:
+    if key is None:
+        return None
+    return base64.b64encode(pack_key(key)).decode('ascii')
+
+def decode_key(data:str) -> tuple:
+    if data is None:
+        return None
+    return unpack_key(base64.b64decode(data))
+
+def add_counts(counts1:Tuple, counts2:Tuple) -> Tuple[int, int, int, int]:
+    return tuple(count1 + count2 for count1, count2 in zip(counts1, counts2))
+
+
+# The journal is an append-only file with one JSON record per line:
+#   {"event": "table", "tables": [t1, t2], "counts": [same, diff, only1, only2]}
+#   {"event": "plan", "tables": [t1, t2], "mode": m, "ranges": [[lo, hi], ...]}
+#   {"event": "range", "tables": [t1, t2], "mode": m, "lo": lo, "hi": hi, "counts": [...]}
+# Keys are packed with pack_key and base64 encoded.  Records are flushed as they
+# are written but only fsync'd every sync_records records or sync_seconds, so a
+# crash can lose the last few checkpoints, which just means that work is redone.
+class CheckpointJournal:
+    def __init__(self, path:str, resume:bool = False, sync_records:int = DEFAULT_SYNC_RECORDS,
+                 sync_seconds:float = DEFAULT_SYNC_SECONDS):
+        self.path = path
+        self.sync_records = sync_records
+        self.sync_seconds = sync_seconds
+        self.tables: Dict[Tuple[str, str], Tuple] = dict()
+        self.plans: Dict[Tuple, List[KeyRange]] = dict()
+        self.ranges: Dict[Tuple, List[Tuple[KeyRange, Tuple]]] = dict()
+        if resume and os.path.exists(path):
+            self.load()
+        self.file = open(path, 'a' if resume else 'w')
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def load(self):
+        with open(self.path) as FILE:
+            for line in FILE:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # torn last line from a crash
+                    continue
+                tablepair = tuple(record['tables'])
+                event = record['event']
+                if event == 'table':
+                    self.tables[tablepair] = tuple(record['counts'])
+                elif event == 'plan':
+                    ranges = [ KeyRange(decode_key(lo), decode_key(hi)) for lo, hi in record['ranges'] ]
+                    self.plans[tablepair + (record['mode'],)] = ranges
+                elif event == 'range':
+                    keyrange = KeyRange(decode_key(record['lo']), decode_key(record['hi']))
+                    self.ranges.setdefault(tablepair + (record['mode'],), []).append((keyrange, tuple(record['counts'])))
+
+    def write(self, record:dict):
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            self.unsynced += 1
+            if self.unsynced >= self.sync_records or time.monotonic() - self.last_sync >= self.sync_seconds:
+                self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            self.file.flush()
+            self.sync()
+            self.file.close()
+
+    # returns the counts of a table finished by an earlier run, None if not finished
+    def get_table_result(self, tablename1:str, tablename2:str) -> Tuple:
+        return self.tables.get((tablename1, tablename2))
+
+    def table_done(self, tablename1:str, tablename2:str, counts:Tuple):
+        self.tables[(tablename1, tablename2)] = tuple(counts)
+        self.write({'event': 'table', 'tables': [tablename1, tablename2], 'counts': list(counts)})
+
+    def get_table_checkpoint(self, tablename1:str, tablename2:str, mode:str):
+        return TableCheckpoint(self, tablename1, tablename2, mode)
+
+
+# Checkpoints of the key ranges of one table in one diff mode.
+# The streaming diff checkpoints consecutive ranges and resumes after the last
+# one, the partitioned diff records its range plan and skips finished ranges.
+class TableCheckpoint:
+    def __init__(self, journal:CheckpointJournal, tablename1:str, tablename2:str, mode:str,
+                 interval:int = DEFAULT_CHECKPOINT_ROWS):
+        self.journal = journal
+        self.tablename1 = tablename1
+        self.tablename2 = tablename2
+        self.mode = mode
+        self.interval = interval
+        self.statekey = (tablename1, tablename2, mode)
+        self.done = list(journal.ranges.get(self.statekey, []))
+
+    # counts of the ranges finished by earlier runs
+    def get_prior_counts(self) -> Tuple[int, int, int, int]:
+        counts = (0, 0, 0, 0)
+        for keyrange, rangecounts in self.done:
+            counts = add_counts(counts, rangecounts)
+        return counts
+
+    # first key not yet diffed by a streaming diff, None to start from the beginning
+    def get_resume_key(self) -> tuple:
+        if len(self.done) == 0:
+            return None
+        return self.done[-1][0].hi
+
+    # true if a streaming diff checkpointed the last range of the table
+    def is_stream_complete(self) -> bool:
+        return len(self.done) > 0 and self.done[-1][0].hi is None
+
+    def get_plan(self) -> List[KeyRange]:
+        return self.journal.plans.get(self.statekey)
+
+    def save_plan(self, keyranges:List[KeyRange]):
+        self.journal.plans[self.statekey] = keyranges
+        self.journal.write({'event': 'plan', 'tables': [self.tablename1, self.tablename2], 'mode': self.mode,
+                            'ranges': [ [encode_key(keyrange.lo), encode_key(keyrange.hi)] for keyrange in keyranges ]})
+
+    def is_range_done(self, keyrange:KeyRange) -> bool:
+        return any(keyrange == donerange for donerange, counts in self.done)
+
+    def range_done(self, keyrange:KeyRange, counts:Tuple):
+        self.journal.write({'event': 'range', 'tables': [self.tablename1, self.tablename2], 'mode': self.mode,
+                            'lo': encode_key(keyrange.lo), 'hi': encode_key(keyrange.hi), 'counts': list(counts)})
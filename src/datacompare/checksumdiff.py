@@ -0,0 +1,78 @@
+#
+# diff table contents by comparing checksums of primary key ranges
+#
+
+from typing import List, Tuple
+from dbdiff.schema import Database
+from datacompare.resultsink import ResultSink
+from datacompare.tablediff import TableDiff
+from datacompare.keyrange import and_where, get_range_expressions, get_table_key_range, split_key_range
+
+# ranges with at most this many rows on both sides are compared row by row
+DEFAULT_LEAF_SIZE = 10000
+# number of subranges a mismatched range is split into
+DEFAULT_FANOUT = 16
+
+
+# The checksum diff asks each server for the row count and an aggregate hash of
+# every row in a primary key range.  Ranges that match are counted as identical
+# without transferring any rows.  Ranges that do not match are split and checked
+# again, until the range is small enough (leafsize) to fetch and diff in memory.
+# On a mostly identical pair of tables only the aggregate queries and the rows
+# of a few small ranges cross the network.
+#
+# The row hashes are computed from the text form of each value, so identical rows
+# only hash the same when both servers render the values the same way.  For mixed
+# engine diffs most ranges will mismatch and the diff degrades to row fetches.
+class ChecksumDiff(TableDiff):
+    def __init__(self, db1:Database, db2:Database, verbose=False, canonicalize=None,
+                 leafsize:int = DEFAULT_LEAF_SIZE, fanout:int = DEFAULT_FANOUT, sink:ResultSink = None):
+        super().__init__(db1, db2, verbose=verbose, canonicalize=canonicalize, sink=sink)
+        self.leafsize = leafsize
+        self.fanout = fanout
+
+    # returns same count, diffs, only1, only2
+    def diff_rows_checksum(self, tablename1:str, tablename2:str, where:str = None) -> Tuple[int, List, List, List]:
+        table1, table2, pklist = self.check_tables(tablename1, tablename2)
+        if len(pklist) == 0:
+            raise ValueError('table has no primary key ' + tablename1)
+        pklist2 = table2.get_primary_key_columns()
+        keyexprs1, keyexprs2 = get_range_expressions(self.db1, self.db2, pklist, pklist2)
+        samecount = 0
+        diffs, only1, only2 = self.new_results(tablename1, tablename2, pklist)
+        checksum_queries = 0
+        leaf_ranges = 0
+        # depth first traversal keeps the list of pending ranges small
+        pending = [ get_table_key_range(self.db1, self.db2, tablename1, tablename2, pklist, where) ]
+        while len(pending) > 0:
+            keyrange = pending.pop()
+            where1, params1 = and_where(where, None, *keyrange.get_where(keyexprs1))
+            where2, params2 = and_where(where, None, *keyrange.get_where(keyexprs2))
+            count1, checksum1 = self.db1.fetch_range_checksum(tablename1, table1, where1, params1)
+            count2, checksum2 = self.db2.fetch_range_checksum(tablename2, table2, where2, params2)
+            checksum_queries += 1
+            if count1 == count2 and checksum1 == checksum2:
+                samecount += count1
+                continue
+            subranges = [ keyrange ]
+            if max(count1, count2) > self.leafsize:
+                # split using the side with more rows so the quantiles are meaningful
+                if count1 >= count2:
+                    subranges = split_key_range(self.db1, tablename1, pklist, keyrange, self.fanout, count1, where,
+                                                None, keyexprs1)
+                else:
+                    subranges = split_key_range(self.db2, tablename2, pklist2, keyrange, self.fanout, count2, where,
+                                                None, keyexprs2)
+            if len(subranges) > 1:
+                # push in reverse so ranges are processed in key order
+                pending.extend(reversed(subranges))
+                continue
+            # leaf range: fetch the rows and compare them in memory
+            leaf_ranges += 1
+            sames, leafdiffs, leafonly1, leafonly2 = self.diff_range(tablename1, tablename2, pklist, keyrange, where)
+            samecount += len(sames)
+            diffs.extend(leafdiffs)
+            only1.extend(leafonly1)
+            only2.extend(leafonly2)
+        print("\tChecksum queries: " + str(checksum_queries) + ", leaf ranges fetched: " + str(leaf_ranges))
+        return samecount, diffs, only1, only2
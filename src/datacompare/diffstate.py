@@ -0,0 +1,180 @@
+#
+# persisted state for incremental data diffs
+#
+
+from decimal import Decimal
+from typing import Dict
+from dbdiff.schema import Database, Table
+import datetime
+import hashlib
+import json
+import os
+
+
+# Encode a watermark value for the JSON state file, keeping its type.
+# Only the types that make sense for a change tracking column are supported.
+def encode_watermark(value) -> dict:
+    if value is None:
+        return None
+    valtype = type(value)
+    if valtype is int:
+        return {'type': 'int', 'value': value}
+    if valtype is Decimal:
+        return {'type': 'decimal', 'value': str(value)}
+    if valtype is float:
+        return {'type': 'float', 'value': value}
+    if valtype is datetime.datetime:
+        return {'type': 'datetime', 'value': value.isoformat()}
+    if valtype is datetime.date:
+        return {'type': 'date', 'value': value.isoformat()}
+    raise ValueError('unsupported watermark type ' + str(valtype))
+
+def decode_watermark(data:dict):
+    if data is None:
+        return None
+    valtype = data['type']
+    value = data['value']
+    if valtype == 'int':
+        return int(value)
+    if valtype == 'decimal':
+        return Decimal(value)
+    if valtype == 'float':
+        return float(value)
+    if valtype == 'datetime':
+        return datetime.datetime.fromisoformat(value)
+    if valtype == 'date':
+        return datetime.date.fromisoformat(value)
+    raise ValueError('unsupported watermark type ' + str(valtype))
+
+
+# render a watermark value as a SQL literal that MySQL and Postgres both accept
+def watermark_literal(value) -> str:
+    valtype = type(value)
+    if valtype is int or valtype is Decimal or valtype is float:
+        return str(value)
+    if valtype is datetime.datetime:
+        return "'" + value.isoformat(sep=' ') + "'"
+    if valtype is datetime.date:
+        return "'" + value.isoformat() + "'"
+    raise ValueError('unsupported watermark type ' + str(valtype))
+
+
+# where clause that selects the rows changed after lo, up to and including hi
+def get_watermark_where(column:str, lo, hi) -> str:
+    terms = []
+    if lo is not None:
+        terms.append(column + ' > ' + watermark_literal(lo))
+    if hi is not None:
+        terms.append(column + ' <= ' + watermark_literal(hi))
+    if len(terms) == 0:
+        return None
+    return ' AND '.join(terms)
+
+
+# Hash of the column definitions and primary key of both tables.
+# A change to either table changes the fingerprint and forces a full diff.
+def get_schema_fingerprint(table1:Table, table2:Table) -> str:
+    hasher = hashlib.sha1()
+    for table in (table1, table2):
+        for col in sorted(table.columns, key=lambda col: col.position or 0):
+            coldef = [ col.name, col.type, str(col.nullable), str(col.primaryKey) ]
+            hasher.update(('|'.join(coldef) + '\n').encode('utf-8'))
+        hasher.update(b'--\n')
+    return hasher.hexdigest()
+
+
+# The state file is a JSON object with one entry per table pair, keyed by
+# "tablename1/tablename2", holding the change tracking column, the watermark
+# up to which the table was last verified, the schema fingerprint and the
+# counts of the last run.
+class DiffState:
+    def __init__(self, path:str):
+        self.path = path
+        self.tables: Dict[str, dict] = dict()
+        if os.path.exists(path):
+            with open(path) as FILE:
+                data = json.load(FILE)
+            self.tables = data.get('tables', dict())
+
+    def get_table_key(self, tablename1:str, tablename2:str) -> str:
+        return tablename1 + '/' + tablename2
+
+    def get_table(self, tablename1:str, tablename2:str) -> dict:
+        return self.tables.get(self.get_table_key(tablename1, tablename2))
+
+    def set_table(self, tablename1:str, tablename2:str, entry:dict):
+        self.tables[self.get_table_key(tablename1, tablename2)] = entry
+
+    # write to a temporary file and rename, so a crash never leaves a truncated state file
+    def save(self):
+        temppath = self.path + '.tmp'
+        with open(temppath, 'w') as FILE:
+            json.dump({'tables': self.tables}, FILE, indent=2, sort_keys=True)
+        os.replace(temppath, self.path)
+
+
+# One table of an incremental diff.  plan() reads the previous watermark from
+# the state and the current high watermark from the databases, and returns the
+# where clause for this run.  record() stores the result of the run.
+class IncrementalTable:
+    def __init__(self, state:DiffState, column:str, tablename1:str, tablename2:str):
+        self.state = state
+        self.column = column
+        self.tablename1 = tablename1
+        self.tablename2 = tablename2
+        self.lo = None
+        self.hi = None
+        self.fingerprint = None
+        self.rebaseline = False
+
+    # returns the where clause, None for a full diff
+    def plan(self, db1:Database, db2:Database) -> str:
+        table1 = db1.get_table(self.tablename1)
+        table2 = db2.get_table(self.tablename2)
+        col1 = table1.get_column(self.column)
+        col2 = table2.get_column(self.column)
+        if col1 is None or col2 is None:
+            raise ValueError('change tracking column ' + self.column + ' not found in ' + self.tablename1)
+        self.fingerprint = get_schema_fingerprint(table1, table2)
+        entry = self.state.get_table(self.tablename1, self.tablename2)
+        if entry is None or entry['column'] != self.column or entry['schema'] != self.fingerprint:
+            self.rebaseline = True
+        else:
+            self.lo = decode_watermark(entry['watermark'])
+            self.rebaseline = self.lo is None
+        # Stop at the lower of the two high watermarks, so rows that have not
+        # replicated yet are left for the next run instead of reported as missing.
+        max1 = db1.fetch_key_bounds(self.tablename1, col1)[1]
+        max2 = db2.fetch_key_bounds(self.tablename2, col2)[1]
+        maxs = [ val for val in (max1, max2) if val is not None ]
+        self.hi = min(maxs) if len(maxs) > 0 else None
+        if self.hi is not None:
+            # fail before the diff runs if the column type cannot be a watermark
+            watermark_literal(self.hi)
+        if self.rebaseline:
+            # a full diff also covers rows where the column is NULL
+            return None
+        return get_watermark_where(self.column, self.lo, self.hi)
+
+    # The watermark only advances when the diff was clean, so rows that differed
+    # are checked again by the next run.
+    def record(self, samecount:int, diffcount:int, only1count:int, only2count:int):
+        entry = self.state.get_table(self.tablename1, self.tablename2)
+        watermark = entry['watermark'] if entry is not None and not self.rebaseline else None
+        if diffcount == 0 and only1count == 0 and only2count == 0 and self.hi is not None:
+            watermark = encode_watermark(self.hi)
+        self.state.set_table(self.tablename1, self.tablename2, {
+            'column': self.column,
+            'watermark': watermark,
+            'schema': self.fingerprint,
+            'samecount': samecount,
+            'diffcount': diffcount,
+            'only1count': only1count,
+            'only2count': only2count,
+            'verified': datetime.datetime.now().isoformat(timespec='seconds'),
+        })
+
+    def get_description(self) -> str:
+        if self.rebaseline:
+            return 'full diff (new table or schema change)'
+        return self.column + ' > ' + str(self.lo)
@@ -0,0 +1,102 @@
+#
+# primary key index in typed NumPy arrays for fixed width keys
+#
+
+from typing import Iterator, List, Tuple
+from dbdiff.schema import Column
+from datacompare.rowdigest import DIGEST_SIZE
+
+try:
+    import numpy  # type: ignore
+except ModuleNotFoundError:  # pragma: no cover - optional dependency
+    numpy = None
+
+# number of keys converted to an array at a time while an index is built
+KEY_CHUNK_SIZE = 65536
+
+
+# Returns the NumPy dtype of the primary key, or None if the key is not fixed
+# width (or NumPy is not installed) and the dict based diff has to be used.
+# A single integer column is a plain int64/uint64, composite integer keys are
+# packed into a structured dtype with one field per key column.
+def get_key_dtype(pklist:List[Column]):
+    if numpy is None or len(pklist) == 0:
+        return None
+    fields = []
+    for index, col in enumerate(pklist):
+        if not col.is_integer_type():
+            return None
+        unsigned = 'unsigned' in (col.type or '').lower()
+        fields.append(('k' + str(index), '<u8' if unsigned else '<i8'))
+    if len(fields) == 1:
+        return numpy.dtype(fields[0][1])
+    return numpy.dtype(fields)
+
+
+# Convert keys to an array of dtype.  Keys are scalars for a single column key
+# and tuples for composite keys, one element tuples are accepted for both.
+def make_key_array(keys:Iterator, dtype, count:int = -1):
+    if dtype.names is None:
+        keys = (key[0] if type(key) is tuple else key for key in keys)
+    return numpy.fromiter(keys, dtype, count)
+
+
+# Find the positions of the common and the unmatched keys of two key arrays.
+# Keys must be unique within each array.
+# returns common positions in keys1, common positions in keys2, only1 positions, only2 positions
+def match_keys(keys1, keys2) -> Tuple:
+    common, common1, common2 = numpy.intersect1d(keys1, keys2, assume_unique=True, return_indices=True)
+    only1 = numpy.setdiff1d(numpy.arange(len(keys1)), common1, assume_unique=True)
+    only2 = numpy.setdiff1d(numpy.arange(len(keys2)), common2, assume_unique=True)
+    return common1, common2, only1, only2
+
+
+# Collects (key, digest) pairs into a key array and a digest array.  Keys are
+# converted a chunk at a time, so no python object per key is kept: an entry
+# costs the key width plus 16 bytes instead of a dict entry, a key tuple and a
+# bytes object.
+class KeyDigestIndex:
+    def __init__(self, dtype):
+        self.dtype = dtype
+        self.keychunks = []
+        self.digestchunks = []
+        self.keys = None
+        self.digests = None
+
+    def extend(self, pairs:Iterator[Tuple[tuple, bytes]]):
+        keys = []
+        digests = []
+        for key, digest in pairs:
+            keys.append(key)
+            digests.append(digest)
+            if len(keys) >= KEY_CHUNK_SIZE:
+                self.add_chunk(keys, digests)
+                keys = []
+                digests = []
+        if len(keys) > 0:
+            self.add_chunk(keys, digests)
+        self.keys = numpy.concatenate(self.keychunks) if self.keychunks else numpy.empty(0, self.dtype)
+        self.digests = numpy.concatenate(self.digestchunks) if self.digestchunks else numpy.empty(0, 'S' + str(DIGEST_SIZE))
+        self.keychunks = []
+        self.digestchunks = []
+        return self
+
+    def add_chunk(self, keys:List, digests:List[bytes]):
+        self.keychunks.append(make_key_array(keys, self.dtype, len(keys)))
+        self.digestchunks.append(numpy.frombuffer(b''.join(digests), dtype='S' + str(DIGEST_SIZE)))
+
+    # return the keys at positions as a list of key tuples
+    def get_keys(self, positions) -> List[tuple]:
+        keys = self.keys[positions].tolist()
+        if self.dtype.names is None:
+            return [ (key,) for key in keys ]
+        return keys
+
+
+# Diff two key digest indexes with vectorized set operations.
+# returns same count, diff keys, only1 keys, only2 keys
+def diff_key_digest_indexes(index1:KeyDigestIndex, index2:KeyDigestIndex) -> Tuple[int, List, List, List]:
+    common1, common2, only1, only2 = match_keys(index1.keys, index2.keys)
+    differ = index1.digests[common1] != index2.digests[common2]
+    samecount = int(len(common1) - numpy.count_nonzero(differ))
+    return (samecount, index1.get_keys(common1[differ]), index1.get_keys(only1), index2.get_keys(only2))
@@ -0,0 +1,142 @@
+#
+# primary key ranges and the SQL predicates that select them
+#
+
+from typing import List, Tuple
+from dbdiff.schema import Column, Database
+
+
+class KeyRange:
+    # lo is inclusive, hi is exclusive, None means unbounded.
+    # Bounds are key tuples with one value per primary key column.
+    def __init__(self, lo:tuple = None, hi:tuple = None):
+        self.lo = lo
+        self.hi = hi
+
+    def __eq__(self, __o: object) -> bool:
+        if type(self) is not type(__o):
+            return False
+        return self.lo == __o.lo and self.hi == __o.hi
+
+    def __repr__(self) -> str:
+        return 'KeyRange(' + str(self.lo) + ', ' + str(self.hi) + ')'
+
+    def contains(self, key:tuple) -> bool:
+        if self.lo is not None and key < self.lo:
+            return False
+        if self.hi is not None and not key < self.hi:
+            return False
+        return True
+
+    # return a where clause and parameters that select the keys in this range.
+    # keyexprs are the key expressions of the database the clause is for (see
+    # get_range_expressions), so that both databases put the same keys in a range.
+    def get_where(self, keyexprs:List[str]) -> Tuple[str, tuple]:
+        terms = []
+        params = []
+        if self.lo is not None:
+            terms.append(key_compare_sql(keyexprs, '>='))
+            params.extend(self.lo)
+        if self.hi is not None:
+            terms.append(key_compare_sql(keyexprs, '<'))
+            params.extend(self.hi)
+        if len(terms) == 0:
+            return None, None
+        return ' AND '.join(terms), tuple(params)
+
+
+# compare the key against a parameter tuple, using a row constructor for composite keys
+def key_compare_sql(keyexprs:List[str], op:str) -> str:
+    if len(keyexprs) == 1:
+        return keyexprs[0] + ' ' + op + ' %s'
+    placeholders = ', '.join([ '%s' ] * len(keyexprs))
+    return '(' + ', '.join(keyexprs) + ') ' + op + ' (' + placeholders + ')'
+
+
+# combine two where clauses (either may be None) and their parameters
+def and_where(where1:str, params1:tuple, where2:str, params2:tuple) -> Tuple[str, tuple]:
+    if where1 is None:
+        return where2, params2
+    if where2 is None:
+        return where1, params1
+    params = tuple(params1 or ()) + tuple(params2 or ())
+    return '(' + where1 + ') AND ' + where2, params
+
+
+# Return the key expressions of the range predicates of both databases.
+# A range only needs both sides to agree on which keys fall in it, so when both
+# servers order the key the same way natively the plain key columns are
+# compared and the primary key index serves the range.  Otherwise the keys are
+# compared with the sort expressions, which agree across engines but for
+# string keys on MySQL and Postgres cannot use the index.
+def get_range_expressions(db1:Database, db2:Database, pklist1:List[Column],
+                          pklist2:List[Column]) -> Tuple[List[str], List[str]]:
+    order1 = db1.get_key_order(pklist1)
+    if order1 is not None and order1 == db2.get_key_order(pklist2):
+        return [ col.name for col in pklist1 ], [ col.name for col in pklist2 ]
+    return db1.get_key_sort_expressions(pklist1), db2.get_key_sort_expressions(pklist2)
+
+
+# true if the key is a single integer column that can be split arithmetically
+def is_integer_key(pklist:List[Column]) -> bool:
+    return len(pklist) == 1 and pklist[0].is_integer_type()
+
+
+# return the range that covers all keys of both tables.
+# Integer keys get concrete bounds so they can be split without querying the
+# data, all other keys start out unbounded.
+def get_table_key_range(db1:Database, db2:Database, tablename1:str, tablename2:str,
+                        pklist:List[Column], where:str = None) -> KeyRange:
+    if not is_integer_key(pklist):
+        return KeyRange()
+    min1, max1 = db1.fetch_key_bounds(tablename1, pklist[0], where)
+    min2, max2 = db2.fetch_key_bounds(tablename2, pklist[0], where)
+    mins = [ val for val in (min1, min2) if val is not None ]
+    maxs = [ val for val in (max1, max2) if val is not None ]
+    if len(mins) == 0:
+        return KeyRange()
+    return KeyRange((min(mins),), (max(maxs) + 1,))
+
+
+# Split a key range into at most parts subranges.
+# Integer keys with concrete bounds are split arithmetically.  Other keys are
+# split at quantiles: rowcount is the number of rows in keyrange on db, and
+# the split keys are read with LIMIT/OFFSET queries in the order of keyexprs
+# (the key sort expressions by default), which must be the expressions the
+# ranges are selected with.
+# Returns a single range if the range cannot be split any further.
+def split_key_range(db:Database, tablename:str, pklist:List[Column], keyrange:KeyRange,
+                    parts:int, rowcount:int, where:str = None, params:tuple = None,
+                    keyexprs:List[str] = None) -> List[KeyRange]:
+    if parts < 2:
+        return [ keyrange ]
+    splitkeys = []
+    if is_integer_key(pklist) and keyrange.lo is not None and keyrange.hi is not None:
+        lo = keyrange.lo[0]
+        hi = keyrange.hi[0]
+        step = max(1, -(-(hi - lo) // parts))
+        splitkeys = [ (key,) for key in range(lo + step, hi, step) ]
+    elif rowcount > 1:
+        keyexprs = keyexprs or db.get_key_sort_expressions(pklist)
+        rangewhere, rangeparams = keyrange.get_where(keyexprs)
+        where, params = and_where(where, params, rangewhere, rangeparams)
+        for part in range(1, parts):
+            offset = rowcount * part // parts
+            if offset == 0:
+                continue
+            key = db.fetch_key_at_offset(tablename, pklist, offset, where, params, keyexprs)
+            if key is None:
+                break
+            splitkeys.append(key)
+    # build subranges, dropping duplicate boundaries.  The split keys are inside
+    # the range and ascending in the key order of the server, which for string
+    # keys compared natively need not be python order, so they are not compared.
+    ranges = []
+    lo = keyrange.lo
+    for key in splitkeys:
+        if key == lo:
+            continue
+        ranges.append(KeyRange(lo, key))
+        lo = key
+    ranges.append(KeyRange(lo, keyrange.hi))
+    return ranges
@@ -0,0 +1,201 @@
+#
+# per column value normalizers for diffs between two database engines
+#
+
+from decimal import Decimal
+from typing import Callable, Dict, Iterator, List, Tuple
+from dbdiff.schema import Column, Database, Table
+import datetime
+import json
+
+
+#
+# value converters; every converter passes None through
+#
+def to_bool(value):
+    return value if value is None else bool(value)
+
+def to_decimal(value):
+    if value is None or type(value) is Decimal:
+        return value
+    # str gives the shortest repr of a float, not its binary expansion
+    return Decimal(str(value))
+
+def make_to_decimal(scale:int) -> Callable:
+    quantum = Decimal(1).scaleb(-scale)
+
+    def to_scaled_decimal(value):
+        if value is None:
+            return value
+        if type(value) is not Decimal:
+            value = Decimal(str(value))
+        return value.quantize(quantum)
+    return to_scaled_decimal
+
+def to_naive_utc(value):
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+def timedelta_to_time(value):
+    if value is None:
+        return value
+    seconds = int(value.total_seconds())
+    return datetime.time(seconds // 3600 % 24, seconds // 60 % 60, seconds % 60, value.microseconds)
+
+def to_bytes(value):
+    return value if value is None else bytes(value)
+
+def to_str(value):
+    return value if value is None else str(value)
+
+def dump_json(value):
+    return value if value is None else json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+def parse_json(value):
+    return value if value is None else dump_json(json.loads(value))
+
+
+# Returns the (DB1, DB2) converters that bring the values of one column read
+# from two engines to the same python value, either of which is None if that
+# side needs no conversion.  The choice is made once from the column types, so
+# the values themselves are never inspected to pick a converter.
+def get_column_normalizers(col1:Column, col2:Column) -> Tuple[Callable, Callable]:
+    kind1 = col1.get_value_kind()
+    kind2 = col2.get_value_kind()
+    kinds = (kind1, kind2)
+    if kind1 == 'bytes' and kind2 == 'bytes':
+        # drivers return bytes, bytearray or memoryview, only bytes is hashable
+        return (to_bytes, to_bytes) if type(col1) is not type(col2) else (None, None)
+    if kind1 == kind2:
+        return None, None
+    if set(kinds) <= { 'bool', 'intbool', 'integer' } and ('bool' in kinds or 'intbool' in kinds):
+        # tinyint(1) 0/1 against a boolean
+        return to_bool, to_bool
+    if 'decimal' in kinds and set(kinds) <= { 'decimal', 'integer', 'float' }:
+        scale = col1.get_type_scale() if kind1 == 'decimal' else None
+        if scale is None and kind2 == 'decimal':
+            scale = col2.get_type_scale()
+        func = make_to_decimal(scale) if scale is not None else to_decimal
+        return func, func
+    if set(kinds) <= { 'json', 'jsontext', 'string' }:
+        # parsed json is dumped, json text (or a string column) is parsed and dumped
+        return (dump_json if kind1 == 'json' else parse_json,
+                dump_json if kind2 == 'json' else parse_json)
+    if set(kinds) == { 'datetime', 'datetimetz' }:
+        # naive datetimes are taken to be UTC
+        return (to_naive_utc if kind1 == 'datetimetz' else None,
+                to_naive_utc if kind2 == 'datetimetz' else None)
+    if set(kinds) == { 'time', 'timedelta' }:
+        # MySQL returns TIME values as timedeltas
+        return (timedelta_to_time if kind1 == 'timedelta' else None,
+                timedelta_to_time if kind2 == 'timedelta' else None)
+    if set(kinds) == { 'uuid', 'string' }:
+        return (to_str if kind1 == 'uuid' else None,
+                to_str if kind2 == 'uuid' else None)
+    return None, None
+
+
+# Returns the {colname: converter} maps of DB1 and DB2 for the columns both
+# tables have, leaving out the columns whose values already line up.
+def get_table_normalizers(table1:Table, table2:Table) -> Tuple[Dict[str, Callable], Dict[str, Callable]]:
+    columns2 = { col.name: col for col in table2.columns }
+    normalizers1 = dict()
+    normalizers2 = dict()
+    for col1 in table1.columns:
+        col2 = columns2.get(col1.name)
+        if col2 is None:
+            continue
+        func1, func2 = get_column_normalizers(col1, col2)
+        if func1 is not None:
+            normalizers1[col1.name] = func1
+        if func2 is not None:
+            normalizers2[col2.name] = func2
+    return normalizers1, normalizers2
+
+
+# Returns a function that converts the normalized columns of a dict row in place.
+def make_dict_normalizer(normalizers:Dict[str, Callable]) -> Callable:
+    items = tuple(normalizers.items())
+
+    def normalize(row:dict) -> dict:
+        for colname, func in items:
+            if colname in row:
+                row[colname] = func(row[colname])
+        return row
+    return normalize
+
+# Returns a function that converts the normalized columns of a tuple row with
+# the given column order, or None if none of the columns are normalized.
+def make_tuple_normalizer(normalizers:Dict[str, Callable], colnames:List[str]) -> Callable:
+    items = tuple((index, normalizers[colname]) for index, colname in enumerate(colnames) if colname in normalizers)
+    if len(items) == 0:
+        return None
+
+    def normalize(row:tuple) -> tuple:
+        row = list(row)
+        for index, func in items:
+            row[index] = func(row[index])
+        return tuple(row)
+    return normalize
+
+
+# Wraps a Database so that the rows fetched from the tables given normalizers
+# come back with their values converted.  Everything else goes to the wrapped
+# database.  TableDiff wraps both sides when two tables need normalizers.
+class NormalizedDatabase:
+    def __init__(self, db:Database):
+        self.db = db
+        self.dict_normalizers: Dict[str, Callable] = dict()
+        self.normalizers: Dict[str, Dict[str, Callable]] = dict()
+
+    def __getattr__(self, name:str):
+        return getattr(self.db, name)
+
+    def set_normalizers(self, tablename:str, normalizers:Dict[str, Callable]):
+        if len(normalizers) == 0:
+            self.normalizers.pop(tablename, None)
+            self.dict_normalizers.pop(tablename, None)
+            return
+        self.normalizers[tablename] = normalizers
+        self.dict_normalizers[tablename] = make_dict_normalizer(normalizers)
+
+    def normalize_rows(self, tablename:str, rows:List[Dict]) -> List[Dict]:
+        normalize = self.dict_normalizers.get(tablename)
+        if normalize is None or rows is None:
+            return rows
+        return [ normalize(row) for row in rows ]
+
+    def normalize_stream(self, tablename:str, rows:Iterator[Dict]) -> Iterator[Dict]:
+        normalize = self.dict_normalizers.get(tablename)
+        if normalize is None:
+            yield from rows
+            return
+        for row in rows:
+            yield normalize(row)
+
+    def fetch_table_rows(self, tablename:str, *args, **kwargs) -> List[Dict]:
+        return self.normalize_rows(tablename, self.db.fetch_table_rows(tablename, *args, **kwargs))
+
+    def fetch_table_rows_stream(self, tablename:str, *args, **kwargs) -> Iterator[Dict]:
+        return self.normalize_stream(tablename, self.db.fetch_table_rows_stream(tablename, *args, **kwargs))
+
+    def fetch_rows_by_keys(self, tablename:str, *args, **kwargs) -> List[Dict]:
+        return self.normalize_rows(tablename, self.db.fetch_rows_by_keys(tablename, *args, **kwargs))
+
+    def fetch_table_sample(self, tablename:str, *args, **kwargs) -> List[Dict]:
+        return self.normalize_rows(tablename, self.db.fetch_table_sample(tablename, *args, **kwargs))
+
+    def fetch_table_tuples(self, tablename:str, columns:List[str], *args, **kwargs) -> List[tuple]:
+        rows = self.db.fetch_table_tuples(tablename, columns, *args, **kwargs)
+        normalize = make_tuple_normalizer(self.normalizers.get(tablename, {}), columns)
+        if normalize is None:
+            return rows
+        return [ normalize(row) for row in rows ]
+
+    def fetch_table_tuples_stream(self, tablename:str, columns:List[str], *args, **kwargs) -> Iterator[tuple]:
+        rows = self.db.fetch_table_tuples_stream(tablename, columns, *args, **kwargs)
+        normalize = make_tuple_normalizer(self.normalizers.get(tablename, {}), columns)
+        if normalize is None:
+            return rows
+        return map(normalize, rows)
@@ -0,0 +1,208 @@
+#
+# run data diffs concurrently on separate database connections
+#
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Tuple
+from dbdiff.schema import DEFAULT_BATCH_SIZE, Database, Table
+from util.database_credentials import read_credentials_file
+import copy
+import queue
+import threading
+
+# default number of batches buffered between the fetch threads and the consumer
+DEFAULT_PREFETCH_DEPTH = 4
+
+
+# Opens new connections to a database whose schema has already been imported.
+# Each connection gets a shallow copy of the schema database object, so the
+# table, column and constraint objects are shared and only the connection differs.
+class DatabaseConnector:
+    def __init__(self, envfile:str, schemadb:Database):
+        self.envfile = envfile
+        self.schemadb = schemadb
+        dbenv = read_credentials_file(envfile)
+        self.host = dbenv.get('host', 'localhost')
+        # functions that wrap each new connection (throttling, instrumentation),
+        # applied in the order they were added
+        self.wrappers = []
+
+    def add_wrapper(self, wrapper:Callable[[Database], Database]):
+        self.wrappers.append(wrapper)
+
+    def connect(self) -> Database:
+        dbenv = read_credentials_file(self.envfile)
+        if 'type' in dbenv:
+            del dbenv['type']
+        db = copy.copy(self.schemadb)
+        db.connect(**dbenv)
+        for wrapper in self.wrappers:
+            db = wrapper(db)
+        return db
+
+
+# Limits the number of concurrent connections to each host.
+# A caller acquires all the connections it needs at once, so two workers can never
+# deadlock holding one connection each while waiting for a second one.
+class ConnectionLimiter:
+    def __init__(self, maxperhost:int = None):
+        self.maxperhost = maxperhost
+        self.inuse: Dict[str, int] = dict()
+        self.condition = threading.Condition()
+
+    # hosts lists one entry per connection, so a host may appear more than once
+    def acquire(self, hosts:List[str]):
+        if self.maxperhost is None:
+            return
+        needed = self.get_needed(hosts)
+        with self.condition:
+            while not all(self.inuse.get(host, 0) + count <= self.maxperhost for host, count in needed.items()):
+                self.condition.wait()
+            for host, count in needed.items():
+                self.inuse[host] = self.inuse.get(host, 0) + count
+
+    def release(self, hosts:List[str]):
+        if self.maxperhost is None:
+            return
+        needed = self.get_needed(hosts)
+        with self.condition:
+            for host, count in needed.items():
+                self.inuse[host] -= count
+            self.condition.notify_all()
+
+    # count connections per host; a request larger than the cap is clamped
+    # to the cap so it can still run, alone
+    def get_needed(self, hosts:List[str]) -> Dict[str, int]:
+        needed = dict()
+        for host in hosts:
+            needed[host] = min(needed.get(host, 0) + 1, self.maxperhost)
+        return needed
+
+    def connections(self, hosts:List[str]):
+        return _LimiterContext(self, hosts)
+
+
+class _LimiterContext:
+    def __init__(self, limiter:ConnectionLimiter, hosts:List[str]):
+        self.limiter = limiter
+        self.hosts = hosts
+
+    def __enter__(self):
+        self.limiter.acquire(self.hosts)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.limiter.release(self.hosts)
+        return False
+
+
+# estimated size of a table from the catalog statistics, as a sort key
+# (data length, row count), with 0 for unknown values
+def get_table_size(table:Table) -> tuple:
+    if table is None:
+        return (0, 0)
+    return (table.data_length or 0, table.rows or 0)
+
+
+# Run worker(task) for every task on a pool of jobs threads.
+# Tasks are started in order of decreasing size so that one huge table does not
+# end up running alone at the end, but results are yielded in task order.
+def run_tasks(tasks:List, worker:Callable, jobs:int, sizefunc:Callable = None) -> Iterator:
+    order = list(range(len(tasks)))
+    if sizefunc is not None:
+        order.sort(key=lambda index: sizefunc(tasks[index]), reverse=True)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = dict()
+        for index in order:
+            futures[index] = executor.submit(worker, tasks[index])
+        for index in range(len(tasks)):
+            yield futures[index].result()
+
+
+# marks the end of a source in the prefetch queue
+_END = object()
+
+
+class _ErrorBatch:
+    def __init__(self, error:BaseException):
+        self.error = error
+
+
+# Read several row iterators on background threads and yield (source index, batch)
+# as the batches arrive, so the consumer can compare rows while the next batches
+# are still being fetched.  The queue holds at most depth batches, which bounds
+# memory when the consumer is slower than the databases.  With concurrent False
+# the sources are read one after the other on a single thread, for sources that
+# share a connection.  An exception in a source is raised in the consumer.
+def fetch_batches(sources:List[Iterator], batchsize:int = DEFAULT_BATCH_SIZE, depth:int = DEFAULT_PREFETCH_DEPTH,
+                  concurrent:bool = True) -> Iterator[Tuple[int, List]]:
+    batches = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(indexes:List[int]):
+        for index in indexes:
+            try:
+                batch = []
+                for row in sources[index]:
+                    batch.append(row)
+                    if len(batch) >= batchsize:
+                        if not put((index, batch)):
+                            return
+                        batch = []
+                if len(batch) > 0 and not put((index, batch)):
+                    return
+            except BaseException as error:
+                put((index, _ErrorBatch(error)))
+                return
+            put((index, _END))
+
+    # close the sources on the thread that read them, also when the consumer
+    # stopped early or a source failed, so a server-side cursor does not stay
+    # open with an unread result until the generator is garbage collected
+    def producer(indexes:List[int]):
+        try:
+            produce(indexes)
+        finally:
+            for index in indexes:
+                close = getattr(sources[index], 'close', None)
+                if close is not None:
+                    close()
+
+    if concurrent:
+        groups = [ [ index ] for index in range(len(sources)) ]
+    else:
+        groups = [ list(range(len(sources))) ]
+    threads = [ threading.Thread(target=producer, args=(group,), daemon=True) for group in groups ]
+    for thread in threads:
+        thread.start()
+    remaining = len(sources)
+    try:
+        while remaining > 0:
+            index, batch = batches.get()
+            if batch is _END:
+                remaining -= 1
+            elif isinstance(batch, _ErrorBatch):
+                raise batch.error
+            else:
+                yield index, batch
+    finally:
+        # stop the producers if the consumer gave up early
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+# iterate one row source through a background fetch thread
+def prefetch_rows(rows:Iterator, batchsize:int = DEFAULT_BATCH_SIZE, depth:int = DEFAULT_PREFETCH_DEPTH) -> Iterator:
+    for index, batch in fetch_batches([ rows ], batchsize, depth):
+        for row in batch:
+            yield row
@@ -0,0 +1,81 @@
+#
+# cheap table level signals that identify identical tables before any row transfer
+#
+
+from typing import List, Tuple
+from dbdiff.schema import Database
+from datacompare.parallel import ConnectionLimiter, DatabaseConnector, run_tasks
+
+
+# Row count, primary key bounds and server checksum of a table.
+class TableSignature:
+    def __init__(self, rowcount:int = None, minkey = None, maxkey = None, checksum = None):
+        self.rowcount = rowcount
+        self.minkey = minkey
+        self.maxkey = maxkey
+        self.checksum = checksum
+
+    def __eq__(self, __o: object) -> bool:
+        if type(self) is not type(__o):
+            return False
+        return (self.rowcount == __o.rowcount and self.minkey == __o.minkey
+                and self.maxkey == __o.maxkey and self.checksum == __o.checksum)
+
+    def __repr__(self) -> str:
+        return ('TableSignature(' + str(self.rowcount) + ', ' + str(self.minkey) + ', '
+                + str(self.maxkey) + ', ' + str(self.checksum) + ')')
+
+    # Count and key bounds alone cannot show that two tables are identical, so a
+    # match needs a checksum on both sides (or two empty tables).
+    def matches(self, other) -> bool:
+        if self.rowcount is None or self != other:
+            return False
+        return self.rowcount == 0 or self.checksum is not None
+
+
+def fetch_table_signature(db:Database, tablename:str) -> TableSignature:
+    table = db.get_table(tablename)
+    pklist = table.get_primary_key_columns()
+    rowcount = db.fetch_table_rowcount(tablename, None)
+    minkey = None
+    maxkey = None
+    if len(pklist) > 0:
+        bounds = db.fetch_key_bounds(tablename, pklist[0])
+        if bounds is not None:
+            minkey, maxkey = bounds
+    checksum = db.fetch_table_checksum(tablename, table)
+    return TableSignature(rowcount, minkey, maxkey, checksum)
+
+
+# Fetch the signatures of every table pair from both databases.
+# With connectors the tables are split into jobs chunks per side and every chunk
+# runs on its own connection, so both sides are checked at the same time.
+# returns a list of (signature1, signature2) in tables order
+def precheck_tables(db1:Database, db2:Database, tables:List[Tuple[str, str]],
+                    connectors:Tuple[DatabaseConnector, DatabaseConnector] = None,
+                    jobs:int = 1, maxperhost:int = None) -> List[Tuple[TableSignature, TableSignature]]:
+    if connectors is None or len(tables) == 0:
+        return [ (fetch_table_signature(db1, tablename1), fetch_table_signature(db2, tablename2))
+                 for tablename1, tablename2 in tables ]
+    limiter = ConnectionLimiter(maxperhost)
+    chunks = max(1, min(jobs, len(tables)))
+    tasks = []
+    for side in (0, 1):
+        for chunk in range(chunks):
+            tasks.append((side, list(range(chunk, len(tables), chunks))))
+
+    def worker(task):
+        side, indexes = task
+        connector = connectors[side]
+        with limiter.connections([ connector.host ]):
+            db = connector.connect()
+            try:
+                return [ (index, fetch_table_signature(db, tables[index][side])) for index in indexes ]
+            finally:
+                db.close()
+
+    signatures = [ [ None, None ] for tablepair in tables ]
+    for task, results in zip(tasks, run_tasks(tasks, worker, len(tasks))):
+        for index, signature in results:
+            signatures[index][task[0]] = signature
+    return [ tuple(pair) for pair in signatures ]
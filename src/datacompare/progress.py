@@ -0,0 +1,382 @@
+#
+# progress, throughput and ETA of a data diff run: a live progress line and a
+# Prometheus textfile collector metrics file
+#
+
+from typing import Callable, Dict, Iterator, List, Tuple
+from dbdiff.schema import DEFAULT_KEY_BATCH_SIZE, Column, Database, Table
+import os
+import sys
+import threading
+import time
+
+# seconds between two refreshes of the progress line and the metrics file
+DEFAULT_PROGRESS_INTERVAL = 1.0
+# rows between two row size samples for the bytes estimate
+BYTES_SAMPLE_INTERVAL = 64
+# rows counted locally by a fetch stream before they are added to the table
+COUNT_FLUSH_ROWS = 1000
+
+SIDES = ('db1', 'db2')
+PHASES = ('fetch', 'decode', 'compare')
+
+
+# approximate size of a row's values as sent by the server
+def estimate_row_bytes(row) -> int:
+    size = 0
+    for value in (row.values() if isinstance(row, dict) else row):
+        if isinstance(value, (str, bytes, bytearray, memoryview)):
+            size += len(value)
+        elif value is not None:
+            size += 8
+    return size
+
+
+def format_count(count:float) -> str:
+    for limit, suffix in ((1e9, 'G'), (1e6, 'M'), (1e3, 'k')):
+        if count >= limit:
+            return '{:.1f}'.format(count / limit) + suffix
+    return str(int(count))
+
+def format_duration(seconds:float) -> str:
+    if seconds is None:
+        return '?'
+    seconds = int(seconds)
+    return str(seconds // 3600) + ':' + '{:02d}:{:02d}'.format(seconds // 60 % 60, seconds % 60)
+
+# escape a Prometheus label value
+def escape_label(value:str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Rows, bytes and phase times of one table pair.  estimate is the larger of
+# the two catalog row estimates, None if neither database has one.
+class TableProgress:
+    def __init__(self, tablename1:str, tablename2:str, estimate:int = None):
+        self.tablename1 = tablename1
+        self.tablename2 = tablename2
+        self.estimate = estimate
+        self.lock = threading.Lock()
+        self.rows = [ 0, 0 ]
+        self.bytes = [ 0, 0 ]
+        self.fetchtime = [ 0.0, 0.0 ]
+        self.decodetime = 0.0
+        self.start = None
+        self.end = None
+
+    def add_fetch(self, side:int, rows:int, rowbytes:int, seconds:float, now:float):
+        with self.lock:
+            if self.start is None:
+                self.start = now - seconds
+            self.rows[side] += rows
+            self.bytes[side] += rowbytes
+            self.fetchtime[side] += seconds
+
+    def add_decode(self, seconds:float):
+        with self.lock:
+            self.decodetime += seconds
+
+    def get_elapsed(self, now:float) -> float:
+        if self.start is None:
+            return 0.0
+        return (self.end if self.end is not None else now) - self.start
+
+    # rows of the table done, the side that is further along
+    def get_rows_done(self) -> int:
+        done = max(self.rows)
+        if self.end is not None and self.estimate is not None:
+            return max(done, self.estimate)
+        return done if self.estimate is None else min(done, self.estimate)
+
+    # Phase seconds: fetch is the time the slower side spent in the database
+    # driver, decode the time spent turning rows into digests, and compare the
+    # rest of the table's wall time.  Both sides are mostly fetched at once, so
+    # the faster side's fetch overlaps the others.
+    def get_phase_times(self, now:float) -> Dict[str, float]:
+        fetch = max(self.fetchtime)
+        compare = max(0.0, self.get_elapsed(now) - fetch - self.decodetime)
+        return {'fetch': fetch, 'decode': self.decodetime, 'compare': compare}
+
+    # seconds until the table is done at its current rate, None if not known
+    def get_eta(self, now:float) -> float:
+        elapsed = self.get_elapsed(now)
+        done = max(self.rows)
+        if self.end is not None:
+            return 0.0
+        if self.estimate is None or done == 0 or elapsed <= 0:
+            return None
+        return max(0.0, (self.estimate - done) * elapsed / done)
+
+
+# Progress of a diff run over a list of table pairs.  The instrumented
+# databases report the rows they fetch, the tables report when they are done,
+# and at most every interval seconds the progress line is redrawn and the
+# metrics file rewritten.
+class DiffProgress:
+    def __init__(self, tables:List[Tuple[str, str, int]], live:bool = True, metricspath:str = None,
+                 interval:float = DEFAULT_PROGRESS_INTERVAL, clock=time.monotonic, output=None):
+        self.tables = [ TableProgress(tablename1, tablename2, estimate) for tablename1, tablename2, estimate in tables ]
+        self.bytable: Dict[Tuple[int, str], TableProgress] = dict()
+        for table in self.tables:
+            self.bytable[(0, table.tablename1)] = table
+            self.bytable[(1, table.tablename2)] = table
+        self.live = live
+        self.metricspath = metricspath
+        self.interval = interval
+        self.clock = clock
+        self.output = output or sys.stderr
+        self.lock = threading.Lock()
+        self.start = clock()
+        self.lastupdate = None
+        self.tablesdone = 0
+        self.linelength = 0
+
+    def get_table(self, side:int, tablename:str) -> TableProgress:
+        return self.bytable.get((side, tablename))
+
+    def add_fetch(self, side:int, tablename:str, rows:int, rowbytes:int, seconds:float):
+        table = self.get_table(side, tablename)
+        if table is None:
+            return
+        now = self.clock()
+        table.add_fetch(side, rows, rowbytes, seconds, now)
+        self.update(now)
+
+    # wrap a row conversion function so its time is the decode phase of a table
+    def time_decode(self, tablename1:str, func:Callable) -> Callable:
+        table = self.get_table(0, tablename1)
+        if table is None:
+            return func
+        clock = time.perf_counter
+
+        def timed(*args):
+            start = clock()
+            try:
+                return func(*args)
+            finally:
+                table.add_decode(clock() - start)
+        return timed
+
+    def table_done(self, tablename1:str, tablename2:str):
+        table = self.get_table(0, tablename1)
+        if table is None:
+            return
+        now = self.clock()
+        with table.lock:
+            if table.start is None:
+                table.start = now
+            table.end = now
+        with self.lock:
+            self.tablesdone += 1
+        self.update(now, force=True)
+
+    # returns the rows done and the estimated total rows of the run
+    def get_totals(self) -> Tuple[int, int]:
+        done = 0
+        total = 0
+        for table in self.tables:
+            rows = table.get_rows_done()
+            done += rows
+            total += table.estimate if table.estimate is not None else rows
+        return done, max(total, done)
+
+    # seconds until the run is done at its current overall rate, None if not known
+    def get_eta(self, now:float) -> float:
+        done, total = self.get_totals()
+        elapsed = now - self.start
+        if self.tablesdone == len(self.tables):
+            return 0.0
+        if done == 0 or elapsed <= 0:
+            return None
+        return max(0.0, (total - done) * elapsed / done)
+
+    # returns (rows, bytes, fetch seconds) of a side over all tables
+    def get_side_totals(self, side:int) -> Tuple[int, int, float]:
+        return (sum(table.rows[side] for table in self.tables), sum(table.bytes[side] for table in self.tables),
+                sum(table.fetchtime[side] for table in self.tables))
+
+    def get_active_table(self) -> TableProgress:
+        active = [ table for table in self.tables if table.start is not None and table.end is None ]
+        return active[-1] if len(active) > 0 else None
+
+    def format_line(self, now:float) -> str:
+        done, total = self.get_totals()
+        elapsed = max(now - self.start, 1e-9)
+        percent = 100.0 * done / total if total > 0 else 100.0
+        parts = [ '[{:5.1f}%] '.format(percent) + str(self.tablesdone) + '/' + str(len(self.tables)) + ' tables' ]
+        table = self.get_active_table()
+        if table is not None:
+            parts.append(table.tablename1 + ' ' + format_count(max(table.rows)) + '/'
+                         + (format_count(table.estimate) if table.estimate is not None else '?') + ' rows, ETA '
+                         + format_duration(table.get_eta(now)))
+        for side, label in enumerate(('DB1', 'DB2')):
+            rows, rowbytes, fetchtime = self.get_side_totals(side)
+            parts.append(label + ' ' + format_count(rows / elapsed) + ' rows/s ' + format_count(rowbytes / elapsed) + 'B/s')
+        parts.append('ETA ' + format_duration(self.get_eta(now)))
+        return ' | '.join(parts)
+
+    def format_metrics(self, now:float) -> str:
+        elapsed = max(now - self.start, 1e-9)
+        done, total = self.get_totals()
+        eta = self.get_eta(now)
+        lines = []
+
+        def metric(name:str, kind:str, help:str, samples:List[Tuple[str, float]]):
+            lines.append('# HELP datadiff_' + name + ' ' + help)
+            lines.append('# TYPE datadiff_' + name + ' ' + kind)
+            for labels, value in samples:
+                lines.append('datadiff_' + name + labels + ' ' + repr(float(value)))
+
+        sides = [ (side, label) + self.get_side_totals(side) for side, label in enumerate(SIDES) ]
+        metric('rows_fetched_total', 'counter', 'Rows fetched from each database.',
+               [ ('{side="' + label + '"}', rows) for side, label, rows, rowbytes, fetchtime in sides ])
+        metric('bytes_fetched_total', 'counter', 'Estimated bytes of the rows fetched from each database.',
+               [ ('{side="' + label + '"}', rowbytes) for side, label, rows, rowbytes, fetchtime in sides ])
+        metric('rows_per_second', 'gauge', 'Rows fetched per second of run time.',
+               [ ('{side="' + label + '"}', rows / elapsed) for side, label, rows, rowbytes, fetchtime in sides ])
+        metric('bytes_per_second', 'gauge', 'Estimated bytes fetched per second of run time.',
+               [ ('{side="' + label + '"}', rowbytes / elapsed) for side, label, rows, rowbytes, fetchtime in sides ])
+        phases = dict.fromkeys(PHASES, 0.0)
+        for table in self.tables:
+            for phase, seconds in table.get_phase_times(now).items():
+                phases[phase] += seconds
+        metric('phase_seconds_total', 'counter', 'Table diff time split into fetch, decode and compare.',
+               [ ('{phase="' + phase + '"}', seconds) for phase, seconds in phases.items() ])
+        metric('tables', 'gauge', 'Tables in the run.', [ ('', len(self.tables)) ])
+        metric('tables_done', 'gauge', 'Tables finished.', [ ('', self.tablesdone) ])
+        metric('rows_done', 'gauge', 'Rows diffed, the further along side of each table.', [ ('', done) ])
+        metric('rows_estimated', 'gauge', 'Estimated rows of the run from the catalog row counts.', [ ('', total) ])
+        metric('elapsed_seconds', 'gauge', 'Seconds since the run started.', [ ('', elapsed) ])
+        if eta is not None:
+            metric('eta_seconds', 'gauge', 'Estimated seconds until the run is done.', [ ('', eta) ])
+        tablesamples = []
+        for table in self.tables:
+            labels = '{table1="' + escape_label(table.tablename1) + '",table2="' + escape_label(table.tablename2) + '"}'
+            tablesamples.append((labels, table))
+        metric('table_rows_done', 'gauge', 'Rows diffed per table.',
+               [ (labels, table.get_rows_done()) for labels, table in tablesamples ])
+        metric('table_rows_estimated', 'gauge', 'Catalog row estimate per table.',
+               [ (labels, table.estimate) for labels, table in tablesamples if table.estimate is not None ])
+        tableetas = [ (labels, table.get_eta(now)) for labels, table in tablesamples ]
+        metric('table_eta_seconds', 'gauge', 'Estimated seconds until the table is done.',
+               [ (labels, eta) for labels, eta in tableetas if eta is not None ])
+        return '\n'.join(lines) + '\n'
+
+    # write the metrics file through a temporary file, so a scrape never sees half a file
+    def write_metrics(self, now:float):
+        temppath = self.metricspath + '.tmp'
+        with open(temppath, 'w') as file:
+            file.write(self.format_metrics(now))
+        os.replace(temppath, self.metricspath)
+
+    def update(self, now:float = None, force:bool = False):
+        now = self.clock() if now is None else now
+        with self.lock:
+            if not force and self.lastupdate is not None and now - self.lastupdate < self.interval:
+                return
+            self.lastupdate = now
+            if self.live:
+                line = self.format_line(now)
+                self.output.write('\r' + line.ljust(self.linelength))
+                self.output.flush()
+                self.linelength = len(line)
+            if self.metricspath is not None:
+                self.write_metrics(now)
+
+    # final refresh, ends the progress line
+    def close(self):
+        self.update(force=True)
+        if self.live:
+            with self.lock:
+                self.output.write('\n')
+                self.output.flush()
+
+
+# Wraps a Database so that the rows fetched from the tables of a run are
+# counted as side (0 for DB1, 1 for DB2), with the time spent in the database
+# driver as the fetch phase.  Rows are counted in local batches and their size
+# estimated from every BYTES_SAMPLE_INTERVAL'th row, so a stream pays for two
+# clock reads per row.
+class InstrumentedDatabase:
+    def __init__(self, db:Database, progress:DiffProgress, side:int):
+        self.db = db
+        self.progress = progress
+        self.side = side
+
+    def __getattr__(self, name:str):
+        return getattr(self.db, name)
+
+    def count_rows(self, tablename:str, rows, seconds:float):
+        if rows is None:
+            return rows
+        rowbytes = 0
+        if len(rows) > 0:
+            samples = rows[::BYTES_SAMPLE_INTERVAL]
+            rowbytes = sum(estimate_row_bytes(row) for row in samples) * len(rows) // len(samples)
+        self.progress.add_fetch(self.side, tablename, len(rows), rowbytes, seconds)
+        return rows
+
+    def count_stream(self, tablename:str, rows:Iterator) -> Iterator:
+        if self.progress.get_table(self.side, tablename) is None:
+            yield from rows
+            return
+        clock = time.perf_counter
+        iterator = iter(rows)
+        count = 0
+        sampled = 0
+        samplebytes = 0
+        seconds = 0.0
+        try:
+            while True:
+                start = clock()
+                try:
+                    row = next(iterator)
+                except StopIteration:
+                    seconds += clock() - start
+                    return
+                seconds += clock() - start
+                if count % BYTES_SAMPLE_INTERVAL == 0:
+                    sampled += 1
+                    samplebytes += estimate_row_bytes(row)
+                count += 1
+                if count >= COUNT_FLUSH_ROWS:
+                    self.progress.add_fetch(self.side, tablename, count, samplebytes * count // sampled, seconds)
+                    count = sampled = samplebytes = 0
+                    seconds = 0.0
+                yield row
+        finally:
+            if count > 0 or seconds > 0:
+                self.progress.add_fetch(self.side, tablename, count,
+                                        samplebytes * count // sampled if sampled > 0 else 0, seconds)
+
+    def timed_fetch(self, tablename:str, fetch:Callable):
+        start = time.perf_counter()
+        rows = fetch()
+        return self.count_rows(tablename, rows, time.perf_counter() - start)
+
+    def fetch_table_rows(self, tablename:str, *args, **kwargs) -> List[Dict]:
+        return self.timed_fetch(tablename, lambda: self.db.fetch_table_rows(tablename, *args, **kwargs))
+
+    def fetch_table_rows_stream(self, tablename:str, *args, **kwargs) -> Iterator[Dict]:
+        return self.count_stream(tablename, self.db.fetch_table_rows_stream(tablename, *args, **kwargs))
+
+    def fetch_table_tuples(self, tablename:str, *args, **kwargs) -> List[tuple]:
+        return self.timed_fetch(tablename, lambda: self.db.fetch_table_tuples(tablename, *args, **kwargs))
+
+    def fetch_table_tuples_stream(self, tablename:str, *args, **kwargs) -> Iterator[tuple]:
+        return self.count_stream(tablename, self.db.fetch_table_tuples_stream(tablename, *args, **kwargs))
+
+    def fetch_table_row_hashes(self, tablename:str, *args, **kwargs) -> Iterator[Tuple[tuple, bytes]]:
+        hashes = self.db.fetch_table_row_hashes(tablename, *args, **kwargs)
+        return self.count_stream(tablename, hashes) if hashes is not None else None
+
+    def fetch_rows_by_keys(self, tablename:str, pklist:List[Column], keys:List[tuple],
+                           batchsize:int = DEFAULT_KEY_BATCH_SIZE) -> List[Dict]:
+        return self.timed_fetch(tablename, lambda: self.db.fetch_rows_by_keys(tablename, pklist, keys, batchsize))
+
+
+# catalog row estimate of a table pair, the larger of the two sides
+def get_row_estimate(db1:Database, db2:Database, tablename1:str, tablename2:str) -> int:
+    estimates = [ estimate for estimate in (db1.fetch_row_estimate(tablename1), db2.fetch_row_estimate(tablename2))
+                  if estimate is not None ]
+    return max(estimates) if len(estimates) > 0 else None
@@ -0,0 +1,381 @@
+#
+# repair scripts: turn the row level differences of a data diff into the batched
+# INSERT/UPDATE/DELETE statements that make DB2 (the target) match DB1
+#
+
+from decimal import Decimal
+from typing import Dict, Iterator, List, Tuple
+from dbdiff.schema import Database
+from dbdiff.schema.compare import TopoSort
+from dbdiff.schema.mysql import MySQLDatabase
+from dbdiff.schema.postgres import PostgresDatabase
+from dbdiff.schema.sqlite import SQLiteDatabase
+from datacompare.resultsink import ONLY1, ONLY2, ResultSink
+import datetime
+import json
+import math
+import os
+import shutil
+import tempfile
+
+# rows (or keys) per INSERT or DELETE statement
+DEFAULT_REPAIR_BATCH_ROWS = 500
+# rows changed per transaction when a script is written or applied
+DEFAULT_TRANSACTION_ROWS = 10000
+
+# repair operations, all but deletes are run parent tables first, deletes child tables first
+UPSERT = 'upsert'
+INSERT = 'insert'
+UPDATE = 'update'
+DELETE = 'delete'
+
+
+#
+# SQL dialects: identifier quoting, literals and the batched statements
+#
+class RepairDialect:
+    begin = 'BEGIN'
+    upsert = False
+
+    def quote_identifier(self, name:str) -> str:
+        return '.'.join('"' + part.replace('"', '""') + '"' for part in name.split('.'))
+
+    def quote_string(self, value:str) -> str:
+        return "'" + value.replace("'", "''") + "'"
+
+    def format_bytes(self, value:bytes) -> str:
+        return "X'" + value.hex() + "'"
+
+    # infinity and NaN have no literal in standard SQL, dialects that store
+    # them override this
+    def format_float(self, value:float) -> str:
+        if not math.isfinite(value):
+            raise ValueError('cannot write ' + repr(value) + ' as a ' + type(self).__name__ + ' literal')
+        return repr(value)
+
+    # [-]HH:MM:SS[.ffffff] from the total duration, as MySQL TIME and Postgres
+    # interval take it (str(timedelta) gives '-1 day, 23:00:00')
+    def format_timedelta(self, value:datetime.timedelta) -> str:
+        micros = (value.days * 86400 + value.seconds) * 1000000 + value.microseconds
+        sign = '-' if micros < 0 else ''
+        seconds, micros = divmod(abs(micros), 1000000)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        text = sign + '{:02d}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+        if micros > 0:
+            text += '.{:06d}'.format(micros)
+        return self.quote_string(text)
+
+    def format_literal(self, value) -> str:
+        if value is None:
+            return 'NULL'
+        if isinstance(value, bool):
+            return 'TRUE' if value else 'FALSE'
+        if isinstance(value, (int, Decimal)):
+            return str(value)
+        if isinstance(value, float):
+            return self.format_float(value)
+        if isinstance(value, str):
+            return self.quote_string(value)
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return self.format_bytes(bytes(value))
+        if isinstance(value, (datetime.date, datetime.time)):
+            return self.quote_string(value.isoformat(' ') if isinstance(value, datetime.datetime) else value.isoformat())
+        if isinstance(value, (dict, list)):
+            # parsed json columns
+            return self.quote_string(json.dumps(value))
+        if isinstance(value, datetime.timedelta):
+            return self.format_timedelta(value)
+        # uuid and other values with a parseable str form
+        return self.quote_string(str(value))
+
+    def format_values(self, colnames:List[str], rows:List[dict]) -> str:
+        return ', '.join('(' + ', '.join(self.format_literal(row[colname]) for colname in colnames) + ')'
+                         for row in rows)
+
+    def get_insert_statement(self, tablename:str, colnames:List[str], rows:List[dict]) -> str:
+        return ('INSERT INTO ' + self.quote_identifier(tablename)
+                + ' (' + ', '.join(self.quote_identifier(colname) for colname in colnames) + ') VALUES '
+                + self.format_values(colnames, rows))
+
+    def get_delete_statement(self, tablename:str, keycolnames:List[str], keys:List[tuple]) -> str:
+        if len(keycolnames) == 1:
+            target = self.quote_identifier(keycolnames[0])
+            values = ', '.join(self.format_literal(key[0]) for key in keys)
+        else:
+            target = '(' + ', '.join(self.quote_identifier(colname) for colname in keycolnames) + ')'
+            values = ', '.join('(' + ', '.join(self.format_literal(value) for value in key) + ')' for key in keys)
+        return 'DELETE FROM ' + self.quote_identifier(tablename) + ' WHERE ' + target + ' IN (' + values + ')'
+
+    def get_update_statement(self, tablename:str, colnames:List[str], keycolnames:List[str], row:dict) -> str:
+        updatecols = [ colname for colname in colnames if colname not in keycolnames ]
+        return ('UPDATE ' + self.quote_identifier(tablename) + ' SET '
+                + ', '.join(self.quote_identifier(colname) + ' = ' + self.format_literal(row[colname])
+                            for colname in updatecols)
+                + ' WHERE ' + ' AND '.join(self.quote_identifier(colname) + ' = ' + self.format_literal(row[colname])
+                                           for colname in keycolnames))
+
+    # Returns an INSERT that overwrites the rows whose keys already exist, so
+    # rows only in DB1 and diff rows share batches.  Dialects without one (upsert
+    # is False) insert rows only in DB1 in batches and update diff rows one at a time.
+    def get_upsert_statement(self, tablename:str, colnames:List[str], keycolnames:List[str], rows:List[dict]) -> str:
+        return None
+
+
+class MySQLRepairDialect(RepairDialect):
+    begin = 'START TRANSACTION'
+    upsert = True
+
+    def quote_identifier(self, name:str) -> str:
+        return '.'.join('`' + part.replace('`', '``') + '`' for part in name.split('.'))
+
+    # backslash is an escape character unless NO_BACKSLASH_ESCAPES is set
+    def quote_string(self, value:str) -> str:
+        return "'" + value.replace('\\', '\\\\').replace("'", "''") + "'"
+
+    def get_upsert_statement(self, tablename:str, colnames:List[str], keycolnames:List[str], rows:List[dict]) -> str:
+        updatecols = [ colname for colname in colnames if colname not in keycolnames ] or keycolnames[:1]
+        updates = ', '.join(self.quote_identifier(colname) + ' = VALUES(' + self.quote_identifier(colname) + ')'
+                            for colname in updatecols)
+        return self.get_insert_statement(tablename, colnames, rows) + ' ON DUPLICATE KEY UPDATE ' + updates
+
+
+class PostgresRepairDialect(RepairDialect):
+    upsert = True
+
+    # bytea hex input format, standard_conforming_strings keeps the backslash
+    def format_bytes(self, value:bytes) -> str:
+        return "'\\x" + value.hex() + "'"
+
+    # the float input syntax takes quoted Infinity, -Infinity and NaN
+    def format_float(self, value:float) -> str:
+        if math.isnan(value):
+            return "'NaN'"
+        if math.isinf(value):
+            return "'Infinity'" if value > 0 else "'-Infinity'"
+        return repr(value)
+
+    def get_upsert_statement(self, tablename:str, colnames:List[str], keycolnames:List[str], rows:List[dict]) -> str:
+        conflict = ' ON CONFLICT (' + ', '.join(self.quote_identifier(colname) for colname in keycolnames) + ') '
+        updatecols = [ colname for colname in colnames if colname not in keycolnames ]
+        if len(updatecols) == 0:
+            return self.get_insert_statement(tablename, colnames, rows) + conflict + 'DO NOTHING'
+        updates = ', '.join(self.quote_identifier(colname) + ' = EXCLUDED.' + self.quote_identifier(colname)
+                            for colname in updatecols)
+        return self.get_insert_statement(tablename, colnames, rows) + conflict + 'DO UPDATE SET ' + updates
+
+
+# SQLite 3.24 and later take the Postgres ON CONFLICT upsert, with the
+# generic literals, and compare a row value with IN only against a subquery
+class SQLiteRepairDialect(PostgresRepairDialect):
+    def format_bytes(self, value:bytes) -> str:
+        return "X'" + value.hex() + "'"
+
+    # an out of range literal reads as infinity, NaN is stored as NULL
+    def format_float(self, value:float) -> str:
+        if math.isinf(value):
+            return '9e999' if value > 0 else '-9e999'
+        return RepairDialect.format_float(self, value)
+
+    def get_delete_statement(self, tablename:str, keycolnames:List[str], keys:List[tuple]) -> str:
+        if len(keycolnames) == 1:
+            return super().get_delete_statement(tablename, keycolnames, keys)
+        target = '(' + ', '.join(self.quote_identifier(colname) for colname in keycolnames) + ')'
+        values = ', '.join('(' + ', '.join(self.format_literal(value) for value in key) + ')' for key in keys)
+        return 'DELETE FROM ' + self.quote_identifier(tablename) + ' WHERE ' + target + ' IN (VALUES ' + values + ')'
+
+
+def get_repair_dialect(db:Database) -> RepairDialect:
+    if isinstance(db, MySQLDatabase):
+        return MySQLRepairDialect()
+    if isinstance(db, PostgresDatabase):
+        return PostgresRepairDialect()
+    if isinstance(db, SQLiteDatabase):
+        return SQLiteRepairDialect()
+    return RepairDialect()
+
+
+# Returns {tablename: position} of the named tables of db in foreign key
+# dependency order, referenced tables first.  Foreign keys to tables that are
+# not repaired are ignored.  Tables in a foreign key cycle come last in name
+# order; a cycle can only be repaired with deferred constraints (or with the
+# foreign key checks off), since no statement order satisfies it.
+def get_table_order(db:Database, tablenames:List[str]) -> Dict[str, int]:
+    tables = []
+    for tablename in sorted(tablenames):
+        try:
+            table = db.get_table(tablename)
+        except ValueError:
+            continue
+        if table is not None:
+            tables.append(table)
+    order = dict()
+    for position, table in enumerate(TopoSort.sort(tables)):
+        order.setdefault(table.name, position)
+        order.setdefault(table.get_full_name(), position)
+    return order
+
+
+# A result sink that turns the differences into repair statements for DB2:
+# rows only in DB1 and diff rows are written with their DB1 values (upserted,
+# where the dialect can), rows only in DB2 are deleted by primary key.  Rows
+# are grouped into statements of batchrows rows, which are spooled to one file
+# per table and operation, so the tables can be diffed in any order (and on any
+# number of threads) and the statements still come out in foreign key order:
+# inserts and updates parent tables first, then deletes child tables first.
+class RepairSink(ResultSink):
+    rows = True
+
+    def __init__(self, db:Database, batchrows:int = DEFAULT_REPAIR_BATCH_ROWS, dialect:RepairDialect = None,
+                 tempdir:str = None):
+        super().__init__(batchrows)
+        self.db = db
+        self.dialect = dialect or get_repair_dialect(db)
+        self.spooldir = tempfile.mkdtemp(prefix='dbdiff-repair-', dir=tempdir)
+        self.pending: Dict[Tuple[str, str], List] = dict()
+        self.keycolnames: Dict[str, List[str]] = dict()
+        self.colnames: Dict[str, Dict[str, str]] = dict()
+        self.spools: Dict[Tuple[str, str], object] = dict()
+        self.rowcounts: Dict[Tuple[str, str], int] = dict()
+
+    def write_row(self, kind:str, tablename1:str, tablename2:str, keycolnames:List[str], row:dict, other:dict = None):
+        with self.lock:
+            self.keycolnames[tablename2] = list(keycolnames)
+            if kind == ONLY2:
+                self.add(tablename2, DELETE, tuple(row[colname] for colname in keycolnames))
+            elif self.dialect.upsert:
+                self.add(tablename2, UPSERT, dict(row))
+            else:
+                self.add(tablename2, INSERT if kind == ONLY1 else UPDATE, dict(row))
+
+    def add(self, tablename:str, operation:str, item):
+        pending = self.pending.setdefault((tablename, operation), [])
+        pending.append(item)
+        if len(pending) >= self.batchsize:
+            self.write_batch(tablename, operation)
+
+    # DB1 column name -> DB2 column name for the columns of the DB2 table
+    def get_column_map(self, tablename:str) -> Dict[str, str]:
+        colmap = self.colnames.get(tablename)
+        if colmap is None:
+            table = self.db.get_table(tablename)
+            if table is None:
+                raise ValueError('db2: table not found ' + tablename)
+            colmap = dict()
+            for col in sorted(table.columns, key=lambda col: col.position or 0):
+                colmap.setdefault(col.name.lower(), col.name)
+                colmap[col.name] = col.name
+            self.colnames[tablename] = colmap
+        return colmap
+
+    def write_batch(self, tablename:str, operation:str):
+        items = self.pending.pop((tablename, operation), [])
+        if len(items) == 0:
+            return
+        colmap = self.get_column_map(tablename)
+        keycolnames = [ colmap.get(colname, colmap.get(colname.lower(), colname))
+                        for colname in self.keycolnames[tablename] ]
+        if operation == DELETE:
+            statements = [ (len(items), self.dialect.get_delete_statement(tablename, keycolnames, items)) ]
+        else:
+            # DB1 rows renamed to the DB2 columns, columns DB2 does not have are dropped
+            names = [ (colname, colmap.get(colname, colmap.get(colname.lower()))) for colname in items[0] ]
+            names = [ (colname1, colname2) for colname1, colname2 in names if colname2 is not None ]
+            rows = [ { colname2: row[colname1] for colname1, colname2 in names } for row in items ]
+            colnames = [ colname2 for colname1, colname2 in names ]
+            if operation == UPSERT:
+                statements = [ (len(rows), self.dialect.get_upsert_statement(tablename, colnames, keycolnames, rows)) ]
+            elif operation == INSERT:
+                statements = [ (len(rows), self.dialect.get_insert_statement(tablename, colnames, rows)) ]
+            else:
+                statements = [ (1, self.dialect.get_update_statement(tablename, colnames, keycolnames, row))
+                               for row in rows ]
+        spool = self.spools.get((tablename, operation))
+        if spool is None:
+            spool = open(os.path.join(self.spooldir, str(len(self.spools)) + '.jsonl'), 'w+')
+            self.spools[(tablename, operation)] = spool
+        # one [row count, statement] per line, statements may span lines
+        for rowcount, statement in statements:
+            spool.write(json.dumps([ rowcount, statement ]) + '\n')
+        self.rowcounts[(tablename, operation)] = self.rowcounts.get((tablename, operation), 0) + len(items)
+
+    def flush(self):
+        for tablename, operation in list(self.pending):
+            self.write_batch(tablename, operation)
+
+    # returns {operation: rows} of a table
+    def get_counts(self, tablename:str) -> Dict[str, int]:
+        return { operation: count for (name, operation), count in self.rowcounts.items() if name == tablename }
+
+    # Iterate (tablename, row count, statement) in repair order: the inserts and
+    # updates of the tables in foreign key order, then the deletes in reverse
+    # order.  Only the repaired tables are sorted, tables the sort does not
+    # know go last.
+    def iter_statements(self) -> Iterator[Tuple[str, int, str]]:
+        with self.lock:
+            self.flush()
+            for spool in self.spools.values():
+                spool.flush()
+        tablenames = sorted(set(tablename for tablename, operation in self.spools))
+        order = get_table_order(self.db, tablenames)
+        tablenames.sort(key=lambda tablename: order.get(tablename, len(order)))
+        steps = [ (tablename, operation) for tablename in tablenames for operation in (UPSERT, INSERT, UPDATE) ]
+        steps.extend((tablename, DELETE) for tablename in reversed(tablenames))
+        for step in steps:
+            spool = self.spools.get(step)
+            if spool is None:
+                continue
+            spool.seek(0)
+            for line in spool:
+                rowcount, statement = json.loads(line)
+                yield step[0], rowcount, statement
+            spool.seek(0, os.SEEK_END)
+
+    # Group the statements into transactions of about transactionrows changed
+    # rows.  A batch is never split, so a transaction can be one batch larger.
+    def iter_transactions(self, transactionrows:int = DEFAULT_TRANSACTION_ROWS) -> Iterator[List[str]]:
+        statements = []
+        rows = 0
+        for tablename, rowcount, statement in self.iter_statements():
+            if rows > 0 and rows + rowcount > transactionrows:
+                yield statements
+                statements = []
+                rows = 0
+            statements.append(statement)
+            rows += rowcount
+        if len(statements) > 0:
+            yield statements
+
+    # write the statements to a SQL script, returns the number of statements
+    def write_script(self, path:str, transactionrows:int = DEFAULT_TRANSACTION_ROWS) -> int:
+        count = 0
+        with open(path, 'w') as file:
+            file.write('-- repair script for ' + str(self.db.name) + '\n')
+            for statements in self.iter_transactions(transactionrows):
+                file.write(self.dialect.begin + ';\n')
+                for statement in statements:
+                    file.write(statement + ';\n')
+                file.write('COMMIT;\n')
+                count += len(statements)
+        return count
+
+    # run the statements on db (the DB2 connection), one transaction at a time
+    # returns the number of transactions committed
+    def apply(self, db:Database, transactionrows:int = DEFAULT_TRANSACTION_ROWS) -> int:
+        count = 0
+        for statements in self.iter_transactions(transactionrows):
+            db.execute_statements(statements)
+            count += 1
+        return count
+
+    def close(self):
+        super().close()
+        for spool in self.spools.values():
+            spool.flush()
+
+    # remove the spool files, after the script was written or applied
+    def cleanup(self):
+        for spool in self.spools.values():
+            spool.close()
+        self.spools = dict()
+        shutil.rmtree(self.spooldir, ignore_errors=True)
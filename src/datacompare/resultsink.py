@@ -0,0 +1,309 @@
+#
+# result sinks that receive the row level differences of a data diff
+#
+
+from decimal import Decimal
+from itertools import repeat
+from typing import Dict, List, Tuple
+import csv
+import datetime
+import json
+import os
+import sqlite3
+import threading
+
+# records buffered by a sink before they are written out
+DEFAULT_SINK_BATCH_SIZE = 1000
+
+# kinds of row level differences
+DIFF = 'diff'
+ONLY1 = 'only1'
+ONLY2 = 'only2'
+
+
+# List of result rows that can also hold the DB2 row of each diff row, so the
+# changed column values can be reported after the diff.  others[i] is the DB2
+# row of self[i], or None if it is not known.
+class RowList(list):
+    def __init__(self, rows=()):
+        super().__init__(rows)
+        self.others = [ None ] * len(self)
+
+    def add(self, row, other=None):
+        super().append(row)
+        self.others.append(other)
+
+    def append(self, row):
+        self.add(row)
+
+    def extend(self, rows):
+        others = getattr(rows, 'others', None)
+        rows = list(rows)
+        super().extend(rows)
+        self.others.extend(others if others is not None else repeat(None, len(rows)))
+
+
+# Stands in for a result list in a diff engine: rows are passed on to the sink
+# as they are found and only counted here, so memory does not grow with the
+# number of differences.
+class RowCollector:
+    def __init__(self, sink:'ResultSink', kind:str, tablename1:str, tablename2:str, keycolnames:List[str]):
+        self.sink = sink
+        self.kind = kind
+        self.tablename1 = tablename1
+        self.tablename2 = tablename2
+        self.keycolnames = keycolnames
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, row, other=None):
+        self.count += 1
+        if self.sink.rows:
+            self.sink.write_row(self.kind, self.tablename1, self.tablename2, self.keycolnames, row, other)
+
+    def append(self, row):
+        self.add(row)
+
+    def extend(self, rows):
+        others = getattr(rows, 'others', None)
+        for row, other in zip(rows, others if others is not None else repeat(None)):
+            self.add(row, other)
+
+    # count rows that were not fetched because the sink does not keep rows
+    def add_count(self, count:int):
+        self.count += count
+
+
+# returns {colname: [value1, value2]} for the columns whose values differ
+def get_changed_columns(row1:dict, row2:dict) -> Dict[str, list]:
+    changes = dict()
+    for colname, value1 in row1.items():
+        value2 = row2.get(colname)
+        if value1 != value2:
+            changes[colname] = [ value1, value2 ]
+    for colname, value2 in row2.items():
+        if colname not in row1:
+            changes[colname] = [ None, value2 ]
+    return changes
+
+
+# json.dumps default for the values databases return
+def encode_json_value(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, datetime.timedelta)):
+        return str(value)
+    return repr(value)
+
+def dump_json(value) -> str:
+    return json.dumps(value, default=encode_json_value, sort_keys=True)
+
+
+# The base sink only counts.  Subclasses that keep rows set rows = True and
+# write the buffered records out in batches in write_records().  Sinks are
+# shared by the tables diffed on worker threads, so writes hold a lock.
+# A file sink opened with append keeps the records of an earlier run, which a
+# resumed run relies on: the rows of the tables and key ranges finished before
+# are only in that file.  Rows of the ranges that were in progress when the
+# earlier run stopped are written again.
+class ResultSink:
+    rows = False
+
+    def __init__(self, batchsize:int = DEFAULT_SINK_BATCH_SIZE):
+        self.batchsize = batchsize
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.tables: List[Tuple[str, str, Tuple]] = []
+
+    # returns the diffs, only1 and only2 collectors for a table
+    def get_collectors(self, tablename1:str, tablename2:str, keycolnames:List[str]) -> Tuple[RowCollector, RowCollector, RowCollector]:
+        return (RowCollector(self, DIFF, tablename1, tablename2, keycolnames),
+                RowCollector(self, ONLY1, tablename1, tablename2, keycolnames),
+                RowCollector(self, ONLY2, tablename1, tablename2, keycolnames))
+
+    # pass on the rows of an engine that returned lists instead of collectors
+    def add_results(self, tablename1:str, tablename2:str, keycolnames:List[str], diffs, only1, only2):
+        if not self.rows:
+            return
+        for kind, rows in ((DIFF, diffs), (ONLY1, only1), (ONLY2, only2)):
+            if isinstance(rows, RowCollector):
+                continue
+            RowCollector(self, kind, tablename1, tablename2, keycolnames).extend(rows)
+
+    def write_row(self, kind:str, tablename1:str, tablename2:str, keycolnames:List[str], row:dict, other:dict = None):
+        record = {'kind': kind, 'table1': tablename1, 'table2': tablename2,
+                  'key': [ row[colname] for colname in keycolnames ], 'row': dict(row)}
+        if other is not None:
+            record['changes'] = get_changed_columns(row, other)
+        with self.lock:
+            self.buffer.append(record)
+            if len(self.buffer) >= self.batchsize:
+                self.flush()
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.write_records(self.buffer)
+            self.buffer = []
+
+    # write out the buffered records and make them durable; called before a
+    # checkpoint journal records the rows written so far as done
+    def sync(self):
+        with self.lock:
+            self.flush()
+            self.sync_records()
+
+    def table_done(self, tablename1:str, tablename2:str, counts:Tuple):
+        with self.lock:
+            self.flush()
+            self.tables.append((tablename1, tablename2, tuple(counts)))
+            self.write_table(tablename1, tablename2, tuple(counts))
+            self.sync_records()
+
+    def write_records(self, records:List[dict]):
+        pass
+
+    def write_table(self, tablename1:str, tablename2:str, counts:Tuple):
+        pass
+
+    def sync_records(self):
+        pass
+
+    def close(self):
+        with self.lock:
+            self.flush()
+
+
+# One JSON object per line for every row level difference and every table.
+class JSONLSink(ResultSink):
+    rows = True
+
+    def __init__(self, path:str, batchsize:int = DEFAULT_SINK_BATCH_SIZE, append:bool = False):
+        super().__init__(batchsize)
+        self.file = open(path, 'a' if append else 'w')
+
+    def write_records(self, records:List[dict]):
+        self.file.write(''.join(dump_json(record) + '\n' for record in records))
+
+    def sync_records(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def write_table(self, tablename1:str, tablename2:str, counts:Tuple):
+        same, diff, only1, only2 = counts
+        self.file.write(dump_json({'kind': 'table', 'table1': tablename1, 'table2': tablename2, 'same': same,
+                                   'diff': diff, 'only1': only1, 'only2': only2}) + '\n')
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+# CSV with one line per changed column of a diff row (and one line for a diff
+# row whose DB2 values are not known) and one line per row only in one table,
+# holding the row as JSON in before (only1) or after (only2).
+class CSVSink(ResultSink):
+    rows = True
+    HEADER = [ 'kind', 'table1', 'table2', 'key', 'column', 'before', 'after' ]
+
+    def __init__(self, path:str, batchsize:int = DEFAULT_SINK_BATCH_SIZE, append:bool = False):
+        super().__init__(batchsize)
+        # an appended file already has its header
+        header = not append or not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a' if append else 'w', newline='')
+        self.writer = csv.writer(self.file)
+        if header:
+            self.writer.writerow(self.HEADER)
+
+    def write_records(self, records:List[dict]):
+        lines = []
+        for record in records:
+            prefix = [ record['kind'], record['table1'], record['table2'], dump_json(record['key']) ]
+            if record['kind'] == ONLY2:
+                lines.append(prefix + [ '', '', dump_json(record['row']) ])
+            elif 'changes' in record:
+                for colname, (before, after) in record['changes'].items():
+                    lines.append(prefix + [ colname, dump_json(before), dump_json(after) ])
+            else:
+                lines.append(prefix + [ '', dump_json(record['row']), '' ])
+        self.writer.writerows(lines)
+
+    def write_table(self, tablename1:str, tablename2:str, counts:Tuple):
+        self.writer.writerow([ 'table', tablename1, tablename2, '', '', '', dump_json(list(counts)) ])
+
+    def sync_records(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+# A local SQLite database with the counts of every table (diff_tables), every
+# row level difference (diff_rows) and the before/after values of the changed
+# columns of diff rows (diff_columns).  Values are stored as JSON text.
+class SQLiteSink(ResultSink):
+    rows = True
+
+    def __init__(self, path:str, batchsize:int = DEFAULT_SINK_BATCH_SIZE, append:bool = False):
+        super().__init__(batchsize)
+        if not append and os.path.exists(path):
+            os.remove(path)
+        # the lock serializes the writes from the worker threads
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS diff_tables (table1 TEXT, table2 TEXT, same_count INTEGER, diff_count INTEGER,
+                                                    only1_count INTEGER, only2_count INTEGER);
+            CREATE TABLE IF NOT EXISTS diff_rows (id INTEGER PRIMARY KEY, kind TEXT, table1 TEXT, table2 TEXT,
+                                                  key TEXT, row TEXT);
+            CREATE TABLE IF NOT EXISTS diff_columns (row_id INTEGER, column_name TEXT, before TEXT, after TEXT);
+            CREATE INDEX IF NOT EXISTS diff_rows_table ON diff_rows (table1, kind);
+            CREATE INDEX IF NOT EXISTS diff_columns_row ON diff_columns (row_id);
+        """)
+        self.nextid = self.conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM diff_rows').fetchone()[0]
+
+    def write_records(self, records:List[dict]):
+        rows = []
+        columns = []
+        for record in records:
+            rowid = self.nextid
+            self.nextid += 1
+            rows.append((rowid, record['kind'], record['table1'], record['table2'],
+                         dump_json(record['key']), dump_json(record['row'])))
+            for colname, (before, after) in record.get('changes', {}).items():
+                columns.append((rowid, colname, dump_json(before), dump_json(after)))
+        self.conn.executemany('INSERT INTO diff_rows VALUES (?, ?, ?, ?, ?, ?)', rows)
+        self.conn.executemany('INSERT INTO diff_columns VALUES (?, ?, ?, ?)', columns)
+        self.conn.commit()
+
+    def write_table(self, tablename1:str, tablename2:str, counts:Tuple):
+        self.conn.execute('INSERT INTO diff_tables VALUES (?, ?, ?, ?, ?, ?)', (tablename1, tablename2) + counts)
+        self.conn.commit()
+
+    def close(self):
+        super().close()
+        self.conn.close()
+
+
+# Make a sink from a --results value: count, or a file name whose extension
+# (.jsonl, .csv, .db/.sqlite) or jsonl:/csv:/sqlite: prefix selects the format.
+# With append an existing file keeps its records, for a resumed run.
+def make_result_sink(spec:str, batchsize:int = DEFAULT_SINK_BATCH_SIZE, append:bool = False) -> ResultSink:
+    if spec is None or spec == 'count':
+        return ResultSink(batchsize)
+    sinkclasses = {'jsonl': JSONLSink, 'csv': CSVSink, 'sqlite': SQLiteSink}
+    if ':' in spec and spec.split(':', 1)[0] in sinkclasses:
+        kind, path = spec.split(':', 1)
+        return sinkclasses[kind](path, batchsize, append)
+    extension = os.path.splitext(spec)[1].lower()
+    if extension in ('.jsonl', '.json'):
+        return JSONLSink(spec, batchsize, append)
+    if extension == '.csv':
+        return CSVSink(spec, batchsize, append)
+    if extension in ('.db', '.sqlite', '.sqlite3'):
+        return SQLiteSink(spec, batchsize, append)
+    raise ValueError('unknown result sink ' + spec + ' (use count, or a .jsonl, .csv or .db file)')
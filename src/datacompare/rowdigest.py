@@ -0,0 +1,138 @@
+#
+# compact fixed width fingerprints of table rows and binary encoding of keys
+#
+
+from decimal import Decimal
+from typing import Iterable
+import datetime
+import hashlib
+import struct
+import uuid
+
+# size in bytes of a row digest
+DIGEST_SIZE = 16
+
+# marker for a column that is missing from a row
+MISSING = object()
+
+
+# Encode a value as bytes with a type tag, so that values of different types
+# (e.g. the string '1' and the integer 1) never encode the same.
+# Decimals are normalized so that values that compare equal encode the same.
+def encode_value(value) -> bytes:
+    if value is None:
+        return b'N'
+    if value is MISSING:
+        return b'M'
+    valtype = type(value)
+    if valtype is str:
+        return b'S' + value.encode('utf-8', 'surrogatepass')
+    if valtype is bool:
+        return b'B1' if value else b'B0'
+    if valtype is int:
+        return b'I' + str(value).encode('ascii')
+    if valtype is bytes:
+        return b'Y' + value
+    if valtype is bytearray or valtype is memoryview:
+        return b'Y' + bytes(value)
+    if valtype is Decimal:
+        if value.is_finite():
+            value = value.normalize()
+        return b'D' + str(value).encode('ascii')
+    if valtype is float:
+        return b'F' + repr(value).encode('ascii')
+    if valtype is datetime.datetime or valtype is datetime.date or valtype is datetime.time:
+        return b'T' + value.isoformat().encode('ascii')
+    if valtype is datetime.timedelta:
+        return b'V' + str(value).encode('ascii')
+    return b'R' + repr(value).encode('utf-8', 'surrogatepass')
+
+
+# return the digest of a sequence of column values
+def row_digest(values:Iterable) -> bytes:
+    hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    for value in values:
+        encoded = encode_value(value)
+        # length prefix so adjacent values cannot run together
+        hasher.update(len(encoded).to_bytes(4, 'big'))
+        hasher.update(encoded)
+    return hasher.digest()
+
+
+# Returns a function that computes the digest of a dict row.
+# The columns are always read in the order of colnames, so rows from tables
+# whose columns are in a different order still produce the same digest.
+def make_row_digester(colnames:Iterable[str]):
+    colnames = tuple(colnames)
+
+    def digester(row:dict) -> bytes:
+        return row_digest(row.get(colname, MISSING) for colname in colnames)
+    return digester
+
+
+#
+# binary key encoding
+#
+# Primary key tuples are packed into bytes for spill files and snapshots.  Each
+# value is written as a one byte type tag, a 4 byte length and the payload, so
+# keys can be unpacked back into the original python values.
+#
+_KEY_HEADER = struct.Struct('>cI')
+
+def _pack_key_value(value) -> tuple:
+    if value is None:
+        return b'N', b''
+    valtype = type(value)
+    if valtype is int:
+        return b'I', str(value).encode('ascii')
+    if valtype is str:
+        return b'S', value.encode('utf-8', 'surrogatepass')
+    if valtype is bytes or valtype is bytearray or valtype is memoryview:
+        return b'Y', bytes(value)
+    if valtype is bool:
+        return b'B', b'1' if value else b'0'
+    if valtype is Decimal:
+        return b'D', str(value).encode('ascii')
+    if valtype is float:
+        return b'F', repr(value).encode('ascii')
+    if valtype is datetime.datetime:
+        return b'T', value.isoformat().encode('ascii')
+    if valtype is datetime.date:
+        return b'A', value.isoformat().encode('ascii')
+    if valtype is datetime.time:
+        return b'H', value.isoformat().encode('ascii')
+    if valtype is uuid.UUID:
+        return b'U', value.bytes
+    raise TypeError('unsupported key type ' + str(valtype))
+
+_KEY_DECODERS = {
+    b'N': lambda data: None,
+    b'I': lambda data: int(data),
+    b'S': lambda data: data.decode('utf-8', 'surrogatepass'),
+    b'Y': lambda data: bytes(data),
+    b'B': lambda data: data == b'1',
+    b'D': lambda data: Decimal(data.decode('ascii')),
+    b'F': lambda data: float(data),
+    b'T': lambda data: datetime.datetime.fromisoformat(data.decode('ascii')),
+    b'A': lambda data: datetime.date.fromisoformat(data.decode('ascii')),
+    b'H': lambda data: datetime.time.fromisoformat(data.decode('ascii')),
+    b'U': lambda data: uuid.UUID(bytes=bytes(data)),
+}
+
+def pack_key(key:tuple) -> bytes:
+    parts = []
+    for value in key:
+        tag, payload = _pack_key_value(value)
+        parts.append(_KEY_HEADER.pack(tag, len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+def unpack_key(data:bytes) -> tuple:
+    values = []
+    offset = 0
+    while offset < len(data):
+        tag, length = _KEY_HEADER.unpack_from(data, offset)
+        offset += _KEY_HEADER.size
+        values.append(_KEY_DECODERS[tag](data[offset:offset + length]))
+        offset += length
+    return tuple(values)
@@ -0,0 +1,66 @@
+#
+# positional (tuple) rows for the in-memory data diff
+#
+
+from collections.abc import Sequence
+from typing import Iterator, List
+from dbdiff.schema import Column, Table
+import operator
+
+
+# The column order of tuple rows and the positions of the primary key columns.
+# Key columns are resolved to indexes once per table, so the key of a row is a
+# single itemgetter call instead of one dict lookup per key column.
+class RowLayout:
+    def __init__(self, colnames:List[str], pklist:List[Column]):
+        self.colnames = tuple(colnames)
+        self.keyindexes = tuple(self.colnames.index(col.name) for col in pklist)
+        # a single key column gives scalar keys, like TableDiff.get_row_key
+        self.get_key = operator.itemgetter(*self.keyindexes)
+
+    def to_dict(self, row:tuple) -> dict:
+        return dict(zip(self.colnames, row))
+
+    # others optionally holds the DB2 rows of diff rows, in the same order
+    def to_dicts(self, rows:List[tuple], others:List[tuple] = None) -> 'DictRows':
+        return DictRows(self, rows, DictRows(self, others) if others is not None else None)
+
+
+# Returns the layout shared by two tables, with the columns in table1 position
+# order, or None if the tables do not have the same set of columns (the rows
+# then have to be compared as dicts, where the extra columns count as a diff).
+def get_row_layout(table1:Table, table2:Table, pklist:List[Column]) -> RowLayout:
+    colnames = [ col.name for col in sorted(table1.columns, key=lambda col: col.position or 0) ]
+    if len(colnames) == 0 or set(colnames) != set(col.name for col in table2.columns):
+        return None
+    return RowLayout(colnames, pklist)
+
+
+# Read only list of tuple rows that turns each row into a dict when it is
+# accessed, so rows are only converted when they are reported.
+class DictRows(Sequence):
+    def __init__(self, layout:RowLayout, rows:List[tuple], others:'DictRows' = None):
+        self.layout = layout
+        self.rows = rows
+        self.others = others
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return DictRows(self.layout, self.rows[index])
+        return self.layout.to_dict(self.rows[index])
+
+    def __iter__(self) -> Iterator[dict]:
+        to_dict = self.layout.to_dict
+        for row in self.rows:
+            yield to_dict(row)
+
+    def __eq__(self, __o: object) -> bool:
+        if isinstance(__o, DictRows) or isinstance(__o, list):
+            return list(self) == list(__o)
+        return False
+
+    def __repr__(self) -> str:
+        return repr(list(self))
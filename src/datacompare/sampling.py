@@ -0,0 +1,110 @@
+#
+# estimate how far two tables have diverged from a random sample of rows
+#
+
+from typing import List, Tuple
+from dbdiff.schema import Database
+from datacompare.resultsink import ResultSink
+from datacompare.tablediff import TableDiff
+import math
+
+# default fraction of rows sampled from each table
+DEFAULT_SAMPLE_FRACTION = 0.01
+# z value of a 95% confidence interval
+DEFAULT_Z = 1.96
+
+
+# parse a sample size such as 0.1% or 0.001 into a fraction
+def parse_sample_fraction(text:str) -> float:
+    text = text.strip()
+    if text.endswith('%'):
+        fraction = float(text[:-1]) / 100.0
+    else:
+        fraction = float(text)
+    if not 0.0 < fraction <= 1.0:
+        raise ValueError('sample size must be between 0 and 100%: ' + text)
+    return fraction
+
+
+# Wilson score interval for a proportion of count out of total.
+# Unlike the normal approximation it stays inside [0, 1] and is still
+# meaningful when no mismatches at all were found in the sample.
+def wilson_interval(count:int, total:int, z:float = DEFAULT_Z) -> Tuple[float, float]:
+    if total == 0:
+        return 0.0, 1.0
+    phat = count / total
+    denom = 1.0 + z * z / total
+    center = (phat + z * z / (2 * total)) / denom
+    margin = z * math.sqrt(phat * (1.0 - phat) / total + z * z / (4 * total * total)) / denom
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+# estimated rates of one kind of difference
+class RateEstimate:
+    def __init__(self, name:str, count:int, total:int, population:int = None, z:float = DEFAULT_Z):
+        self.name = name
+        self.count = count
+        self.total = total
+        self.rate = count / total if total > 0 else 0.0
+        self.lo, self.hi = wilson_interval(count, total, z)
+        self.population = population
+
+    def get_description(self) -> str:
+        text = (self.name + ': ' + str(self.count) + ' of ' + str(self.total) + ' sampled, '
+                + format_percent(self.rate) + ' [' + format_percent(self.lo) + ' - ' + format_percent(self.hi) + ']')
+        if self.population is not None:
+            text = text + ', about ' + str(round(self.rate * self.population)) + ' rows'
+        return text
+
+def format_percent(rate:float) -> str:
+    return '{:.3g}%'.format(rate * 100.0)
+
+
+# The sample diff takes a random sample of the rows of each table and looks the
+# sampled keys up on the other side in batches.  The DB1 sample gives the rate of
+# mismatched rows and of rows missing from DB2, the DB2 sample the rate of rows
+# missing from DB1, each with a Wilson confidence interval.  The returned lists
+# only hold the sampled rows.
+class SampleDiff(TableDiff):
+    def __init__(self, db1:Database, db2:Database, verbose=False, canonicalize=None,
+                 fraction:float = DEFAULT_SAMPLE_FRACTION, z:float = DEFAULT_Z, sink:ResultSink = None):
+        super().__init__(db1, db2, verbose=verbose, canonicalize=canonicalize, sink=sink)
+        self.fraction = fraction
+        self.z = z
+        self.estimates: List[RateEstimate] = []
+
+    # returns same count, diffs, only1, only2 of the sampled rows
+    def diff_rows_sample(self, tablename1:str, tablename2:str, where:str = None) -> Tuple[int, List, List, List]:
+        table1, table2, pklist = self.check_tables(tablename1, tablename2)
+        if len(pklist) == 0:
+            raise ValueError('table has no primary key ' + tablename1)
+        pklist2 = table2.get_primary_key_columns()
+        sample1 = self.db1.fetch_table_sample(tablename1, pklist, self.fraction, where)
+        sample2 = self.db2.fetch_table_sample(tablename2, pklist2, self.fraction, where)
+        print("\tSampled " + str(len(sample1)) + " from DB1, " + str(len(sample2)) + " from DB2")
+        #
+        # look up the DB1 sample in DB2
+        #
+        keyfunc = lambda row: tuple(row[col.name] for col in pklist)
+        keys1 = [ keyfunc(row) for row in sample1 ]
+        rows2 = self.db2.fetch_rows_by_keys(tablename2, pklist2, keys1)
+        sames, diffs, only1, _ = self.diff_row_lists(sample1, rows2, pklist)
+        #
+        # look up the DB2 sample in DB1, only the keys missing from DB1 are new
+        #
+        keys2 = [ keyfunc(row) for row in sample2 ]
+        found1 = set(keyfunc(row) for row in self.db1.fetch_rows_by_keys(tablename1, pklist, keys2))
+        only2 = [ row for row, key in zip(sample2, keys2) if key not in found1 ]
+        #
+        # scale the rates up to the estimated table sizes
+        #
+        population1 = round(len(sample1) / self.fraction)
+        population2 = round(len(sample2) / self.fraction)
+        self.estimates = [
+            RateEstimate('Mismatched', len(diffs), len(sample1), population1, self.z),
+            RateEstimate('Missing from DB2', len(only1), len(sample1), population1, self.z),
+            RateEstimate('Missing from DB1', len(only2), len(sample2), population2, self.z),
+        ]
+        for estimate in self.estimates:
+            print("\t" + estimate.get_description())
+        return len(sames), diffs, only1, only2
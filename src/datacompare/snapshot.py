@@ -0,0 +1,260 @@
+#
+# offline fingerprint snapshots of a table: export (key, digest) pairs to a file
+# and diff them later against a live database or another snapshot
+#
+
+from typing import Iterator, List, Tuple
+from dbdiff.schema import DEFAULT_BATCH_SIZE, Database
+from datacompare.checkpoint import decode_key, encode_key
+from datacompare.rowdigest import DIGEST_SIZE, make_row_digester, pack_key, unpack_key
+from datacompare.tablediff import merge_join
+import bisect
+import json
+import mmap
+import os
+import struct
+import time
+
+# first bytes of every snapshot file
+SNAPSHOT_MAGIC = b'DBDIFFSN'
+SNAPSHOT_VERSION = 1
+# records between two entries of the sparse key index
+SNAPSHOT_INDEX_INTERVAL = 4096
+# write buffer size of the snapshot file
+SNAPSHOT_BUFFER_SIZE = 1024 * 1024
+
+# header: magic, version, record count, offset of the first record,
+# offset and length of the metadata/index block
+_SNAPSHOT_HEADER = struct.Struct('>8sHQQQQ')
+# record layout: 2 byte key length, packed key, digest
+_RECORD_HEADER = struct.Struct('>H')
+
+
+# A snapshot file is a fixed size header followed by the (packed key, digest)
+# records of a table in ascending key order and a JSON block with the table
+# metadata and a sparse index of every SNAPSHOT_INDEX_INTERVAL'th key and its
+# record offset.  The header is written last, so a file that was not finished
+# has no magic and is rejected.  Rows are digested as the driver returns them,
+# without the cross engine value normalizers of tablediff, so the metadata
+# records the engine and marks the digests as not normalized.
+# returns the number of records written
+def write_snapshot(db:Database, tablename:str, path:str, where:str = None,
+                   batchsize:int = DEFAULT_BATCH_SIZE) -> int:
+    table = db.get_table(tablename)
+    if table is None:
+        raise ValueError('table not found ' + tablename)
+    pklist = table.get_primary_key_columns()
+    if len(pklist) == 0:
+        raise ValueError('table has no primary key ' + tablename)
+    colnames = [ col.name for col in sorted(table.columns, key=lambda col: col.position or 0) ]
+    digester = make_row_digester(colnames)
+    keyexprs = db.get_key_sort_expressions(pklist)
+    index = []
+    count = 0
+    temppath = path + '.tmp'
+    with open(temppath, 'wb', buffering=SNAPSHOT_BUFFER_SIZE) as file:
+        file.write(bytes(_SNAPSHOT_HEADER.size))
+        offset = _SNAPSHOT_HEADER.size
+        prevkey = None
+        for row in db.fetch_table_rows_stream(tablename, where, ', '.join(keyexprs), batchsize):
+            key = tuple(row[col.name] for col in pklist)
+            # the diff merge joins on key order, so the order must be strictly ascending
+            if prevkey is not None and not prevkey < key:
+                raise ValueError(tablename + ': rows not in ascending key order at key ' + str(key))
+            prevkey = key
+            if count % SNAPSHOT_INDEX_INTERVAL == 0:
+                index.append([ encode_key(key), offset ])
+            keybytes = pack_key(key)
+            file.write(_RECORD_HEADER.pack(len(keybytes)))
+            file.write(keybytes)
+            file.write(digester(row))
+            offset += _RECORD_HEADER.size + len(keybytes) + DIGEST_SIZE
+            count += 1
+        metadata = {
+            'database': db.name,
+            'engine': get_engine_name(db),
+            'normalized': False,
+            'table': tablename,
+            'columns': colnames,
+            'primary_key': [ col.name for col in pklist ],
+            'where': where,
+            'rowcount': count,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'index': index,
+        }
+        block = json.dumps(metadata).encode('utf-8')
+        file.write(block)
+        file.seek(0)
+        file.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, count, _SNAPSHOT_HEADER.size,
+                                         offset, len(block)))
+    os.replace(temppath, path)
+    return count
+
+
+# the engine a snapshot was taken from, the class name of the database
+def get_engine_name(db:Database) -> str:
+    return type(db).__name__
+
+
+# true if path starts with the snapshot magic
+def is_snapshot_file(path:str) -> bool:
+    try:
+        with open(path, 'rb') as file:
+            return file.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+    except OSError:
+        return False
+
+
+# A snapshot file opened through a read only memory map, so records are read
+# straight from the page cache without loading the whole file.
+class TableSnapshot:
+    def __init__(self, path:str):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            self.file.close()
+            raise ValueError('not a snapshot file ' + path)
+        if len(self.map) < _SNAPSHOT_HEADER.size:
+            self.close()
+            raise ValueError('not a snapshot file ' + path)
+        magic, version, count, recordstart, recordend, blocklen = _SNAPSHOT_HEADER.unpack_from(self.map, 0)
+        if magic != SNAPSHOT_MAGIC:
+            self.close()
+            raise ValueError('not a snapshot file ' + path)
+        if version != SNAPSHOT_VERSION:
+            self.close()
+            raise ValueError('unsupported snapshot version ' + str(version) + ' ' + path)
+        self.rowcount = count
+        self.recordstart = recordstart
+        self.recordend = recordend
+        metadata = json.loads(self.map[recordend:recordend + blocklen].decode('utf-8'))
+        self.database = metadata['database']
+        # snapshots written before the engine was recorded
+        self.engine = metadata.get('engine')
+        self.normalized = metadata.get('normalized', False)
+        self.tablename = metadata['table']
+        self.colnames = metadata['columns']
+        self.pkcolnames = metadata['primary_key']
+        self.where = metadata['where']
+        self.created = metadata['created']
+        self.indexkeys = [ decode_key(key) for key, offset in metadata['index'] ]
+        self.indexoffsets = [ offset for key, offset in metadata['index'] ]
+
+    def close(self):
+        if getattr(self, 'map', None) is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_description(self) -> str:
+        return (self.tablename + ' from ' + str(self.database) + ' (' + str(self.rowcount) + ' rows, '
+                + self.created + ')')
+
+    # Iterate the (key tuple, digest) records in key order, starting at the first
+    # key >= startkey.  The sparse index locates the block holding startkey, so
+    # only that block is scanned.
+    def iter_records(self, startkey:tuple = None) -> Iterator[Tuple[tuple, bytes]]:
+        offset = self.recordstart
+        if startkey is not None and len(self.indexkeys) > 0:
+            block = bisect.bisect_right(self.indexkeys, startkey) - 1
+            if block >= 0:
+                offset = self.indexoffsets[block]
+        data = self.map
+        end = self.recordend
+        while offset < end:
+            (keylen,) = _RECORD_HEADER.unpack_from(data, offset)
+            offset += _RECORD_HEADER.size
+            key = unpack_key(data[offset:offset + keylen])
+            offset += keylen
+            digest = data[offset:offset + DIGEST_SIZE]
+            offset += DIGEST_SIZE
+            if startkey is not None and key < startkey:
+                continue
+            yield key, digest
+
+
+# Merge join a snapshot (as DB1) with the same table streamed live from db (as
+# DB2).  Live rows are digested over the snapshot columns in snapshot order,
+# followed by any columns the live table added, so a changed column set shows
+# up as differing rows.  The where clause of the snapshot is applied to the live
+# table as well.  Only keys are known for the snapshot side.  Neither side is
+# normalized, so a live table on another engine than the snapshot may report
+# rows whose values only differ in their driver types.
+# returns same count, diffs (DB2 rows), only1 (key tuples), only2 (DB2 rows)
+def diff_snapshot_table(snapshot:TableSnapshot, db:Database, tablename:str = None,
+                        batchsize:int = DEFAULT_BATCH_SIZE) -> Tuple[int, List, List, List]:
+    tablename = tablename or snapshot.tablename
+    table = db.get_table(tablename)
+    if table is None:
+        raise ValueError('db2: table not found ' + tablename)
+    pklist = table.get_primary_key_columns()
+    if [ col.name for col in pklist ] != snapshot.pkcolnames:
+        raise ValueError('primary key column lists not equal')
+    check_engines(snapshot.engine, get_engine_name(db))
+    colnames = list(snapshot.colnames)
+    for col in sorted(table.columns, key=lambda col: col.position or 0):
+        if col.name not in colnames:
+            colnames.append(col.name)
+    digester = make_row_digester(colnames)
+    keyexprs = db.get_key_sort_expressions(pklist)
+    rows = db.fetch_table_rows_stream(tablename, snapshot.where, ', '.join(keyexprs), batchsize)
+    keyfunc = lambda row: tuple(row[col.name] for col in pklist)
+    samecount = 0
+    diffs = []
+    only1 = []
+    only2 = []
+    for key, record, row in merge_join(snapshot.iter_records(), rows, lambda record: record[0], keyfunc):
+        if row is None:
+            only1.append(key)
+        elif record is None:
+            only2.append(row)
+        elif record[1] == digester(row):
+            samecount += 1
+        else:
+            diffs.append(row)
+    return samecount, diffs, only1, only2
+
+
+# Warn when the two sides of a snapshot diff come from different engines, whose
+# drivers may return equal values as different python types.
+def check_engines(engine1:str, engine2:str):
+    if engine1 is None or engine2 is None:
+        print("\tWARNING: snapshot engine unknown, digests are not normalized across engines")
+    elif engine1 != engine2:
+        print("\tWARNING: " + engine1 + " and " + engine2 + " values are not normalized, "
+              "rows may differ only in their driver types")
+
+
+# Merge join two snapshots of the same table, no database needed.
+# returns same count, diff keys, only1 keys, only2 keys
+def diff_snapshots(snapshot1:TableSnapshot, snapshot2:TableSnapshot) -> Tuple[int, List, List, List]:
+    if snapshot1.pkcolnames != snapshot2.pkcolnames:
+        raise ValueError('primary key column lists not equal')
+    if snapshot1.colnames != snapshot2.colnames:
+        # digests cover the columns in order, so no row could match
+        print("\tWARNING: snapshot columns differ, every common key is reported as a diff")
+    check_engines(snapshot1.engine, snapshot2.engine)
+    samecount = 0
+    diffkeys = []
+    only1keys = []
+    only2keys = []
+    getkey = lambda record: record[0]
+    for key, record1, record2 in merge_join(snapshot1.iter_records(), snapshot2.iter_records(), getkey, getkey):
+        if record2 is None:
+            only1keys.append(key)
+        elif record1 is None:
+            only2keys.append(key)
+        elif record1[1] == record2[1]:
+            samecount += 1
+        else:
+            diffkeys.append(key)
+    return samecount, diffkeys, only1keys, only2keys
@@ -0,0 +1,204 @@
+#
+# out of core diff that hash partitions both tables to local disk
+#
+
+from typing import BinaryIO, Iterator, List, Tuple
+from dbdiff.schema import DEFAULT_BATCH_SIZE, Database
+from datacompare.resultsink import ResultSink
+from datacompare.tablediff import TableDiff
+from datacompare.rowdigest import DIGEST_SIZE, pack_key, unpack_key
+import os
+import struct
+import tempfile
+import zlib
+
+# estimated bytes of memory per key -> digest entry while a partition is diffed
+ENTRY_MEMORY_ESTIMATE = 200
+# upper bound on the number of partitions of one pass.  A side is spilled with
+# all its partition files open, which stays well under the common open file
+# limit of 1024; partitions that are still too big are partitioned again.
+MAX_PARTITIONS = 256
+# write buffer size per partition file, smaller when the memory budget is small
+SPILL_BUFFER_SIZE = 256 * 1024
+MIN_SPILL_BUFFER_SIZE = 4 * 1024
+# partitions are chosen from the bits of a 32 bit key hash
+HASH_RANGE = 2 ** 32
+
+# record layout: 2 byte key length, packed key, digest
+_RECORD_HEADER = struct.Struct('>H')
+
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+# parse a memory size such as 512M or 2G into bytes
+def parse_memory_size(text:str) -> int:
+    text = text.strip().upper()
+    if text.endswith('B'):
+        text = text[:-1]
+    unit = ''
+    if len(text) > 0 and text[-1] in _SIZE_UNITS:
+        unit = text[-1]
+        text = text[:-1]
+    return int(float(text) * _SIZE_UNITS[unit])
+
+
+def write_record(file:BinaryIO, keybytes:bytes, digest:bytes):
+    file.write(_RECORD_HEADER.pack(len(keybytes)))
+    file.write(keybytes)
+    file.write(digest)
+
+
+# iterate the (packed key, digest) records of a partition file
+def read_records(path:str):
+    with open(path, 'rb', buffering=SPILL_BUFFER_SIZE) as file:
+        while True:
+            header = file.read(_RECORD_HEADER.size)
+            if not header:
+                break
+            (keylen,) = _RECORD_HEADER.unpack(header)
+            keybytes = file.read(keylen)
+            digest = file.read(DIGEST_SIZE)
+            yield keybytes, digest
+
+
+# The spill diff is a Grace hash join.  Both tables are streamed once, each row
+# is reduced to its packed primary key and row digest, and the record is appended
+# to one of K partition files chosen by a hash of the key.  Matching keys always
+# land in the same partition, so the partitions can then be diffed one at a time
+# with only one partition's key -> digest map in memory.  K is chosen so that the
+# write buffers of the K files plus a partition map fit in max_memory; a pair of
+# partitions that still holds too many records is partitioned again on the next
+# bits of the key hash before it is diffed.
+class SpillDiff(TableDiff):
+    def __init__(self, db1:Database, db2:Database, verbose=False, canonicalize=None,
+                 max_memory:int = None, tempdir:str = None, sink:ResultSink = None):
+        super().__init__(db1, db2, verbose=verbose, canonicalize=canonicalize, sink=sink)
+        self.max_memory = max_memory
+        self.tempdir = tempdir
+
+    # the write buffers of a pass take at most half the memory budget
+    def get_buffer_size(self, partitions:int) -> int:
+        if self.max_memory is None:
+            return SPILL_BUFFER_SIZE
+        return max(MIN_SPILL_BUFFER_SIZE, min(SPILL_BUFFER_SIZE, self.max_memory // (2 * partitions)))
+
+    # the fewest partitions whose map of rows / partitions records fits in the
+    # budget left over by the write buffers, at most MAX_PARTITIONS
+    def get_partition_plan(self, rows:int) -> int:
+        if self.max_memory is None:
+            return 1
+        for partitions in range(1, MAX_PARTITIONS + 1):
+            mapmemory = self.max_memory - partitions * self.get_buffer_size(partitions)
+            if rows * ENTRY_MEMORY_ESTIMATE <= partitions * mapmemory:
+                break
+        return partitions
+
+    # true if a partition of rows records needs another partitioning pass
+    def is_too_big(self, rows:int) -> bool:
+        return self.max_memory is not None and rows * ENTRY_MEMORY_ESTIMATE > self.max_memory
+
+    # choose the number of partitions from the catalog row estimates
+    def get_partition_count(self, tablename1:str, tablename2:str) -> int:
+        if self.max_memory is None:
+            return 1
+        table1 = self.db1.get_table(tablename1)
+        table2 = self.db2.get_table(tablename2)
+        rows = max(table1.rows or 0, table2.rows or 0)
+        if rows == 0:
+            rows = max(self.db1.fetch_table_rowcount(tablename1) or 0, self.db2.fetch_table_rowcount(tablename2) or 0)
+        return self.get_partition_plan(rows)
+
+    # Write (packed key, digest) records to the partition files at paths, by
+    # the key hash divided by divisor (the product of the partition counts of
+    # the earlier passes), so every pass uses other bits of the hash.
+    # returns the number of records in each partition
+    def spill_records(self, records:Iterator[Tuple[bytes, bytes]], paths:List[str], divisor:int = 1) -> List[int]:
+        partitions = len(paths)
+        counts = [ 0 ] * partitions
+        buffersize = self.get_buffer_size(partitions)
+        files = [ open(path, 'wb', buffering=buffersize) for path in paths ]
+        try:
+            for keybytes, digest in records:
+                partition = zlib.crc32(keybytes) // divisor % partitions
+                write_record(files[partition], keybytes, digest)
+                counts[partition] += 1
+        finally:
+            for file in files:
+                file.close()
+        return counts
+
+    # stream a table into the partition files
+    # returns the number of records in each partition
+    def spill_table(self, db:Database, tablename:str, pklist, digester, paths:List[str],
+                    where:str = None, batchsize:int = DEFAULT_BATCH_SIZE) -> List[int]:
+        records = ((pack_key(tuple(row[col.name] for col in pklist)), digester(row))
+                   for row in db.fetch_table_rows_stream(tablename, where, None, batchsize))
+        return self.spill_records(records, paths)
+
+    # Diff one pair of partition files with count1 and count2 records, split
+    # again first when the larger one does not fit in the memory budget.
+    # divisor is the product of the partition counts of the passes that made
+    # the files.  The files are removed once they are diffed or split.
+    # returns same count, diff keys, only1 keys, only2 keys (packed)
+    def diff_partition(self, path1:str, path2:str, count1:int, count2:int,
+                       divisor:int) -> Tuple[int, List[bytes], List[bytes], List[bytes]]:
+        rows = max(count1, count2)
+        partitions = self.get_partition_plan(rows)
+        # a hash range that is used up cannot split the keys any further
+        if not self.is_too_big(rows) or partitions < 2 or divisor * partitions > HASH_RANGE:
+            result = self.diff_key_digests(read_records(path1), read_records(path2))
+            os.remove(path1)
+            os.remove(path2)
+            return result
+        paths1 = [ path1 + '_' + str(part) for part in range(partitions) ]
+        paths2 = [ path2 + '_' + str(part) for part in range(partitions) ]
+        counts1 = self.spill_records(read_records(path1), paths1, divisor)
+        os.remove(path1)
+        counts2 = self.spill_records(read_records(path2), paths2, divisor)
+        os.remove(path2)
+        samecount = 0
+        diffkeys = []
+        only1keys = []
+        only2keys = []
+        for subpath1, subpath2, subcount1, subcount2 in zip(paths1, paths2, counts1, counts2):
+            partsame, partdiffs, partonly1, partonly2 = self.diff_partition(subpath1, subpath2, subcount1, subcount2,
+                                                                            divisor * partitions)
+            samecount += partsame
+            diffkeys.extend(partdiffs)
+            only1keys.extend(partonly1)
+            only2keys.extend(partonly2)
+        return samecount, diffkeys, only1keys, only2keys
+
+    # returns same count, diffs, only1, only2
+    def diff_rows_spill(self, tablename1:str, tablename2:str, where:str = None,
+                        batchsize:int = DEFAULT_BATCH_SIZE) -> Tuple[int, List, List, List]:
+        table1, table2, pklist = self.check_tables(tablename1, tablename2)
+        if len(pklist) == 0:
+            raise ValueError('table has no primary key ' + tablename1)
+        pklist2 = table2.get_primary_key_columns()
+        digester = self.get_row_digester(tablename1, table1, table2)
+        partitions = self.get_partition_count(tablename1, tablename2)
+        samecount = 0
+        diffkeys = []
+        only1keys = []
+        only2keys = []
+        with tempfile.TemporaryDirectory(prefix='dbdiff_spill_', dir=self.tempdir) as spilldir:
+            paths1 = [ os.path.join(spilldir, 'db1_' + str(part)) for part in range(partitions) ]
+            paths2 = [ os.path.join(spilldir, 'db2_' + str(part)) for part in range(partitions) ]
+            counts = []
+            for db, tablename, tablepk, paths, label in ((self.db1, tablename1, pklist, paths1, 'DB1'),
+                                                         (self.db2, tablename2, pklist2, paths2, 'DB2')):
+                counts.append(self.spill_table(db, tablename, tablepk, digester, paths, where, batchsize))
+                print("\tSpilled " + str(sum(counts[-1])) + " from " + label + " into " + str(partitions) + " partitions")
+            for path1, path2, count1, count2 in zip(paths1, paths2, counts[0], counts[1]):
+                partsame, partdiffs, partonly1, partonly2 = self.diff_partition(path1, path2, count1, count2, partitions)
+                samecount += partsame
+                diffkeys.extend(partdiffs)
+                only1keys.extend(partonly1)
+                only2keys.extend(partonly2)
+        # fetch the full rows for the keys that differ
+        diffs, only1, only2 = self.fetch_diff_rows(tablename1, tablename2, pklist,
+                                                   [ unpack_key(keybytes) for keybytes in diffkeys ],
+                                                   [ unpack_key(keybytes) for keybytes in only1keys ],
+                                                   [ unpack_key(keybytes) for keybytes in only2keys ])
+        return samecount, diffs, only1, only2
@@ -2,17 +2,69 @@
 # diff table contents
 #
 
-from typing import List
+from typing import Callable, Iterator, List, Tuple
 from xml.etree.ElementTree import canonicalize
-from dbdiff.schema import Column, Database
+from dbdiff.schema import DEFAULT_BATCH_SIZE, Column, Database, Table
+from datacompare.checkpoint import TableCheckpoint
+from datacompare.keyindex import KeyDigestIndex, diff_key_digest_indexes, get_key_dtype
+from datacompare.keyrange import KeyRange, and_where, get_range_expressions, get_table_key_range, split_key_range
+from datacompare.normalize import NormalizedDatabase, get_table_normalizers
+from datacompare.parallel import ConnectionLimiter, DatabaseConnector, fetch_batches, prefetch_rows, run_tasks
+from datacompare.resultsink import ResultSink, RowList
+from datacompare.rowdigest import make_row_digester
+from datacompare.rowlayout import RowLayout, get_row_layout
+
+
+# Merge join two row streams that are both sorted by key.
+# Yields (key, row1, row2) where row1 or row2 is None if the key is only in one stream.
+# Raises ValueError if either stream is not in ascending key order, since the
+# result would silently be wrong.
+def merge_join(rows1:Iterator, rows2:Iterator, key1:Callable, key2:Callable):
+    row1 = next(rows1, None)
+    row2 = next(rows2, None)
+    k1 = key1(row1) if row1 is not None else None
+    k2 = key2(row2) if row2 is not None else None
+    while row1 is not None or row2 is not None:
+        if row2 is None or (row1 is not None and k1 < k2):
+            yield k1, row1, None
+            row1, k1 = _next_in_order(rows1, key1, k1, 'db1')
+        elif row1 is None or k2 < k1:
+            yield k2, None, row2
+            row2, k2 = _next_in_order(rows2, key2, k2, 'db2')
+        else:
+            yield k1, row1, row2
+            row1, k1 = _next_in_order(rows1, key1, k1, 'db1')
+            row2, k2 = _next_in_order(rows2, key2, k2, 'db2')
+
+def _next_in_order(rows:Iterator, keyfunc:Callable, prevkey, side:str):
+    row = next(rows, None)
+    if row is None:
+        return None, None
+    key = keyfunc(row)
+    if not prevkey < key:
+        raise ValueError(side + ': rows not in ascending key order at key ' + str(key))
+    return row, key
 
 
 class TableDiff:
-    def __init__(self, db1:Database, db2:Database, verbose=False, canonicalize=None):
+    def __init__(self, db1:Database, db2:Database, verbose=False, canonicalize=None, sink:ResultSink = None):
         self.db1 = db1
         self.db2 = db2
         self.verbose = verbose
         self.canonicalize = canonicalize
+        # with a sink the streaming engines pass differences on as they are found
+        self.sink = sink
+        # table pairs whose value normalizers have been set up
+        self.normalized = set()
+        # with a DiffProgress, the time spent digesting rows is its decode phase
+        self.progress = None
+
+    # the digest function of the rows of a table pair
+    def get_row_digester(self, tablename1:str, table1:Table, table2:Table):
+        digester = make_row_digester(self.get_compare_columns(table1, table2))
+        if self.progress is not None:
+            digester = self.progress.time_decode(tablename1, digester)
+        return digester
 
     # return an immutable object that can be used as a dictionary key
     def get_row_key(self, row:dict, pklist:List[Column]):
@@ -30,7 +82,33 @@ class TableDiff:
             keytuple = tuple(keylist)
             return keytuple            
 
-    def prep_diff(self, tablename1:str, tablename2:str, where:str = None, orderby:str = None):
+    # names of the columns of both tables, in table1 column order
+    # followed by any columns that only exist in table2
+    def get_compare_columns(self, table1:Table, table2:Table) -> List[str]:
+        colnames = [ col.name for col in sorted(table1.columns, key=lambda col: col.position or 0) ]
+        for col in sorted(table2.columns, key=lambda col: col.position or 0):
+            if col.name not in colnames:
+                colnames.append(col.name)
+        return colnames
+
+    # The diffs, only1 and only2 results of a streaming engine.  Without a sink
+    # these are lists, with a sink they are collectors that hand the rows on to
+    # the sink and only count them.
+    def new_results(self, tablename1:str, tablename2:str, pklist:List[Column]) -> Tuple:
+        if self.sink is None:
+            return RowList(), RowList(), RowList()
+        return self.sink.get_collectors(tablename1, tablename2, [ col.name for col in pklist ])
+
+    # journal a finished key range, after the rows the range handed to the sink
+    # are written out, so a resumed run never skips rows the sink has not kept
+    def checkpoint_range(self, checkpoint:TableCheckpoint, keyrange:KeyRange, counts:Tuple):
+        if self.sink is not None:
+            self.sink.sync()
+        checkpoint.range_done(keyrange, counts)
+
+    # look up both tables and check that their primary keys match
+    # returns table1, table2, primary key column list
+    def check_tables(self, tablename1:str, tablename2:str) -> Tuple[Table, Table, List[Column]]:
         # ensure table exists in both databases
         table1 = self.db1.get_table(tablename1)
         if table1 is None:
@@ -42,32 +120,154 @@ class TableDiff:
         pk1 = table1.get_primary_key_columns()
         pk2 = table2.get_primary_key_columns()
         if pk1 != pk2:
-            if self.canonicalize is not None:
+            if len(pk1) == len(pk2) and any(type(col1) is not type(col2) for col1, col2 in zip(pk1, pk2)):
+                # columns read from two different engines only have their names in common
+                if [ col.name for col in pk1 ] != [ col.name for col in pk2 ]:
+                    raise ValueError('primary key column lists not equal')
+            elif self.canonicalize is not None:
                 pk1copy = [ pkcol.copy(canonicalize=self.canonicalize) for pkcol in pk1 ]
                 pk2copy = [ pkcol.copy(canonicalize=self.canonicalize) for pkcol in pk2 ]
                 if pk1copy != pk2copy:
                     raise ValueError('primary key column lists not equal (canonicalized)')
             else:
                 raise ValueError('primary key column lists not equal')
+        if (tablename1, tablename2) not in self.normalized:
+            self.set_normalizers(tablename1, table1, tablename2, table2)
+        return table1, table2, pk1
 
+    # Columns whose values come back from the two engines as different python
+    # values (tinyint(1) and bool, json text and parsed json, ...) get a converter
+    # chosen once from the column types.  Both databases are then wrapped so the
+    # rows of these tables are converted as they are fetched.
+    def set_normalizers(self, tablename1:str, table1:Table, tablename2:str, table2:Table):
+        self.normalized.add((tablename1, tablename2))
+        if self.db1 is self.db2:
+            return
+        normalizers1, normalizers2 = get_table_normalizers(table1, table2)
+        if len(normalizers1) == 0 and len(normalizers2) == 0 and not isinstance(self.db1, NormalizedDatabase):
+            return
+        if not isinstance(self.db1, NormalizedDatabase):
+            self.db1 = NormalizedDatabase(self.db1)
+            self.db2 = NormalizedDatabase(self.db2)
+        self.db1.set_normalizers(tablename1, normalizers1)
+        self.db2.set_normalizers(tablename2, normalizers2)
+
+    # run fetch1 against db1 and fetch2 against db2 at the same time, on two
+    # threads, unless both sides share one database connection
+    def fetch_both(self, fetch1:Callable, fetch2:Callable) -> Tuple:
+        if self.db1 is self.db2:
+            return fetch1(), fetch2()
+        return tuple(run_tasks([ fetch1, fetch2 ], lambda fetch: fetch(), 2))
+
+    def prep_diff(self, tablename1:str, tablename2:str, where:str = None, orderby:str = None):
+        table1, table2, pk1 = self.check_tables(tablename1, tablename2)
         #
         # build a dict for each table that contains all records
         #
-        rows1 = self.db1.fetch_table_rows(tablename1, where, orderby)
+        rows1, rows2 = self.fetch_both(lambda: self.db1.fetch_table_rows(tablename1, where, orderby),
+                                       lambda: self.db2.fetch_table_rows(tablename2, where, orderby))
         print("\tFetched " + str(len(rows1)) + " from DB1")
-        rows2 = self.db2.fetch_table_rows(tablename2, where, orderby)
         print("\tFetched " + str(len(rows2)) + " from DB2")
         return rows1, rows2, pk1
 
-    def diff_rows(self, tablename1:str, tablename2:str, where:str = None, orderby:str = None):
-        rows1, rows2, pklist = self.prep_diff(tablename1, tablename2, where, orderby)
-        if self.verbose:
-            print("Table " + tablename1 + " DB1 rows:" + str(len(rows1)) 
-                + "Table " + tablename2 + " DB2 rows:" + str(len(rows2)))
+    # In-memory diff.  When both tables have the same columns the rows are
+    # streamed as tuples from both databases at once and matched as the batches
+    # arrive, otherwise both tables are fetched as dict rows and compared.
+    def diff_rows(self, tablename1:str, tablename2:str, where:str = None, orderby:str = None,
+                  batchsize:int = DEFAULT_BATCH_SIZE):
+        table1, table2, pklist = self.check_tables(tablename1, tablename2)
+        layout = get_row_layout(table1, table2, pklist)
+        if layout is None:
+            rows1, rows2, pklist = self.prep_diff(tablename1, tablename2, where, orderby)
+            if self.verbose:
+                print("Table " + tablename1 + " DB1 rows:" + str(len(rows1)) 
+                    + "Table " + tablename2 + " DB2 rows:" + str(len(rows2)))
+            return self.diff_row_lists(rows1, rows2, pklist)
+        rows1 = self.db1.fetch_table_tuples_stream(tablename1, layout.colnames, where, orderby, batchsize)
+        rows2 = self.db2.fetch_table_tuples_stream(tablename2, layout.colnames, where, orderby, batchsize)
+        batches = fetch_batches([ rows1, rows2 ], batchsize, concurrent=(self.db1 is not self.db2))
+        return self.diff_tuple_batches(batches, layout)
+
+    # fetch the rows of one primary key range from both databases and diff them in memory
+    # returns sames, diffs, only1, only2
+    def diff_range(self, tablename1:str, tablename2:str, pklist:List[Column], keyrange:KeyRange, where:str = None):
+        table1, table2, _ = self.check_tables(tablename1, tablename2)
+        pklist2 = table2.get_primary_key_columns()
+        keyexprs1, keyexprs2 = get_range_expressions(self.db1, self.db2, pklist, pklist2)
+        where1, params1 = and_where(where, None, *keyrange.get_where(keyexprs1))
+        where2, params2 = and_where(where, None, *keyrange.get_where(keyexprs2))
+        layout = get_row_layout(table1, table2, pklist)
+        if layout is None:
+            rows1, rows2 = self.fetch_both(lambda: self.db1.fetch_table_rows(tablename1, where1, None, params1),
+                                           lambda: self.db2.fetch_table_rows(tablename2, where2, None, params2))
+            return self.diff_row_lists(rows1, rows2, pklist)
+        rows1, rows2 = self.fetch_both(lambda: self.db1.fetch_table_tuples(tablename1, layout.colnames, where1, None, params1),
+                                       lambda: self.db2.fetch_table_tuples(tablename2, layout.colnames, where2, None, params2))
+        return self.diff_tuple_lists(rows1, rows2, layout)
+
+    # Symmetric hash join of (side, batch) tuple row batches from fetch_batches.
+    # Each row is matched against the unmatched rows of the other side as soon as
+    # it arrives, so comparing overlaps with fetching and only unmatched rows are
+    # held in the pending maps.
+    # returns sames, diffs, only1, only2 as lists that convert to dict rows on access
+    def diff_tuple_batches(self, batches:Iterator[Tuple[int, List[tuple]]], layout:RowLayout):
+        getkey = layout.get_key
+        pending = ( dict(), dict() )
+        counts = [ 0, 0 ]
+        sames = []
+        diffs = []
+        diffs2 = []
+        for side, batch in batches:
+            counts[side] += len(batch)
+            unmatched = pending[side]
+            pop = pending[1 - side].pop
+            for row in batch:
+                key = getkey(row)
+                other = pop(key, None)
+                if other is None:
+                    unmatched[key] = row
+                    continue
+                row1, row2 = (row, other) if side == 0 else (other, row)
+                if row1 == row2:
+                    sames.append(row1)
+                else:
+                    diffs.append(row1)
+                    diffs2.append(row2)
+        print("\tFetched " + str(counts[0]) + " from DB1")
+        print("\tFetched " + str(counts[1]) + " from DB2")
+        only1 = list(pending[0].values())
+        only2 = list(pending[1].values())
+        return layout.to_dicts(sames), layout.to_dicts(diffs, diffs2), layout.to_dicts(only1), layout.to_dicts(only2)
+
+    # compare two lists of tuple rows in memory, positionally
+    # returns sames, diffs, only1, only2 as lists that convert to dict rows on access
+    def diff_tuple_lists(self, rows1:List[tuple], rows2:List[tuple], layout:RowLayout):
+        getkey = layout.get_key
+        tab2dict = { getkey(row): row for row in rows2 }
+        pop = tab2dict.pop
+        sames = []
+        diffs = []
+        diffs2 = []
+        only1 = []
+        for row in rows1:
+            row2 = pop(getkey(row), None)
+            if row2 is None:
+                only1.append(row)
+            elif row == row2:
+                sames.append(row)
+            else:
+                diffs.append(row)
+                diffs2.append(row2)
+        only2 = list(tab2dict.values())
+        return layout.to_dicts(sames), layout.to_dicts(diffs, diffs2), layout.to_dicts(only1), layout.to_dicts(only2)
+
+    # compare two lists of rows in memory
+    # returns sames, diffs, only1, only2
+    def diff_row_lists(self, rows1:List, rows2:List, pklist:List[Column]):
         #
         # return vals
         sames = []
-        diffs = []
+        diffs = RowList()
         only1 = []
         only2 = []
         #
@@ -89,7 +289,7 @@ class TableDiff:
                 if row == row2:
                     sames.append(row)
                 else:
-                    diffs.append(row)
+                    diffs.add(row, row2)
                 # remove row2 from dict since it is already processed
                 del tab2dict[pk]
         #
@@ -100,4 +300,272 @@ class TableDiff:
             # add to only2 list
             only2.append(row2)
         return sames, diffs, only1, only2
-       
\ No newline at end of file
+
+    # Streaming diff: read both tables ordered by primary key through server-side
+    # cursors and merge join the two streams, so memory use is bounded by the
+    # batch size instead of the table size.  Identical rows are only counted.
+    # With a checkpoint the diff records a key range every checkpoint.interval
+    # rows and resumes after the last range recorded by an earlier run.
+    # returns same count, diffs, only1, only2
+    def diff_rows_stream(self, tablename1:str, tablename2:str, where:str = None,
+                         batchsize:int = DEFAULT_BATCH_SIZE, checkpoint:TableCheckpoint = None) -> Tuple[int, List, List, List]:
+        table1, table2, pklist = self.check_tables(tablename1, tablename2)
+        if len(pklist) == 0:
+            raise ValueError('table has no primary key ' + tablename1)
+        samecount = 0
+        diffs, only1, only2 = self.new_results(tablename1, tablename2, pklist)
+        if checkpoint is not None and checkpoint.is_stream_complete():
+            return samecount, diffs, only1, only2
+        keyexprs1 = self.db1.get_key_sort_expressions(pklist)
+        keyexprs2 = self.db2.get_key_sort_expressions(table2.get_primary_key_columns())
+        startkey = checkpoint.get_resume_key() if checkpoint is not None else None
+        where1, params1 = and_where(where, None, *KeyRange(startkey).get_where(keyexprs1))
+        where2, params2 = and_where(where, None, *KeyRange(startkey).get_where(keyexprs2))
+        rows1 = self.db1.fetch_table_rows_stream(tablename1, where1, ', '.join(keyexprs1), batchsize, params1)
+        rows2 = self.db2.fetch_table_rows_stream(tablename2, where2, ', '.join(keyexprs2), batchsize, params2)
+        if self.db1 is not self.db2:
+            # read both sides on background threads while the merge join runs
+            rows1 = prefetch_rows(rows1, batchsize)
+            rows2 = prefetch_rows(rows2, batchsize)
+        # always use tuple keys so single and composite keys compare the same way
+        keyfunc = lambda row: tuple(row[col.name] for col in pklist)
+        count1 = 0
+        count2 = 0
+        # start key, row count and result counts at the start of the current checkpoint range
+        rangestart = startkey
+        rangerows = 0
+        rangebase = (0, 0, 0, 0)
+        for key, row1, row2 in merge_join(rows1, rows2, keyfunc, keyfunc):
+            if checkpoint is not None and count1 + count2 - rangerows >= checkpoint.interval:
+                counts = (samecount, len(diffs), len(only1), len(only2))
+                self.checkpoint_range(checkpoint, KeyRange(rangestart, key),
+                                      tuple(now - base for now, base in zip(counts, rangebase)))
+                rangestart = key
+                rangerows = count1 + count2
+                rangebase = counts
+            if row1 is None:
+                only2.append(row2)
+                count2 += 1
+            elif row2 is None:
+                only1.append(row1)
+                count1 += 1
+            else:
+                if row1 == row2:
+                    samecount += 1
+                else:
+                    diffs.add(row1, row2)
+                count1 += 1
+                count2 += 1
+        if checkpoint is not None:
+            counts = (samecount, len(diffs), len(only1), len(only2))
+            self.checkpoint_range(checkpoint, KeyRange(rangestart, None),
+                                  tuple(now - base for now, base in zip(counts, rangebase)))
+        print("\tStreamed " + str(count1) + " from DB1")
+        print("\tStreamed " + str(count2) + " from DB2")
+        return samecount, diffs, only1, only2
+
+    # Partitioned diff: split the table into primary key ranges (between MIN/MAX for
+    # integer keys, at quantiles of the key order otherwise) and diff the ranges
+    # concurrently, each on its own pair of connections opened by the connectors.
+    # The limiter, if given, caps the connections opened against each host.
+    # returns same count, diffs, only1, only2 (merged in key order)
+    def diff_rows_partitioned(self, tablename1:str, tablename2:str, partitions:int,
+                              connector1:DatabaseConnector, connector2:DatabaseConnector,
+                              where:str = None, jobs:int = None, limiter:ConnectionLimiter = None,
+                              checkpoint:TableCheckpoint = None) -> Tuple[int, List, List, List]:
+        table1, table2, pklist = self.check_tables(tablename1, tablename2)
+        if len(pklist) == 0:
+            raise ValueError('table has no primary key ' + tablename1)
+        keyranges = None
+        if checkpoint is not None:
+            # a resumed diff keeps the ranges of the earlier run
+            keyranges = checkpoint.get_plan()
+        if keyranges is None:
+            keyranges = self.get_partitions(tablename1, tablename2, pklist, partitions, where)
+            if checkpoint is not None:
+                checkpoint.save_plan(keyranges)
+        plancount = len(keyranges)
+        if checkpoint is not None:
+            keyranges = [ keyrange for keyrange in keyranges if not checkpoint.is_range_done(keyrange) ]
+        limiter = limiter or ConnectionLimiter()
+        hosts = [ connector1.host, connector2.host ]
+
+        def worker(keyrange):
+            with limiter.connections(hosts):
+                db1 = connector1.connect()
+                try:
+                    db2 = connector2.connect()
+                    try:
+                        rangediff = TableDiff(db1, db2, verbose=self.verbose, canonicalize=self.canonicalize)
+                        return rangediff.diff_range(tablename1, tablename2, pklist, keyrange, where)
+                    finally:
+                        db2.close()
+                finally:
+                    db1.close()
+
+        samecount = 0
+        diffs, only1, only2 = self.new_results(tablename1, tablename2, pklist)
+        if len(keyranges) == 0:
+            return samecount, diffs, only1, only2
+        results = run_tasks(keyranges, worker, jobs or len(keyranges))
+        for keyrange, result in zip(keyranges, results):
+            sames, rangediffs, rangeonly1, rangeonly2 = result
+            samecount += len(sames)
+            diffs.extend(rangediffs)
+            only1.extend(rangeonly1)
+            only2.extend(rangeonly2)
+            if checkpoint is not None:
+                # ranges are journaled in key order once their rows are in the results
+                self.checkpoint_range(checkpoint, keyrange, tuple(len(rows) for rows in result))
+        print("\tDiffed " + str(len(keyranges)) + " of " + str(plancount) + " key ranges")
+        return samecount, diffs, only1, only2
+
+    # split the key space of a table into at most partitions ranges
+    def get_partitions(self, tablename1:str, tablename2:str, pklist:List[Column], partitions:int,
+                       where:str = None) -> List[KeyRange]:
+        keyrange = get_table_key_range(self.db1, self.db2, tablename1, tablename2, pklist, where)
+        rowcount = 0
+        if keyrange.lo is None:
+            # quantile split, row count is needed to compute the offsets
+            rowcount = self.db1.fetch_table_rowcount(tablename1, where)
+        pklist2 = self.db2.get_table(tablename2).get_primary_key_columns()
+        keyexprs = get_range_expressions(self.db1, self.db2, pklist, pklist2)[0]
+        return split_key_range(self.db1, tablename1, pklist, keyrange, partitions, rowcount, where, None, keyexprs)
+
+    # Fingerprint diff: reduce every row to a fixed width digest as soon as it is
+    # fetched.  DB2 is held as a key -> digest map and DB1 is streamed against it,
+    # so matching rows are only counted.  DB2 rows are re-fetched by key only for
+    # the keys that are missing from DB1.
+    # returns same count, diffs, only1, only2
+    def diff_rows_fingerprint(self, tablename1:str, tablename2:str, where:str = None,
+                              batchsize:int = DEFAULT_BATCH_SIZE) -> Tuple[int, List, List, List]:
+        table1, table2, pklist = self.check_tables(tablename1, tablename2)
+        if len(pklist) == 0:
+            raise ValueError('table has no primary key ' + tablename1)
+        digester = self.get_row_digester(tablename1, table1, table2)
+        keyfunc = lambda row: tuple(row[col.name] for col in pklist)
+        if get_key_dtype(pklist) is not None:
+            # fixed width keys: index both sides in arrays and fetch the differing rows by key
+            digests1 = ((keyfunc(row), digester(row)) for row in self.db1.fetch_table_rows_stream(tablename1, where, None, batchsize))
+            digests2 = ((keyfunc(row), digester(row)) for row in self.db2.fetch_table_rows_stream(tablename2, where, None, batchsize))
+            samecount, diffkeys, only1keys, only2keys = self.diff_key_digests(digests1, digests2, pklist)
+            print("\tFingerprinted " + str(samecount + len(diffkeys) + len(only1keys)) + " from DB1, "
+                  + str(samecount + len(diffkeys) + len(only2keys)) + " from DB2")
+            diffs, only1, only2 = self.fetch_diff_rows(tablename1, tablename2, pklist, diffkeys, only1keys, only2keys)
+            return samecount, diffs, only1, only2
+        #
+        # build key -> digest map for db2
+        #
+        digests2 = dict()
+        for row in self.db2.fetch_table_rows_stream(tablename2, where, None, batchsize):
+            digests2[keyfunc(row)] = digester(row)
+        print("\tFingerprinted " + str(len(digests2)) + " from DB2")
+        #
+        # stream db1 against the map
+        # with a sink only the keys are kept and the rows are fetched at the end
+        #
+        keep = keyfunc if self.sink is not None else (lambda row: row)
+        samecount = 0
+        diffs = []
+        only1 = []
+        count1 = 0
+        for row in self.db1.fetch_table_rows_stream(tablename1, where, None, batchsize):
+            count1 += 1
+            digest2 = digests2.pop(keyfunc(row), None)
+            if digest2 is None:
+                only1.append(keep(row))
+            elif digest2 == digester(row):
+                samecount += 1
+            else:
+                diffs.append(keep(row))
+        print("\tFingerprinted " + str(count1) + " from DB1")
+        if self.sink is not None:
+            diffs, only1, only2 = self.fetch_diff_rows(tablename1, tablename2, pklist, diffs, only1, list(digests2.keys()))
+            return samecount, diffs, only1, only2
+        #
+        # remaining keys are only in db2
+        #
+        pklist2 = table2.get_primary_key_columns()
+        only2 = self.db2.fetch_rows_by_keys(tablename2, pklist2, list(digests2.keys()))
+        return samecount, diffs, only1, only2
+
+    # Fetch the full rows for keys found to differ by a digest based diff.
+    # Rows for diff and only1 keys come from DB1, rows for only2 keys from DB2.
+    # Keys are fetched batchsize at a time, so a sink receives the rows in
+    # batches.  A sink also gets the DB2 rows of the diff keys for the changed
+    # column values, and a sink that only counts gets no rows at all.
+    # returns diffs, only1, only2
+    def fetch_diff_rows(self, tablename1:str, tablename2:str, pklist:List[Column],
+                        diffkeys:List[tuple], only1keys:List[tuple], only2keys:List[tuple],
+                        batchsize:int = DEFAULT_BATCH_SIZE) -> Tuple[List, List, List]:
+        diffs, only1, only2 = self.new_results(tablename1, tablename2, pklist)
+        if self.sink is not None and not self.sink.rows:
+            diffs.add_count(len(diffkeys))
+            only1.add_count(len(only1keys))
+            only2.add_count(len(only2keys))
+            return diffs, only1, only2
+        pklist2 = self.db2.get_table(tablename2).get_primary_key_columns()
+        keyfunc = lambda row: tuple(row[col.name] for col in pklist)
+        keys1 = list(diffkeys) + list(only1keys)
+        diffset = set(diffkeys)
+        for start in range(0, len(keys1), batchsize):
+            rows1 = self.db1.fetch_rows_by_keys(tablename1, pklist, keys1[start:start + batchsize])
+            rows2 = dict()
+            if self.sink is not None:
+                batchdiffs = [ key for key in keys1[start:start + batchsize] if key in diffset ]
+                if len(batchdiffs) > 0:
+                    rows2 = { keyfunc(row): row for row in self.db2.fetch_rows_by_keys(tablename2, pklist2, batchdiffs) }
+            for row in rows1:
+                key = keyfunc(row)
+                if key in diffset:
+                    diffs.add(row, rows2.get(key))
+                else:
+                    only1.append(row)
+        only2keys = list(only2keys)
+        for start in range(0, len(only2keys), batchsize):
+            only2.extend(self.db2.fetch_rows_by_keys(tablename2, pklist2, only2keys[start:start + batchsize]))
+        return diffs, only1, only2
+
+    # Compare two streams of (key, digest) pairs, holding the second as a map.
+    # Fixed width keys (given pklist) are held in NumPy arrays instead.
+    # returns same count, diff keys, only1 keys, only2 keys
+    def diff_key_digests(self, digests1:Iterator[Tuple[tuple, bytes]],
+                         digests2:Iterator[Tuple[tuple, bytes]], pklist:List[Column] = None) -> Tuple[int, List, List, List]:
+        dtype = get_key_dtype(pklist) if pklist is not None else None
+        if dtype is not None:
+            index2 = KeyDigestIndex(dtype).extend(digests2)
+            index1 = KeyDigestIndex(dtype).extend(digests1)
+            return diff_key_digest_indexes(index1, index2)
+        digestmap = dict(digests2)
+        samecount = 0
+        diffkeys = []
+        only1keys = []
+        for key, digest in digests1:
+            digest2 = digestmap.pop(key, None)
+            if digest2 is None:
+                only1keys.append(key)
+            elif digest2 == digest:
+                samecount += 1
+            else:
+                diffkeys.append(key)
+        only2keys = list(digestmap.keys())
+        return samecount, diffkeys, only1keys, only2keys
+
+    # Server hash diff: each server computes an md5 digest of every row, so only
+    # the primary key values and 16 bytes per row cross the network.  Full rows
+    # are fetched afterwards for the keys that differ.
+    # The digests are computed from the text form of the values, so this mode
+    # is meant for diffs between two servers of the same engine.
+    # returns same count, diffs, only1, only2
+    def diff_rows_serverhash(self, tablename1:str, tablename2:str, where:str = None,
+                             batchsize:int = DEFAULT_BATCH_SIZE) -> Tuple[int, List, List, List]:
+        table1, table2, pklist = self.check_tables(tablename1, tablename2)
+        if len(pklist) == 0:
+            raise ValueError('table has no primary key ' + tablename1)
+        digests1 = self.db1.fetch_table_row_hashes(tablename1, table1, where, None, batchsize)
+        digests2 = self.db2.fetch_table_row_hashes(tablename2, table2, where, None, batchsize)
+        samecount, diffkeys, only1keys, only2keys = self.diff_key_digests(digests1, digests2, pklist)
+        print("\tHashed " + str(samecount + len(diffkeys) + len(only1keys)) + " from DB1, "
+              + str(samecount + len(diffkeys) + len(only2keys)) + " from DB2")
+        diffs, only1, only2 = self.fetch_diff_rows(tablename1, tablename2, pklist, diffkeys, only1keys, only2keys)
+        return samecount, diffs, only1, only2
@@ -0,0 +1,233 @@
+#
+# adaptive load throttling: read tables in short primary key chunks whose size
+# follows the measured query latency, under a rows per second ceiling
+#
+
+from typing import Dict, Iterator, List, Tuple
+from dbdiff.schema import DEFAULT_KEY_BATCH_SIZE, Column, Database
+import threading
+import time
+
+# rows in the first chunk of a table scan
+DEFAULT_CHUNK_SIZE = 1000
+MIN_CHUNK_SIZE = 10
+MAX_CHUNK_SIZE = 100000
+# seconds between two server load checks
+DEFAULT_LOAD_CHECK_INTERVAL = 1.0
+# first and longest wait while the server load is over the threshold
+MIN_LOAD_BACKOFF = 0.5
+MAX_LOAD_BACKOFF = 30.0
+
+
+# Counters of the chunk queries and waits of one Throttle.
+class ThrottleStats:
+    def __init__(self):
+        self.chunks = 0
+        self.rows = 0
+        self.querytime = 0.0
+        self.maxlatency = 0.0
+        self.minchunk = None
+        self.maxchunk = None
+        self.ratesleep = 0.0
+        self.backoffs = 0
+        self.backoffsleep = 0.0
+        self.loadwaits = 0
+        self.loadsleep = 0.0
+        self.maxthreads = None
+
+    def get_summary(self) -> str:
+        if self.chunks == 0:
+            return 'no chunks read'
+        summary = (str(self.rows) + ' rows in ' + str(self.chunks) + ' chunks of ' + str(self.minchunk) + '-'
+                   + str(self.maxchunk) + ' rows, query time avg ' + '{:.0f}'.format(self.querytime / self.chunks * 1000)
+                   + ' ms, max ' + '{:.0f}'.format(self.maxlatency * 1000) + ' ms')
+        if self.ratesleep > 0:
+            summary += ', rate limit wait ' + '{:.1f}'.format(self.ratesleep) + 's'
+        if self.backoffs > 0:
+            summary += ', ' + str(self.backoffs) + ' latency backoffs ' + '{:.1f}'.format(self.backoffsleep) + 's'
+        if self.maxthreads is not None:
+            summary += ', Threads_running max ' + str(self.maxthreads)
+        if self.loadwaits > 0:
+            summary += ', ' + str(self.loadwaits) + ' load waits ' + '{:.1f}'.format(self.loadsleep) + 's'
+        return summary
+
+
+# Paces the chunk queries against one database server.  Each table scan keeps
+# its own chunk size: with a target latency a chunk that took longer than the
+# target shrinks the next chunk in proportion and pauses the scan for as long
+# as the query took, and a full chunk well under the target grows the next one
+# (at most doubling it).  The rows per second ceiling and the Threads_running
+# check are shared by all scans of the server, on any number of threads.
+class Throttle:
+    def __init__(self, chunksize:int = DEFAULT_CHUNK_SIZE, target_latency:float = None,
+                 max_rows_per_second:float = None, max_threads_running:int = None,
+                 load_check_interval:float = DEFAULT_LOAD_CHECK_INTERVAL, clock=time.monotonic, sleep=time.sleep):
+        self.chunksize = chunksize or DEFAULT_CHUNK_SIZE
+        self.target_latency = target_latency
+        self.max_rows_per_second = max_rows_per_second
+        self.max_threads_running = max_threads_running
+        self.load_check_interval = load_check_interval
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.stats = ThrottleStats()
+        # earliest start of the next chunk query under the rows per second ceiling
+        self.nexttime = None
+        self.lastloadcheck = None
+
+    # wait while the server is over the Threads_running threshold, checking at
+    # most once per load_check_interval
+    def wait_for_load(self, db:Database):
+        if self.max_threads_running is None:
+            return
+        with self.lock:
+            now = self.clock()
+            if self.lastloadcheck is not None and now - self.lastloadcheck < self.load_check_interval:
+                return
+            self.lastloadcheck = now
+        delay = MIN_LOAD_BACKOFF
+        while True:
+            running = db.fetch_threads_running()
+            if running is None:
+                return
+            with self.lock:
+                if self.stats.maxthreads is None or running > self.stats.maxthreads:
+                    self.stats.maxthreads = running
+                if running <= self.max_threads_running:
+                    # the interval starts when the load is back under the threshold
+                    self.lastloadcheck = self.clock()
+                    return
+                self.stats.loadwaits += 1
+                self.stats.loadsleep += delay
+            self.sleep(delay)
+            delay = min(delay * 2, MAX_LOAD_BACKOFF)
+
+    # record a chunk query and wait as the latency target and the rate ceiling
+    # require, returns the size of the next chunk
+    def chunk_done(self, chunksize:int, rowcount:int, latency:float) -> int:
+        nextsize = chunksize
+        pause = 0.0
+        with self.lock:
+            stats = self.stats
+            stats.chunks += 1
+            stats.rows += rowcount
+            stats.querytime += latency
+            stats.maxlatency = max(stats.maxlatency, latency)
+            stats.minchunk = chunksize if stats.minchunk is None else min(stats.minchunk, chunksize)
+            stats.maxchunk = chunksize if stats.maxchunk is None else max(stats.maxchunk, chunksize)
+            if self.target_latency is not None:
+                if latency > self.target_latency:
+                    nextsize = max(MIN_CHUNK_SIZE, int(chunksize * self.target_latency / latency))
+                    pause = latency
+                    stats.backoffs += 1
+                    stats.backoffsleep += latency
+                elif rowcount >= chunksize:
+                    growth = min(2.0, self.target_latency / latency) if latency > 0 else 2.0
+                    nextsize = min(MAX_CHUNK_SIZE, max(chunksize, int(chunksize * growth)))
+            if self.max_rows_per_second is not None:
+                now = self.clock()
+                start = now if self.nexttime is None or self.nexttime < now else self.nexttime
+                self.nexttime = start + rowcount / self.max_rows_per_second
+                ratewait = self.nexttime - now - pause
+                if ratewait > 0:
+                    stats.ratesleep += ratewait
+                    pause += ratewait
+        if pause > 0:
+            self.sleep(pause)
+        return nextsize
+
+    def get_summary(self) -> str:
+        with self.lock:
+            return self.stats.get_summary()
+
+
+# Wraps a Database so that rows are read through the throttle: table scans
+# become a series of keyset chunk queries in key order and rows fetched by key
+# count against the rate ceiling.  A scan without an order pages by the plain
+# key columns, which the primary key index serves; a scan with an order (the
+# diff engines only ask for key order) pages by the key sort expressions,
+# which for string keys on MySQL and Postgres need an index on the expression.
+# Tables without a primary key, and the server side hash and checksum queries,
+# go straight to the wrapped database.
+class ThrottledDatabase:
+    def __init__(self, db:Database, throttle:Throttle):
+        self.db = db
+        self.throttle = throttle
+
+    def __getattr__(self, name:str):
+        return getattr(self.db, name)
+
+    def get_primary_key(self, tablename:str) -> List[Column]:
+        table = self.db.get_table(tablename)
+        return table.get_primary_key_columns() if table is not None else []
+
+    # yield the rows of a table in key order, one chunk query at a time.
+    # ordered scans follow the key sort expressions, others the native key order
+    def scan_chunks(self, tablename:str, pklist:List[Column], where:str = None, params:tuple = None,
+                    ordered:bool = False) -> Iterator[Dict]:
+        keyexprs = self.db.get_key_sort_expressions(pklist) if ordered else [ col.name for col in pklist ]
+        throttle = self.throttle
+        chunksize = throttle.chunksize
+        after = None
+        while True:
+            throttle.wait_for_load(self.db)
+            start = throttle.clock()
+            rows = self.db.fetch_key_chunk(tablename, pklist, after, chunksize, where, params, keyexprs)
+            latency = throttle.clock() - start
+            nextsize = throttle.chunk_done(chunksize, len(rows), latency)
+            yield from rows
+            if len(rows) < chunksize:
+                return
+            after = tuple(rows[-1][col.name] for col in pklist)
+            chunksize = nextsize
+
+    def fetch_table_rows_stream(self, tablename:str, where:str = None, orderby:str = None,
+                                batchsize:int = None, params:tuple = None) -> Iterator[Dict]:
+        pklist = self.get_primary_key(tablename)
+        if len(pklist) == 0:
+            return self.db.fetch_table_rows_stream(tablename, where, orderby, batchsize, params)
+        return self.scan_chunks(tablename, pklist, where, params, orderby is not None)
+
+    def fetch_table_rows(self, tablename:str, where:str = None, orderby:str = None, params:tuple = None) -> List[Dict]:
+        pklist = self.get_primary_key(tablename)
+        if len(pklist) == 0:
+            return self.db.fetch_table_rows(tablename, where, orderby, params)
+        return list(self.scan_chunks(tablename, pklist, where, params, orderby is not None))
+
+    def fetch_table_tuples_stream(self, tablename:str, columns:List[str], where:str = None, orderby:str = None,
+                                  batchsize:int = None, params:tuple = None) -> Iterator[tuple]:
+        pklist = self.get_primary_key(tablename)
+        if len(pklist) == 0:
+            return self.db.fetch_table_tuples_stream(tablename, columns, where, orderby, batchsize, params)
+        rows = self.scan_chunks(tablename, pklist, where, params, orderby is not None)
+        return (tuple(row[colname] for colname in columns) for row in rows)
+
+    def fetch_table_tuples(self, tablename:str, columns:List[str], where:str = None, orderby:str = None,
+                           params:tuple = None) -> List[tuple]:
+        return list(self.fetch_table_tuples_stream(tablename, columns, where, orderby, None, params))
+
+    def fetch_rows_by_keys(self, tablename:str, pklist:List[Column], keys:List[tuple],
+                           batchsize:int = DEFAULT_KEY_BATCH_SIZE) -> List[Dict]:
+        rows = []
+        for start in range(0, len(keys), batchsize):
+            batchkeys = keys[start:start + batchsize]
+            self.throttle.wait_for_load(self.db)
+            began = self.throttle.clock()
+            batch = self.db.fetch_rows_by_keys(tablename, pklist, batchkeys, batchsize)
+            self.throttle.chunk_done(len(batchkeys), len(batch), self.throttle.clock() - began)
+            rows.extend(batch)
+        return rows
+
+
+# Returns the (DB1, DB2) throttles for the throttle options, or None if no
+# throttle option is set.  Each server gets its own throttle.
+def make_throttles(options:dict) -> Tuple[Throttle, Throttle]:
+    if options is None:
+        return None
+    settings = { name: options.get(name) for name in ('chunk_size', 'target_latency', 'max_rows_per_second',
+                                                      'max_threads_running') }
+    if all(value is None for value in settings.values()):
+        return None
+    return tuple(Throttle(chunksize=settings['chunk_size'], target_latency=settings['target_latency'],
+                          max_rows_per_second=settings['max_rows_per_second'],
+                          max_threads_running=settings['max_threads_running']) for side in range(2))
@@ -2,8 +2,64 @@
 # Base Classes for Database Schema
 #
 
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Tuple
+from ..tracing import profiled
 import copy
+import zlib
+
+# default number of rows fetched per round trip by the streaming fetch methods
+DEFAULT_BATCH_SIZE = 10000
+# default number of keys per query when rows are fetched by primary key
+DEFAULT_KEY_BATCH_SIZE = 1000
+
+# build a SELECT query for a table with optional where and order by clauses
+# columns is a list of column names or expressions, default is *
+def select_query(tablename:str, where:str = None, orderby:str = None, columns:List[str] = None) -> str:
+    if columns is None:
+        query = 'SELECT * FROM ' + tablename
+    else:
+        query = 'SELECT ' + ', '.join(columns) + ' FROM ' + tablename
+    if where is not None:
+        query = query + ' WHERE ' + where
+    if orderby is not None:
+        query = query + ' ORDER BY ' + orderby
+    return query
+
+# rows whose 32 bit key hash is below this threshold make up a sample of the given fraction
+def sample_threshold(fraction:float) -> int:
+    return int(fraction * 2 ** 32)
+
+# build a where clause that selects count rows by their primary key values
+def key_in_where(keycols:List[str], count:int) -> str:
+    if len(keycols) == 1:
+        return keycols[0] + ' IN (' + ', '.join([ '%s' ] * count) + ')'
+    rowplaceholder = '(' + ', '.join([ '%s' ] * len(keycols)) + ')'
+    return '(' + ', '.join(keycols) + ') IN (' + ', '.join([ rowplaceholder ] * count) + ')'
+
+# build a query that returns the key columns of the row at a given offset in key order
+def key_at_offset_query(tablename:str, keycols:List[str], sortexprs:List[str], where:str = None) -> str:
+    query = 'SELECT ' + ', '.join(keycols) + ' FROM ' + tablename
+    if where is not None:
+        query = query + ' WHERE ' + where
+    query = query + ' ORDER BY ' + ', '.join(sortexprs) + ' LIMIT 1 OFFSET %s'
+    return query
+
+# build a query for the next chunk of rows in key order (keyset pagination): the
+# first LIMIT %s rows, or with after the first rows whose key sorts after a key
+# given as parameters, compared with a row constructor for composite keys
+def key_chunk_query(tablename:str, sortexprs:List[str], where:str = None, after:bool = False) -> str:
+    terms = []
+    if where is not None:
+        terms.append('(' + where + ')')
+    if after:
+        if len(sortexprs) == 1:
+            terms.append(sortexprs[0] + ' > %s')
+        else:
+            terms.append('(' + ', '.join(sortexprs) + ') > (' + ', '.join([ '%s' ] * len(sortexprs)) + ')')
+    query = 'SELECT * FROM ' + tablename
+    if len(terms) > 0:
+        query = query + ' WHERE ' + ' AND '.join(terms)
+    return query + ' ORDER BY ' + ', '.join(sortexprs) + ' LIMIT %s'
 
 class Column:
     def __init__(self, name, type, tableName=None, schema=None, nullable=True, primaryKey=False, defaultValue=None, constraints=None, position=None):
@@ -54,6 +110,42 @@ class Column:
             colcopy.tableName = canonicalize(colcopy.tableName)
         return colcopy
 
+    # type name without length, precision or modifiers, e.g. 'varchar' for 'varchar(255)'
+    def get_base_type(self) -> str:
+        if self.type is None:
+            return ''
+        return self.type.split('(')[0].split(' ')[0].lower()
+
+    # true if values of this column sort by collation rather than by value
+    # subclasses override this with engine specific type names
+    def is_string_type(self) -> bool:
+        return False
+
+    # true if this column holds integers, so key ranges can be split arithmetically
+    def is_integer_type(self) -> bool:
+        return False
+
+    # The kind of python value the driver returns for this column, used to line up
+    # values of the same column read from two different engines:
+    # bool, intbool (0/1 integers used as booleans), integer, decimal, float, datetime,
+    # datetimetz, date, time, timedelta, bytes, json (parsed), jsontext (json as a
+    # string), uuid, string or other.
+    # subclasses override this with engine specific type names
+    def get_value_kind(self) -> str:
+        return 'other'
+
+    # scale of a decimal type such as decimal(10,2), None if the type does not give one
+    def get_type_scale(self) -> int:
+        if self.type is None or '(' not in self.type:
+            return None
+        args = self.type.split('(', 1)[1].split(')', 1)[0].split(',')
+        if len(args) < 2:
+            return None
+        try:
+            return int(args[1])
+        except ValueError:
+            return None
+
 class Index:
     def __init__(self, name, tableName, schema:str = None):
         self.name = name
@@ -162,6 +254,43 @@ class Routine:
         
     
 
+# Maps an attribute of the objects in a list (e.g. the name of the columns of
+# a table) to the first object with that value, which is the object a linear
+# scan of the list would find.  Objects appended through add() are indexed
+# as they come.  A list that was changed directly (appended to or replaced)
+# no longer has the identity and length the dict was built for, and is
+# indexed again on the next lookup.  The key attribute of an object must not
+# change once it is in the list.
+# Tables are shared by the threads of a parallel diff, so the list, length and
+# dict are kept in one tuple that is replaced in a single assignment, and a
+# lookup never sees a new list with the dict of an old one.
+class Lookup:
+    def __init__(self, keyname:str):
+        self.keyname = keyname
+        self.state = (None, 0, dict())
+
+    def get_index(self, items:List) -> Dict:
+        indexed, count, index = self.state
+        if items is not indexed or len(items) != count:
+            # the length is taken first, an item appended meanwhile is indexed next time
+            count = len(items)
+            index = dict()
+            for item in items[:count]:
+                index.setdefault(getattr(item, self.keyname), item)
+            self.state = (items, count, index)
+        return index
+
+    def get(self, items:List, key):
+        return self.get_index(items).get(key)
+
+    # index item, which was just appended to items
+    def add(self, items:List, item):
+        indexed, count, index = self.state
+        if items is indexed and len(items) == count + 1:
+            index.setdefault(getattr(item, self.keyname), item)
+            self.state = (items, count + 1, index)
+
+
 class Table:
     def __init__(self, name, schema=None, rows=None):
         self.name = name
@@ -174,6 +303,11 @@ class Table:
         self.index_length = 0
         self.auto_increment = None
         self.table_collation = None        
+        # name and position lookups of the lists above
+        self.column_names = Lookup('name')
+        self.column_positions = Lookup('position')
+        self.constraint_names = Lookup('name')
+        self.index_names = Lookup('name')
 
     def get_full_name(self) -> str:
         if self.schema is not None:
@@ -191,40 +325,37 @@ class Table:
         return self.indexes
 
     def get_column(self, name:str) -> Column:
-        match = None
-        for column in self.columns:
-            if column.name == name:
-                match = column
-                break
-        return match
+        return self.column_names.get(self.columns, name)
 
     def get_column_by_position(self, position: int) -> Column:
-        match = None
-        for column in self.columns:
-            if column.position == position:
-                match = column
-                break
-        return match
+        return self.column_positions.get(self.columns, position)
 
     def get_constraint(self, name:str) -> Constraint:
-        for constraint in self.constraints:
-            if constraint.name == name:
-                return constraint
-        return None
+        return self.constraint_names.get(self.constraints, name)
 
     def get_index(self, name:str) -> Index:
-        for index in self.indexes:
-            if index.name == name:
-                return index
-        return None
+        return self.index_names.get(self.indexes, name)
+
+    def add_column(self, column:Column):
+        self.columns.append(column)
+        self.column_names.add(self.columns, column)
+        self.column_positions.add(self.columns, column)
 
     def add_index(self, index:Index):
         self.indexes.append(index)
+        self.index_names.add(self.indexes, index)
+
+    # add a constraint of this table; Database.add_constraint also indexes it
+    # for find_constraint
+    def add_constraint(self, constraint:Constraint):
+        self.constraints.append(constraint)
+        self.constraint_names.add(self.constraints, constraint)
         
     def get_primary_key_columns(self) -> List[Column]:
         pklist = [ col for col in self.columns if col.primaryKey ]
         return pklist
 
+    @profiled('compare')
     def diff_columns(self, table, canonicalize=None) -> Tuple[List[Column],List[Column],List[Column],List[Column]]:
         same = []
         notsame = []
@@ -254,6 +385,7 @@ class Table:
                 only2.append(col2)
         return same, notsame, only1, only2
 
+    @profiled('compare')
     def diff_indexes(self, table, canonicalize=None) -> Tuple[List[Index],List[Index],List[Index],List[Index]]:
         same = []
         notsame = []
@@ -283,6 +415,7 @@ class Table:
                 only2.append(idx2)
         return same, notsame, only1, only2
 
+    @profiled('compare')
     def diff_constraints(self, table, canonicalize=None) -> Tuple[List[Constraint],List[Constraint],List[Constraint],List[Constraint]]:
         same = []
         notsame = []
@@ -321,6 +454,10 @@ class Database:
         self.tables: Dict[Table] = dict()
         self.indexes: Dict[Index] = dict()
         self.routines: Dict[Routine] = dict()
+        # constraint name -> [(table name, constraint)] over all tables, for find_constraint
+        self.constraint_names: Dict[str, List[Tuple[str, Constraint]]] = dict()
+        # table name -> position in tables, rebuilt when tables were added
+        self.table_positions: Dict[str, int] = dict()
 
     def get_table(self, tablename) -> Table:
         if tablename in self.tables:
@@ -329,7 +466,32 @@ class Database:
             return None
 
     def add_table(self, table: Table):
+        replaced = self.tables.get(table.name)
         self.tables[table.name] = table
+        if replaced is not None:
+            # drop the constraints of the replaced table from the index
+            self.constraint_names = dict()
+            for dbtable in self.tables.values():
+                self.index_constraints(dbtable)
+        else:
+            self.index_constraints(table)
+
+    def index_constraints(self, table: Table):
+        for constraint in table.constraints:
+            self.index_constraint(table, constraint)
+
+    def index_constraint(self, table: Table, constraint: Constraint):
+        self.constraint_names.setdefault(constraint.name, []).append((table.name, constraint))
+
+    def add_constraint(self, table: Table, constraint: Constraint):
+        table.add_constraint(constraint)
+        self.index_constraint(table, constraint)
+
+    # position of a table in tables, which keeps the order the tables were added in
+    def get_table_position(self, tablename: str) -> int:
+        if len(self.table_positions) != len(self.tables):
+            self.table_positions = { name: position for position, name in enumerate(self.tables) }
+        return self.table_positions.get(tablename, len(self.tables))
         
     def add_routine(self, routine: Routine):
         self.routines[routine.name] = routine
@@ -341,10 +503,23 @@ class Database:
             tablelist = [ canonicalize(table.get_full_name()) for table in self.tables.values() ]
         return tablelist
 
+    # Constraints added through add_table and add_constraint are found in the
+    # name index.  Postgres only requires constraint names to be unique per
+    # table, so of several constraints with the name the one in the first table
+    # in tables order is returned, as a scan of the tables would.  A constraint
+    # appended to a table directly is found by scanning the tables, and indexed
+    # for the next lookup.
     def find_constraint(self, name:str) -> Constraint:
+        matches = self.constraint_names.get(name)
+        if matches is not None:
+            if len(matches) == 1:
+                return matches[0][1]
+            # min keeps the first of the constraints of one table
+            return min(matches, key=lambda match: self.get_table_position(match[0]))[1]
         for table in self.tables.values():
             constraint = table.get_constraint(name)
             if constraint is not None:
+                self.index_constraint(table, constraint)
                 return constraint
         return None
 
@@ -358,12 +533,124 @@ class Database:
         else:
             return None
 
-    def fetch_table_rows(self, tablename:str, where:str, orderby:str) -> List[Dict]:
+    def fetch_table_rows(self, tablename:str, where:str, orderby:str, params:tuple = None) -> List[Dict]:
         return None
 
-    def fetch_table_rowcount(self, tablename:str, where:str) -> int:
+    # stream table rows; subclasses override this to avoid loading the whole table
+    def fetch_table_rows_stream(self, tablename:str, where:str = None, orderby:str = None,
+                                batchsize:int = DEFAULT_BATCH_SIZE, params:tuple = None) -> Iterator[Dict]:
+        rows = self.fetch_table_rows(tablename, where, orderby, params)
+        if rows is not None:
+            for row in rows:
+                yield row
+
+    # fetch rows as tuples of the given columns, in the order of columns.
+    # Tuples take a fraction of the memory of dict rows; subclasses fetch them
+    # with a positional cursor, this fallback converts dict rows.
+    def fetch_table_tuples(self, tablename:str, columns:List[str], where:str = None, orderby:str = None,
+                           params:tuple = None) -> List[tuple]:
+        rows = self.fetch_table_rows(tablename, where, orderby, params)
+        return [ tuple(row[colname] for colname in columns) for row in rows ]
+
+    # stream rows as tuples of the given columns; subclasses override this to
+    # avoid loading the whole table
+    def fetch_table_tuples_stream(self, tablename:str, columns:List[str], where:str = None, orderby:str = None,
+                                  batchsize:int = DEFAULT_BATCH_SIZE, params:tuple = None) -> Iterator[tuple]:
+        rows = self.fetch_table_tuples(tablename, columns, where, orderby, params)
+        if rows is not None:
+            for row in rows:
+                yield row
+
+    def fetch_table_rowcount(self, tablename:str, where:str, params:tuple = None) -> int:
         return None
 
+    # return ORDER BY expressions for the key columns that sort rows in the same
+    # order on every engine (and in python), subclasses override for string types
+    def get_key_sort_expressions(self, pklist:List[Column]) -> List[str]:
+        return [ col.name for col in pklist ]
+
+    # return a value that describes how the server orders the key columns
+    # without sort expressions (engine and string collations), None if unknown.
+    # Two databases with equal key orders agree on which keys fall in a range
+    # when the plain columns are compared, so the primary key index can be used.
+    def get_key_order(self, pklist:List[Column]) -> tuple:
+        return None
+
+    # return (row count, checksum) for the rows matching where, with the row hashes
+    # aggregated on the server.  Subclasses implement this with engine specific SQL.
+    def fetch_range_checksum(self, tablename:str, table:Table, where:str = None, params:tuple = None) -> Tuple[int, int]:
+        return None
+
+    # return a whole table checksum computed by the server, None if the engine has none.
+    # Checksums are only comparable between servers of the same engine.
+    def fetch_table_checksum(self, tablename:str, table:Table):
+        return None
+
+    # stream (key tuple, row digest) pairs with the row digest computed on the server,
+    # so only the primary key values and a 16 byte hash per row are transferred
+    def fetch_table_row_hashes(self, tablename:str, table:Table, where:str = None, orderby:str = None,
+                               batchsize:int = DEFAULT_BATCH_SIZE, params:tuple = None) -> Iterator[Tuple[tuple, bytes]]:
+        return None
+
+    # return (min, max) of a single column key
+    def fetch_key_bounds(self, tablename:str, pkcol:Column, where:str = None, params:tuple = None) -> Tuple:
+        return None
+
+    # fetch the rows with the given primary key tuples, batchsize keys per query
+    def fetch_rows_by_keys(self, tablename:str, pklist:List[Column], keys:List[tuple],
+                           batchsize:int = DEFAULT_KEY_BATCH_SIZE) -> List[Dict]:
+        keycols = [ col.name for col in pklist ]
+        rows = []
+        for start in range(0, len(keys), batchsize):
+            batch = keys[start:start + batchsize]
+            params = tuple(value for key in batch for value in key)
+            rows.extend(self.fetch_table_rows(tablename, key_in_where(keycols, len(batch)), None, params))
+        return rows
+
+    # return the key tuple of the row at offset in key order, or None past the end.
+    # keyexprs are the expressions that define the key order, the key sort
+    # expressions by default
+    def fetch_key_at_offset(self, tablename:str, pklist:List[Column], offset:int, where:str = None, params:tuple = None,
+                            keyexprs:List[str] = None) -> Tuple:
+        return None
+
+    # fetch the first limit rows in key order whose key is after the key tuple
+    # after (from the first key if after is None), so a table can be read in
+    # short keyset queries instead of one long scan.  keyexprs are the
+    # expressions that define the key order, the key sort expressions by default
+    def fetch_key_chunk(self, tablename:str, pklist:List[Column], after:tuple, limit:int,
+                        where:str = None, params:tuple = None, keyexprs:List[str] = None) -> List[Dict]:
+        return None
+
+    # return the number of threads executing statements on the server, None if
+    # the engine does not report it
+    def fetch_threads_running(self) -> int:
+        return None
+
+    # return the catalog estimate of the rows of a table, None if there is none;
+    # this is the row count read with the schema, subclasses ask the server
+    def fetch_row_estimate(self, tablename:str) -> int:
+        table = self.get_table(tablename)
+        return table.rows if table is not None else None
+
+    # Return a random sample of about fraction of the rows.  This fallback streams
+    # every row and keeps the rows whose key hash is below the sample threshold;
+    # subclasses push the sampling down to the server.
+    def fetch_table_sample(self, tablename:str, pklist:List[Column], fraction:float,
+                           where:str = None, params:tuple = None) -> List[Dict]:
+        threshold = sample_threshold(fraction)
+        rows = []
+        for row in self.fetch_table_rows_stream(tablename, where, None, DEFAULT_BATCH_SIZE, params):
+            key = tuple(row[col.name] for col in pklist)
+            if zlib.crc32(repr(key).encode('utf-8')) < threshold:
+                rows.append(row)
+        return rows
+
+    # run statements in one transaction that is rolled back if a statement fails.
+    # Subclasses implement this on their connection.
+    def execute_statements(self, statements:List[str]):
+        raise NotImplementedError(type(self).__name__ + ' cannot execute statements')
+
 
 class SchemaAwareDatabase:
     def __init__(self, name: str, schemas: List[str] = None, default_schema: str = None):
@@ -414,6 +701,12 @@ class SchemaAwareDatabase:
             raise ValueError(f"Invalid schema: {schema}")
         return dbschema.find_constraint(name)
 
+    def add_constraint(self, table: Table, constraint: Constraint):
+        dbschema = self.schemas.get(table.schema)
+        if dbschema is None:
+            raise ValueError(f"Invalid schema: {table.schema}")
+        dbschema.add_constraint(table, constraint)
+
     def get_procedure_list(self) -> List[str]:
         # build list of procedures from all schemas
         proclist = []
@@ -436,8 +729,75 @@ class SchemaAwareDatabase:
             self.schemas[schema] = dbschema
         dbschema.add_routine(routine)
         
-    def fetch_table_rows(self, tablename:str, schema:str, where:str, orderby:str) -> List[Dict]:
+    def fetch_table_rows(self, tablename:str, where:str = None, orderby:str = None, params:tuple = None) -> List[Dict]:
+        return None
+
+    def fetch_table_rows_stream(self, tablename:str, where:str = None, orderby:str = None,
+                                batchsize:int = DEFAULT_BATCH_SIZE, params:tuple = None) -> Iterator[Dict]:
+        rows = self.fetch_table_rows(tablename, where, orderby, params)
+        if rows is not None:
+            for row in rows:
+                yield row
+
+    def fetch_table_tuples(self, tablename:str, columns:List[str], where:str = None, orderby:str = None,
+                           params:tuple = None) -> List[tuple]:
+        return None
+
+    def fetch_table_tuples_stream(self, tablename:str, columns:List[str], where:str = None, orderby:str = None,
+                                  batchsize:int = DEFAULT_BATCH_SIZE, params:tuple = None) -> Iterator[tuple]:
+        return None
+
+    def fetch_table_rowcount(self, tablename:str, where:str = None, params:tuple = None) -> int:
+        return None
+
+    def get_key_sort_expressions(self, pklist:List[Column]) -> List[str]:
+        return [ col.name for col in pklist ]
+
+    def get_key_order(self, pklist:List[Column]) -> tuple:
+        return None
+
+    def fetch_range_checksum(self, tablename:str, table:Table, where:str = None, params:tuple = None) -> Tuple[int, int]:
+        return None
+
+    def fetch_table_checksum(self, tablename:str, table:Table):
+        return None
+
+    def fetch_table_row_hashes(self, tablename:str, table:Table, where:str = None, orderby:str = None,
+                               batchsize:int = DEFAULT_BATCH_SIZE, params:tuple = None) -> Iterator[Tuple[tuple, bytes]]:
+        return None
+
+    def fetch_key_bounds(self, tablename:str, pkcol:Column, where:str = None, params:tuple = None) -> Tuple:
         return None
 
-    def fetch_table_rowcount(self, tablename:str, schema:str, where:str) -> int:
+    def fetch_key_at_offset(self, tablename:str, pklist:List[Column], offset:int, where:str = None, params:tuple = None,
+                            keyexprs:List[str] = None) -> Tuple:
         return None
+
+    def fetch_key_chunk(self, tablename:str, pklist:List[Column], after:tuple, limit:int,
+                        where:str = None, params:tuple = None, keyexprs:List[str] = None) -> List[Dict]:
+        return None
+
+    def fetch_threads_running(self) -> int:
+        return None
+
+    def fetch_row_estimate(self, tablename:str) -> int:
+        table = self.get_table(tablename)
+        return table.rows if table is not None else None
+
+    def fetch_table_sample(self, tablename:str, pklist:List[Column], fraction:float,
+                           where:str = None, params:tuple = None) -> List[Dict]:
+        return None
+
+    # fetch the rows with the given primary key tuples, batchsize keys per query
+    def fetch_rows_by_keys(self, tablename:str, pklist:List[Column], keys:List[tuple],
+                           batchsize:int = DEFAULT_KEY_BATCH_SIZE) -> List[Dict]:
+        keycols = [ col.name for col in pklist ]
+        rows = []
+        for start in range(0, len(keys), batchsize):
+            batch = keys[start:start + batchsize]
+            params = tuple(value for key in batch for value in key)
+            rows.extend(self.fetch_table_rows(tablename, key_in_where(keycols, len(batch)), None, params))
+        return rows
+
+    def execute_statements(self, statements:List[str]):
+        raise NotImplementedError(type(self).__name__ + ' cannot execute statements')
@@ -4,6 +4,7 @@
 
 from typing import List, Tuple
 from . import Database, Table
+from ..tracing import profiled
 
 class SchemaCompare:
     def __init__(self, db1: Database, db2: Database, canonicalize=None) -> None:
@@ -13,6 +14,7 @@ class SchemaCompare:
 
     # compare table sets in each db
     # return tables in both, tables only in 1, tables only in 2
+    @profiled('compare')
     def diff_table_list(self) -> Tuple[List[Tuple], List[Tuple], List[Tuple]]:
         both = []
         only1 = []
@@ -48,6 +50,7 @@ class SchemaCompare:
                 only2.append((canon2,orig2))
         return both, only1, only2
 
+    @profiled('compare')
     def diff_procedure_list(self) -> Tuple[List[str], List[str], List[str]]:
         both = []
         only1 = []
@@ -71,6 +74,7 @@ class SchemaCompare:
 # reference: https://en.wikipedia.org/wiki/Topological_sorting
 class TopoSort:
     @classmethod
+    @profiled('compare')
     def sort(self, tables:List[Table]) -> List[Table]:
         # get list of tables with no dependencies
         sorted = []
@@ -90,10 +94,15 @@ class TopoSort:
             else:
                 nodelist.append(table)
 
-        # step 2: scan nodelist, adding nodes to sorted in topo order
+        # step 2: scan nodelist, adding nodes to sorted in topo order.
+        # Links to tables that are not in the list do not hold a table back.
+        # A pass that adds no table means the rest are in (or depend on) a
+        # foreign key cycle, they go last in the order they were given.
+        names = set(table.name for table in tables)
         while len(nodelist) > 0:
             #print('Sorted:' + str(len(sorted_dict)) + ' Work:' + str(len(fklist)))
-            for table in nodelist:
+            added = False
+            for table in list(nodelist):
                 all_deps_visited = True
                 # check if table dependencies are already visited
                 for constr in table.constraints:
@@ -102,7 +111,7 @@ class TopoSort:
                         reftable = constr.reference_table
                         # note: must detect and ignore self-referential fk links
                         #   since this is a dependency loop that will break the algorithm
-                        if reftable not in visited and reftable != table.name:
+                        if reftable not in visited and reftable != table.name and reftable in names:
                             #print(reftable + ' not visited')
                             all_deps_visited = False
                             break
@@ -111,4 +120,8 @@ class TopoSort:
                     sorted.append(table)
                     visited[table.name] = table
                     nodelist.remove(table)
+                    added = True
+            if not added:
+                sorted.extend(nodelist)
+                break
         return sorted
@@ -2,8 +2,9 @@
 # import mysql schema
 #
 
-from typing import Dict, List
-from . import Constraint, Database, Table, Column, Index
+from typing import Dict, Iterator, List, Tuple
+from . import DEFAULT_BATCH_SIZE, Constraint, Database, Table, Column, Index, key_at_offset_query, key_chunk_query, sample_threshold, select_query
+from ..tracing import fetch_all, profiled, span
 
 try:
     import mysql.connector  # type: ignore
@@ -48,11 +49,23 @@ class MySQLTable(Table):
         self.table_collation = TABLE_COLLATION
 
 
+# column types that are compared using a collation
+MYSQL_STRING_TYPES = ('char', 'varchar', 'tinytext', 'text', 'mediumtext', 'longtext', 'enum', 'set')
+MYSQL_INTEGER_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'integer', 'bigint')
+# value kinds of the column types whose values are not plain strings or integers
+MYSQL_VALUE_KINDS = {
+    'bool': 'intbool', 'boolean': 'intbool',
+    'decimal': 'decimal', 'numeric': 'decimal', 'float': 'float', 'double': 'float', 'real': 'float',
+    'datetime': 'datetime', 'timestamp': 'datetime', 'date': 'date', 'time': 'timedelta',
+    'binary': 'bytes', 'varbinary': 'bytes', 'tinyblob': 'bytes', 'blob': 'bytes', 'mediumblob': 'bytes',
+    'longblob': 'bytes', 'bit': 'bytes', 'json': 'jsontext',
+}
+
 # Note: information_schema.columns has additional columns that break down COLUMN_TYPE
 class MySQLColumn(Column):
     def __init__(self,
         TABLE_NAME=None, COLUMN_NAME=None, COLUMN_TYPE=None, COLUMN_KEY=None,
-        IS_NULLABLE=None, COLUMN_DEFAULT=None, ORDINAL_POSITION=None):
+        IS_NULLABLE=None, COLUMN_DEFAULT=None, ORDINAL_POSITION=None, COLLATION_NAME=None):
         super().__init__(COLUMN_NAME, COLUMN_TYPE)
         if IS_NULLABLE == 'YES':
             self.nullable = True
@@ -65,6 +78,25 @@ class MySQLColumn(Column):
         self.defaultValue = COLUMN_DEFAULT
         self.position = ORDINAL_POSITION
         self.tableName = TABLE_NAME
+        # collation of string columns, None for other types
+        self.collation = COLLATION_NAME
+
+    def is_string_type(self) -> bool:
+        return self.get_base_type() in MYSQL_STRING_TYPES
+
+    def is_integer_type(self) -> bool:
+        return self.get_base_type() in MYSQL_INTEGER_TYPES
+
+    def get_value_kind(self) -> str:
+        basetype = self.get_base_type()
+        # tinyint(1) is how MySQL declares booleans, the driver returns 0/1
+        if basetype == 'tinyint' and (self.type or '').lower().startswith('tinyint(1)'):
+            return 'intbool'
+        if basetype in MYSQL_INTEGER_TYPES:
+            return 'integer'
+        if basetype in MYSQL_STRING_TYPES:
+            return 'string'
+        return MYSQL_VALUE_KINDS.get(basetype, 'other')
 
 class MySQLConstraint(Constraint):
     def __init__(self, TABLE_NAME, CONSTRAINT_NAME, CONSTRAINT_TYPE):
@@ -95,59 +127,235 @@ class MySQLDatabase(Database):
             raise ImportError("mysql.connector is required for database connections")
         self.conn = mysql.connector.connect(**kwargs)
 
-    def fetch_table_rows(self, tablename: str, where: str = None, orderby: str = None) -> List[Dict]:
-        query = 'SELECT * FROM ' + tablename
-        if where is not None:
-            query = query + ' WHERE ' + where
-        if orderby is not None:
-            query = query + ' ORDER BY ' + orderby
+    def close(self):
+        self.conn.close()
+
+    def fetch_table_rows(self, tablename: str, where: str = None, orderby: str = None, params: tuple = None) -> List[Dict]:
+        query = select_query(tablename, where, orderby)
         rows = []
         with self.conn.cursor(dictionary=True) as cursor:
-            cursor.execute(query)
+            cursor.execute(query, params)
             for row in cursor:
                 rows.append(row)
         return rows
 
-    def fetch_table_rowcount(self, tablename: str, where: str = None) -> int:
+    def fetch_table_tuples(self, tablename: str, columns: List[str], where: str = None, orderby: str = None,
+                           params: tuple = None) -> List[tuple]:
+        query = select_query(tablename, where, orderby, columns)
+        with self.conn.cursor() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+        return rows
+
+    # use an unbuffered cursor so the client only holds one batch of rows at a time
+    def fetch_table_rows_stream(self, tablename: str, where: str = None, orderby: str = None,
+                                batchsize: int = DEFAULT_BATCH_SIZE, params: tuple = None) -> Iterator[Dict]:
+        query = select_query(tablename, where, orderby)
+        with self.conn.cursor(dictionary=True, buffered=False) as cursor:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batchsize)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+
+    def fetch_table_tuples_stream(self, tablename: str, columns: List[str], where: str = None, orderby: str = None,
+                                  batchsize: int = DEFAULT_BATCH_SIZE, params: tuple = None) -> Iterator[tuple]:
+        query = select_query(tablename, where, orderby, columns)
+        with self.conn.cursor(buffered=False) as cursor:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batchsize)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+
+    # string keys are sorted by their binary value, which matches python
+    # string ordering and postgres "C" collation ordering for utf8 data
+    def get_key_sort_expressions(self, pklist: List[Column]) -> List[str]:
+        exprs = []
+        for col in pklist:
+            if col.is_string_type():
+                exprs.append('CAST(' + col.name + ' AS BINARY)')
+            else:
+                exprs.append(col.name)
+        return exprs
+
+    # string keys order by their column collation, unknown if it was not read
+    def get_key_order(self, pklist: List[Column]) -> tuple:
+        order = [ 'mysql' ]
+        for col in pklist:
+            collation = None
+            if col.is_string_type():
+                collation = getattr(col, 'collation', None)
+                if collation is None:
+                    return None
+            order.append(collation)
+        return tuple(order)
+
+    def fetch_table_rowcount(self, tablename: str, where: str = None, params: tuple = None) -> int:
         query = 'SELECT COUNT(*) FROM ' + tablename
         if where is not None:
             query = query + ' WHERE ' + where
         with self.conn.cursor() as cursor:
-            cursor.execute(query)
+            cursor.execute(query, params)
             row = cursor.fetchone()
             rowcount = row[0]
         return rowcount
 
+    # SQL expression that renders a column value as a string for hashing
+    def get_column_text_expression(self, col: Column) -> str:
+        basetype = col.get_base_type()
+        if basetype == 'bit':
+            # BIT values are raw bytes, hash their binary digits instead
+            return 'BIN(' + col.name + ')'
+        if basetype == 'json':
+            return 'CAST(' + col.name + ' AS CHAR)'
+        return col.name
+
+    # SQL expression for the md5 hex digest of a row.  Each value is length prefixed
+    # so adjacent values cannot run together, and NULL is encoded as 'N'.
+    def get_row_hash_expression(self, table: Table) -> str:
+        columns = sorted(table.columns, key=lambda col: col.position)
+        parts = []
+        for col in columns:
+            text = self.get_column_text_expression(col)
+            parts.append("COALESCE(CONCAT(CHAR_LENGTH(" + text + "), ':', " + text + "), 'N')")
+        return 'MD5(CONCAT(' + ', '.join(parts) + '))'
+
+    def fetch_table_row_hashes(self, tablename: str, table: Table, where: str = None, orderby: str = None,
+                               batchsize: int = DEFAULT_BATCH_SIZE, params: tuple = None) -> Iterator[Tuple[tuple, bytes]]:
+        keycols = [ col.name for col in table.get_primary_key_columns() ]
+        columns = keycols + [ 'UNHEX(' + self.get_row_hash_expression(table) + ')' ]
+        query = select_query(tablename, where, orderby, columns)
+        keylen = len(keycols)
+        with self.conn.cursor(buffered=False) as cursor:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batchsize)
+                if not rows:
+                    break
+                for row in rows:
+                    yield tuple(row[:keylen]), bytes(row[keylen])
+
+    # CHECKSUM TABLE reads the whole table on the server, the value depends on the
+    # row format and server version as well as the data
+    def fetch_table_checksum(self, tablename: str, table: Table):
+        with self.conn.cursor() as cursor:
+            cursor.execute('CHECKSUM TABLE ' + tablename)
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return row[1]
+
+    # the checksum is the sum of the first 60 bits of each row hash, which is
+    # independent of row order and does not overflow the DECIMAL result of SUM
+    def fetch_range_checksum(self, tablename: str, table: Table, where: str = None, params: tuple = None) -> Tuple[int, int]:
+        rowhash = self.get_row_hash_expression(table)
+        query = 'SELECT COUNT(*), SUM(CAST(CONV(SUBSTRING(' + rowhash + ', 1, 15), 16, 10) AS UNSIGNED)) FROM ' + tablename
+        if where is not None:
+            query = query + ' WHERE ' + where
+        with self.conn.cursor() as cursor:
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+        rowcount = row[0]
+        checksum = int(row[1]) if row[1] is not None else 0
+        return rowcount, checksum
+
+    def fetch_key_bounds(self, tablename: str, pkcol: Column, where: str = None, params: tuple = None) -> Tuple:
+        query = 'SELECT MIN(' + pkcol.name + '), MAX(' + pkcol.name + ') FROM ' + tablename
+        if where is not None:
+            query = query + ' WHERE ' + where
+        with self.conn.cursor() as cursor:
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+        return row[0], row[1]
+
+    def fetch_key_at_offset(self, tablename: str, pklist: List[Column], offset: int, where: str = None, params: tuple = None,
+                            keyexprs: List[str] = None) -> Tuple:
+        keycols = [ col.name for col in pklist ]
+        query = key_at_offset_query(tablename, keycols, keyexprs or self.get_key_sort_expressions(pklist), where)
+        params = tuple(params or ()) + (offset,)
+        with self.conn.cursor() as cursor:
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return tuple(row)
+
+    def fetch_key_chunk(self, tablename: str, pklist: List[Column], after: tuple, limit: int,
+                        where: str = None, params: tuple = None, keyexprs: List[str] = None) -> List[Dict]:
+        query = key_chunk_query(tablename, keyexprs or self.get_key_sort_expressions(pklist), where, after is not None)
+        params = tuple(params or ()) + tuple(after or ()) + (limit,)
+        with self.conn.cursor(dictionary=True) as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+        return rows
+
+    def fetch_threads_running(self) -> int:
+        with self.conn.cursor() as cursor:
+            cursor.execute("SHOW GLOBAL STATUS LIKE 'Threads_running'")
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return int(row[1])
+
+    # Hash modulo sampling: keep the rows whose CRC32 of the primary key is below
+    # the threshold.  The server still scans the table but only the sample is sent,
+    # and the same keys are picked on every run.
+    def fetch_table_sample(self, tablename: str, pklist: List[Column], fraction: float,
+                           where: str = None, params: tuple = None) -> List[Dict]:
+        keycols = [ col.name for col in pklist ]
+        samplewhere = 'CRC32(CONCAT_WS(CHAR(31), ' + ', '.join(keycols) + ')) < %s'
+        if where is not None:
+            samplewhere = '(' + where + ') AND ' + samplewhere
+        params = tuple(params or ()) + (sample_threshold(fraction),)
+        return self.fetch_table_rows(tablename, samplewhere, None, params)
+
+    # the connection does not autocommit, so the statements form one transaction
+    def execute_statements(self, statements: List[str]):
+        try:
+            with self.conn.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    @profiled('catalog')
     def fetch_tables(self, dbname) -> List[Table]:
         dbname = dbname or self.name
         mysql_tables_query = """SELECT * FROM INFORMATION_SCHEMA.TABLES WHERE table_schema = %s"""
         with self.conn.cursor(dictionary=True) as cursor:
-            cursor.execute(mysql_tables_query, (dbname,))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, mysql_tables_query, (dbname,), 'information_schema.tables')
             tables = []
             for dbrow in dbrows:
                 table = MySQLTable(**dbrow)
                 self.add_table(table)
             return tables
 
+    @profiled('catalog')
     def fetch_columns(self, dbname) -> List[Column]:
         dbname = dbname or self.name
         mysql_columns_query = """SELECT 
                 TABLE_NAME, COLUMN_NAME, COLUMN_TYPE,
                 COLUMN_KEY, IS_NULLABLE, COLUMN_DEFAULT,
-                ORDINAL_POSITION
+                ORDINAL_POSITION, COLLATION_NAME
             FROM INFORMATION_SCHEMA.COLUMNS 
             WHERE table_schema = %s
             ORDER BY TABLE_NAME, ORDINAL_POSITION"""
         with self.conn.cursor(dictionary=True) as cursor:
-            cursor.execute(mysql_columns_query, (dbname,))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, mysql_columns_query, (dbname,), 'information_schema.columns')
             columns = []
             for dbrow in dbrows:
                 column = MySQLColumn(**dbrow)
                 columns.append(column)
             return columns
 
+    @profiled('catalog')
     def fetch_index_columns(self, dbname) -> List[Index]:
         dbname = dbname or self.name
         mysql_indexes_query = """SELECT 
@@ -158,10 +366,10 @@ class MySQLDatabase(Database):
             WHERE table_schema = %s
             ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX"""
         with self.conn.cursor(dictionary=True) as cursor:
-            cursor.execute(mysql_indexes_query, (dbname,))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, mysql_indexes_query, (dbname,), 'information_schema.statistics')
             return dbrows
 
+    @profiled('catalog')
     def fetch_constraints(self, dbname) -> List[Constraint]:
         dbname = dbname or self.name
         mysql_constraints_query = """SELECT 
@@ -170,12 +378,14 @@ class MySQLDatabase(Database):
             WHERE table_schema = %s
             ORDER BY TABLE_NAME, CONSTRAINT_NAME"""        
         with self.conn.cursor(dictionary=True) as cursor:
-            cursor.execute(mysql_constraints_query, (dbname,))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, mysql_constraints_query, (dbname,), 'information_schema.table_constraints')
             constraints = []
+            # (table, constraint name) -> constraint; names are only unique per table
+            constraintmap = dict()
             for dbrow in dbrows:
                 constraint = MySQLConstraint(**dbrow)
                 constraints.append(constraint)
+                constraintmap.setdefault((constraint.table, constraint.name), constraint)
 
             # fetch column data for constraints
             mysql_constraints_columns_query = """SELECT 
@@ -186,16 +396,11 @@ class MySQLDatabase(Database):
                 FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE 
                 WHERE table_schema = %s
                 ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION"""
-            cursor.execute(mysql_constraints_columns_query, (dbname,))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, mysql_constraints_columns_query, (dbname,), 'information_schema.key_column_usage')
             for dbrow in dbrows:
                 cname = dbrow['CONSTRAINT_NAME']
                 ctabname = dbrow['TABLE_NAME']
-                cmatch = None
-                for constraint in constraints:
-                    if constraint.table == ctabname and constraint.name == cname:
-                        cmatch = constraint
-                        break
+                cmatch = constraintmap.get((ctabname, cname))
                 if cmatch is None:
                     raise ValueError("Missing Constraint " + cname)
                 # add column data to constraint
@@ -215,6 +420,7 @@ class MySQLDatabase(Database):
                     cmatch.reference_columns.append(refcolumn)
         return constraints                
 
+    @profiled('catalog')
     def fetch_routines(self, dbname) -> List[dict]:
         dbname = dbname or self.name
         mysql_routines_query = """SELECT 
@@ -223,8 +429,7 @@ class MySQLDatabase(Database):
             WHERE ROUTINE_SCHEMA = %s
             ORDER BY ROUTINE_NAME"""        
         with self.conn.cursor(dictionary=True) as cursor:
-            cursor.execute(mysql_routines_query, (dbname,))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, mysql_routines_query, (dbname,), 'information_schema.routines')
             routines = []
             for dbrow in dbrows:
                 rname = dbrow['ROUTINE_NAME']
@@ -234,60 +439,66 @@ class MySQLDatabase(Database):
                 routines.append(routine)
             return routines
 
+    @profiled('import')
     def import_schema(self, dbname):
         self.reset(dbname)
         # import table list
-        dbtables = self.fetch_tables(self.name)
-        for dbtable in dbtables:
-            tablename = dbtable.name
-            self.tables[tablename] = dbtable
+        with span('import tables', 'import'):
+            dbtables = self.fetch_tables(self.name)
+            for dbtable in dbtables:
+                tablename = dbtable.name
+                self.tables[tablename] = dbtable
 
         # import columns
-        dbcolumns = self.fetch_columns(self.name)
-        for dbcolumn in dbcolumns:
-            tablename = dbcolumn.tableName
-            table = self.get_table(tablename)
-            if table == None:
-                raise ValueError(tablename)
-            table.columns.append(dbcolumn)
+        with span('import columns', 'import'):
+            dbcolumns = self.fetch_columns(self.name)
+            for dbcolumn in dbcolumns:
+                tablename = dbcolumn.tableName
+                table = self.get_table(tablename)
+                if table == None:
+                    raise ValueError(tablename)
+                table.add_column(dbcolumn)
 
         # import index columns
-        dbindexrows = self.fetch_index_columns(self.name)
-        for dbrow in dbindexrows:
-            tablename = dbrow['TABLE_NAME']
-            indexName = dbrow['INDEX_NAME']
-            nonUnique = dbrow['NON_UNIQUE']
-            colName = dbrow['COLUMN_NAME']
-            collation = dbrow['COLLATION']
-            subpart = dbrow['SUB_PART']
-            nullable = dbrow['NULLABLE']
-            position = dbrow['SEQ_IN_INDEX']
-
-            # find table
-            table = self.get_table(tablename)
-            if table == None:
-                raise ValueError(tablename)
-            # find or create index in table
-            index = table.get_index(indexName)
-            if index == None:
-                # create new index object
-                isUnique = nonUnique == 0
-                index = MySQLIndex(indexName, tablename, isUnique)
-                table.indexes.append(index)
-
-            # add column to index
-            # convert nullable to boolean
-            nullable = (nullable == 'YES')
-            index.add_column(colName, collation, nullable, subpart, position)
+        with span('import indexes', 'import'):
+            dbindexrows = self.fetch_index_columns(self.name)
+            for dbrow in dbindexrows:
+                tablename = dbrow['TABLE_NAME']
+                indexName = dbrow['INDEX_NAME']
+                nonUnique = dbrow['NON_UNIQUE']
+                colName = dbrow['COLUMN_NAME']
+                collation = dbrow['COLLATION']
+                subpart = dbrow['SUB_PART']
+                nullable = dbrow['NULLABLE']
+                position = dbrow['SEQ_IN_INDEX']
+
+                # find table
+                table = self.get_table(tablename)
+                if table == None:
+                    raise ValueError(tablename)
+                # find or create index in table
+                index = table.get_index(indexName)
+                if index == None:
+                    # create new index object
+                    isUnique = nonUnique == 0
+                    index = MySQLIndex(indexName, tablename, isUnique)
+                    table.add_index(index)
+
+                # add column to index
+                # convert nullable to boolean
+                nullable = (nullable == 'YES')
+                index.add_column(colName, collation, nullable, subpart, position)
 
         # import constraints
-        dbconstraints = self.fetch_constraints(self.name)
-        for dbconstraint in dbconstraints:
-            tablename = dbconstraint.table
-            basetable = self.get_table(tablename)
-            if basetable == None:
-                raise ValueError('constraint ' + dbconstraint.name + ' missing table ' + tablename)
-            basetable.constraints.append(dbconstraint)
+        with span('import constraints', 'import'):
+            dbconstraints = self.fetch_constraints(self.name)
+            for dbconstraint in dbconstraints:
+                tablename = dbconstraint.table
+                basetable = self.get_table(tablename)
+                if basetable == None:
+                    raise ValueError('constraint ' + dbconstraint.name + ' missing table ' + tablename)
+                self.add_constraint(basetable, dbconstraint)
 
         # import routines
-        self.routines = self.fetch_routines(self.name)
+        with span('import routines', 'import'):
+            self.routines = self.fetch_routines(self.name)
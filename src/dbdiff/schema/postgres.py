@@ -1,8 +1,27 @@
-from typing import List, Dict
-from . import Column, Constraint, Database, Index, Routine, SchemaAwareDatabase, Table
-from psycopg.conninfo import make_conninfo
-from psycopg.rows import dict_row
-import psycopg
+from typing import Iterator, List, Dict, Tuple
+from . import DEFAULT_BATCH_SIZE, Column, Constraint, Database, Index, Routine, SchemaAwareDatabase, Table, key_at_offset_query, key_chunk_query, select_query
+from ..tracing import fetch_all, profiled, span
+import itertools
+
+try:
+    import psycopg  # type: ignore
+    from psycopg.conninfo import make_conninfo  # type: ignore
+    from psycopg.rows import dict_row  # type: ignore
+except ModuleNotFoundError:  # pragma: no cover - optional dependency
+    psycopg = None
+
+# column types (udt names) that are compared using a collation
+POSTGRES_STRING_TYPES = ('varchar', 'bpchar', 'char', 'text', 'name', 'citext')
+POSTGRES_INTEGER_TYPES = ('int2', 'int4', 'int8')
+# value kinds of the column types (udt names) whose values are not plain strings or integers
+POSTGRES_VALUE_KINDS = {
+    'bool': 'bool', 'numeric': 'decimal', 'float4': 'float', 'float8': 'float',
+    'timestamp': 'datetime', 'timestamptz': 'datetimetz', 'date': 'date', 'time': 'time',
+    'bytea': 'bytes', 'json': 'json', 'jsonb': 'json', 'uuid': 'uuid',
+}
+
+# sequence used to generate unique names for server-side cursors
+_cursor_ids = itertools.count(1)
 
 
 class PostgresTable(Table):
@@ -50,6 +69,22 @@ class PostgresColumn(Column):
             self.nullable = True
         else:
             self.nullable = False
+        # None when the column uses the database default collation
+        self.collation = collation_name
+
+    def is_string_type(self) -> bool:
+        return self.get_base_type() in POSTGRES_STRING_TYPES
+
+    def is_integer_type(self) -> bool:
+        return self.get_base_type() in POSTGRES_INTEGER_TYPES
+
+    def get_value_kind(self) -> str:
+        basetype = self.get_base_type()
+        if basetype in POSTGRES_INTEGER_TYPES:
+            return 'integer'
+        if basetype in POSTGRES_STRING_TYPES:
+            return 'string'
+        return POSTGRES_VALUE_KINDS.get(basetype, 'other')
 
 
 class PostgresConstraint(Constraint):
@@ -128,6 +163,8 @@ class PostgresRoutine(Routine):
 class PostgresDatabase(SchemaAwareDatabase):
     def __init__(self, name:str, schemas: List[str] = None):
         super().__init__(name, schemas)
+        # collation of string columns without their own, read on first use
+        self.default_collation = None
 
     def connect(self, **kwargs):
         # groom kwargs from env file for psycopg
@@ -139,36 +176,219 @@ class PostgresDatabase(SchemaAwareDatabase):
         if 'schemalist' in kwargs:
             # caller needs to have saved this prior to calling connect
             del kwargs['schemalist']
+        if psycopg is None:  # pragma: no cover - optional dependency
+            raise ImportError("psycopg is required for database connections")
         conninfo = make_conninfo(**kwargs)
         self.conn = psycopg.connect(conninfo)
 
+    def close(self):
+        self.conn.close()
+
     def cursor(self):
         cur = self.conn.cursor(row_factory=dict_row)
         return cur
     
-    def fetch_table_rows(self, tablename: str, where: str = None, orderby: str = None) -> List[Dict]:
-        query = 'SELECT * FROM ' + tablename
-        if where is not None:
-            query = query + ' WHERE ' + where
-        if orderby is not None:
-            query = query + ' ORDER BY ' + orderby
+    def fetch_table_rows(self, tablename: str, where: str = None, orderby: str = None, params: tuple = None) -> List[Dict]:
+        query = select_query(tablename, where, orderby)
         rows = []
         with self.cursor() as cursor:
-            cursor.execute(query)
+            cursor.execute(query, params)
             for row in cursor:
                 rows.append(row)
         return rows
 
-    def fetch_table_rowcount(self, tablename: str, where: str = None) -> int:
-        query = 'SELECT COUNT(*) FROM ' + tablename
+    # the default tuple row factory, not self.cursor() which returns dict rows
+    def fetch_table_tuples(self, tablename: str, columns: List[str], where: str = None, orderby: str = None,
+                           params: tuple = None) -> List[tuple]:
+        query = select_query(tablename, where, orderby, columns)
+        with self.conn.cursor() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+        return rows
+
+    # use a named (server-side) cursor so the client only holds one batch of rows at a time
+    def fetch_table_rows_stream(self, tablename: str, where: str = None, orderby: str = None,
+                                batchsize: int = DEFAULT_BATCH_SIZE, params: tuple = None) -> Iterator[Dict]:
+        query = select_query(tablename, where, orderby)
+        cursorname = 'dbdiff_stream_' + str(next(_cursor_ids))
+        with self.conn.cursor(name=cursorname, row_factory=dict_row) as cursor:
+            cursor.itersize = batchsize
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batchsize)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+
+    def fetch_table_tuples_stream(self, tablename: str, columns: List[str], where: str = None, orderby: str = None,
+                                  batchsize: int = DEFAULT_BATCH_SIZE, params: tuple = None) -> Iterator[tuple]:
+        query = select_query(tablename, where, orderby, columns)
+        cursorname = 'dbdiff_stream_' + str(next(_cursor_ids))
+        with self.conn.cursor(name=cursorname) as cursor:
+            cursor.itersize = batchsize
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batchsize)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+
+    # string keys are sorted with the "C" collation (byte order), which matches
+    # python string ordering and mysql binary ordering for utf8 data
+    def get_key_sort_expressions(self, pklist: List[Column]) -> List[str]:
+        exprs = []
+        for col in pklist:
+            if col.is_string_type():
+                exprs.append(col.name + ' COLLATE "C"')
+            else:
+                exprs.append(col.name)
+        return exprs
+
+    # string keys order by their column collation, or the database default
+    def get_key_order(self, pklist: List[Column]) -> tuple:
+        order = [ 'postgres' ]
+        for col in pklist:
+            collation = None
+            if col.is_string_type():
+                collation = getattr(col, 'collation', None) or self.fetch_default_collation()
+            order.append(collation)
+        return tuple(order)
+
+    def fetch_default_collation(self) -> str:
+        if self.default_collation is None:
+            with self.cursor() as cursor:
+                cursor.execute('SELECT datcollate FROM pg_database WHERE datname = current_database()')
+                self.default_collation = cursor.fetchone()['datcollate']
+        return self.default_collation
+
+    def fetch_table_rowcount(self, tablename: str, where: str = None, params: tuple = None) -> int:
+        query = 'SELECT COUNT(*) AS rowcount FROM ' + tablename
         if where is not None:
             query = query + ' WHERE ' + where
         with self.cursor() as cursor:
-            cursor.execute(query)
+            cursor.execute(query, params)
             row = cursor.fetchone()
-            rowcount = row[0]
+            rowcount = row['rowcount']
         return rowcount
 
+    # SQL expression that renders a column value as text for hashing.
+    # Values whose text form depends on session settings are rendered explicitly.
+    def get_column_text_expression(self, col: Column) -> str:
+        basetype = col.get_base_type()
+        if basetype == 'timestamptz':
+            return "(" + col.name + " AT TIME ZONE 'UTC')::text"
+        if basetype == 'bytea':
+            return "encode(" + col.name + ", 'hex')"
+        return col.name + '::text'
+
+    # SQL expression for the md5 hex digest of a row.  Each value is length prefixed
+    # so adjacent values cannot run together, and NULL is encoded as 'N'.
+    def get_row_hash_expression(self, table: Table) -> str:
+        columns = sorted(table.columns, key=lambda col: col.position)
+        parts = []
+        for col in columns:
+            text = self.get_column_text_expression(col)
+            parts.append("COALESCE(length(" + text + ") || ':' || " + text + ", 'N')")
+        return 'md5(concat(' + ', '.join(parts) + '))'
+
+    def fetch_table_row_hashes(self, tablename: str, table: Table, where: str = None, orderby: str = None,
+                               batchsize: int = DEFAULT_BATCH_SIZE, params: tuple = None) -> Iterator[Tuple[tuple, bytes]]:
+        keycols = [ col.name for col in table.get_primary_key_columns() ]
+        columns = keycols + [ "decode(" + self.get_row_hash_expression(table) + ", 'hex')" ]
+        query = select_query(tablename, where, orderby, columns)
+        keylen = len(keycols)
+        cursorname = 'dbdiff_hash_' + str(next(_cursor_ids))
+        with self.conn.cursor(name=cursorname) as cursor:
+            cursor.itersize = batchsize
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batchsize)
+                if not rows:
+                    break
+                for row in rows:
+                    yield tuple(row[:keylen]), bytes(row[keylen])
+
+    # Postgres has no table checksum, use the row count and checksum of the
+    # whole table.  The aggregate keeps a running sum, so unlike hashing the
+    # concatenated row hashes its memory does not grow with the table.
+    def fetch_table_checksum(self, tablename: str, table: Table):
+        return self.fetch_range_checksum(tablename, table)
+
+    # the checksum is the sum of the first 60 bits of each row hash, which is
+    # independent of row order and fits in a positive bigint
+    def fetch_range_checksum(self, tablename: str, table: Table, where: str = None, params: tuple = None) -> Tuple[int, int]:
+        rowhash = self.get_row_hash_expression(table)
+        query = "SELECT COUNT(*) AS rowcount, SUM(('x' || substr(" + rowhash + ", 1, 15))::bit(60)::bigint) AS checksum FROM " + tablename
+        if where is not None:
+            query = query + ' WHERE ' + where
+        with self.cursor() as cursor:
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+        rowcount = row['rowcount']
+        checksum = int(row['checksum']) if row['checksum'] is not None else 0
+        return rowcount, checksum
+
+    def fetch_key_bounds(self, tablename: str, pkcol: Column, where: str = None, params: tuple = None) -> Tuple:
+        query = 'SELECT MIN(' + pkcol.name + ') AS minkey, MAX(' + pkcol.name + ') AS maxkey FROM ' + tablename
+        if where is not None:
+            query = query + ' WHERE ' + where
+        with self.cursor() as cursor:
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+        return row['minkey'], row['maxkey']
+
+    def fetch_key_at_offset(self, tablename: str, pklist: List[Column], offset: int, where: str = None, params: tuple = None,
+                            keyexprs: List[str] = None) -> Tuple:
+        keycols = [ col.name for col in pklist ]
+        query = key_at_offset_query(tablename, keycols, keyexprs or self.get_key_sort_expressions(pklist), where)
+        params = tuple(params or ()) + (offset,)
+        with self.cursor() as cursor:
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return tuple(row[colname] for colname in keycols)
+
+    def fetch_key_chunk(self, tablename: str, pklist: List[Column], after: tuple, limit: int,
+                        where: str = None, params: tuple = None, keyexprs: List[str] = None) -> List[Dict]:
+        query = key_chunk_query(tablename, keyexprs or self.get_key_sort_expressions(pklist), where, after is not None)
+        params = tuple(params or ()) + tuple(after or ()) + (limit,)
+        with self.cursor() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+        return rows
+
+    # reltuples is the planner's row estimate, updated by VACUUM and ANALYZE;
+    # it is -1 for a table that has never been analyzed
+    def fetch_row_estimate(self, tablename: str) -> int:
+        with self.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint AS estimate FROM pg_class WHERE oid = %s::regclass', (tablename,))
+            row = cursor.fetchone()
+        if row is None or row['estimate'] is None or row['estimate'] < 0:
+            return None
+        return row['estimate']
+
+    # BERNOULLI picks each row with the given probability.  SYSTEM would only read
+    # the sampled pages, but it samples whole pages, which clusters the sample.
+    def fetch_table_sample(self, tablename: str, pklist: List[Column], fraction: float,
+                           where: str = None, params: tuple = None) -> List[Dict]:
+        percent = repr(float(fraction) * 100.0)
+        return self.fetch_table_rows(tablename + ' TABLESAMPLE BERNOULLI (' + percent + ')', where, None, params)
+
+    # the connection does not autocommit, so the statements form one transaction
+    def execute_statements(self, statements: List[str]):
+        try:
+            with self.conn.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    @profiled('catalog')
     def fetch_tables(self, dbname: str, schema: str, table_type: str = 'BASE TABLE') -> List[Table]:
         dbname = dbname or self.name
         sql = """SELECT * FROM information_schema.tables
@@ -176,14 +396,14 @@ class PostgresDatabase(SchemaAwareDatabase):
                  AND table_schema = %s 
                  AND table_type = %s"""
         with self.cursor() as cursor:
-            cursor.execute(sql, (dbname, schema, table_type))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, sql, (dbname, schema, table_type), 'information_schema.tables')
             tables = []
             for dbrow in dbrows:
                 table = PostgresTable(**dbrow)
                 tables.append(table)
             return tables
 
+    @profiled('catalog')
     def fetch_columns(self, dbname: str, schema: str) -> List[Column]:
         dbname = dbname or self.name
         sql = """SELECT * FROM information_schema.columns
@@ -191,20 +411,19 @@ class PostgresDatabase(SchemaAwareDatabase):
                  AND table_schema = %s
                  ORDER BY table_name, ordinal_position""" 
         with self.cursor() as cursor:
-            cursor.execute(sql, (dbname, schema))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, sql, (dbname, schema), 'information_schema.columns')
             columns = []
             for dbrow in dbrows:
                 column = PostgresColumn(**dbrow)
                 columns.append(column)
             return columns
 
+    @profiled('catalog')
     def fetch_indexes(self, dbname: str, schema: str) -> List[Index]:
         dbname = dbname or self.name
         sql = """SELECT * FROM pg_indexes WHERE schemaname = %s"""
         with self.cursor() as cursor:
-            cursor.execute(sql, (schema,))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, sql, (schema,), 'pg_indexes')
         for dbrow in dbrows:
             index = PostgresIndex(**dbrow)
             index_table = index.tableName
@@ -213,6 +432,7 @@ class PostgresDatabase(SchemaAwareDatabase):
                 raise ValueError(f"table {index_table} not found for index {index.indexname}")
             table.add_index(index)
 
+    @profiled('catalog')
     def fetch_foreign_keys_pgcat(self, dbname: str, schema: str) -> int:
         sql = """SELECT c.conname as constraint_name,
                         cl.relname as table_name, clns.nspname as table_schema,
@@ -227,8 +447,7 @@ class PostgresDatabase(SchemaAwareDatabase):
                  WHERE ns.nspname = %s and c.contype ='f'"""
         fkcount = 0
         with self.cursor() as cursor:
-            cursor.execute(sql, (schema,))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, sql, (schema,), 'pg_constraint foreign keys')
             for dbrow in dbrows:
                 cname = dbrow['constraint_name']
                 tabname = dbrow['table_name']
@@ -266,10 +485,11 @@ class PostgresDatabase(SchemaAwareDatabase):
                         constraint.reference_columns = []
                     constraint.reference_columns.append(column.name)
                 # add constraint to table
-                basetable.constraints.append(constraint)
+                self.add_constraint(basetable, constraint)
                 fkcount += 1
         return fkcount
 
+    @profiled('catalog')
     def fetch_primary_keys_pgcat(self, dbname: str, schema: str) -> int:
         sql = """SELECT c.conname as constraint_name,
                         cl.relname as table_name, clns.nspname as table_schema,
@@ -281,8 +501,7 @@ class PostgresDatabase(SchemaAwareDatabase):
                  WHERE ns.nspname = %s and c.contype ='p'"""
         pkcount = 0
         with self.cursor() as cursor:
-            cursor.execute(sql, (schema,))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, sql, (schema,), 'pg_constraint primary keys')
             for dbrow in dbrows:
                 cname = dbrow['constraint_name']
                 tabname = dbrow['table_name']
@@ -305,10 +524,11 @@ class PostgresDatabase(SchemaAwareDatabase):
                     constraint.columns.append(column.name)
                     column.primaryKey = True
                 # add constraint to table
-                basetable.constraints.append(constraint)
+                self.add_constraint(basetable, constraint)
                 pkcount += 1
         return pkcount
 
+    @profiled('catalog')
     def fetch_unique_constraints_pgcat(self, dbname: str, schema: str):
         sql = """SELECT c.conname as constraint_name,
                         cl.relname as table_name, clns.nspname as table_schema,
@@ -320,8 +540,7 @@ class PostgresDatabase(SchemaAwareDatabase):
                  WHERE ns.nspname = %s and c.contype ='u'"""
         uqcount = 0
         with self.cursor() as cursor:
-            cursor.execute(sql, (schema,))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, sql, (schema,), 'pg_constraint unique')
             for dbrow in dbrows:
                 cname = dbrow['constraint_name']
                 tabname = dbrow['table_name']
@@ -343,10 +562,11 @@ class PostgresDatabase(SchemaAwareDatabase):
                         raise ValueError(f"column not found:{colindex} in table {tabname}")
                     constraint.columns.append(column.name)
                 # add constraint to table
-                basetable.constraints.append(constraint)
+                self.add_constraint(basetable, constraint)
                 uqcount += 1
         return uqcount
 
+    @profiled('catalog')
     def fetch_constraints_pgcat(self, dbname, schema) -> int:
         ccount = 0
         ccount += self.fetch_primary_keys_pgcat(dbname, schema)
@@ -354,6 +574,7 @@ class PostgresDatabase(SchemaAwareDatabase):
         ccount += self.fetch_foreign_keys_pgcat(dbname, schema)
         return ccount
                 
+    @profiled('catalog')
     def fetch_constraints_infoschema(self, dbname, schema) -> int:
         dbname = dbname or self.name
         dbschema = self.schemas[schema]
@@ -364,8 +585,7 @@ class PostgresDatabase(SchemaAwareDatabase):
                  AND constraint_schema = %s
                  ORDER BY constraint_name"""
         with self.cursor() as cursor:
-            cursor.execute(sql, (dbname, schema))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, sql, (dbname, schema), 'information_schema.table_constraints')
             for dbrow in dbrows:
                 constraint = PostgresConstraint(**dbrow)
                 # add constraint to table since constraint names are not unique
@@ -373,7 +593,7 @@ class PostgresDatabase(SchemaAwareDatabase):
                 pgtable = self.get_table(tabname, schema)
                 if pgtable == None:
                     raise ValueError(f"table not found:{tabname} schema:{schema}")
-                pgtable.constraints.append(constraint)
+                self.add_constraint(pgtable, constraint)
                 constr_count += 1
 
             # fetch data for constraint_table_usage
@@ -381,8 +601,7 @@ class PostgresDatabase(SchemaAwareDatabase):
                      WHERE table_catalog = %s
                      AND table_schema = %s
                      ORDER BY constraint_name"""
-            cursor.execute(sql, (dbname, schema))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, sql, (dbname, schema), 'information_schema.constraint_table_usage')
             for dbrow in dbrows:
                 cname = dbrow['constraint_name']
                 tabschema = dbrow['table_schema']
@@ -403,8 +622,7 @@ class PostgresDatabase(SchemaAwareDatabase):
                      WHERE constraint_catalog = %s
                      AND constraint_schema = %s
                      ORDER BY constraint_name"""
-            cursor.execute(sql, (dbname, schema))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, sql, (dbname, schema), 'information_schema.constraint_column_usage')
             for dbrow in dbrows:
                 tabschema = dbrow['table_schema']
                 tabname = dbrow['table_name']
@@ -428,8 +646,7 @@ class PostgresDatabase(SchemaAwareDatabase):
                      WHERE constraint_catalog = %s
                      AND constraint_schema = %s
                      ORDER BY constraint_name"""
-            cursor.execute(sql, (dbname, schema))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, sql, (dbname, schema), 'information_schema.check_constraints')
             for dbrow in dbrows:
                 cname = dbrow['constraint_name']
                 # check constraints records are not linked to tables
@@ -451,40 +668,46 @@ class PostgresDatabase(SchemaAwareDatabase):
 
         return constr_count
 
+    @profiled('catalog')
     def fetch_routines(self, dbname, schema) -> List[dict]:
         dbname = dbname or self.name
         sql = """SELECT * FROM information_schema.routines 
                  WHERE specific_catalog = %s
                  AND specific_schema = %s"""
         with self.cursor() as cursor:
-            cursor.execute(sql, (dbname, schema))
-            dbrows = cursor.fetchall()
+            dbrows = fetch_all(cursor, sql, (dbname, schema), 'information_schema.routines')
             routines = []
             for dbrow in dbrows:
                 routine = PostgresRoutine(**dbrow)
                 self.add_routine(routine)
             return routines
 
+    @profiled('import')
     def import_schema(self, dbname, schema: str):
         # import table list
-        dbtables = self.fetch_tables(self.name, schema)
-        for dbtable in dbtables:
-            self.add_table(dbtable)
+        with span('import tables', 'import', schema=schema):
+            dbtables = self.fetch_tables(self.name, schema)
+            for dbtable in dbtables:
+                self.add_table(dbtable)
 
         # import columns
-        dbcolumns = self.fetch_columns(self.name, schema)
-        for dbcolumn in dbcolumns:
-            tablename = dbcolumn.tableName
-            table = self.get_table(tablename, schema)
-            if table == None:
-                raise ValueError(tablename)
-            table.columns.append(dbcolumn)
+        with span('import columns', 'import', schema=schema):
+            dbcolumns = self.fetch_columns(self.name, schema)
+            for dbcolumn in dbcolumns:
+                tablename = dbcolumn.tableName
+                table = self.get_table(tablename, schema)
+                if table == None:
+                    raise ValueError(tablename)
+                table.add_column(dbcolumn)
 
         # import indexes
-        self.fetch_indexes(self.name, schema)
+        with span('import indexes', 'import', schema=schema):
+            self.fetch_indexes(self.name, schema)
         
         # import constraints, constraints are saved in the table objects
-        self.fetch_constraints_pgcat(self.name, schema)
+        with span('import constraints', 'import', schema=schema):
+            self.fetch_constraints_pgcat(self.name, schema)
 
         # import routines
-        self.routines = self.fetch_routines(self.name, schema)
+        with span('import routines', 'import', schema=schema):
+            self.routines = self.fetch_routines(self.name, schema)
@@ -0,0 +1,415 @@
+#
+# import sqlite schema
+#
+
+from contextlib import closing
+from typing import Dict, Iterator, List, Tuple
+from . import DEFAULT_BATCH_SIZE, DEFAULT_KEY_BATCH_SIZE, Column, Constraint, Database, Index, Table, key_at_offset_query, key_chunk_query, select_query
+from ..tracing import fetch_all, profiled, span
+import hashlib
+import re
+import sqlite3
+
+# the queries of the framework use the %s placeholders of the MySQL and Postgres drivers
+PLACEHOLDER = re.compile(r'%s')
+
+# convert a query with %s placeholders to sqlite ? placeholders
+def translate_query(query:str) -> str:
+    return PLACEHOLDER.sub('?', query)
+
+
+# Column types map to an affinity by substring, following the rules of
+# https://www.sqlite.org/datatype3.html#determination_of_column_affinity
+def get_type_affinity(coltype:str) -> str:
+    coltype = (coltype or '').upper()
+    if 'INT' in coltype:
+        return 'INTEGER'
+    if 'CHAR' in coltype or 'CLOB' in coltype or 'TEXT' in coltype:
+        return 'TEXT'
+    if 'BLOB' in coltype or coltype == '':
+        return 'BLOB'
+    if 'REAL' in coltype or 'FLOA' in coltype or 'DOUB' in coltype:
+        return 'REAL'
+    return 'NUMERIC'
+
+
+class SQLiteTable(Table):
+    def __init__(self, name=None, sql=None):
+        super().__init__(name)
+        self.sql = sql
+
+
+class SQLiteColumn(Column):
+    # accepts the fields of pragma_table_info, with the table name
+    def __init__(self, table_name=None, cid=None, name=None, type=None, notnull=None, dflt_value=None, pk=None):
+        super().__init__(name, type, tableName=table_name, nullable=not notnull, primaryKey=bool(pk),
+                         defaultValue=dflt_value, position=cid + 1 if cid is not None else None)
+        # position of the column in the primary key, 0 if it is not a key column
+        self.pkposition = pk or 0
+
+    def get_affinity(self) -> str:
+        return get_type_affinity(self.type)
+
+    def is_string_type(self) -> bool:
+        return self.get_affinity() == 'TEXT'
+
+    def is_integer_type(self) -> bool:
+        return self.get_affinity() == 'INTEGER'
+
+    def get_value_kind(self) -> str:
+        if self.get_base_type() in ('bool', 'boolean'):
+            return 'intbool'
+        return {'INTEGER': 'integer', 'TEXT': 'string', 'REAL': 'float', 'BLOB': 'bytes'}.get(self.get_affinity(), 'other')
+
+
+class SQLiteConstraint(Constraint):
+    def __init__(self, table_name, constraint_name, constraint_type):
+        super().__init__(name=constraint_name, type=constraint_type, table=table_name)
+
+    def is_primary_key(self):
+        return self.type == 'PRIMARY KEY'
+
+    def is_foreign_key(self):
+        return self.type == 'FOREIGN KEY'
+
+
+class SQLiteIndex(Index):
+    def __init__(self, name, tableName, unique=False, origin=None):
+        super().__init__(name, tableName)
+        self.unique = unique
+        # c: CREATE INDEX, u: UNIQUE constraint, pk: PRIMARY KEY constraint
+        self.origin = origin
+
+    def add_column(self, name, collation, nullable, subPart, position):
+        coldict = {'name':name, 'collation':collation, 'nullable':nullable, 'subpart':subPart, 'position':position}
+        self.columns.append(coldict)
+
+
+# md5 hex digest of a text value, registered as the md5() SQL function
+def md5_hex(text):
+    if text is None:
+        return None
+    if isinstance(text, str):
+        text = text.encode('utf-8')
+    return hashlib.md5(text).hexdigest()
+
+# Aggregate that sums the first 60 bits of md5 hex digests like the range
+# checksums of the server databases.  The sum does not fit a sqlite integer,
+# so it is returned as text.
+class Hash60Sum:
+    def __init__(self):
+        self.total = 0
+
+    def step(self, digest):
+        if digest is not None:
+            self.total += int(digest[:15], 16)
+
+    def finalize(self):
+        return str(self.total)
+
+
+def dict_row(cursor, row):
+    return { desc[0]: value for desc, value in zip(cursor.description, row) }
+
+
+# A SQLite database file.  The connection runs in autocommit mode, so reads
+# never hold a transaction open, and execute_statements wraps its statements
+# in an explicit transaction.  Queries built for the server databases are run
+# with their %s placeholders translated to ?.
+class SQLiteDatabase(Database):
+    def __init__(self, name):
+        super().__init__(name)
+        self.conn = None
+
+    # database is the path of the database file; the host and user keys of a
+    # credentials file do not apply and are ignored
+    def connect(self, database:str = None, **kwargs):
+        path = database or self.name
+        # the prefetch threads of the streaming engines read a cursor on another
+        # thread than the one that opened it, never at the same time
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.create_function('md5', 1, md5_hex, deterministic=True)
+        self.conn.create_aggregate('hash60_sum', 1, Hash60Sum)
+
+    def close(self):
+        self.conn.close()
+
+    def cursor(self, dictionary:bool = False):
+        cursor = self.conn.cursor()
+        if dictionary:
+            cursor.row_factory = dict_row
+        return cursor
+
+    def execute(self, cursor, query:str, params:tuple = None):
+        cursor.execute(translate_query(query), params or ())
+
+    def fetch_table_rows(self, tablename: str, where: str = None, orderby: str = None, params: tuple = None) -> List[Dict]:
+        with closing(self.cursor(dictionary=True)) as cursor:
+            self.execute(cursor, select_query(tablename, where, orderby), params)
+            return cursor.fetchall()
+
+    def fetch_table_tuples(self, tablename: str, columns: List[str], where: str = None, orderby: str = None,
+                           params: tuple = None) -> List[tuple]:
+        with closing(self.cursor()) as cursor:
+            self.execute(cursor, select_query(tablename, where, orderby, columns), params)
+            return cursor.fetchall()
+
+    def fetch_table_rows_stream(self, tablename: str, where: str = None, orderby: str = None,
+                                batchsize: int = DEFAULT_BATCH_SIZE, params: tuple = None) -> Iterator[Dict]:
+        with closing(self.cursor(dictionary=True)) as cursor:
+            self.execute(cursor, select_query(tablename, where, orderby), params)
+            while True:
+                rows = cursor.fetchmany(batchsize)
+                if not rows:
+                    break
+                yield from rows
+
+    def fetch_table_tuples_stream(self, tablename: str, columns: List[str], where: str = None, orderby: str = None,
+                                  batchsize: int = DEFAULT_BATCH_SIZE, params: tuple = None) -> Iterator[tuple]:
+        with closing(self.cursor()) as cursor:
+            self.execute(cursor, select_query(tablename, where, orderby, columns), params)
+            while True:
+                rows = cursor.fetchmany(batchsize)
+                if not rows:
+                    break
+                yield from rows
+
+    # strings sort by their binary value unless a column declares another
+    # collation, BINARY compares the utf8 bytes, which matches python ordering
+    def get_key_sort_expressions(self, pklist: List[Column]) -> List[str]:
+        exprs = []
+        for col in pklist:
+            if col.is_string_type():
+                exprs.append(col.name + ' COLLATE BINARY')
+            else:
+                exprs.append(col.name)
+        return exprs
+
+    def fetch_table_rowcount(self, tablename: str, where: str = None, params: tuple = None) -> int:
+        query = 'SELECT COUNT(*) FROM ' + tablename
+        if where is not None:
+            query = query + ' WHERE ' + where
+        with closing(self.cursor()) as cursor:
+            self.execute(cursor, query, params)
+            return cursor.fetchone()[0]
+
+    # SQL expression that renders a column value as text for hashing
+    def get_column_text_expression(self, col: Column) -> str:
+        if col.get_value_kind() == 'bytes':
+            return 'hex(' + col.name + ')'
+        return 'CAST(' + col.name + ' AS TEXT)'
+
+    # SQL expression for the md5 hex digest of a row.  Each value is length prefixed
+    # so adjacent values cannot run together, and NULL is encoded as 'N'.
+    def get_row_hash_expression(self, table: Table) -> str:
+        columns = sorted(table.columns, key=lambda col: col.position)
+        parts = []
+        for col in columns:
+            text = self.get_column_text_expression(col)
+            parts.append("COALESCE(length(" + text + ") || ':' || " + text + ", 'N')")
+        return 'md5(' + ' || '.join(parts) + ')'
+
+    def fetch_table_row_hashes(self, tablename: str, table: Table, where: str = None, orderby: str = None,
+                               batchsize: int = DEFAULT_BATCH_SIZE, params: tuple = None) -> Iterator[Tuple[tuple, bytes]]:
+        keycols = [ col.name for col in table.get_primary_key_columns() ]
+        query = select_query(tablename, where, orderby, keycols + [ self.get_row_hash_expression(table) ])
+        keylen = len(keycols)
+        with closing(self.cursor()) as cursor:
+            self.execute(cursor, query, params)
+            while True:
+                rows = cursor.fetchmany(batchsize)
+                if not rows:
+                    break
+                for row in rows:
+                    yield tuple(row[:keylen]), bytes.fromhex(row[keylen])
+
+    # the checksum is the sum of the first 60 bits of each row hash, which is
+    # independent of row order
+    def fetch_range_checksum(self, tablename: str, table: Table, where: str = None, params: tuple = None) -> Tuple[int, int]:
+        query = 'SELECT COUNT(*), hash60_sum(' + self.get_row_hash_expression(table) + ') FROM ' + tablename
+        if where is not None:
+            query = query + ' WHERE ' + where
+        with closing(self.cursor()) as cursor:
+            self.execute(cursor, query, params)
+            row = cursor.fetchone()
+        # an aggregate that saw no rows returns NULL
+        checksum = int(row[1]) if row[1] is not None else 0
+        return row[0], checksum
+
+    # SQLite has no table checksum, use the checksum of the whole table
+    def fetch_table_checksum(self, tablename: str, table: Table):
+        return self.fetch_range_checksum(tablename, table)
+
+    def fetch_key_bounds(self, tablename: str, pkcol: Column, where: str = None, params: tuple = None) -> Tuple:
+        query = 'SELECT MIN(' + pkcol.name + '), MAX(' + pkcol.name + ') FROM ' + tablename
+        if where is not None:
+            query = query + ' WHERE ' + where
+        with closing(self.cursor()) as cursor:
+            self.execute(cursor, query, params)
+            row = cursor.fetchone()
+        return row[0], row[1]
+
+    def fetch_key_at_offset(self, tablename: str, pklist: List[Column], offset: int, where: str = None, params: tuple = None,
+                            keyexprs: List[str] = None) -> Tuple:
+        keycols = [ col.name for col in pklist ]
+        query = key_at_offset_query(tablename, keycols, keyexprs or self.get_key_sort_expressions(pklist), where)
+        with closing(self.cursor()) as cursor:
+            self.execute(cursor, query, tuple(params or ()) + (offset,))
+            row = cursor.fetchone()
+        return tuple(row) if row is not None else None
+
+    def fetch_key_chunk(self, tablename: str, pklist: List[Column], after: tuple, limit: int,
+                        where: str = None, params: tuple = None, keyexprs: List[str] = None) -> List[Dict]:
+        query = key_chunk_query(tablename, keyexprs or self.get_key_sort_expressions(pklist), where, after is not None)
+        with closing(self.cursor(dictionary=True)) as cursor:
+            self.execute(cursor, query, tuple(params or ()) + tuple(after or ()) + (limit,))
+            return cursor.fetchall()
+
+    # composite keys are matched against a VALUES list, SQLite only compares a
+    # row value with IN against a subquery
+    def fetch_rows_by_keys(self, tablename: str, pklist: List[Column], keys: List[tuple],
+                           batchsize: int = DEFAULT_KEY_BATCH_SIZE) -> List[Dict]:
+        keycols = [ col.name for col in pklist ]
+        rowplaceholder = '(' + ', '.join([ '%s' ] * len(keycols)) + ')'
+        rows = []
+        for start in range(0, len(keys), batchsize):
+            batch = keys[start:start + batchsize]
+            if len(keycols) == 1:
+                where = keycols[0] + ' IN (' + ', '.join([ '%s' ] * len(batch)) + ')'
+            else:
+                where = '(' + ', '.join(keycols) + ') IN (VALUES ' + ', '.join([ rowplaceholder ] * len(batch)) + ')'
+            params = tuple(value for key in batch for value in key)
+            rows.extend(self.fetch_table_rows(tablename, where, None, params))
+        return rows
+
+    def execute_statements(self, statements: List[str]):
+        with closing(self.cursor()) as cursor:
+            cursor.execute('BEGIN')
+            try:
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+
+    @profiled('catalog')
+    def fetch_tables(self) -> List[Table]:
+        sql = """SELECT name, sql FROM sqlite_master
+                 WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+                 ORDER BY name"""
+        with closing(self.cursor(dictionary=True)) as cursor:
+            dbrows = fetch_all(cursor, sql, None, 'sqlite_master')
+        return [ SQLiteTable(**dbrow) for dbrow in dbrows ]
+
+    # the row counts gathered by ANALYZE, the first number of each stat
+    @profiled('catalog')
+    def fetch_row_counts(self) -> Dict[str, int]:
+        with closing(self.cursor()) as cursor:
+            if fetch_all(cursor, "SELECT name FROM sqlite_master WHERE name = 'sqlite_stat1'", None, 'sqlite_master') == []:
+                return dict()
+            dbrows = fetch_all(cursor, 'SELECT tbl, stat FROM sqlite_stat1', None, 'sqlite_stat1')
+        return { tablename: int(stat.split(' ')[0]) for tablename, stat in dbrows if stat }
+
+    @profiled('catalog')
+    def fetch_columns(self) -> List[Column]:
+        sql = """SELECT m.name AS table_name, p.*
+                 FROM sqlite_master m JOIN pragma_table_info(m.name) p
+                 WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+                 ORDER BY m.name, p.cid"""
+        with closing(self.cursor(dictionary=True)) as cursor:
+            dbrows = fetch_all(cursor, sql, None, 'pragma_table_info')
+        return [ SQLiteColumn(**dbrow) for dbrow in dbrows ]
+
+    @profiled('catalog')
+    def fetch_index_columns(self) -> List[dict]:
+        sql = """SELECT m.name AS table_name, il.name AS index_name, il."unique" AS is_unique,
+                        il.origin AS origin, ix.seqno AS seqno, ix.name AS column_name, ix.coll AS collation
+                 FROM sqlite_master m
+                 JOIN pragma_index_list(m.name) il
+                 JOIN pragma_index_xinfo(il.name) ix
+                 WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' AND ix.key = 1
+                 ORDER BY m.name, il.name, ix.seqno"""
+        with closing(self.cursor(dictionary=True)) as cursor:
+            return fetch_all(cursor, sql, None, 'pragma_index_list')
+
+    @profiled('catalog')
+    def fetch_foreign_keys(self) -> List[dict]:
+        sql = """SELECT m.name AS table_name, fk.id AS id, fk.seq AS seq, fk."table" AS ref_table,
+                        fk."from" AS column_name, fk."to" AS ref_column
+                 FROM sqlite_master m JOIN pragma_foreign_key_list(m.name) fk
+                 WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+                 ORDER BY m.name, fk.id, fk.seq"""
+        with closing(self.cursor(dictionary=True)) as cursor:
+            return fetch_all(cursor, sql, None, 'pragma_foreign_key_list')
+
+    # SQLite does not name primary keys and foreign keys: the primary key is
+    # PRIMARY (as in MySQL) and foreign keys are named after the table and
+    # their position in it, e.g. fk_orders_0.  UNIQUE constraints are named
+    # after the index that enforces them.
+    @profiled('import')
+    def import_schema(self, dbname=None):
+        self.reset(dbname or self.name)
+        # import table list
+        with span('import tables', 'import'):
+            rowcounts = self.fetch_row_counts()
+            for dbtable in self.fetch_tables():
+                dbtable.rows = rowcounts.get(dbtable.name)
+                self.add_table(dbtable)
+
+        # import columns and primary keys
+        with span('import columns', 'import'):
+            for dbcolumn in self.fetch_columns():
+                table = self.get_table(dbcolumn.tableName)
+                if table is None:
+                    raise ValueError(dbcolumn.tableName)
+                table.add_column(dbcolumn)
+            for table in self.tables.values():
+                pkcols = sorted((col for col in table.columns if col.primaryKey), key=lambda col: col.pkposition)
+                if len(pkcols) > 0:
+                    constraint = SQLiteConstraint(table.name, 'PRIMARY', 'PRIMARY KEY')
+                    constraint.columns = [ col.name for col in pkcols ]
+                    self.add_constraint(table, constraint)
+
+        # import index columns, and the unique constraints behind the automatic indexes
+        with span('import indexes', 'import'):
+            for dbrow in self.fetch_index_columns():
+                tablename = dbrow['table_name']
+                table = self.get_table(tablename)
+                if table is None:
+                    raise ValueError(tablename)
+                index = table.get_index(dbrow['index_name'])
+                if index is None:
+                    index = SQLiteIndex(dbrow['index_name'], tablename, dbrow['is_unique'] == 1, dbrow['origin'])
+                    table.add_index(index)
+                    if index.origin == 'u':
+                        self.add_constraint(table, SQLiteConstraint(tablename, index.name, 'UNIQUE'))
+                column = table.get_column(dbrow['column_name'])
+                nullable = column.nullable if column is not None else True
+                index.add_column(dbrow['column_name'], dbrow['collation'], nullable, None, dbrow['seqno'] + 1)
+                if index.origin == 'u':
+                    table.get_constraint(index.name).columns.append(dbrow['column_name'])
+
+        # import foreign keys, a reference without columns is to the primary key
+        with span('import constraints', 'import'):
+            for dbrow in self.fetch_foreign_keys():
+                tablename = dbrow['table_name']
+                table = self.get_table(tablename)
+                if table is None:
+                    raise ValueError(tablename)
+                cname = 'fk_' + tablename + '_' + str(dbrow['id'])
+                constraint = table.get_constraint(cname)
+                if constraint is None:
+                    constraint = SQLiteConstraint(tablename, cname, 'FOREIGN KEY')
+                    constraint.reference_table = dbrow['ref_table']
+                    constraint.reference_columns = []
+                    self.add_constraint(table, constraint)
+                constraint.columns.append(dbrow['column_name'])
+                refcolumn = dbrow['ref_column']
+                if refcolumn is None:
+                    reftable = self.get_table(dbrow['ref_table'])
+                    if reftable is None:
+                        raise ValueError('constraint ' + cname + ' missing table ' + dbrow['ref_table'])
+                    pkcols = sorted(reftable.get_primary_key_columns(), key=lambda col: col.pkposition)
+                    refcolumn = pkcols[dbrow['seq']].name
+                constraint.reference_columns.append(refcolumn)
@@ -0,0 +1,228 @@
+#
+# profiling spans of schema import, catalog queries and diff steps, written as
+# a Chrome trace file (chrome://tracing or https://ui.perfetto.dev)
+#
+
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# the active profiler, None while profiling is off
+_profiler = None
+
+
+# A timed section of the run.  args are shown with the span in the trace
+# viewer, and set() adds to them while the span is open (e.g. a row count).
+class Span:
+    def __init__(self, profiler:'Profiler', name:str, category:str, args:Dict):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+        self.startmemory = 0
+        self.peakmemory = 0
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.profiler.begin(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.profiler.end(self)
+        return False
+
+
+# stands in for every span while profiling is off
+class NullSpan:
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NULL_SPAN = NullSpan()
+
+
+# Collects the spans of all threads as complete ('X') trace events.  With
+# trace_memory, tracemalloc records the peak Python heap of each span; the
+# peak is reset at every span boundary and carried up to the enclosing span,
+# so the peaks of nested spans are exact on one thread and approximate when
+# spans run on several threads at once.
+class Profiler:
+    def __init__(self, trace_memory:bool = True, clock=time.perf_counter):
+        self.trace_memory = trace_memory
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.events: List[Dict] = []
+        self.threadnames: Dict[int, str] = dict()
+        self.pid = os.getpid()
+        self.start = clock()
+        self.started_tracemalloc = False
+
+    def get_stack(self) -> List[Span]:
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+            with self.lock:
+                self.threadnames[threading.get_ident()] = threading.current_thread().name
+        return stack
+
+    # fold the traced memory peak since the last span boundary into the
+    # innermost open span, and start a new peak
+    def mark_memory(self, stack:List[Span]) -> int:
+        current, peak = tracemalloc.get_traced_memory()
+        if len(stack) > 0:
+            stack[-1].peakmemory = max(stack[-1].peakmemory, peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        return current
+
+    def begin(self, span:Span):
+        stack = self.get_stack()
+        if self.trace_memory:
+            span.startmemory = span.peakmemory = self.mark_memory(stack)
+        stack.append(span)
+        span.start = self.clock()
+
+    def end(self, span:Span):
+        end = self.clock()
+        stack = self.get_stack()
+        args = span.args
+        if self.trace_memory:
+            endmemory = self.mark_memory(stack)
+            args['memory_peak_bytes'] = span.peakmemory
+            args['memory_delta_bytes'] = endmemory - span.startmemory
+        if span in stack:
+            stack.remove(span)
+        if self.trace_memory and len(stack) > 0:
+            stack[-1].peakmemory = max(stack[-1].peakmemory, span.peakmemory)
+        event = {'name': span.name, 'cat': span.category, 'ph': 'X',
+                 'ts': round((span.start - self.start) * 1e6, 3), 'dur': round((end - span.start) * 1e6, 3),
+                 'pid': self.pid, 'tid': threading.get_ident(), 'args': args}
+        with self.lock:
+            self.events.append(event)
+
+    def start_memory(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+
+    def stop_memory(self):
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    # returns the events in the Chrome trace event format, with a name for each thread
+    def get_trace(self) -> Dict:
+        with self.lock:
+            events = sorted(self.events, key=lambda event: event['ts'])
+            threadnames = dict(self.threadnames)
+        metadata = [ {'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                     for tid, name in threadnames.items() ]
+        return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
+
+    def write_trace(self, path:str):
+        with open(path, 'w') as file:
+            json.dump(self.get_trace(), file, default=str)
+
+    # returns {span name: (count, total seconds)}
+    def get_totals(self) -> Dict[str, tuple]:
+        totals = dict()
+        with self.lock:
+            for event in self.events:
+                count, seconds = totals.get(event['name'], (0, 0.0))
+                totals[event['name']] = (count + 1, seconds + event['dur'] / 1e6)
+        return totals
+
+
+def get_profiler() -> Profiler:
+    return _profiler
+
+def start_profiling(trace_memory:bool = True) -> Profiler:
+    global _profiler
+    profiler = Profiler(trace_memory)
+    profiler.start_memory()
+    _profiler = profiler
+    return profiler
+
+def stop_profiling() -> Profiler:
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    if profiler is not None:
+        profiler.stop_memory()
+    return profiler
+
+# Profile the with block when path is set and write the trace to path.
+@contextmanager
+def profiling(path:str, trace_memory:bool = True):
+    if path is None:
+        yield None
+        return
+    profiler = start_profiling(trace_memory)
+    try:
+        yield profiler
+    finally:
+        stop_profiling()
+        profiler.write_trace(path)
+
+
+# a span of the active profiler; while profiling is off this is one global
+# lookup and returns the shared NULL_SPAN
+def span(name:str, category:str = 'diff', **args):
+    profiler = _profiler
+    if profiler is None:
+        return NULL_SPAN
+    return Span(profiler, name, category, args)
+
+# decorator that runs every call of a function or method in a span named after it
+def profiled(category:str) -> Callable:
+    def decorator(func:Callable) -> Callable:
+        name = func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _profiler
+            if profiler is None:
+                return func(*args, **kwargs)
+            with Span(profiler, name, category, dict()):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# some drivers reject None for a query without parameters
+def execute(cursor, sql:str, params:tuple = None):
+    if params is None:
+        cursor.execute(sql)
+    else:
+        cursor.execute(sql, params)
+
+# Execute a catalog query and fetch all its rows.  When profiling, the query
+# is a span with its SQL text, parameters and row count.
+def fetch_all(cursor, sql:str, params:tuple = None, name:str = 'query') -> List:
+    profiler = _profiler
+    if profiler is None:
+        execute(cursor, sql, params)
+        return cursor.fetchall()
+    args = {'sql': ' '.join(sql.split())}
+    if params is not None:
+        args['params'] = [ str(param) for param in params ]
+    with Span(profiler, name, 'query', args) as query:
+        execute(cursor, sql, params)
+        rows = cursor.fetchall()
+        query.set(rows=len(rows))
+    return rows
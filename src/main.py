@@ -2,6 +2,8 @@ from dbdiff.schema import Database
 from dbdiff.schema.mysql import MySQLDatabase
 from dbdiff.schema.compare import SchemaCompare, TopoSort
 from dbdiff.schema.postgres import PostgresDatabase
+from dbdiff.schema.sqlite import SQLiteDatabase
+from dbdiff.tracing import profiling, span
 from util.database_credentials import read_credentials_file
 from typing import List
 import click
@@ -34,6 +36,12 @@ def read_database_from_env(envfile) -> Database:
         for schema in schemas:
             db.import_schema(dbname, schema)
         return db
+    elif dbtype == 'sqlite':
+        # database is the path of the database file
+        db = SQLiteDatabase(dbname)
+        db.connect(**dbenv)
+        db.import_schema(dbname)
+        return db
     else:
         raise Exception('Unknown Database Type ' + dbtype)
 
@@ -43,62 +51,8 @@ def diff_schema(db1:Database, db2:Database, canonicalize=None):
     tabsboth, tabsonly1, tabsonly2 = cmp.diff_table_list()
 
     for table1,table2 in tabsboth:
-        print('TABLE: ' + table1 + ' ==? ' + table2)
-        tbl1 = cmp.db1.get_table(table1)
-        tbl2 = cmp.db2.get_table(table2)
-        tsame, tdiff, tonly1, tonly2 = tbl1.diff_columns(tbl2, canonicalize=canonicalize)
-        if len(tsame) >= 0 and len(tdiff) == 0 and len(tonly1) == 0 and len(tonly2) == 0:
-            print("\tALL COLUMNS MATCH!")
-        else:
-            print("\tSame Columns:" + str(len(tsame)))
-            if len(tdiff) > 0:
-                cnames = [ c.name for c in tdiff ]
-                print("\tDiff Columns:" + str(cnames))
-            if len(tonly1) > 0:
-                cnames = [ c.name for c in tonly1 ]
-                print("\tOnly in DB1 Columns:" + str(cnames))
-            if len(tonly2) > 0:
-                cnames = [ c.name for c in tonly2 ]
-                print("\tOnly in DB2 Columns:" + str(cnames))
-        # diff auto_increment
-        tbl1_ai = tbl1.auto_increment
-        tbl2_ai = tbl2.auto_increment
-        if tbl1_ai != tbl2_ai:
-            print("\tAUTOINCREMENT: db1:" + str(tbl1_ai) + " <> db2:" + str(tbl2_ai))
-        # diff constraints
-        csame, cdiff, conly1, conly2 = tbl1.diff_constraints(tbl2, canonicalize=canonicalize)
-        if len(csame) >= 0 and len(cdiff) == 0 and len(conly1) == 0 and len(conly2) == 0:
-            print("\tALL CONSTRAINTS MATCH!")
-        else:
-            if len(csame) > 0:
-                cnames = [ c.name for c in csame ]
-                print("\tSame Constraints:" + str(cnames))
-            if len(cdiff) > 0:
-                cnames = [ c.name for c in cdiff ]
-                print("\tDiff Constraints: " + str(cnames))
-            if len(conly1) > 0:
-                cnames = [ c.name for c in conly1 ]
-                print("\tOnly in DB1 Constraints:" + str(cnames))
-            if len(conly2) > 0:
-                cnames = [ c.name for c in conly2 ]
-                print("\tOnly in DB2 Constraints:" + str(cnames))
-        # diff indexes
-        isame, idiff, ionly1, ionly2 = tbl1.diff_indexes(tbl2, canonicalize=canonicalize)
-        if len(isame) >= 0 and len(idiff) == 0 and len(ionly1) == 0 and len(ionly2) == 0:
-            print("\tALL INDEXES MATCH!")
-        else:
-            if len(isame) > 0:
-                inames = [ ix.name for ix in isame ]
-                print("\tSame Indexes:" + str(inames))
-            if len(idiff) > 0:
-                inames = [ ix.name for ix in idiff ]
-                print("\tDiff Indexes: " + str(inames))
-            if len(ionly1) > 0:
-                inames = [ ix.name for ix in ionly1 ]
-                print("\tOnly in DB1 Indexes:" + str(inames))
-            if len(ionly2) > 0:
-                inames = [ ix.name for ix in ionly2 ]
-                print("\tOnly in DB2 Indexes:" + str(inames))
+        with span('diff table', 'compare', table1=table1, table2=table2):
+            diff_schema_table(cmp, table1, table2, canonicalize)
 
     if len(tabsonly1) > 0:
         print("\nTABLES ONLY IN DB1")
@@ -109,6 +63,65 @@ def diff_schema(db1:Database, db2:Database, canonicalize=None):
         for canontable,origtable in tabsonly2:
             print("\t" + origtable)
 
+# print the column, constraint and index differences of a table in both databases
+def diff_schema_table(cmp:SchemaCompare, table1:str, table2:str, canonicalize=None):
+    print('TABLE: ' + table1 + ' ==? ' + table2)
+    tbl1 = cmp.db1.get_table(table1)
+    tbl2 = cmp.db2.get_table(table2)
+    tsame, tdiff, tonly1, tonly2 = tbl1.diff_columns(tbl2, canonicalize=canonicalize)
+    if len(tsame) >= 0 and len(tdiff) == 0 and len(tonly1) == 0 and len(tonly2) == 0:
+        print("\tALL COLUMNS MATCH!")
+    else:
+        print("\tSame Columns:" + str(len(tsame)))
+        if len(tdiff) > 0:
+            cnames = [ c.name for c in tdiff ]
+            print("\tDiff Columns:" + str(cnames))
+        if len(tonly1) > 0:
+            cnames = [ c.name for c in tonly1 ]
+            print("\tOnly in DB1 Columns:" + str(cnames))
+        if len(tonly2) > 0:
+            cnames = [ c.name for c in tonly2 ]
+            print("\tOnly in DB2 Columns:" + str(cnames))
+    # diff auto_increment
+    tbl1_ai = tbl1.auto_increment
+    tbl2_ai = tbl2.auto_increment
+    if tbl1_ai != tbl2_ai:
+        print("\tAUTOINCREMENT: db1:" + str(tbl1_ai) + " <> db2:" + str(tbl2_ai))
+    # diff constraints
+    csame, cdiff, conly1, conly2 = tbl1.diff_constraints(tbl2, canonicalize=canonicalize)
+    if len(csame) >= 0 and len(cdiff) == 0 and len(conly1) == 0 and len(conly2) == 0:
+        print("\tALL CONSTRAINTS MATCH!")
+    else:
+        if len(csame) > 0:
+            cnames = [ c.name for c in csame ]
+            print("\tSame Constraints:" + str(cnames))
+        if len(cdiff) > 0:
+            cnames = [ c.name for c in cdiff ]
+            print("\tDiff Constraints: " + str(cnames))
+        if len(conly1) > 0:
+            cnames = [ c.name for c in conly1 ]
+            print("\tOnly in DB1 Constraints:" + str(cnames))
+        if len(conly2) > 0:
+            cnames = [ c.name for c in conly2 ]
+            print("\tOnly in DB2 Constraints:" + str(cnames))
+    # diff indexes
+    isame, idiff, ionly1, ionly2 = tbl1.diff_indexes(tbl2, canonicalize=canonicalize)
+    if len(isame) >= 0 and len(idiff) == 0 and len(ionly1) == 0 and len(ionly2) == 0:
+        print("\tALL INDEXES MATCH!")
+    else:
+        if len(isame) > 0:
+            inames = [ ix.name for ix in isame ]
+            print("\tSame Indexes:" + str(inames))
+        if len(idiff) > 0:
+            inames = [ ix.name for ix in idiff ]
+            print("\tDiff Indexes: " + str(inames))
+        if len(ionly1) > 0:
+            inames = [ ix.name for ix in ionly1 ]
+            print("\tOnly in DB1 Indexes:" + str(inames))
+        if len(ionly2) > 0:
+            inames = [ ix.name for ix in ionly2 ]
+            print("\tOnly in DB2 Indexes:" + str(inames))
+
 def diff_procs(db1:Database, db2:Database):
     cmp = SchemaCompare(db1, db2)
     both, only1, only2 = cmp.diff_procedure_list()
@@ -176,15 +189,22 @@ def schemadiff():
 @click.argument('db2')
 @click.option('--uppercase', '--upper', default=False)
 @click.option('--lowercase', '--lower', default=False)
-def diffschema(db1, db2, uppercase, lowercase):
+@click.option('--profile', 'profile', default=None, metavar='FILE',
+              help='write a Chrome trace (chrome://tracing, ui.perfetto.dev) of the catalog queries, '
+                   'schema import phases and compare steps to FILE')
+def diffschema(db1, db2, uppercase, lowercase, profile):
     canonicalize = None
     if uppercase:
         canonicalize = str_upper
     elif lowercase:
         canonicalize = str_lower
-    dbobj1 = read_database_from_env(db1)
-    dbobj2 = read_database_from_env(db2)
-    diff_schema(dbobj1, dbobj2, canonicalize)
+    with profiling(profile):
+        with span('import schema', 'import', database=db1):
+            dbobj1 = read_database_from_env(db1)
+        with span('import schema', 'import', database=db2):
+            dbobj2 = read_database_from_env(db2)
+        with span('diff schema', 'compare'):
+            diff_schema(dbobj1, dbobj2, canonicalize)
 
 @schemadiff.command()
 @click.argument('db1')
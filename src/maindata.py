@@ -1,25 +1,177 @@
 from dbdiff.schema.mysql import MySQLDatabase
-from dbdiff.schema import Database
+from dbdiff.schema.postgres import PostgresDatabase
+from dbdiff.schema.sqlite import SQLiteDatabase
+from dbdiff.schema import DEFAULT_BATCH_SIZE, Database
+from dbdiff.tracing import profiling, span
 from datacompare.tablediff import TableDiff
+from datacompare.checksumdiff import ChecksumDiff, DEFAULT_FANOUT, DEFAULT_LEAF_SIZE
 from datacompare.dbscan import DatabaseScan
+from datacompare.precheck import precheck_tables
+from datacompare.progress import DiffProgress, InstrumentedDatabase, get_row_estimate
+from datacompare.repair import DEFAULT_REPAIR_BATCH_ROWS, DEFAULT_TRANSACTION_ROWS, RepairSink
+from datacompare.resultsink import ResultSink, make_result_sink
+from datacompare.sampling import DEFAULT_SAMPLE_FRACTION, SampleDiff, parse_sample_fraction
+from datacompare.snapshot import TableSnapshot, diff_snapshot_table, diff_snapshots, is_snapshot_file, write_snapshot
+from datacompare.spilldiff import SpillDiff, parse_memory_size
+from datacompare.throttle import ThrottledDatabase, make_throttles
+from datacompare.checkpoint import CheckpointJournal, TableCheckpoint, add_counts
+from datacompare.diffstate import DiffState, IncrementalTable
+from datacompare.parallel import ConnectionLimiter, DatabaseConnector, get_table_size, run_tasks
 from util.database_credentials import read_credentials_file
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 import click
+import os
+import time
 
 def read_database_from_env(envfile) -> Database:
     dbenv = read_credentials_file(envfile)
     dbname = dbenv['database']
-    db = MySQLDatabase(dbname)
-    db.connect(**dbenv)
-    db.import_schema(dbname)
-    return db
+    if 'type' not in dbenv:
+        dbtype = 'mysql'
+    else:
+        dbtype = dbenv['type']
+        # remove 'type' key from dbenv
+        del dbenv['type']
+
+    if dbtype == 'mysql':
+        db = MySQLDatabase(dbname)
+        db.connect(**dbenv)
+        db.import_schema(dbname)
+        return db
+    elif dbtype == 'postgres':
+        db = PostgresDatabase(dbname)
+        schemalist = dbenv['schemalist']
+        db.connect(**dbenv)
+
+        schemas = schemalist.split(',')
+        for schema in schemas:
+            db.import_schema(dbname, schema)
+        # unqualified table names, as matched against a MySQL database, are in the first schema
+        db.default_schema = schemas[0]
+        return db
+    elif dbtype == 'sqlite':
+        # database is the path of the database file
+        db = SQLiteDatabase(dbname)
+        db.connect(**dbenv)
+        db.import_schema(dbname)
+        return db
+    else:
+        raise Exception('Unknown Database Type ' + dbtype)
+
+def print_table_result(tablename1:str, tablename2:str, samecount:int, diffcount:int, only1count:int, only2count:int):
+    if diffcount == 0 and only1count == 0 and only2count == 0:
+        print("TABLE: " + tablename1 + " / " + tablename2 + " " + str(samecount) + " ROWS MATCH!")
+    else:
+        print("\nTABLE: " + tablename1 + " / " + tablename2)
+        print("\tSAME COUNT: " + str(samecount))
+        if diffcount > 0:
+            print("\tDIFFS COUNT: " + str(diffcount))
+        if only1count > 0:
+            print("\tOnly in DB1 COUNT: " + str(only1count))
+        if only2count > 0:
+            print("\tOnly in DB2 COUNT: " + str(only2count))
+        print("\n")
+
+# data diff engines selectable with --mode
+DIFF_MODES = ['rows', 'stream', 'checksum', 'partition', 'fingerprint', 'spill', 'serverhash', 'sample']
 
-def maindata(db1:Database, db2:Database, tablelist:Tuple[str], canonicalize=None):
-    tablediff = TableDiff(db1, db2, canonicalize=canonicalize)    
+# default values for the engine options passed to make_table_diff and diff_table
+DEFAULT_OPTIONS = {
+    'batchsize': DEFAULT_BATCH_SIZE,
+    'leafsize': DEFAULT_LEAF_SIZE,
+    'fanout': DEFAULT_FANOUT,
+    'partitions': 8,
+    'jobs': 1,
+    'max_memory': None,
+    'spilldir': None,
+    'incremental': None,
+    'state': None,
+    'checkpoint': None,
+    'resume': False,
+    'sample': DEFAULT_SAMPLE_FRACTION,
+    'precheck': False,
+    'results': 'count',
+    'chunk_size': None,
+    'target_latency': None,
+    'max_rows_per_second': None,
+    'max_threads_running': None,
+    'progress': False,
+    'metrics': None,
+}
+
+def make_table_diff(db1:Database, db2:Database, mode:str, canonicalize=None, options:dict = None,
+                    sink:ResultSink = None, progress:DiffProgress = None) -> TableDiff:
+    options = dict(DEFAULT_OPTIONS, **(options or {}))
+    if mode == 'checksum':
+        tablediff = ChecksumDiff(db1, db2, canonicalize=canonicalize,
+                                 leafsize=options['leafsize'], fanout=options['fanout'], sink=sink)
+    elif mode == 'spill':
+        tablediff = SpillDiff(db1, db2, canonicalize=canonicalize,
+                              max_memory=options['max_memory'], tempdir=options['spilldir'], sink=sink)
+    elif mode == 'sample':
+        tablediff = SampleDiff(db1, db2, canonicalize=canonicalize, fraction=options['sample'], sink=sink)
+    else:
+        tablediff = TableDiff(db1, db2, canonicalize=canonicalize, sink=sink)
+    tablediff.progress = progress
+    return tablediff
+
+# diff one table with the selected engine
+# the partition engine opens its own connections through connectors
+# where restricts the diff to a subset of the rows of both tables
+# the stream and partition engines checkpoint key ranges through checkpoint, and
+# the counts of ranges finished by an earlier run are added to the result
+# the rows that differ go to the result sink of tablediff, if it has one
+# returns same count, diff count, only1 count, only2 count
+def diff_table(tablediff:TableDiff, tablename1:str, tablename2:str, mode:str = 'rows',
+               options:dict = None, connectors:Tuple[DatabaseConnector, DatabaseConnector] = None,
+               limiter:ConnectionLimiter = None, where:str = None,
+               checkpoint:TableCheckpoint = None) -> Tuple[int, int, int, int]:
+    with span('diff table', 'diff', table1=tablename1, table2=tablename2, mode=mode) as tablespan:
+        options = dict(DEFAULT_OPTIONS, **(options or {}))
+        if mode == 'partition':
+            if connectors is None:
+                raise ValueError('partition mode requires database connectors')
+            samecount, diffs, only1, only2 = tablediff.diff_rows_partitioned(tablename1, tablename2, options['partitions'],
+                                                                             connectors[0], connectors[1], where=where,
+                                                                             jobs=options['jobs'], limiter=limiter,
+                                                                             checkpoint=checkpoint)
+        elif mode == 'stream':
+            samecount, diffs, only1, only2 = tablediff.diff_rows_stream(tablename1, tablename2, where,
+                                                                        batchsize=options['batchsize'],
+                                                                        checkpoint=checkpoint)
+        elif mode == 'checksum':
+            samecount, diffs, only1, only2 = tablediff.diff_rows_checksum(tablename1, tablename2, where)
+        elif mode == 'fingerprint':
+            samecount, diffs, only1, only2 = tablediff.diff_rows_fingerprint(tablename1, tablename2, where,
+                                                                             batchsize=options['batchsize'])
+        elif mode == 'spill':
+            samecount, diffs, only1, only2 = tablediff.diff_rows_spill(tablename1, tablename2, where,
+                                                                       batchsize=options['batchsize'])
+        elif mode == 'serverhash':
+            samecount, diffs, only1, only2 = tablediff.diff_rows_serverhash(tablename1, tablename2, where,
+                                                                            batchsize=options['batchsize'])
+        elif mode == 'sample':
+            samecount, diffs, only1, only2 = tablediff.diff_rows_sample(tablename1, tablename2, where)
+        else:
+            sames, diffs, only1, only2 = tablediff.diff_rows(tablename1, tablename2, where)
+            samecount = len(sames)
+        if tablediff.sink is not None:
+            # engines that hold their results in memory hand them to the sink at the end
+            keycolnames = [ col.name for col in tablediff.db1.get_table(tablename1).get_primary_key_columns() ]
+            tablediff.sink.add_results(tablename1, tablename2, keycolnames, diffs, only1, only2)
+        counts = (samecount, len(diffs), len(only1), len(only2))
+        if checkpoint is not None:
+            counts = add_counts(checkpoint.get_prior_counts(), counts)
+        tablespan.set(same=counts[0], diffs=counts[1], only1=counts[2], only2=counts[3])
+    return counts
+
+# match the requested tables against the tables of each database
+# returns list of (tablename1, tablename2) in both, tables only in db1, tables only in db2
+def match_tables(db1:Database, db2:Database, tablelist:Tuple[str], canonicalize=None):
     table_list = None
     if len(tablelist) == 0:
         # diff all tables
-        table_list = tablediff.db1.get_table_list(canonicalize=canonicalize)
+        table_list = db1.get_table_list(canonicalize=canonicalize)
     else:
         table_list = list(tablelist)
 
@@ -33,10 +185,10 @@ def maindata(db1:Database, db2:Database, tablelist:Tuple[str], canonicalize=None
         db1_list = [ (canonicalize(table),table) for table in db1_list ]
         db2_list = [ (canonicalize(table),table) for table in db2_list ]
 
+    tables_both = []
     tables_only1 = []
     tables_only2 = []
     for tablename in table_list:
-        print("CHECK TABLE " + tablename)
         # check that table exists in both databases
         db1_match = None
         db2_match = None
@@ -49,29 +201,178 @@ def maindata(db1:Database, db2:Database, tablelist:Tuple[str], canonicalize=None
                 db2_match = tabtuple
                 break
         if db1_match is not None and db2_match is None:
-            tables_only1.append(db1_match)
+            tables_only1.append(db1_match[1])
+            continue
+        elif db2_match is not None and db1_match is None:
+            tables_only2.append(db2_match[1])
             continue
-        elif  db2_match is not None and db1_match is None:
-            tables_only2.append(db2_match)
+        elif db1_match is None and db2_match is None:
+            print("TABLE NOT FOUND " + tablename)
             continue
+        tables_both.append((db1_match[1], db2_match[1]))
+    return tables_both, tables_only1, tables_only2
+
+# Diff tables on a pool of worker threads.  Each table gets its own pair of
+# connections opened through the connectors, and the limiter caps the number of
+# connections open against each host.  wheres and checkpoints optionally map a
+# table pair to a where clause and a checkpoint, and the differences go to the
+# shared sink.  Results are yielded in tables order.
+def diff_tables_parallel(connector1:DatabaseConnector, connector2:DatabaseConnector, tables:List[Tuple[str, str]],
+                         mode:str, canonicalize=None, options:dict = None, jobs:int = 1, maxperhost:int = None,
+                         wheres:Dict[Tuple[str, str], str] = None,
+                         checkpoints:Dict[Tuple[str, str], TableCheckpoint] = None, sink:ResultSink = None,
+                         progress:DiffProgress = None):
+    limiter = ConnectionLimiter(maxperhost)
+    hosts = [ connector1.host, connector2.host ]
+
+    def worker(tablepair):
+        tablename1, tablename2 = tablepair
+        with limiter.connections(hosts):
+            db1 = connector1.connect()
+            try:
+                db2 = connector2.connect()
+                try:
+                    tablediff = make_table_diff(db1, db2, mode, canonicalize, options, sink, progress)
+                    where = wheres.get(tablepair) if wheres is not None else None
+                    checkpoint = checkpoints.get(tablepair) if checkpoints is not None else None
+                    return diff_table(tablediff, tablename1, tablename2, mode, options, where=where,
+                                      checkpoint=checkpoint)
+                finally:
+                    db2.close()
+            finally:
+                db1.close()
+
+    # schedule largest tables first
+    sizefunc = lambda tablepair: get_table_size(connector1.schemadb.get_table(tablepair[0]))
+    for tablepair, counts in zip(tables, run_tasks(tables, worker, jobs, sizefunc)):
+        yield tablepair, counts
+
+# Wrap both databases, and the connections the connectors open from now on,
+# with wrap(db, side), where side is 0 for DB1 and 1 for DB2.
+# returns the wrapped db1, db2
+def wrap_databases(db1:Database, db2:Database, connectors:Tuple[DatabaseConnector, DatabaseConnector], wrap):
+    if connectors is not None:
+        for side, connector in enumerate(connectors):
+            connector.add_wrapper(lambda db, side=side: wrap(db, side))
+    return wrap(db1, 0), wrap(db2, 1)
+
+def maindata(db1:Database, db2:Database, tablelist:Tuple[str], canonicalize=None,
+             mode='rows', options:dict = None, connectors:Tuple[DatabaseConnector, DatabaseConnector] = None,
+             jobs:int = 1, maxperhost:int = None):
+    # with throttle options rows are read in adaptive primary key chunks, paced per server
+    throttles = make_throttles(options)
+    if throttles is not None:
+        db1, db2 = wrap_databases(db1, db2, connectors, lambda db, side: ThrottledDatabase(db, throttles[side]))
+
+    tables_both, tables_only1, tables_only2 = match_tables(db1, db2, tablelist, canonicalize)
+
+    # with a checkpoint journal, tables finished by an earlier run are reported
+    # from the journal and partially diffed tables continue where they stopped
+    journal = None
+    checkpoints = dict()
+    if options is not None and options.get('checkpoint') is not None:
+        journal = CheckpointJournal(options['checkpoint'], resume=options.get('resume', False))
+        tables_todo = []
+        for tablename1, tablename2 in tables_both:
+            counts = journal.get_table_result(tablename1, tablename2)
+            if counts is not None:
+                print("CHECK TABLE " + tablename1 + " (finished by an earlier run)")
+                print_table_result(tablename1, tablename2, *counts)
+                continue
+            tables_todo.append((tablename1, tablename2))
+            checkpoints[(tablename1, tablename2)] = journal.get_table_checkpoint(tablename1, tablename2, mode)
+        tables_both = tables_todo
+
+    # incremental diffs only look at rows changed since the last verified watermark
+    state = None
+    incrementals = dict()
+    wheres = dict()
+    if options is not None and options.get('incremental') is not None:
+        state = DiffState(options['state'])
+        for tablepair in tables_both:
+            incremental = IncrementalTable(state, options['incremental'], tablepair[0], tablepair[1])
+            wheres[tablepair] = incremental.plan(db1, db2)
+            incrementals[tablepair] = incremental
+
+    # row level differences stream to the result sink, by default it only counts them.
+    # A resumed run appends to the results of the earlier run, which hold the rows
+    # of the tables and ranges the journal reports as finished.
+    sink = options.get('results') if options is not None else None
+    if not isinstance(sink, ResultSink):
+        sink = make_result_sink(sink, append=(journal is not None and options.get('resume', False)))
+
+    progress = None
+
+    def record_result(tablename1, tablename2, counts):
+        print_table_result(tablename1, tablename2, *counts)
+        sink.table_done(tablename1, tablename2, counts)
+        if progress is not None:
+            progress.table_done(tablename1, tablename2)
+        if state is not None:
+            incrementals[(tablename1, tablename2)].record(*counts)
+            state.save()
+        if journal is not None:
+            journal.table_done(tablename1, tablename2, counts)
+
+    try:
+        # tables whose count, key bounds and server checksum match are reported
+        # as matching without fetching any rows
+        precheck_time = None
+        if options is not None and options.get('precheck'):
+            start = time.monotonic()
+            with span('precheck', 'diff', tables=len(tables_both)):
+                signatures = precheck_tables(db1, db2, tables_both, connectors, jobs, maxperhost)
+            precheck_time = time.monotonic() - start
+            tables_todo = []
+            for (tablename1, tablename2), (signature1, signature2) in zip(tables_both, signatures):
+                if signature1.matches(signature2):
+                    record_result(tablename1, tablename2, (signature1.rowcount, 0, 0, 0))
+                else:
+                    tables_todo.append((tablename1, tablename2))
+            print("PRECHECK: " + str(len(tables_both) - len(tables_todo)) + " of " + str(len(tables_both))
+                  + " tables match, " + "{:.1f}".format(precheck_time) + "s")
+            tables_both = tables_todo
 
-        tablename1 = db1_match[1]
-        tablename2 = db2_match[1]
+        # with progress the fetched rows are counted per side against the catalog row estimates
+        if options is not None and (options.get('progress') or options.get('metrics') is not None):
+            progress = DiffProgress([ (tablename1, tablename2, get_row_estimate(db1, db2, tablename1, tablename2))
+                                      for tablename1, tablename2 in tables_both ],
+                                    live=bool(options.get('progress')), metricspath=options.get('metrics'))
+            db1, db2 = wrap_databases(db1, db2, connectors, lambda db, side: InstrumentedDatabase(db, progress, side))
 
-        # table exists in both databases so diff the rows...
-        sames, diffs, only1, only2 = tablediff.diff_rows(tablename1, tablename2)
-        if len(diffs) == 0 and len(only1) == 0 and len(only2) == 0:
-            print("TABLE: " + tablename1 + " / " + tablename2 + " " + str(len(sames)) + " ROWS MATCH!")
+        start = time.monotonic()
+        # in partition mode the jobs run the key ranges of one table at a time
+        if jobs > 1 and connectors is not None and mode != 'partition':
+            results = diff_tables_parallel(connectors[0], connectors[1], tables_both, mode, canonicalize,
+                                           options, jobs, maxperhost, wheres, checkpoints, sink, progress)
+            for (tablename1, tablename2), counts in results:
+                record_result(tablename1, tablename2, counts)
         else:
-            print("\nTABLE: " + tablename1 + " / " + tablename2)
-            print("\tSAME COUNT: " + str(len(sames)))
-            if len(diffs) > 0:
-                print("\tDIFFS COUNT: " + str(len(diffs)))
-            if len(only1) > 0:
-                print("\tOnly in DB1 COUNT: " + str(len(only1)))
-            if len(only2) > 0:
-                print("\tOnly in DB2 COUNT: " + str(len(only2)))
-            print("\n")
+            options = dict(options or {}, jobs=jobs)
+            limiter = ConnectionLimiter(maxperhost)
+            tablediff = make_table_diff(db1, db2, mode, canonicalize, options, sink, progress)
+            for tablename1, tablename2 in tables_both:
+                print("CHECK TABLE " + tablename1)
+                if state is not None:
+                    print("\t" + incrementals[(tablename1, tablename2)].get_description())
+                # table exists in both databases so diff the rows...
+                counts = diff_table(tablediff, tablename1, tablename2, mode, options, connectors, limiter,
+                                    wheres.get((tablename1, tablename2)), checkpoints.get((tablename1, tablename2)))
+                record_result(tablename1, tablename2, counts)
+        if precheck_time is not None:
+            print("\nPrecheck time: " + "{:.1f}".format(precheck_time) + "s, diff time: "
+                  + "{:.1f}".format(time.monotonic() - start) + "s for " + str(len(tables_both)) + " tables")
+    finally:
+        sink.close()
+        if journal is not None:
+            journal.close()
+        if progress is not None:
+            progress.close()
+
+    if throttles is not None:
+        print("\nTHROTTLE DB1: " + throttles[0].get_summary())
+        print("THROTTLE DB2: " + throttles[1].get_summary())
+
     # print tables only in one db or the other
     if len(tables_only1) > 0:
         print("\nTABLES ONLY IN DB1\n")
@@ -83,6 +384,52 @@ def maindata(db1:Database, db2:Database, tablelist:Tuple[str], canonicalize=None
             print("\t" + db2table)
 
 
+# diff a snapshot file (as DB1) against a live database or a second snapshot file (as DB2)
+# target is a credentials file or a snapshot file, tablename the DB2 table (default: the snapshot table)
+def snapshotdiff(snapshotpath:str, target:str, tablename:str = None, batchsize:int = DEFAULT_BATCH_SIZE):
+    with TableSnapshot(snapshotpath) as snapshot:
+        print("SNAPSHOT " + snapshot.get_description())
+        if is_snapshot_file(target):
+            with TableSnapshot(target) as snapshot2:
+                print("SNAPSHOT " + snapshot2.get_description())
+                samecount, diffs, only1, only2 = diff_snapshots(snapshot, snapshot2)
+                tablename = snapshot2.tablename
+        else:
+            db = read_database_from_env(target)
+            tablename = tablename or snapshot.tablename
+            print("CHECK TABLE " + tablename)
+            samecount, diffs, only1, only2 = diff_snapshot_table(snapshot, db, tablename, batchsize)
+        print_table_result(snapshot.tablename, tablename, samecount, len(diffs), len(only1), len(only2))
+
+
+# diff the tables and turn the differences into the statements that make DB2
+# match DB1, written to the script output and/or applied to db2
+def repairdata(db1:Database, db2:Database, tablelist:Tuple[str], canonicalize=None, mode='stream',
+               options:dict = None, connectors:Tuple[DatabaseConnector, DatabaseConnector] = None,
+               jobs:int = 1, maxperhost:int = None, output:str = None, apply:bool = False,
+               statementrows:int = DEFAULT_REPAIR_BATCH_ROWS, transactionrows:int = DEFAULT_TRANSACTION_ROWS):
+    if mode == 'sample':
+        raise ValueError('a sampled diff cannot be repaired')
+    repairsink = RepairSink(db2, statementrows, tempdir=(options or {}).get('spilldir'))
+    try:
+        maindata(db1, db2, tablelist, canonicalize, mode, dict(options or {}, results=repairsink),
+                 connectors, jobs, maxperhost)
+        print("\nREPAIR " + str(db2.name))
+        for tablename1, tablename2, counts in repairsink.tables:
+            rowcounts = repairsink.get_counts(tablename2)
+            if len(rowcounts) > 0:
+                print("\t" + tablename2 + ": " + ', '.join(str(count) + ' ' + operation
+                                                          for operation, count in sorted(rowcounts.items())))
+        if output is not None:
+            count = repairsink.write_script(output, transactionrows)
+            print("\tWrote " + str(count) + " statements to " + output)
+        if apply:
+            count = repairsink.apply(db2, transactionrows)
+            print("\tApplied " + str(count) + " transactions to " + str(db2.name))
+    finally:
+        repairsink.cleanup()
+
+
 def dbreport(db:Database, tablelist:Tuple[str]):
     dbscan = DatabaseScan(db)
     table_list = None
@@ -107,20 +454,163 @@ def datadiff():
 
 @click.command()
 @click.argument('db1')
-@click.argument('db2')
+@click.argument('db2', required=False)
 @click.option('--uppercase', '--upper', default=False)
 @click.option('--lowercase', '--lower', default=False)
+@click.option('--mode', type=click.Choice(DIFF_MODES), default='rows',
+              help='rows: compare in memory, stream: merge join ordered rows (constant memory), '
+                   'checksum: bisect primary key ranges by server-side checksums, '
+                   'partition: diff primary key ranges of each table concurrently, '
+                   'fingerprint: hold only key -> row digest maps in memory, '
+                   'spill: hash partition key/digest records to local disk, '
+                   'serverhash: compare per-row MD5 hashes computed by the database servers, '
+                   'sample: estimate mismatch rates from a random sample of rows (see --sample)')
+@click.option('--batch-size', 'batchsize', type=int, default=DEFAULT_BATCH_SIZE,
+              help='rows fetched per round trip in streaming modes')
+@click.option('--leaf-size', 'leafsize', type=int, default=DEFAULT_LEAF_SIZE,
+              help='checksum mode: compare ranges with at most this many rows row by row')
+@click.option('--fanout', type=int, default=DEFAULT_FANOUT,
+              help='checksum mode: number of subranges a mismatched range is split into')
+@click.option('--partitions', type=int, default=DEFAULT_OPTIONS['partitions'],
+              help='partition mode: number of primary key ranges each table is split into')
+@click.option('--max-memory', 'maxmemory', default=None,
+              help='spill mode: memory budget for the partition buffers and one partition, e.g. 512M or 2G')
+@click.option('--spill-dir', 'spilldir', default=None,
+              help='spill mode: directory for the partition files (default: system temp dir)')
+@click.option('--jobs', '-j', type=int, default=1,
+              help='number of tables (or key ranges in partition mode) diffed concurrently, each on its own connections')
+@click.option('--max-connections-per-host', 'maxperhost', type=int, default=None,
+              help='cap on concurrent connections to each database host when --jobs > 1')
+@click.option('--incremental', 'incremental', default=None, metavar='COLUMN',
+              help='only diff rows whose change tracking column (e.g. updated_at) is past the last verified watermark')
+@click.option('--state', 'statefile', default='datadiff-state.json',
+              help='incremental mode: file that holds the watermark and counts of each table')
+@click.option('--checkpoint', 'checkpoint', default=None, metavar='FILE',
+              help='journal finished tables (and key ranges in stream and partition modes) to FILE')
+@click.option('--resume', is_flag=True, default=False,
+              help='skip the work recorded in the --checkpoint journal by an earlier run')
+@click.option('--sample', 'sample', default=None, metavar='SIZE',
+              help='sample SIZE of the rows of each table (e.g. 0.1%) and report estimated divergence; implies --mode sample')
+@click.option('--precheck', is_flag=True, default=False,
+              help='skip tables whose row count, key bounds and server checksum match on both sides')
+@click.option('--against-snapshot', 'against', default=None, metavar='FILE',
+              help='diff the snapshot FILE as DB1 against DB2, given as a credentials file or a second '
+                   'snapshot file; the optional next argument names the DB2 table')
+@click.option('--results', 'results', default='count', metavar='SINK',
+              help='where row level differences go: count (only count them), or a .jsonl, .csv or '
+                   '.db (SQLite) file that receives every differing row and the changed column values')
+@click.option('--chunk-size', 'chunksize', type=int, default=None,
+              help='throttle: read tables in primary key chunks of N rows (the first chunk with --target-latency)')
+@click.option('--target-latency', 'targetlatency', type=float, default=None, metavar='MS',
+              help='throttle: adapt the chunk size to keep each chunk query under MS milliseconds, '
+                   'and back off when a query takes longer')
+@click.option('--max-rows-per-second', 'maxrowrate', type=float, default=None,
+              help='throttle: ceiling on the rows read per second from each server')
+@click.option('--max-threads-running', 'maxthreads', type=int, default=None,
+              help='throttle: wait while MySQL Threads_running is over this threshold')
+@click.option('--progress', 'progress', is_flag=True, default=False,
+              help='show a live progress line on stderr: rows/s and bytes/s per side and the table and overall ETA')
+@click.option('--metrics-file', 'metrics', default=None, metavar='FILE',
+              help='keep progress and throughput metrics in FILE, in Prometheus textfile collector format')
+@click.option('--profile', 'profile', default=None, metavar='FILE',
+              help='write a Chrome trace (chrome://tracing, ui.perfetto.dev) of the schema import, catalog '
+                   'queries and table diffs to FILE')
 @click.argument('tablelist', nargs=-1)  # varargs
-def tablediff(db1, db2, uppercase, lowercase, tablelist):
+def tablediff(db1, db2, uppercase, lowercase, mode, batchsize, leafsize, fanout, partitions, maxmemory, spilldir,
+              jobs, maxperhost, incremental, statefile, checkpoint, resume, sample, precheck, against, results,
+              chunksize, targetlatency, maxrowrate, maxthreads, progress, metrics, profile, tablelist):
+    if against is not None:
+        # the snapshot takes the place of DB1, so the arguments are DB2 [TABLE]
+        if len(tablelist) > 0:
+            raise click.UsageError('--against-snapshot diffs one table: DB2 [TABLE]')
+        # a snapshot diff is its own merge join over digests: it has no diff mode, result
+        # sink, case folding, throttle or progress reporting, so only --batch-size applies
+        ctx = click.get_current_context()
+        ignored = [ param.opts[0] for param in ctx.command.params
+                    if isinstance(param, click.Option) and param.name not in ('against', 'batchsize')
+                    and ctx.get_parameter_source(param.name) != click.core.ParameterSource.DEFAULT ]
+        if len(ignored) > 0:
+            raise click.UsageError('--against-snapshot cannot be combined with ' + ', '.join(ignored))
+        snapshotdiff(against, db1, db2, batchsize)
+        return
+    if db2 is None:
+        raise click.UsageError('missing argument DB2')
     canonicalize = None
     if uppercase:
         canonicalize = str_upper
     elif lowercase:
         canonicalize = str_lower
+    if resume and checkpoint is None:
+        raise click.UsageError('--resume requires --checkpoint FILE')
+    if sample is not None:
+        mode = 'sample'
+    if mode == 'sample' and incremental is not None:
+        raise click.UsageError('a sampled diff cannot advance the --incremental watermark')
+
+    options = {'batchsize': batchsize, 'leafsize': leafsize, 'fanout': fanout, 'partitions': partitions,
+               'spilldir': spilldir, 'incremental': incremental, 'state': statefile,
+               'checkpoint': checkpoint, 'resume': resume, 'precheck': precheck, 'results': results,
+               'chunk_size': chunksize, 'max_rows_per_second': maxrowrate, 'max_threads_running': maxthreads,
+               'progress': progress, 'metrics': metrics}
+    if targetlatency is not None:
+        options['target_latency'] = targetlatency / 1000.0
+    if sample is not None:
+        options['sample'] = parse_sample_fraction(sample)
+    if maxmemory is not None:
+        options['max_memory'] = parse_memory_size(maxmemory)
+    with profiling(profile):
+        with span('import schema', 'import', database=db1):
+            dbobj1 = read_database_from_env(db1)
+        with span('import schema', 'import', database=db2):
+            dbobj2 = read_database_from_env(db2)
+        connectors = (DatabaseConnector(db1, dbobj1), DatabaseConnector(db2, dbobj2))
+        maindata(dbobj1, dbobj2, tablelist, canonicalize=canonicalize, mode=mode, options=options,
+                 connectors=connectors, jobs=jobs, maxperhost=maxperhost)
 
+@click.command()
+@click.argument('db1')
+@click.argument('db2')
+@click.option('--uppercase', '--upper', default=False)
+@click.option('--lowercase', '--lower', default=False)
+@click.option('--mode', type=click.Choice([ mode for mode in DIFF_MODES if mode != 'sample' ]), default='stream',
+              help='diff engine that finds the rows to repair, see tablediff --help')
+@click.option('--batch-size', 'batchsize', type=int, default=DEFAULT_BATCH_SIZE,
+              help='rows fetched per round trip in streaming modes')
+@click.option('--partitions', type=int, default=DEFAULT_OPTIONS['partitions'],
+              help='partition mode: number of primary key ranges each table is split into')
+@click.option('--jobs', '-j', type=int, default=1,
+              help='number of tables (or key ranges in partition mode) diffed concurrently, each on its own connections')
+@click.option('--max-connections-per-host', 'maxperhost', type=int, default=None,
+              help='cap on concurrent connections to each database host when --jobs > 1')
+@click.option('--precheck', is_flag=True, default=False,
+              help='skip tables whose row count, key bounds and server checksum match on both sides')
+@click.option('--output', '-o', 'output', default=None, metavar='FILE',
+              help='write the repair statements for DB2 to the SQL script FILE')
+@click.option('--apply', 'apply', is_flag=True, default=False,
+              help='run the repair statements on DB2')
+@click.option('--statement-rows', 'statementrows', type=int, default=DEFAULT_REPAIR_BATCH_ROWS,
+              help='rows (or keys) per multi-row INSERT or DELETE statement')
+@click.option('--transaction-rows', 'transactionrows', type=int, default=DEFAULT_TRANSACTION_ROWS,
+              help='rows changed per transaction')
+@click.option('--spill-dir', 'spilldir', default=None,
+              help='directory for the spooled statements (default: system temp dir)')
+@click.argument('tablelist', nargs=-1)  # varargs
+def repair(db1, db2, uppercase, lowercase, mode, batchsize, partitions, jobs, maxperhost, precheck, output, apply,
+           statementrows, transactionrows, spilldir, tablelist):
+    if output is None and not apply:
+        raise click.UsageError('repair needs --output FILE and/or --apply')
+    canonicalize = None
+    if uppercase:
+        canonicalize = str_upper
+    elif lowercase:
+        canonicalize = str_lower
     dbobj1 = read_database_from_env(db1)
     dbobj2 = read_database_from_env(db2)
-    maindata(dbobj1, dbobj2, tablelist, canonicalize=canonicalize)
+    options = {'batchsize': batchsize, 'partitions': partitions, 'spilldir': spilldir, 'precheck': precheck}
+    connectors = (DatabaseConnector(db1, dbobj1), DatabaseConnector(db2, dbobj2))
+    repairdata(dbobj1, dbobj2, tablelist, canonicalize=canonicalize, mode=mode, options=options,
+               connectors=connectors, jobs=jobs, maxperhost=maxperhost, output=output, apply=apply,
+               statementrows=statementrows, transactionrows=transactionrows)
 
 @click.command()
 @click.argument('db')
@@ -130,8 +620,23 @@ def tablereport(db, tablelist):
     dbreport(dbobj,tablelist)
 
 
+@click.command()
+@click.argument('db')
+@click.argument('table')
+@click.argument('output')
+@click.option('--batch-size', 'batchsize', type=int, default=DEFAULT_BATCH_SIZE,
+              help='rows fetched per round trip')
+def snapshot(db, table, output, batchsize):
+    dbobj = read_database_from_env(db)
+    print("SNAPSHOT TABLE " + table)
+    count = write_snapshot(dbobj, table, output, batchsize=batchsize)
+    print("\tWrote " + str(count) + " row digests to " + output + " (" + str(os.path.getsize(output)) + " bytes)")
+
+
 datadiff.add_command(tablediff)
 datadiff.add_command(tablereport)
+datadiff.add_command(snapshot)
+datadiff.add_command(repair)
 
 if __name__ == "__main__":
     datadiff()
@@ -0,0 +1,67 @@
+#
+# in-memory Database used to exercise the data diff engines without a server
+#
+
+from typing import Dict, List
+from dbdiff.schema import Column, Database, Table
+from datacompare.rowdigest import row_digest
+
+
+class MemoryDatabase(Database):
+    def __init__(self, name):
+        super().__init__(name)
+        self.data = dict()
+
+    # create a table with the given column names; pkcols names the primary key columns
+    def create_table(self, tablename:str, colnames:List[str], pkcols:List[str], rows:List[Dict]):
+        table = Table(tablename)
+        for position, colname in enumerate(colnames, start=1):
+            column = Column(colname, 'int', tableName=tablename, position=position,
+                            primaryKey=(colname in pkcols))
+            table.columns.append(column)
+        self.add_table(table)
+        self.data[tablename] = list(rows)
+        return table
+
+    def fetch_table_rows(self, tablename:str, where:str = None, orderby:str = None, params:tuple = None) -> List[Dict]:
+        rows = [ dict(row) for row in self.data[tablename] ]
+        if orderby is not None:
+            sortcols = [ expr.strip() for expr in orderby.split(',') ]
+            rows.sort(key=lambda row: tuple(row[col] for col in sortcols))
+        return rows
+
+    def fetch_table_rowcount(self, tablename:str, where:str = None, params:tuple = None) -> int:
+        return len(self.data[tablename])
+
+    def fetch_table_checksum(self, tablename:str, table:Table):
+        colnames = [ col.name for col in table.columns ]
+        digests = sorted(row_digest(row[col] for col in colnames) for row in self.data[tablename])
+        return row_digest(digests).hex()
+
+    def fetch_key_bounds(self, tablename:str, pkcol:Column, where:str = None, params:tuple = None):
+        values = [ row[pkcol.name] for row in self.data[tablename] if row[pkcol.name] is not None ]
+        if len(values) == 0:
+            return None, None
+        return min(values), max(values)
+
+    def fetch_rows_by_keys(self, tablename:str, pklist:List[Column], keys:List[tuple], batchsize:int = 1000) -> List[Dict]:
+        keyset = set(keys)
+        keycols = [ col.name for col in pklist ]
+        return [ dict(row) for row in self.data[tablename] if tuple(row[col] for col in keycols) in keyset ]
+
+    def fetch_key_chunk(self, tablename:str, pklist:List[Column], after:tuple, limit:int,
+                        where:str = None, params:tuple = None, keyexprs:List[str] = None) -> List[Dict]:
+        keycols = [ col.name for col in pklist ]
+        keyfunc = lambda row: tuple(row[col] for col in keycols)
+        rows = sorted((dict(row) for row in self.data[tablename]), key=keyfunc)
+        if after is not None:
+            rows = [ row for row in rows if keyfunc(row) > after ]
+        return rows[:limit]
+
+    # stands in for the server computed row hash
+    def fetch_table_row_hashes(self, tablename:str, table:Table, where:str = None, orderby:str = None,
+                               batchsize:int = 10000, params:tuple = None):
+        keycols = [ col.name for col in table.get_primary_key_columns() ]
+        colnames = [ col.name for col in table.columns ]
+        for row in self.fetch_table_rows(tablename, where, orderby, params):
+            yield tuple(row[col] for col in keycols), row_digest(row[col] for col in colnames)
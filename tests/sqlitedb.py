@@ -0,0 +1,32 @@
+#
+# SQLite databases built from row lists, used to exercise the range predicates
+# the diff engines generate against a real SQL engine
+#
+
+import os
+import sqlite3
+from typing import List
+from dbdiff.schema.sqlite import SQLiteDatabase
+
+
+# create a SQLite file at path with one table and the given rows, and return
+# the imported database
+def make_sqlite_db(path:str, create:str, tablename:str, rows:List[tuple]) -> SQLiteDatabase:
+    conn = sqlite3.connect(path)
+    conn.execute(create)
+    if len(rows) > 0:
+        conn.executemany('INSERT INTO ' + tablename + ' VALUES (' + ', '.join([ '?' ] * len(rows[0])) + ')', rows)
+    conn.commit()
+    conn.close()
+    db = SQLiteDatabase(path)
+    db.connect(database=path)
+    db.import_schema()
+    return db
+
+
+
+# write a credentials file that opens dbpath, for a DatabaseConnector
+def write_env_file(path:str, dbpath:str) -> str:
+    with open(path, 'w') as file:
+        file.write('type=sqlite\ndatabase=' + os.path.abspath(dbpath) + '\n')
+    return path
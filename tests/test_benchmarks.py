@@ -0,0 +1,118 @@
+import pytest
+
+from benchmarks import schemadiff
+from benchmarks.datadiff import compare_to_baselines, read_baselines, run_benchmarks, save_baselines
+from benchmarks.datagen import DIVERGENCES, KEY_TYPES, BenchmarkCase, generate_case, read_expected
+from benchmarks.schemagen import (SchemaShape, import_mysql, import_postgres, make_catalog, make_mysql_rows,
+                                  make_postgres_rows)
+from dbdiff.schema.sqlite import SQLiteDatabase
+from dbdiff.schema.compare import SchemaCompare, TopoSort
+from datacompare.tablediff import TableDiff
+
+
+def open_db(path):
+    db = SQLiteDatabase(path)
+    db.connect(database=path)
+    db.import_schema()
+    return db
+
+
+def make_result(name, rows_per_second, peak_rss_mb, correct=True):
+    return {'name': name, 'rows_per_second': rows_per_second, 'peak_rss_mb': peak_rss_mb,
+            'counts': [ 1, 0, 0, 0 ], 'correct': correct}
+
+
+class TestBenchmarks:
+    @pytest.mark.parametrize('keytype', KEY_TYPES)
+    @pytest.mark.parametrize('divergence', DIVERGENCES)
+    def test_expected_counts(self, tmp_path, keytype, divergence):
+        case = BenchmarkCase(2000, keytype, divergence, width=5, fraction=0.05)
+        casedir = generate_case(case, str(tmp_path))
+        expected = read_expected(casedir)
+        db1 = open_db(casedir + '/db1.sqlite')
+        db2 = open_db(casedir + '/db2.sqlite')
+        samecount, diffs, only1, only2 = TableDiff(db1, db2).diff_rows_stream('bench', 'bench', batchsize=300)
+        assert [ samecount, len(diffs), len(only1), len(only2) ] == expected['counts']
+        if divergence != 'none':
+            assert sum(expected['counts'][1:]) > 0
+        assert db1.fetch_row_estimate('bench') == 2000
+        # a second run reuses the generated files
+        assert generate_case(case, str(tmp_path)) == casedir
+
+    def test_missing_range_is_contiguous(self):
+        case = BenchmarkCase(1000, 'composite', 'missing', fraction=0.1)
+        missing = [ rownum for rownum in range(1000) if case.is_missing(case.get_key(rownum)[1]) ]
+        assert missing == list(range(450, 550))
+
+    def test_compare_to_baselines(self):
+        baselines = {'a/stream': {'rows_per_second': 1000.0, 'peak_rss_mb': 100.0},
+                     'b/stream': {'rows_per_second': 1000.0, 'peak_rss_mb': 100.0}}
+        results = [ make_result('a/stream', 800.0, 120.0), make_result('b/stream', 700.0, 130.0),
+                    make_result('c/stream', 1.0, 1000.0), make_result('d/stream', 1.0, 1.0, correct=False) ]
+        failures = compare_to_baselines(results, baselines, 0.25)
+        assert failures == [ 'b/stream: 700 rows/s, baseline 1,000', 'b/stream: 130.0 MB peak RSS, baseline 100.0',
+                             'd/stream: wrong counts [1, 0, 0, 0]' ]
+
+    def test_run_benchmarks(self, tmp_path):
+        lines = []
+        results = run_benchmarks([ BenchmarkCase(500, 'uuid', 'tail') ], [ 'partition' ], str(tmp_path),
+                                 {'partitions': 3}, repeat=2, log=lines.append)
+        assert len(results) == 1 and results[0]['correct']
+        assert results[0]['rows'] == 505 and results[0]['rows_per_second'] > 0
+        assert len(lines) == 2
+        path = str(tmp_path / 'baselines.json')
+        save_baselines(path, results)
+        assert list(read_baselines(path)) == [ 'uuid-tail-500-w4-f0.01/partition' ]
+
+
+class TestSchemaBenchmarks:
+    def test_import_and_compare(self):
+        shape = SchemaShape(200, columns=6, foreignkeys=2, divergence=0.1)
+        catalog1, catalog2 = make_catalog(shape, 1), make_catalog(shape, 2)
+        mysqldb = import_mysql(make_mysql_rows(catalog1, 'bench'), 'bench')
+        db1 = import_postgres(make_postgres_rows(catalog1, 'bench'), 'bench')
+        db2 = import_postgres(make_postgres_rows(catalog2, 'bench'), 'bench')
+        assert len(mysqldb.tables) == len(catalog1.tables) and len(mysqldb.routines) == 20
+        both, only1, only2 = SchemaCompare(db1, db2).diff_table_list()
+        assert len(only1) > 0 and len(only2) > 0
+        assert len(both) + len(only1) == len(catalog1.tables)
+        changed = [ pair for pair in both if db1.get_table(pair[0]).diff_columns(db2.get_table(pair[1]))[1] ]
+        assert len(changed) > 0
+        for table in catalog1.tables[1:]:
+            # every table has its primary key and foreign keys in both imports
+            mysqltable = mysqldb.get_table(table.name)
+            pgtable = db1.get_table(table.name, 'public')
+            assert len(pgtable.constraints) == len(mysqltable.constraints) == 3 + (table.unique is not None)
+            assert [ col.name for col in pgtable.get_primary_key_columns() ] == [ 'id' ]
+        tables = [ db1.get_table(tablename) for tablename in db1.get_table_list() ]
+        names = [ table.name for table in TopoSort.sort(tables) ]
+        assert sorted(names) == sorted(table.name for table in tables)
+        for table in tables:
+            for con in table.constraints:
+                if con.is_foreign_key():
+                    assert names.index(con.reference_table) < names.index(table.name)
+
+    def test_infoschema_constraints(self):
+        catalog = make_catalog(SchemaShape(50), 1)
+        db = import_postgres(make_postgres_rows(catalog, 'bench', infoschema=True), 'bench')
+        assert all(len(table.constraints) == 0 for table in db.schemas['public'].tables.values())
+        db.fetch_constraints_infoschema('bench', 'public')
+        table = db.get_table(catalog.tables[7].name, 'public')
+        fk = [ con for con in table.constraints if con.is_foreign_key() ][0]
+        assert fk.reference_table == catalog.tables[7].foreignkeys[0][2] and fk.reference_columns == [ 'id' ]
+        assert table.get_column('id').primaryKey
+
+    def test_growth(self):
+        assert schemadiff.fit_exponent({100: 0.01, 1000: 1.0, 10000: 100.0}) == pytest.approx(2.0)
+        assert schemadiff.fit_exponent({100: 0.0001, 1000: 0.01}) is None
+        assert schemadiff.predict_seconds({100: 0.01, 1000: 0.1}, 10000) == pytest.approx(1.0)
+        results = schemadiff.run_benchmarks([ 20, 40 ], {'columns': 5}, steps=[ 'diff_columns', 'TopoSort.sort' ],
+                                 budget=1e-9, log=lambda line: None)
+        # over budget after the first size
+        assert list(results['diff_columns']['seconds']) == [ 20 ]
+        assert list(results['diff_columns']['estimates']) == [ 40 ]
+        baselines = {'diff_columns': {'exponent': 1.0, 'seconds': {'1000': 1.0, '100': 0.001}}}
+        results = {'diff_columns': {'exponent': 1.6, 'seconds': {100: 0.01, 1000: 1.2}, 'estimates': {}}}
+        assert schemadiff.compare_to_baselines(results, baselines, 0.5) == [ 'diff_columns: grows as n^1.60, baseline n^1.00' ]
+        results['diff_columns']['seconds'][1000] = 2.0
+        assert schemadiff.compare_to_baselines(results, baselines, 0.5)[1] == 'diff_columns at 1000 tables: 2.00s, baseline 1.00s'
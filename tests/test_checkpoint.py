@@ -0,0 +1,60 @@
+import datetime
+
+from datacompare.checkpoint import CheckpointJournal, decode_key, encode_key
+from datacompare.keyrange import KeyRange
+from datacompare.tablediff import TableDiff
+from tests.memorydb import MemoryDatabase
+
+
+class TestCheckpoint:
+    def test_key_roundtrip(self):
+        key = (1, 'abc', datetime.date(2024, 1, 2))
+        assert decode_key(encode_key(key)) == key
+        assert encode_key(None) is None
+
+    def test_journal_resume(self, tmp_path):
+        path = str(tmp_path / 'journal.jsonl')
+        journal = CheckpointJournal(path, sync_records=2)
+        journal.table_done('a', 'a', (5, 1, 0, 0))
+        checkpoint = journal.get_table_checkpoint('b', 'b', 'partition')
+        plan = [ KeyRange(None, (10,)), KeyRange((10,), None) ]
+        checkpoint.save_plan(plan)
+        checkpoint.range_done(plan[0], (10, 0, 0, 1))
+        journal.close()
+        # a torn last line from a crash is ignored
+        with open(path, 'a') as FILE:
+            FILE.write('{"event": "range", "tab')
+        journal = CheckpointJournal(path, resume=True)
+        assert journal.get_table_result('a', 'a') == (5, 1, 0, 0)
+        assert journal.get_table_result('b', 'b') is None
+        checkpoint = journal.get_table_checkpoint('b', 'b', 'partition')
+        assert checkpoint.get_plan() == plan
+        assert checkpoint.is_range_done(plan[0])
+        assert not checkpoint.is_range_done(plan[1])
+        assert checkpoint.get_prior_counts() == (10, 0, 0, 1)
+        # ranges of another mode are not reused
+        assert journal.get_table_checkpoint('b', 'b', 'stream').get_prior_counts() == (0, 0, 0, 0)
+        journal.close()
+
+    def test_stream_checkpoints(self, tmp_path):
+        path = str(tmp_path / 'journal.jsonl')
+        db1 = MemoryDatabase('db1')
+        db2 = MemoryDatabase('db2')
+        db1.create_table('t', ['id', 'val'], ['id'], [ {'id':i, 'val':i} for i in range(10) ])
+        db2.create_table('t', ['id', 'val'], ['id'], [ {'id':i, 'val':i} for i in range(1, 10) ])
+        journal = CheckpointJournal(path)
+        checkpoint = journal.get_table_checkpoint('t', 't', 'stream')
+        checkpoint.interval = 6
+        samecount, diffs, only1, only2 = TableDiff(db1, db2).diff_rows_stream('t', 't', checkpoint=checkpoint)
+        journal.close()
+        assert samecount == 9
+        journal = CheckpointJournal(path, resume=True)
+        checkpoint = journal.get_table_checkpoint('t', 't', 'stream')
+        ranges = [ keyrange for keyrange, counts in checkpoint.done ]
+        assert ranges[0].lo is None and ranges[-1].hi is None
+        assert all(ranges[i].hi == ranges[i + 1].lo for i in range(len(ranges) - 1))
+        assert checkpoint.get_prior_counts() == (9, 0, 1, 0)
+        # a finished stream is not diffed again
+        assert checkpoint.is_stream_complete()
+        assert TableDiff(db1, db2).diff_rows_stream('t', 't', checkpoint=checkpoint) == (0, [], [], [])
+        journal.close()
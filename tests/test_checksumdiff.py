@@ -0,0 +1,78 @@
+import pytest
+
+from datacompare.checksumdiff import ChecksumDiff
+from tests.sqlitedb import make_sqlite_db
+
+INT_TABLE = 'CREATE TABLE t (id INTEGER PRIMARY KEY, val INTEGER)'
+COMPOSITE_TABLE = 'CREATE TABLE t (region INTEGER, name VARCHAR(20), val INTEGER, PRIMARY KEY (region, name))'
+
+
+# rows2 is rows1 with the changed keys updated, the missing keys deleted and extra rows added
+def diverge(rows1, changed, missing, extra):
+    rows2 = [ row[:-1] + (row[-1] + 1,) if row[:-1] in changed else row
+              for row in rows1 if row[:-1] not in missing ]
+    return rows2 + extra
+
+
+def run_diff(tmp_path, create, rows1, rows2, capsys, leafsize=8, fanout=4):
+    db1 = make_sqlite_db(str(tmp_path / 'db1.sqlite'), create, 't', rows1)
+    db2 = make_sqlite_db(str(tmp_path / 'db2.sqlite'), create, 't', rows2)
+    samecount, diffs, only1, only2 = ChecksumDiff(db1, db2, leafsize=leafsize, fanout=fanout).diff_rows_checksum('t', 't')
+    output = capsys.readouterr().out
+    leaves = int(output.split('leaf ranges fetched: ')[1].split()[0])
+    return samecount, diffs, only1, only2, leaves
+
+
+def get_keys(rows, keycols):
+    return sorted(tuple(row[col] for col in keycols) for row in rows)
+
+
+class TestChecksumDiff:
+    def test_identical(self, tmp_path, capsys):
+        rows = [ (key, key * 10) for key in range(100) ]
+        samecount, diffs, only1, only2, leaves = run_diff(tmp_path, INT_TABLE, rows, rows, capsys)
+        assert (samecount, len(diffs), len(only1), len(only2)) == (100, 0, 0, 0)
+        assert leaves == 0
+
+    def test_integer_key_boundaries(self, tmp_path, capsys):
+        rows1 = [ (key, key * 10) for key in range(200) ]
+        # 0 and 199 are the ends of the table range, 50 and 51 straddle the first split
+        # of [0, 201), which the extra row 200 makes the table range
+        changed = {(0,), (50,), (51,), (102,), (199,)}
+        missing = {(1,), (101,), (153,)}
+        extra = [ (200, 0) ]
+        rows2 = diverge(rows1, changed, missing, extra)
+        samecount, diffs, only1, only2, leaves = run_diff(tmp_path, INT_TABLE, rows1, rows2, capsys)
+        assert get_keys(diffs, [ 'id' ]) == sorted(changed)
+        assert get_keys(only1, [ 'id' ]) == sorted(missing)
+        assert get_keys(only2, [ 'id' ]) == [ (200,) ]
+        assert samecount == 200 - len(changed) - len(missing)
+        assert [ row['val'] for row in diffs if row['id'] == 50 ] == [ 500 ]
+        # the mismatched ranges were split down to leaves instead of fetched whole
+        assert 1 < leaves < 40
+
+    def test_composite_key(self, tmp_path, capsys):
+        rows1 = [ (region, 'n' + str(seq), region * seq) for region in range(5) for seq in range(30) ]
+        changed = {(0, 'n0'), (2, 'n15'), (4, 'n9')}
+        missing = {(1, 'n29'), (2, 'n0'), (3, 'n3')}
+        # keys before the first and after the last key of DB1
+        extra = [ (-1, 'z', 0), (2, 'n15a', 0), (9, 'a', 0) ]
+        rows2 = diverge(rows1, changed, missing, extra)
+        samecount, diffs, only1, only2, leaves = run_diff(tmp_path, COMPOSITE_TABLE, rows1, rows2, capsys)
+        assert get_keys(diffs, [ 'region', 'name' ]) == sorted(changed)
+        assert get_keys(only1, [ 'region', 'name' ]) == sorted(missing)
+        assert get_keys(only2, [ 'region', 'name' ]) == sorted(row[:-1] for row in extra)
+        assert samecount == 150 - len(changed) - len(missing)
+        assert leaves > 1
+
+    @pytest.mark.parametrize('fanout', [ 2, 3, 7 ])
+    def test_every_row_counted_once(self, tmp_path, capsys, fanout):
+        rows1 = [ (region, format(seq, '03d'), seq) for region in range(3) for seq in range(0, 90, 3) ]
+        changed = set(row[:-1] for row in rows1[::7])
+        missing = set(row[:-1] for row in rows1[3::11])
+        rows2 = diverge(rows1, changed, missing - changed, [])
+        samecount, diffs, only1, only2, leaves = run_diff(tmp_path, COMPOSITE_TABLE, rows1, rows2, capsys,
+                                                          leafsize=5, fanout=fanout)
+        assert samecount + len(diffs) + len(only1) == len(rows1)
+        assert get_keys(only1, [ 'region', 'name' ]) == sorted(missing - changed)
+        assert len(only2) == 0
@@ -0,0 +1,55 @@
+import datetime
+from decimal import Decimal
+
+from datacompare.diffstate import DiffState, IncrementalTable, decode_watermark, encode_watermark, get_watermark_where
+from tests.memorydb import MemoryDatabase
+
+
+def make_dbs(rows1, rows2):
+    db1 = MemoryDatabase('db1')
+    db2 = MemoryDatabase('db2')
+    db1.create_table('t', ['id', 'version'], ['id'], rows1)
+    db2.create_table('t', ['id', 'version'], ['id'], rows2)
+    return db1, db2
+
+
+class TestDiffState:
+    def test_watermark_roundtrip(self):
+        for value in (42, Decimal('1.50'), datetime.datetime(2024, 1, 2, 3, 4, 5, 6), datetime.date(2024, 1, 2)):
+            assert decode_watermark(encode_watermark(value)) == value
+
+    def test_watermark_where(self):
+        assert get_watermark_where('version', None, None) is None
+        assert get_watermark_where('version', 5, 10) == 'version > 5 AND version <= 10'
+        assert get_watermark_where('updated', datetime.datetime(2024, 1, 2, 3, 4, 5), None) == "updated > '2024-01-02 03:04:05'"
+
+    def test_incremental(self, tmp_path):
+        path = str(tmp_path / 'state.json')
+        db1, db2 = make_dbs([ {'id':1, 'version':5}, {'id':2, 'version':9} ], [ {'id':1, 'version':5} ])
+        # first run is a full diff and the watermark stops at the replica's high mark
+        incremental = IncrementalTable(DiffState(path), 'version', 't', 't')
+        assert incremental.plan(db1, db2) is None
+        assert incremental.rebaseline
+        incremental.record(1, 0, 0, 0)
+        incremental.state.save()
+        # second run starts from the saved watermark
+        incremental = IncrementalTable(DiffState(path), 'version', 't', 't')
+        assert incremental.plan(db1, db2) == 'version > 5 AND version <= 5'
+        # a diff with differences does not advance the watermark
+        db2.data['t'].append({'id':2, 'version':9})
+        incremental = IncrementalTable(DiffState(path), 'version', 't', 't')
+        assert incremental.plan(db1, db2) == 'version > 5 AND version <= 9'
+        incremental.record(0, 1, 0, 0)
+        assert incremental.state.get_table('t', 't')['watermark'] == encode_watermark(5)
+
+    def test_schema_change_forces_rebaseline(self, tmp_path):
+        path = str(tmp_path / 'state.json')
+        db1, db2 = make_dbs([ {'id':1, 'version':5} ], [ {'id':1, 'version':5} ])
+        incremental = IncrementalTable(DiffState(path), 'version', 't', 't')
+        incremental.plan(db1, db2)
+        incremental.record(1, 0, 0, 0)
+        incremental.state.save()
+        db2.get_table('t').get_column('version').type = 'bigint'
+        incremental = IncrementalTable(DiffState(path), 'version', 't', 't')
+        assert incremental.plan(db1, db2) is None
+        assert incremental.rebaseline
@@ -0,0 +1,83 @@
+import pytest
+
+from dbdiff.schema import Column, Table
+from dbdiff.schema.mysql import MySQLColumn
+from datacompare.rowdigest import row_digest
+from datacompare.tablediff import TableDiff
+from tests.memorydb import MemoryDatabase
+
+numpy = pytest.importorskip('numpy')
+from datacompare.keyindex import KeyDigestIndex, diff_key_digest_indexes, get_key_dtype, match_keys, make_key_array
+
+
+def intcol(name, coltype='int'):
+    return MySQLColumn(TABLE_NAME='t', COLUMN_NAME=name, COLUMN_TYPE=coltype, COLUMN_KEY='PRI')
+
+
+def make_int_dbs(rows1, rows2, colnames, pkcols):
+    dbs = []
+    for name, rows in (('db1', rows1), ('db2', rows2)):
+        db = MemoryDatabase(name)
+        db.data['t'] = list(rows)
+        table = Table('t')
+        for position, colname in enumerate(colnames, start=1):
+            table.columns.append(MySQLColumn(TABLE_NAME='t', COLUMN_NAME=colname, COLUMN_TYPE='bigint',
+                                             COLUMN_KEY=('PRI' if colname in pkcols else ''), ORDINAL_POSITION=position))
+        db.add_table(table)
+        dbs.append(db)
+    return dbs
+
+
+class TestKeyIndex:
+    def test_key_dtype(self):
+        assert get_key_dtype([ intcol('id') ]) == numpy.dtype('<i8')
+        assert get_key_dtype([ intcol('id', 'bigint unsigned') ]) == numpy.dtype('<u8')
+        assert get_key_dtype([ intcol('a'), intcol('b') ]).names == ('k0', 'k1')
+        # string and untyped keys use the dict path
+        assert get_key_dtype([ intcol('code', 'varchar(10)') ]) is None
+        assert get_key_dtype([ Column('id', 'int') ]) is None
+
+    def test_match_composite_keys(self):
+        dtype = get_key_dtype([ intcol('a'), intcol('b') ])
+        keys1 = make_key_array([ (1, 2), (1, 1), (3, 0) ], dtype)
+        keys2 = make_key_array([ (1, 1), (5, 5) ], dtype)
+        common1, common2, only1, only2 = match_keys(keys1, keys2)
+        assert common1.tolist() == [1] and common2.tolist() == [0]
+        assert only1.tolist() == [0, 2]
+        assert only2.tolist() == [1]
+
+    def test_diff_key_digest_indexes(self):
+        dtype = get_key_dtype([ intcol('id') ])
+        index1 = KeyDigestIndex(dtype).extend(((k,), row_digest([k, k])) for k in range(10))
+        index2 = KeyDigestIndex(dtype).extend(((k,), row_digest([k, k if k != 5 else 0])) for k in range(3, 12))
+        samecount, diffkeys, only1keys, only2keys = diff_key_digest_indexes(index1, index2)
+        assert samecount == 6
+        assert diffkeys == [ (5,) ]
+        assert only1keys == [ (0,), (1,), (2,) ]
+        assert only2keys == [ (10,), (11,) ]
+
+    def test_diff_rows_streams_integer_keys(self, monkeypatch):
+        rows1 = [ {'a':1, 'b':2, 'val':0}, {'a':1, 'b':1, 'val':0}, {'a':3, 'b':3, 'val':3} ]
+        rows2 = [ {'a':1, 'b':1, 'val':1}, {'a':2, 'b':1, 'val':0}, {'a':3, 'b':3, 'val':3} ]
+        db1, db2 = make_int_dbs(rows1, rows2, ['a', 'b', 'val'], ['a', 'b'])
+        # fixed width keys keep the streaming hash join that overlaps fetching and matching
+        joins = []
+        diff_tuple_batches = TableDiff.diff_tuple_batches
+        monkeypatch.setattr(TableDiff, 'diff_tuple_batches',
+                            lambda self, *args: joins.append(1) or diff_tuple_batches(self, *args))
+        sames, diffs, only1, only2 = TableDiff(db1, db2).diff_rows('t', 't')
+        assert joins == [ 1 ]
+        assert sames == [ {'a':3, 'b':3, 'val':3} ]
+        assert diffs == [ {'a':1, 'b':1, 'val':0} ]
+        assert only1 == [ {'a':1, 'b':2, 'val':0} ]
+        assert only2 == [ {'a':2, 'b':1, 'val':0} ]
+
+    def test_diff_rows_fingerprint_numpy_path(self):
+        rows1 = [ {'id':i, 'val':i} for i in range(20) ]
+        rows2 = [ {'id':i, 'val':(i if i != 7 else -1)} for i in range(2, 25) ]
+        db1, db2 = make_int_dbs(rows1, rows2, ['id', 'val'], ['id'])
+        samecount, diffs, only1, only2 = TableDiff(db1, db2).diff_rows_fingerprint('t', 't')
+        assert samecount == 17
+        assert diffs == [ {'id':7, 'val':7} ]
+        assert sorted(row['id'] for row in only1) == [0, 1]
+        assert sorted(row['id'] for row in only2) == list(range(20, 25))
@@ -0,0 +1,135 @@
+from datacompare.keyrange import KeyRange, and_where, get_range_expressions, split_key_range
+from dbdiff.schema.mysql import MySQLColumn, MySQLDatabase
+from dbdiff.schema.postgres import PostgresColumn, PostgresDatabase
+
+
+def make_mysql_key(collation):
+    return [ MySQLColumn('t', 'region', 'int(11)', 'PRI', '', None, 1),
+             MySQLColumn('t', 'name', 'varchar(20)', 'PRI', '', None, 2, collation) ]
+
+
+# answers key at offset queries from a list of keys in server order
+class OffsetDatabase(MySQLDatabase):
+    def __init__(self, keys):
+        super().__init__('db')
+        self.keys = keys
+        self.keyexprs = []
+
+    def fetch_key_at_offset(self, tablename, pklist, offset, where=None, params=None, keyexprs=None):
+        self.keyexprs.append(keyexprs)
+        return self.keys[offset] if offset < len(self.keys) else None
+
+
+class CollationCursor:
+    def __init__(self, queries):
+        self.queries = queries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+
+    def fetchone(self):
+        return {'datcollate': 'en_US.UTF-8'}
+
+
+class CollationPostgresDatabase(PostgresDatabase):
+    def __init__(self):
+        super().__init__('db', [ 'public' ])
+        self.queries = []
+
+    def cursor(self):
+        return CollationCursor(self.queries)
+
+
+class TestKeyRange:
+    def test_where_single_key(self):
+        where, params = KeyRange((1,), (10,)).get_where(['id'])
+        assert where == 'id >= %s AND id < %s'
+        assert params == (1, 10)
+
+    def test_where_composite_key(self):
+        where, params = KeyRange(None, ('a', 2)).get_where(['k1', 'k2'])
+        assert where == '(k1, k2) < (%s, %s)'
+        assert params == ('a', 2)
+
+    def test_where_unbounded(self):
+        assert KeyRange().get_where(['id']) == (None, None)
+
+    def test_and_where(self):
+        assert and_where(None, None, 'id >= %s', (1,)) == ('id >= %s', (1,))
+        assert and_where('x = 1', None, 'id >= %s', (1,)) == ('(x = 1) AND id >= %s', (1,))
+
+    def test_contains(self):
+        keyrange = KeyRange((1,), (10,))
+        assert keyrange.contains((1,))
+        assert not keyrange.contains((10,))
+
+    def test_split_integer_key(self):
+        pkcol = MySQLColumn('t', 'id', 'int(11)', 'PRI', '', None, 1)
+        db = MySQLDatabase('db')
+        ranges = split_key_range(db, 't', [pkcol], KeyRange((0,), (100,)), 4, 100)
+        assert ranges == [ KeyRange((0,), (25,)), KeyRange((25,), (50,)),
+                           KeyRange((50,), (75,)), KeyRange((75,), (100,)) ]
+
+    def test_split_integer_key_narrow(self):
+        pkcol = MySQLColumn('t', 'id', 'bigint unsigned', 'PRI', '', None, 1)
+        db = MySQLDatabase('db')
+        ranges = split_key_range(db, 't', [pkcol], KeyRange((5,), (7,)), 16, 2)
+        assert ranges == [ KeyRange((5,), (6,)), KeyRange((6,), (7,)) ]
+
+    def test_range_expressions_same_collation(self):
+        pklist1 = make_mysql_key('utf8mb4_0900_ai_ci')
+        pklist2 = make_mysql_key('utf8mb4_0900_ai_ci')
+        exprs = get_range_expressions(MySQLDatabase('db1'), MySQLDatabase('db2'), pklist1, pklist2)
+        assert exprs == ([ 'region', 'name' ], [ 'region', 'name' ])
+
+    def test_range_expressions_other_collation(self):
+        pklist1 = make_mysql_key('utf8mb4_0900_ai_ci')
+        pklist2 = make_mysql_key('utf8mb4_general_ci')
+        exprs = get_range_expressions(MySQLDatabase('db1'), MySQLDatabase('db2'), pklist1, pklist2)
+        assert exprs == ([ 'region', 'CAST(name AS BINARY)' ], [ 'region', 'CAST(name AS BINARY)' ])
+
+    def test_range_expressions_unknown_collation(self):
+        pklist = make_mysql_key(None)
+        exprs = get_range_expressions(MySQLDatabase('db1'), MySQLDatabase('db2'), pklist, pklist)
+        assert exprs == ([ 'region', 'CAST(name AS BINARY)' ], [ 'region', 'CAST(name AS BINARY)' ])
+
+    def test_range_expressions_mixed_engines(self):
+        pklist1 = make_mysql_key('C')
+        pklist2 = [ PostgresColumn(column_name='region', udt_name='int4', ordinal_position=1),
+                    PostgresColumn(column_name='name', udt_name='text', ordinal_position=2, collation_name='C') ]
+        exprs = get_range_expressions(MySQLDatabase('db1'), CollationPostgresDatabase(), pklist1, pklist2)
+        assert exprs == ([ 'region', 'CAST(name AS BINARY)' ], [ 'region', 'name COLLATE "C"' ])
+
+    def test_postgres_default_collation(self):
+        db1 = CollationPostgresDatabase()
+        db2 = CollationPostgresDatabase()
+        pklist = [ PostgresColumn(column_name='name', udt_name='text', ordinal_position=1) ]
+        assert db1.get_key_order(pklist) == ('postgres', 'en_US.UTF-8')
+        assert get_range_expressions(db1, db2, pklist, pklist) == ([ 'name' ], [ 'name' ])
+        # the default collation is read once per connection
+        db1.get_key_order(pklist)
+        assert len(db1.queries) == 1
+        # a column collation overrides the default
+        pklist2 = [ PostgresColumn(column_name='name', udt_name='text', ordinal_position=1, collation_name='C') ]
+        assert get_range_expressions(db1, db2, pklist, pklist2) == ([ 'name COLLATE "C"' ], [ 'name COLLATE "C"' ])
+
+    def test_split_in_server_order(self):
+        # a case insensitive collation sorts 'B' between 'a' and 'c', unlike python
+        pklist = [ MySQLColumn('t', 'name', 'varchar(20)', 'PRI', '', None, 1, 'utf8mb4_0900_ai_ci') ]
+        db = OffsetDatabase([ ('a',), ('a',), ('B',), ('c',) ])
+        ranges = split_key_range(db, 't', pklist, KeyRange(), 4, 4, keyexprs=[ 'name' ])
+        assert ranges == [ KeyRange(None, ('a',)), KeyRange(('a',), ('B',)), KeyRange(('B',), ('c',)),
+                           KeyRange(('c',), None) ]
+        assert db.keyexprs == [ [ 'name' ] ] * 3
+        # more parts than rows repeats a split key, which is only used once
+        ranges = split_key_range(db, 't', pklist, KeyRange(), 4, 2, keyexprs=[ 'name' ])
+        assert ranges == [ KeyRange(None, ('a',)), KeyRange(('a',), None) ]
+        # without keyexprs the keys are read in binary order
+        split_key_range(db, 't', pklist, KeyRange(), 2, 4)
+        assert db.keyexprs[-1] == [ 'CAST(name AS BINARY)' ]
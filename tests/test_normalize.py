@@ -0,0 +1,100 @@
+from decimal import Decimal
+import datetime
+import uuid
+
+from dbdiff.schema import Table
+from dbdiff.schema.mysql import MySQLColumn
+from dbdiff.schema.postgres import PostgresColumn
+from datacompare.normalize import NormalizedDatabase, get_column_normalizers, get_table_normalizers
+from datacompare.tablediff import TableDiff
+from tests.memorydb import MemoryDatabase
+
+
+def mysqlcol(name, coltype, key='', position=None):
+    return MySQLColumn(TABLE_NAME='t', COLUMN_NAME=name, COLUMN_TYPE=coltype, COLUMN_KEY=key, ORDINAL_POSITION=position)
+
+def pgcol(name, udtname, primary=False, position=None):
+    col = PostgresColumn(table_name='t', table_schema='public', column_name=name, udt_name=udtname, ordinal_position=position)
+    col.primaryKey = primary
+    return col
+
+def make_db(name, columns, rows):
+    db = MemoryDatabase(name)
+    table = Table('t')
+    table.columns.extend(columns)
+    db.add_table(table)
+    db.data['t'] = list(rows)
+    return db
+
+
+class TestNormalize:
+    def test_value_kinds(self):
+        assert mysqlcol('a', 'tinyint(1)').get_value_kind() == 'intbool'
+        assert mysqlcol('a', 'tinyint(4)').get_value_kind() == 'integer'
+        assert mysqlcol('a', 'decimal(10,2)').get_value_kind() == 'decimal'
+        assert mysqlcol('a', 'decimal(10,2)').get_type_scale() == 2
+        assert mysqlcol('a', 'json').get_value_kind() == 'jsontext'
+        assert mysqlcol('a', 'varchar(36)').get_value_kind() == 'string'
+        assert pgcol('a', 'bool').get_value_kind() == 'bool'
+        assert pgcol('a', 'timestamptz').get_value_kind() == 'datetimetz'
+        assert pgcol('a', 'jsonb').get_value_kind() == 'json'
+
+    def test_column_normalizers(self):
+        func1, func2 = get_column_normalizers(mysqlcol('a', 'tinyint(1)'), pgcol('a', 'bool'))
+        assert func1(1) is True and func2(False) is False and func1(None) is None
+        func1, func2 = get_column_normalizers(mysqlcol('a', 'decimal(10,2)'), pgcol('a', 'float8'))
+        assert func1(Decimal('1.50')) == func2(1.5) and str(func2(1.5)) == '1.50'
+        func1, func2 = get_column_normalizers(mysqlcol('a', 'json'), pgcol('a', 'jsonb'))
+        assert func1('{"b": 1, "a": [1, 2]}') == func2({'a': [1, 2], 'b': 1})
+        func1, func2 = get_column_normalizers(mysqlcol('a', 'datetime'), pgcol('a', 'timestamptz'))
+        aware = datetime.datetime(2024, 1, 1, 12, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+        assert func1 is None and func2(aware) == datetime.datetime(2024, 1, 1, 10, 0)
+        func1, func2 = get_column_normalizers(mysqlcol('a', 'time'), pgcol('a', 'time'))
+        assert func1(datetime.timedelta(hours=1, minutes=2, seconds=3)) == datetime.time(1, 2, 3) and func2 is None
+        func1, func2 = get_column_normalizers(mysqlcol('a', 'blob'), pgcol('a', 'bytea'))
+        assert func1(bytearray(b'x')) == b'x' and func2(memoryview(b'y')) == b'y'
+        value = uuid.uuid4()
+        func1, func2 = get_column_normalizers(mysqlcol('a', 'char(36)'), pgcol('a', 'uuid'))
+        assert func1 is None and func2(value) == str(value)
+        # same kinds need nothing
+        assert get_column_normalizers(mysqlcol('a', 'int'), pgcol('a', 'int4')) == (None, None)
+        assert get_column_normalizers(mysqlcol('a', 'varchar(10)'), pgcol('a', 'text')) == (None, None)
+
+    def test_table_normalizers(self):
+        table1 = Table('t')
+        table1.columns.extend([ mysqlcol('id', 'int'), mysqlcol('flag', 'tinyint(1)'), mysqlcol('only1', 'json') ])
+        table2 = Table('t')
+        table2.columns.extend([ pgcol('id', 'int4'), pgcol('flag', 'bool') ])
+        normalizers1, normalizers2 = get_table_normalizers(table1, table2)
+        assert list(normalizers1.keys()) == [ 'flag' ]
+        assert list(normalizers2.keys()) == [ 'flag' ]
+
+    def test_cross_engine_diff(self):
+        columns1 = [ mysqlcol('id', 'int', 'PRI', 1), mysqlcol('flag', 'tinyint(1)', '', 2),
+                     mysqlcol('amount', 'decimal(10,2)', '', 3), mysqlcol('doc', 'json', '', 4) ]
+        columns2 = [ pgcol('id', 'int4', True, 1), pgcol('flag', 'bool', False, 2),
+                     pgcol('amount', 'numeric', False, 3), pgcol('doc', 'jsonb', False, 4) ]
+        rows1 = [ {'id':i, 'flag':i % 2, 'amount':Decimal(i).quantize(Decimal('0.01')), 'doc':'{"n": %d}' % i}
+                  for i in range(10) ]
+        rows2 = [ {'id':i, 'flag':bool(i % 2), 'amount':Decimal(i if i != 4 else 40), 'doc':{'n': i}}
+                  for i in range(1, 11) ]
+        db1 = make_db('mysql', columns1, rows1)
+        db2 = make_db('postgres', columns2, rows2)
+        for method in ('diff_rows', 'diff_rows_stream', 'diff_rows_fingerprint'):
+            tablediff = TableDiff(db1, db2)
+            result = getattr(tablediff, method)('t', 't')
+            samecount = len(result[0]) if method == 'diff_rows' else result[0]
+            assert samecount == 8, method
+            assert [ row['id'] for row in result[1] ] == [ 4 ], method
+            assert [ row['id'] for row in result[2] ] == [ 0 ], method
+            assert [ row['id'] for row in result[3] ] == [ 10 ], method
+            assert isinstance(tablediff.db1, NormalizedDatabase)
+
+    def test_same_engine_not_wrapped(self):
+        db1 = MemoryDatabase('db1')
+        db2 = MemoryDatabase('db2')
+        db1.create_table('t', ['id', 'val'], ['id'], [ {'id':1, 'val':1} ])
+        db2.create_table('t', ['id', 'val'], ['id'], [ {'id':1, 'val':1} ])
+        tablediff = TableDiff(db1, db2)
+        tablediff.diff_rows('t', 't')
+        assert tablediff.db1 is db1 and tablediff.db2 is db2
@@ -0,0 +1,113 @@
+import inspect
+import threading
+import time
+
+import pytest
+
+from datacompare.parallel import ConnectionLimiter, fetch_batches, get_table_size, prefetch_rows, run_tasks
+from dbdiff.schema.mysql import MySQLTable
+
+
+class TestConnectionLimiter:
+    def test_limit_per_host(self):
+        limiter = ConnectionLimiter(2)
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def worker(task):
+            with limiter.connections(['db1host', 'db2host']):
+                with lock:
+                    active.append(task)
+                    peak.append(len(active))
+                time.sleep(0.01)
+                with lock:
+                    active.remove(task)
+            return task
+
+        results = list(run_tasks(list(range(8)), worker, jobs=4))
+        assert results == list(range(8))
+        assert max(peak) <= 2
+
+    def test_same_host_clamped(self):
+        limiter = ConnectionLimiter(1)
+        # both connections on one host with a cap of 1 must not deadlock
+        with limiter.connections(['host', 'host']):
+            assert limiter.inuse['host'] == 1
+        assert limiter.inuse['host'] == 0
+
+    def test_unlimited(self):
+        limiter = ConnectionLimiter()
+        with limiter.connections(['host']):
+            assert limiter.inuse == {}
+
+
+class TestRunTasks:
+    def test_largest_first_results_in_order(self):
+        started = []
+
+        def worker(task):
+            started.append(task)
+            return task * 10
+
+        tasks = [1, 5, 3]
+        results = list(run_tasks(tasks, worker, jobs=1, sizefunc=lambda task: task))
+        assert started == [5, 3, 1]
+        assert results == [10, 50, 30]
+
+    def test_table_size(self):
+        table = MySQLTable(TABLE_NAME='t', TABLE_ROWS=10, DATA_LENGTH=4096)
+        assert get_table_size(table) == (4096, 10)
+        assert get_table_size(None) == (0, 0)
+
+
+class TestFetchBatches:
+    def test_batches(self):
+        result = { 0: [], 1: [] }
+        for index, batch in fetch_batches([ iter(range(10)), iter(range(100, 105)) ], batchsize=4, depth=1):
+            assert len(batch) <= 4
+            result[index].extend(batch)
+        assert result == { 0: list(range(10)), 1: list(range(100, 105)) }
+
+    def test_sequential(self):
+        batches = list(fetch_batches([ iter([1, 2]), iter([3]) ], batchsize=10, concurrent=False))
+        assert batches == [ (0, [1, 2]), (1, [3]) ]
+
+    def test_error(self):
+        def failing():
+            yield 1
+            raise RuntimeError('lost connection')
+        with pytest.raises(RuntimeError):
+            list(fetch_batches([ failing(), iter(range(3)) ], batchsize=1))
+
+    def test_early_exit(self):
+        rows = prefetch_rows(iter(range(100000)), batchsize=10, depth=2)
+        assert next(rows) == 0
+        # closing the consumer stops the fetch thread
+        rows.close()
+
+    def test_sources_closed(self):
+        closed = []
+        def rows(name, count):
+            try:
+                yield from range(count)
+            finally:
+                closed.append((name, threading.current_thread() is not threading.main_thread()))
+        # the consumer stops after the first batch, the second source was never read
+        sources = [ rows('a', 100000), rows('b', 10) ]
+        batches = fetch_batches(sources, batchsize=10, depth=1, concurrent=False)
+        assert next(batches) == (0, list(range(10)))
+        batches.close()
+        assert closed == [ ('a', True) ]
+        assert all(inspect.getgeneratorstate(source) == inspect.GEN_CLOSED for source in sources)
+        # a failed source is closed by its producer too
+        closed.clear()
+        def failing():
+            try:
+                yield 1
+                raise RuntimeError('lost connection')
+            finally:
+                closed.append(('failing', True))
+        with pytest.raises(RuntimeError):
+            list(fetch_batches([ failing(), rows('c', 3) ], batchsize=1))
+        assert sorted(closed) == [ ('c', True), ('failing', True) ]
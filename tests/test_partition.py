@@ -0,0 +1,85 @@
+import pytest
+
+from datacompare.parallel import DatabaseConnector
+from datacompare.tablediff import TableDiff
+from tests.sqlitedb import make_sqlite_db, write_env_file
+
+INT_TABLE = 'CREATE TABLE t (id INTEGER PRIMARY KEY, val INTEGER)'
+COMPOSITE_TABLE = 'CREATE TABLE t (region INTEGER, seq INTEGER, val INTEGER, PRIMARY KEY (region, seq))'
+STRING_TABLE = 'CREATE TABLE t (code VARCHAR(20) PRIMARY KEY, val INTEGER)'
+
+# keys bunched at both ends of the key space, so equal width and quantile splits differ
+INT_ROWS = [ (key, key) for key in list(range(10)) + list(range(1000, 1097)) ]
+COMPOSITE_ROWS = [ (region, seq, seq) for region in (1, 2, 7) for seq in range(region * 11) ]
+STRING_ROWS = [ (prefix + str(num), num) for prefix in ('A', 'a', 'b-', 'zz') for num in range(23) ]
+
+
+def make_pair(tmp_path, create, rows1, rows2):
+    db1 = make_sqlite_db(str(tmp_path / 'db1.sqlite'), create, 't', rows1)
+    db2 = make_sqlite_db(str(tmp_path / 'db2.sqlite'), create, 't', rows2)
+    return db1, db2
+
+
+# the keys selected by the where clause of each range
+def get_range_keys(db, keyranges):
+    pklist = db.get_table('t').get_primary_key_columns()
+    keycols = [ col.name for col in pklist ]
+    rangekeys = []
+    for keyrange in keyranges:
+        where, params = keyrange.get_where(db.get_key_sort_expressions(pklist))
+        rows = db.fetch_table_rows('t', where, None, params)
+        rangekeys.append([ tuple(row[col] for col in keycols) for row in rows ])
+    return rangekeys
+
+
+class TestPartitions:
+    @pytest.mark.parametrize('create,rows', [ (INT_TABLE, INT_ROWS), (COMPOSITE_TABLE, COMPOSITE_ROWS),
+                                              (STRING_TABLE, STRING_ROWS) ])
+    @pytest.mark.parametrize('partitions', [ 2, 5, 13 ])
+    def test_ranges_cover_keys_once(self, tmp_path, create, rows, partitions):
+        # DB2 has keys beyond both ends of DB1
+        rows2 = rows[5:] + [ (-5,) + rows[0][1:], (9999,) + rows[0][1:] ] if create == INT_TABLE else rows[5:]
+        db1, db2 = make_pair(tmp_path, create, rows, rows2)
+        pklist = db1.get_table('t').get_primary_key_columns()
+        keyranges = TableDiff(db1, db2).get_partitions('t', 't', pklist, partitions)
+        assert 1 < len(keyranges) <= partitions
+        # consecutive ranges share their boundary and the ends are open or cover both tables
+        for previous, keyrange in zip(keyranges, keyranges[1:]):
+            assert previous.hi == keyrange.lo and keyrange.lo is not None
+        for db in (db1, db2):
+            rangekeys = get_range_keys(db, keyranges)
+            allkeys = [ key for keys in rangekeys for key in keys ]
+            keycount = db.fetch_table_rowcount('t')
+            assert len(allkeys) == len(set(allkeys)) == keycount
+            for keyrange, keys in zip(keyranges, rangekeys):
+                assert all(keyrange.contains(key) for key in keys)
+
+    def test_uneven_integer_split(self, tmp_path):
+        db1, db2 = make_pair(tmp_path, INT_TABLE, INT_ROWS, INT_ROWS)
+        pklist = db1.get_table('t').get_primary_key_columns()
+        keyranges = TableDiff(db1, db2).get_partitions('t', 't', pklist, 4)
+        # MIN/MAX bounds split arithmetically, so the low end holds far fewer rows
+        assert keyranges[0].lo == (0,) and keyranges[-1].hi == (1097,)
+        assert [ len(keys) for keys in get_range_keys(db1, keyranges) ] == [ 10, 0, 0, 97 ]
+
+
+class TestPartitionedDiff:
+    @pytest.mark.parametrize('create,rows', [ (INT_TABLE, INT_ROWS), (COMPOSITE_TABLE, COMPOSITE_ROWS),
+                                              (STRING_TABLE, STRING_ROWS) ])
+    def test_diff_rows_partitioned(self, tmp_path, create, rows):
+        # change, drop and add rows at the first and last keys and in between
+        changed = [ rows[0], rows[len(rows) // 2], rows[-1] ]
+        missing = [ rows[1], rows[-2] ]
+        rows2 = [ row[:-1] + (row[-1] + 1,) if row in changed else row for row in rows if row not in missing ]
+        extra = [ (rows[3][0] + 'x',) + rows[3][1:] ] if create == STRING_TABLE else [ (-1,) + rows[3][1:] ]
+        db1, db2 = make_pair(tmp_path, create, rows, rows2 + extra)
+        connectors = [ DatabaseConnector(write_env_file(str(tmp_path / ('db' + str(side) + '.env')),
+                                                        str(tmp_path / ('db' + str(side) + '.sqlite'))), db)
+                       for side, db in ((1, db1), (2, db2)) ]
+        keycols = [ col.name for col in db1.get_table('t').get_primary_key_columns() ]
+        keyfunc = lambda row: tuple(row[col] for col in keycols)
+        samecount, diffs, only1, only2 = TableDiff(db1, db2).diff_rows_partitioned('t', 't', 5, *connectors, jobs=3)
+        assert sorted(map(keyfunc, diffs)) == sorted(row[:len(keycols)] for row in changed)
+        assert sorted(map(keyfunc, only1)) == sorted(row[:len(keycols)] for row in missing)
+        assert sorted(map(keyfunc, only2)) == [ extra[0][:len(keycols)] ]
+        assert samecount == len(rows) - len(changed) - len(missing)
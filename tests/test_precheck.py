@@ -0,0 +1,88 @@
+from decimal import Decimal
+
+from datacompare.precheck import TableSignature, fetch_table_signature, precheck_tables
+from dbdiff.schema.postgres import PostgresColumn, PostgresDatabase, PostgresTable
+from maindata import maindata
+from tests.memorydb import MemoryDatabase
+
+
+def make_dbs():
+    db1 = MemoryDatabase('db1')
+    db2 = MemoryDatabase('db2')
+    for db in (db1, db2):
+        db.create_table('same', ['id', 'val'], ['id'], [ {'id':1, 'val':1}, {'id':2, 'val':2} ])
+        db.create_table('empty', ['id', 'val'], ['id'], [])
+    db1.create_table('changed', ['id', 'val'], ['id'], [ {'id':1, 'val':1}, {'id':2, 'val':2} ])
+    db2.create_table('changed', ['id', 'val'], ['id'], [ {'id':1, 'val':1}, {'id':2, 'val':3} ])
+    return db1, db2
+
+
+# answers the aggregate queries of the precheck and records them
+class RecordingCursor:
+    def __init__(self, queries):
+        self.queries = queries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+        self.query = query
+
+    def fetchone(self):
+        if 'MIN(' in self.query:
+            return {'minkey':1, 'maxkey':3}
+        if 'checksum' in self.query:
+            return {'rowcount':3, 'checksum':Decimal(12345)}
+        return {'rowcount':3}
+
+
+class RecordingPostgresDatabase(PostgresDatabase):
+    def __init__(self):
+        super().__init__('db', [ 'public' ])
+        self.queries = []
+        table = PostgresTable(table_schema='public', table_name='t')
+        for position, name in enumerate([ 'id', 'val' ], start=1):
+            table.add_column(PostgresColumn(table_schema='public', table_name='t', column_name=name,
+                                            udt_name='int4', ordinal_position=position))
+        table.get_column('id').primaryKey = True
+        self.add_table(table)
+
+    def cursor(self):
+        return RecordingCursor(self.queries)
+
+
+class TestPrecheck:
+    def test_signature_matches(self):
+        assert TableSignature(5, 1, 5, 'abc').matches(TableSignature(5, 1, 5, 'abc'))
+        assert not TableSignature(5, 1, 5, 'abc').matches(TableSignature(5, 1, 5, 'abd'))
+        # without a checksum only empty tables match
+        assert not TableSignature(5, 1, 5, None).matches(TableSignature(5, 1, 5, None))
+        assert TableSignature(0, None, None, None).matches(TableSignature(0, None, None, None))
+
+    def test_precheck_tables(self):
+        db1, db2 = make_dbs()
+        tables = [ ('same', 'same'), ('empty', 'empty'), ('changed', 'changed') ]
+        matches = [ sig1.matches(sig2) for sig1, sig2 in precheck_tables(db1, db2, tables) ]
+        assert matches == [ True, True, False ]
+
+    def test_maindata_precheck(self, capsys):
+        db1, db2 = make_dbs()
+        maindata(db1, db2, (), options={'precheck': True})
+        output = capsys.readouterr().out
+        assert 'PRECHECK: 2 of 3 tables match' in output
+        # only the changed table is diffed
+        assert output.count('CHECK TABLE') == 1
+        assert 'CHECK TABLE changed' in output
+
+    def test_postgres_checksum_aggregate(self):
+        db = RecordingPostgresDatabase()
+        signature = fetch_table_signature(db, 'public.t')
+        assert signature == TableSignature(3, 1, 3, (3, 12345))
+        # the checksum is a running sum of row hashes, not an aggregate that grows with the table
+        query = db.queries[-1]
+        assert 'SUM(' in query and '::bit(60)::bigint' in query and 'FROM public.t' in query
+        assert 'string_agg' not in query and 'ORDER BY' not in query
@@ -0,0 +1,114 @@
+import io
+
+import pytest
+
+from datacompare.progress import DiffProgress, InstrumentedDatabase, estimate_row_bytes, format_duration
+from datacompare.tablediff import TableDiff
+from maindata import maindata
+from tests.memorydb import MemoryDatabase
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+
+def make_dbs(rows=100):
+    db1 = MemoryDatabase('db1')
+    db2 = MemoryDatabase('db2')
+    db1.create_table('t', ['id', 'val'], ['id'], [ {'id':i, 'val':'v' + str(i)} for i in range(rows) ])
+    db2.create_table('t', ['id', 'val'], ['id'], [ {'id':i, 'val':'v' + str(i)} for i in range(rows) ])
+    return db1, db2
+
+
+def parse_metrics(text):
+    metrics = dict()
+    for line in text.splitlines():
+        if not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            metrics[name] = float(value)
+    return metrics
+
+
+class TestDiffProgress:
+    def test_estimate_row_bytes(self):
+        assert estimate_row_bytes({'a':'abc', 'b':b'\x00\x01', 'c':5, 'd':None}) == 13
+        assert estimate_row_bytes(('abc', 1)) == 11
+        assert format_duration(3725) == '1:02:05'
+        assert format_duration(None) == '?'
+
+    def test_eta_and_phases(self):
+        clock = FakeClock()
+        progress = DiffProgress([ ('t', 't', 1000), ('u', 'u', None) ], live=False, clock=clock.clock)
+        clock.now = 10.0
+        progress.add_fetch(0, 't', 250, 5000, 2.0)
+        progress.add_fetch(1, 't', 200, 4000, 4.0)
+        table = progress.get_table(0, 't')
+        # started when the first fetch began, 250 of 1000 rows in 10 seconds
+        assert table.start == 8.0
+        clock.now = 18.0
+        assert table.get_rows_done() == 250
+        assert table.get_eta(clock.now) == pytest.approx(30.0)
+        table.add_decode(1.0)
+        assert table.get_phase_times(clock.now) == {'fetch': 4.0, 'decode': 1.0, 'compare': 5.0}
+        progress.table_done('t', 't')
+        assert table.get_eta(clock.now) == 0.0
+        # a table without an estimate counts the rows it has done
+        assert progress.get_totals() == (1000, 1000)
+
+    def test_live_line(self):
+        clock = FakeClock()
+        output = io.StringIO()
+        progress = DiffProgress([ ('t', 't', 2000) ], clock=clock.clock, output=output, interval=1.0)
+        clock.now = 2.0
+        progress.add_fetch(0, 't', 1000, 20000, 1.0)
+        # redrawn at most once per interval
+        clock.now = 2.5
+        progress.add_fetch(1, 't', 1000, 20000, 1.0)
+        assert output.getvalue().count('\r') == 1
+        assert 't 1.0k/2.0k rows, ETA 0:00:01' in output.getvalue()
+        assert 'DB1 500 rows/s 10.0kB/s' in output.getvalue()
+        progress.table_done('t', 't')
+        progress.close()
+        assert output.getvalue().endswith('\n')
+        assert '[100.0%] 1/1 tables' in output.getvalue()
+
+    def test_metrics_file(self, tmp_path):
+        db1, db2 = make_dbs()
+        db1.get_table('t').rows = 100
+        path = str(tmp_path / 'datadiff.prom')
+        progress = DiffProgress([ ('t', 't', 100) ], live=False, metricspath=path)
+        tablediff = TableDiff(InstrumentedDatabase(db1, progress, 0), InstrumentedDatabase(db2, progress, 1))
+        tablediff.progress = progress
+        assert tablediff.diff_rows_fingerprint('t', 't')[0] == 100
+        progress.table_done('t', 't')
+        with open(path) as file:
+            metrics = parse_metrics(file.read())
+        assert metrics['datadiff_rows_fetched_total{side="db1"}'] == 100
+        assert metrics['datadiff_rows_fetched_total{side="db2"}'] == 100
+        assert metrics['datadiff_bytes_fetched_total{side="db1"}'] > 0
+        assert metrics['datadiff_phase_seconds_total{phase="decode"}'] > 0
+        assert metrics['datadiff_table_rows_done{table1="t",table2="t"}'] == 100
+        assert metrics['datadiff_tables_done'] == 1
+        assert metrics['datadiff_eta_seconds'] == 0
+
+    def test_stream_counts(self):
+        db1, db2 = make_dbs(rows=2500)
+        progress = DiffProgress([ ('t', 't', None) ], live=False)
+        tablediff = TableDiff(InstrumentedDatabase(db1, progress, 0), InstrumentedDatabase(db2, progress, 1))
+        samecount, diffs, only1, only2 = tablediff.diff_rows_stream('t', 't', batchsize=100)
+        assert samecount == 2500
+        assert progress.get_table(1, 't').rows == [ 2500, 2500 ]
+
+    def test_maindata(self, tmp_path, capsys):
+        db1, db2 = make_dbs()
+        path = str(tmp_path / 'datadiff.prom')
+        maindata(db1, db2, (), mode='stream', options={'progress': True, 'metrics': path})
+        assert 'tables' in capsys.readouterr().err
+        with open(path) as file:
+            metrics = parse_metrics(file.read())
+        assert metrics['datadiff_rows_done'] == 100
+        assert metrics['datadiff_tables_done'] == 1
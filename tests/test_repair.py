@@ -0,0 +1,169 @@
+import datetime
+import sqlite3
+from decimal import Decimal
+
+import pytest
+
+from dbdiff.schema.mysql import MySQLConstraint
+from datacompare.repair import (MySQLRepairDialect, PostgresRepairDialect, RepairDialect, RepairSink, SQLiteRepairDialect,
+                                get_table_order)
+from maindata import repairdata
+from tests.memorydb import MemoryDatabase
+
+
+class RecordingDatabase(MemoryDatabase):
+    def __init__(self, name):
+        super().__init__(name)
+        self.transactions = []
+
+    def execute_statements(self, statements):
+        self.transactions.append(list(statements))
+
+
+def add_foreign_key(table, reftable):
+    constraint = MySQLConstraint(table.name, 'fk_' + table.name, 'FOREIGN KEY')
+    constraint.reference_table = reftable
+    table.constraints.append(constraint)
+
+
+# parent p and child c (c.pid references p.id); DB2 lacks some rows, has extra
+# rows and a changed row in each table
+def make_dbs(dbclass=MemoryDatabase):
+    db1 = dbclass('db1')
+    db2 = dbclass('db2')
+    p1 = [ {'id':i, 'name':"p'" + str(i)} for i in range(6) ]
+    p2 = [ {'id':i, 'name':"p'" + str(i) if i != 3 else 'x'} for i in range(3, 9) ]
+    c1 = [ {'id':i, 'pid':i % 6, 'name':'c' + str(i)} for i in range(10) ]
+    c2 = [ {'id':i, 'pid':(i % 6) if i != 4 else 5, 'name':'c' + str(i)} for i in range(4, 14) if i % 6 >= 3 ]
+    c2 += [ {'id':20, 'pid':8, 'name':'c20'} ]
+    for db, prows, crows in ((db1, p1, c1), (db2, p2, c2)):
+        # child table first, so the order comes from the foreign keys
+        child = db.create_table('c', ['id', 'pid', 'name'], ['id'], crows)
+        add_foreign_key(child, 'p')
+        db.create_table('p', ['id', 'name'], ['id'], prows)
+    return db1, db2
+
+
+def load_sqlite(db):
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute('CREATE TABLE p (id INTEGER PRIMARY KEY, name TEXT)')
+    conn.execute('CREATE TABLE c (id INTEGER PRIMARY KEY, pid INTEGER REFERENCES p (id), name TEXT)')
+    for tablename in ('p', 'c'):
+        for row in db.data[tablename]:
+            conn.execute('INSERT INTO ' + tablename + ' (' + ', '.join(row) + ') VALUES ('
+                         + ', '.join('?' * len(row)) + ')', tuple(row.values()))
+    return conn
+
+
+class TestRepairDialects:
+    def test_literals(self):
+        dialect = RepairDialect()
+        assert dialect.format_literal(None) == 'NULL'
+        assert dialect.format_literal(True) == 'TRUE'
+        assert dialect.format_literal(Decimal('1.50')) == '1.50'
+        assert dialect.format_literal("it's") == "'it''s'"
+        assert dialect.format_literal(b'\x01\xff') == "X'01ff'"
+        assert dialect.format_literal(datetime.datetime(2024, 1, 2, 3, 4, 5)) == "'2024-01-02 03:04:05'"
+        assert MySQLRepairDialect().format_literal('a\\b') == "'a\\\\b'"
+        assert PostgresRepairDialect().format_literal(b'\x01\xff') == "'\\x01ff'"
+        # TIME values come back as timedelta, written as [-]HH:MM:SS[.ffffff]
+        assert dialect.format_literal(datetime.timedelta(days=1, hours=2)) == "'26:00:00'"
+        assert dialect.format_literal(datetime.timedelta(hours=-1)) == "'-01:00:00'"
+        assert dialect.format_literal(datetime.timedelta(seconds=-1, microseconds=500000)) == "'-00:00:00.500000'"
+        assert MySQLRepairDialect().format_literal(datetime.timedelta(minutes=5, microseconds=7)) == "'00:05:00.000007'"
+        # non-finite floats are quoted where the engine stores them, rejected where it cannot
+        assert dialect.format_literal(1.5) == '1.5'
+        assert PostgresRepairDialect().format_literal(float('inf')) == "'Infinity'"
+        assert PostgresRepairDialect().format_literal(float('-inf')) == "'-Infinity'"
+        assert PostgresRepairDialect().format_literal(float('nan')) == "'NaN'"
+        assert SQLiteRepairDialect().format_literal(float('-inf')) == '-9e999'
+        for value in (float('inf'), float('nan')):
+            with pytest.raises(ValueError):
+                MySQLRepairDialect().format_literal(value)
+        with pytest.raises(ValueError):
+            SQLiteRepairDialect().format_literal(float('nan'))
+
+    def test_mysql_upsert(self):
+        rows = [ {'id':1, 'name':'a'}, {'id':2, 'name':None} ]
+        assert MySQLRepairDialect().get_upsert_statement('t', ['id', 'name'], ['id'], rows) == (
+            "INSERT INTO `t` (`id`, `name`) VALUES (1, 'a'), (2, NULL) ON DUPLICATE KEY UPDATE `name` = VALUES(`name`)")
+
+    def test_postgres_upsert(self):
+        rows = [ {'a':1, 'b':2, 'v':'x'} ]
+        assert PostgresRepairDialect().get_upsert_statement('s.t', ['a', 'b', 'v'], ['a', 'b'], rows) == (
+            'INSERT INTO "s"."t" ("a", "b", "v") VALUES (1, 2, \'x\') ON CONFLICT ("a", "b") DO UPDATE SET "v" = EXCLUDED."v"')
+        assert PostgresRepairDialect().get_upsert_statement('t', ['a'], ['a'], [ {'a':1} ]).endswith('DO NOTHING')
+
+    def test_delete(self):
+        dialect = PostgresRepairDialect()
+        assert dialect.get_delete_statement('t', ['id'], [ (1,), (2,) ]) == 'DELETE FROM "t" WHERE "id" IN (1, 2)'
+        assert dialect.get_delete_statement('t', ['a', 'b'], [ (1, 'x'), (2, 'y') ]) == (
+            'DELETE FROM "t" WHERE ("a", "b") IN ((1, \'x\'), (2, \'y\'))')
+
+
+class TestRepairSink:
+    def test_table_order(self):
+        db1, db2 = make_dbs()
+        order = get_table_order(db2, [ 'c', 'p' ])
+        assert order['p'] < order['c']
+        # a table that is not repaired does not hold back the tables that reference it
+        assert get_table_order(db2, [ 'c' ]) == {'c': 0}
+
+    def test_table_order_cycle(self):
+        db = MemoryDatabase('db')
+        for tablename in ('x', 'b', 'a', 'p'):
+            db.create_table(tablename, ['id', 'ref'], ['id'], [ {'id':1, 'ref':1} ])
+        # a and b reference each other, x references a cycle member, p stands alone
+        add_foreign_key(db.get_table('a'), 'b')
+        add_foreign_key(db.get_table('b'), 'a')
+        add_foreign_key(db.get_table('x'), 'a')
+        order = get_table_order(db, [ 'x', 'b', 'a', 'p' ])
+        assert sorted(order, key=order.get) == [ 'p', 'a', 'b', 'x' ]
+
+    def test_repair_with_cycle(self, tmp_path):
+        db1 = MemoryDatabase('db1')
+        db2 = MemoryDatabase('db2')
+        for db, rows in ((db1, [ {'id':1, 'ref':1} ]), (db2, [])):
+            for tablename, reftable in (('a', 'b'), ('b', 'a')):
+                add_foreign_key(db.create_table(tablename, ['id', 'ref'], ['id'], rows), reftable)
+        path = str(tmp_path / 'repair.sql')
+        repairdata(db1, db2, (), mode='rows', output=path)
+        with open(path) as file:
+            script = file.read()
+        assert script.index('INSERT INTO "a"') < script.index('INSERT INTO "b"')
+
+    @pytest.mark.parametrize('mode', [ 'rows', 'stream', 'fingerprint', 'serverhash' ])
+    def test_script_repairs_target(self, tmp_path, mode):
+        db1, db2 = make_dbs()
+        path = str(tmp_path / 'repair.sql')
+        repairdata(db1, db2, (), mode=mode, output=path, statementrows=2, transactionrows=3)
+        with open(path) as file:
+            script = file.read()
+        # inserts parent first, deletes child first
+        assert script.index('INSERT INTO "p"') < script.index('INSERT INTO "c"')
+        assert script.index('DELETE FROM "c"') < script.index('DELETE FROM "p"')
+        conn = load_sqlite(db2)
+        conn.executescript(script)
+        for tablename in ('p', 'c'):
+            rows = conn.execute('SELECT * FROM ' + tablename + ' ORDER BY id').fetchall()
+            assert rows == [ tuple(row.values()) for row in db1.data[tablename] ]
+
+    def test_apply_in_transactions(self):
+        db1, db2 = make_dbs(RecordingDatabase)
+        sink = RepairSink(db2, batchrows=2)
+        try:
+            sink.write_row('only1', 'p', 'p', ['id'], {'id':0, 'name':'a'})
+            sink.write_row('diff', 'p', 'p', ['id'], {'id':1, 'name':'b'}, {'id':1, 'name':'x'})
+            for i in range(5):
+                sink.write_row('only2', 'c', 'c', ['id'], {'id':i, 'pid':0, 'name':'c'})
+            sink.close()
+            assert sink.get_counts('c') == {'delete': 5}
+            assert sink.apply(db2, transactionrows=3) == 3
+        finally:
+            sink.cleanup()
+        # the generic dialect has no upsert: a batched insert and one update per diff row
+        assert db2.transactions == [
+            [ 'INSERT INTO "p" ("id", "name") VALUES (0, \'a\')', 'UPDATE "p" SET "name" = \'b\' WHERE "id" = 1' ],
+            [ 'DELETE FROM "c" WHERE "id" IN (0, 1)' ],
+            [ 'DELETE FROM "c" WHERE "id" IN (2, 3)', 'DELETE FROM "c" WHERE "id" IN (4)' ] ]
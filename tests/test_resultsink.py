@@ -0,0 +1,163 @@
+import csv
+import json
+import sqlite3
+
+import pytest
+
+from datacompare.resultsink import CSVSink, JSONLSink, ResultSink, RowList, SQLiteSink, get_changed_columns, make_result_sink
+from datacompare.tablediff import TableDiff
+from maindata import maindata
+from tests.memorydb import MemoryDatabase
+
+
+def make_dbs():
+    rows1 = [ {'id':i, 'val':i, 'name':'n' + str(i)} for i in range(10) ]
+    rows2 = [ {'id':i, 'val':(i if i != 5 else -5), 'name':'n' + str(i)} for i in range(2, 12) ]
+    db1 = MemoryDatabase('db1')
+    db2 = MemoryDatabase('db2')
+    db1.create_table('t', ['id', 'val', 'name'], ['id'], rows1)
+    db2.create_table('t', ['id', 'val', 'name'], ['id'], rows2)
+    return db1, db2
+
+
+def read_jsonl(path):
+    with open(path) as file:
+        return [ json.loads(line) for line in file ]
+
+
+class TestResultSink:
+    def test_row_list(self):
+        rows = RowList()
+        rows.add({'id':1}, {'id':1, 'x':2})
+        rows.append({'id':2})
+        more = RowList()
+        more.extend(rows)
+        more.extend([ {'id':3} ])
+        assert more == [ {'id':1}, {'id':2}, {'id':3} ]
+        assert more.others == [ {'id':1, 'x':2}, None, None ]
+
+    def test_changed_columns(self):
+        assert get_changed_columns({'id':1, 'a':1, 'b':2}, {'id':1, 'a':1, 'b':3, 'c':4}) == {'b': [2, 3], 'c': [None, 4]}
+
+    def test_make_result_sink(self, tmp_path):
+        assert type(make_result_sink('count')) is ResultSink
+        for spec, sinkclass in (('out.jsonl', JSONLSink), ('out.csv', CSVSink), ('out.db', SQLiteSink),
+                                ('jsonl:out.txt', JSONLSink)):
+            sink = make_result_sink(str(tmp_path / spec) if ':' not in spec else 'jsonl:' + str(tmp_path / 'out.txt'))
+            assert type(sink) is sinkclass
+            sink.close()
+        with pytest.raises(ValueError):
+            make_result_sink(str(tmp_path / 'out.xyz'))
+
+    @pytest.mark.parametrize('method', [ 'diff_rows_stream', 'diff_rows_fingerprint', 'diff_rows_serverhash' ])
+    def test_streaming_engines_jsonl(self, tmp_path, method):
+        db1, db2 = make_dbs()
+        path = str(tmp_path / 'out.jsonl')
+        sink = JSONLSink(path, batchsize=2)
+        samecount, diffs, only1, only2 = getattr(TableDiff(db1, db2, sink=sink), method)('t', 't')
+        sink.table_done('t', 't', (samecount, len(diffs), len(only1), len(only2)))
+        sink.close()
+        assert (samecount, len(diffs), len(only1), len(only2)) == (7, 1, 2, 2)
+        records = read_jsonl(path)
+        diffrecords = [ record for record in records if record['kind'] == 'diff' ]
+        assert diffrecords == [ {'kind':'diff', 'table1':'t', 'table2':'t', 'key':[5],
+                                 'row':{'id':5, 'val':5, 'name':'n5'}, 'changes':{'val':[5, -5]}} ]
+        assert sorted(record['key'] for record in records if record['kind'] == 'only1') == [ [0], [1] ]
+        assert sorted(record['key'] for record in records if record['kind'] == 'only2') == [ [10], [11] ]
+        assert records[-1] == {'kind':'table', 'table1':'t', 'table2':'t', 'same':7, 'diff':1, 'only1':2, 'only2':2}
+
+    def test_counting_sink_fetches_no_rows(self):
+        db1, db2 = make_dbs()
+        db1.fetch_rows_by_keys = db2.fetch_rows_by_keys = None
+        samecount, diffs, only1, only2 = TableDiff(db1, db2, sink=ResultSink()).diff_rows_serverhash('t', 't')
+        assert (samecount, len(diffs), len(only1), len(only2)) == (7, 1, 2, 2)
+
+    def test_sqlite_sink(self, tmp_path):
+        db1, db2 = make_dbs()
+        path = str(tmp_path / 'out.db')
+        maindata(db1, db2, (), options={'results': path})
+        conn = sqlite3.connect(path)
+        assert conn.execute('SELECT * FROM diff_tables').fetchall() == [ ('t', 't', 7, 1, 2, 2) ]
+        assert conn.execute('SELECT kind, COUNT(*) FROM diff_rows GROUP BY kind ORDER BY kind').fetchall() == [
+            ('diff', 1), ('only1', 2), ('only2', 2) ]
+        assert conn.execute('SELECT r.key, c.column_name, c.before, c.after FROM diff_columns c '
+                            'JOIN diff_rows r ON r.id = c.row_id').fetchall() == [ ('[5]', 'val', '5', '-5') ]
+        conn.close()
+
+    def test_csv_sink(self, tmp_path):
+        db1, db2 = make_dbs()
+        path = str(tmp_path / 'out.csv')
+        sink = CSVSink(path)
+        sames, diffs, only1, only2 = TableDiff(db1, db2).diff_rows('t', 't')
+        sink.add_results('t', 't', [ 'id' ], diffs, only1, only2)
+        sink.close()
+        with open(path, newline='') as file:
+            lines = list(csv.reader(file))
+        assert lines[0] == CSVSink.HEADER
+        assert [ 'diff', 't', 't', '[5]', 'val', '5', '-5' ] in lines
+        assert [ line[0] for line in lines[1:] ].count('only1') == 2
+        assert [ line[0] for line in lines[1:] ].count('only2') == 2
+
+    @pytest.mark.parametrize('spec', [ 'out.jsonl', 'out.csv', 'out.db' ])
+    def test_append(self, tmp_path, spec):
+        path = str(tmp_path / spec)
+        for run in range(2):
+            sink = make_result_sink(path, append=(run == 1))
+            sink.write_row('only1', 't', 't', [ 'id' ], {'id':run})
+            sink.table_done('t', 't', (0, 0, 1, 0))
+            sink.close()
+        if spec.endswith('.db'):
+            conn = sqlite3.connect(path)
+            assert conn.execute('SELECT id, key FROM diff_rows ORDER BY id').fetchall() == [ (1, '[0]'), (2, '[1]') ]
+            assert conn.execute('SELECT COUNT(*) FROM diff_tables').fetchone()[0] == 2
+            conn.close()
+            return
+        if spec.endswith('.csv'):
+            with open(path, newline='') as file:
+                kinds = [ line[0] for line in csv.reader(file) ]
+            # one header at the top
+            assert kinds == [ 'kind', 'only1', 'table', 'only1', 'table' ]
+        else:
+            assert [ record['kind'] for record in read_jsonl(path) ] == [ 'only1', 'table', 'only1', 'table' ]
+        # without append the file is started afresh
+        make_result_sink(path).close()
+        assert 'only1' not in open(path).read()
+
+    def test_stream_rows_written_before_checkpoint(self, tmp_path):
+        db1, db2 = make_dbs()
+        path = str(tmp_path / 'out.jsonl')
+        sink = JSONLSink(path, batchsize=1000)
+
+        # records how many result rows are in the file when each range is journaled
+        class RecordingCheckpoint:
+            interval = 4
+            def __init__(self):
+                self.ranges = []
+            def is_stream_complete(self):
+                return False
+            def get_resume_key(self):
+                return None
+            def range_done(self, keyrange, counts):
+                self.ranges.append((sum(counts[1:]), len(read_jsonl(path))))
+
+        checkpoint = RecordingCheckpoint()
+        TableDiff(db1, db2, sink=sink).diff_rows_stream('t', 't', checkpoint=checkpoint)
+        sink.close()
+        assert len(checkpoint.ranges) > 2
+        written = 0
+        for rangerows, filerows in checkpoint.ranges:
+            written += rangerows
+            assert filerows == written
+
+    def test_resume_appends_results(self, tmp_path):
+        db1, db2 = make_dbs()
+        db1.create_table('u', ['id', 'val'], ['id'], [ {'id':1, 'val':1} ])
+        db2.create_table('u', ['id', 'val'], ['id'], [])
+        options = {'checkpoint': str(tmp_path / 'journal.jsonl'), 'results': str(tmp_path / 'out.jsonl')}
+        maindata(db1, db2, ('t',), options=options)
+        # the resumed run reports t from the journal and keeps its rows
+        maindata(db1, db2, ('t', 'u'), options=dict(options, resume=True))
+        records = read_jsonl(options['results'])
+        assert [ (record['table1'], record['only1']) for record in records if record['kind'] == 'table' ] == [
+            ('t', 2), ('u', 1) ]
+        assert len([ record for record in records if record['table1'] == 't' and record['kind'] != 'table' ]) == 5
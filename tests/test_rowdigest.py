@@ -0,0 +1,47 @@
+from decimal import Decimal
+import datetime
+import uuid
+
+from datacompare.rowdigest import DIGEST_SIZE, encode_value, make_row_digester, pack_key, row_digest, unpack_key
+
+
+class TestRowDigest:
+    def test_digest_size(self):
+        assert len(row_digest([1, 'a', None])) == DIGEST_SIZE
+
+    def test_types_are_distinct(self):
+        assert encode_value(1) != encode_value('1')
+        assert encode_value(True) != encode_value(1)
+        assert encode_value(None) != encode_value('')
+        assert encode_value(b'a') != encode_value('a')
+
+    def test_decimal_normalized(self):
+        assert encode_value(Decimal('1.10')) == encode_value(Decimal('1.1'))
+
+    def test_binary_types(self):
+        assert encode_value(bytearray(b'ab')) == encode_value(b'ab')
+        assert encode_value(memoryview(b'ab')) == encode_value(b'ab')
+
+    def test_values_do_not_run_together(self):
+        assert row_digest(['ab', 'c']) != row_digest(['a', 'bc'])
+
+    def test_datetime(self):
+        value = datetime.datetime(2022, 7, 20, 1, 34, 2)
+        assert row_digest([value]) == row_digest([datetime.datetime(2022, 7, 20, 1, 34, 2)])
+        assert row_digest([value]) != row_digest([value.date()])
+
+    def test_digester_column_order(self):
+        digester = make_row_digester(['id', 'val'])
+        assert digester({'id':1, 'val':2}) == digester({'val':2, 'id':1})
+        assert digester({'id':1}) != digester({'id':1, 'val':None})
+
+
+class TestPackKey:
+    def test_roundtrip(self):
+        key = (1, 'abc', b'\x00\xff', Decimal('1.50'), datetime.date(2024, 1, 2),
+               datetime.datetime(2024, 1, 2, 3, 4, 5), uuid.UUID(int=7), None)
+        assert unpack_key(pack_key(key)) == key
+
+    def test_distinct(self):
+        assert pack_key((1, 23)) != pack_key((12, 3))
+        assert pack_key(('1',)) != pack_key((1,))
@@ -0,0 +1,34 @@
+from dbdiff.schema import Column, Table
+from datacompare.rowlayout import get_row_layout
+
+
+def make_table(colnames, pkcols):
+    table = Table('t')
+    for position, colname in enumerate(colnames, start=1):
+        table.columns.append(Column(colname, 'int', tableName='t', position=position, primaryKey=(colname in pkcols)))
+    return table
+
+
+class TestRowLayout:
+    def test_layout(self):
+        table1 = make_table(['id', 'val', 'code'], ['code', 'id'])
+        # same columns in a different order share table1's layout
+        table2 = make_table(['code', 'id', 'val'], ['code', 'id'])
+        layout = get_row_layout(table1, table2, table1.get_primary_key_columns())
+        assert layout.colnames == ('id', 'val', 'code')
+        assert layout.get_key((1, 2, 'x')) == (1, 'x')
+        assert layout.to_dict((1, 2, 'x')) == {'id':1, 'val':2, 'code':'x'}
+        rows = layout.to_dicts([ (1, 2, 'x'), (3, 4, 'y') ])
+        assert len(rows) == 2
+        assert rows[1] == {'id':3, 'val':4, 'code':'y'}
+        assert rows == [ {'id':1, 'val':2, 'code':'x'}, {'id':3, 'val':4, 'code':'y'} ]
+
+    def test_single_key(self):
+        table = make_table(['id', 'val'], ['id'])
+        layout = get_row_layout(table, table, table.get_primary_key_columns())
+        assert layout.get_key((7, 8)) == 7
+
+    def test_different_columns(self):
+        table1 = make_table(['id', 'val'], ['id'])
+        table2 = make_table(['id', 'val', 'extra'], ['id'])
+        assert get_row_layout(table1, table2, table1.get_primary_key_columns()) is None
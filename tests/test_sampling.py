@@ -0,0 +1,37 @@
+import pytest
+
+from datacompare.sampling import SampleDiff, parse_sample_fraction, wilson_interval
+from tests.memorydb import MemoryDatabase
+
+
+class TestSampling:
+    def test_parse_sample_fraction(self):
+        assert parse_sample_fraction('0.1%') == pytest.approx(0.001)
+        assert parse_sample_fraction('0.25') == 0.25
+        with pytest.raises(ValueError):
+            parse_sample_fraction('150%')
+
+    def test_wilson_interval(self):
+        lo, hi = wilson_interval(0, 1000)
+        assert lo == 0.0 and 0.0 < hi < 0.01
+        lo, hi = wilson_interval(50, 100)
+        assert lo < 0.5 < hi
+        assert wilson_interval(0, 0) == (0.0, 1.0)
+
+    def test_diff_rows_sample(self):
+        rows1 = [ {'id':i, 'val':i} for i in range(2000) ]
+        # every 10th row differs, ids 2000.. only exist in db2
+        rows2 = [ {'id':i, 'val':(i if i % 10 else -1)} for i in range(2200) ]
+        db1 = MemoryDatabase('db1')
+        db2 = MemoryDatabase('db2')
+        db1.create_table('t', ['id', 'val'], ['id'], rows1)
+        db2.create_table('t', ['id', 'val'], ['id'], rows2)
+        sampler = SampleDiff(db1, db2, fraction=0.5)
+        samecount, diffs, only1, only2 = sampler.diff_rows_sample('t', 't')
+        assert len(only1) == 0
+        assert all(row['id'] % 10 == 0 for row in diffs)
+        assert all(row['id'] >= 2000 for row in only2)
+        mismatched, missing2, missing1 = sampler.estimates
+        assert mismatched.lo <= 0.1 <= mismatched.hi
+        assert missing2.count == 0
+        assert missing1.lo <= 200 / 2200 <= missing1.hi
@@ -0,0 +1,91 @@
+import pytest
+
+from dbdiff.schema import Column, Constraint, Database, Index, SchemaAwareDatabase, Table
+
+
+def make_table(name, schema=None, columns=3):
+    table = Table(name, schema)
+    for position in range(1, columns + 1):
+        table.add_column(Column('c' + str(position), 'int', name, schema, position=position))
+    return table
+
+
+class TestSchemaLookup:
+    def test_column_lookup(self):
+        table = make_table('t1')
+        assert table.get_column('c2').position == 2
+        assert table.get_column_by_position(3).name == 'c3'
+        assert table.get_column('c9') is None
+        table.add_column(Column('c4', 'int', 't1', position=4))
+        assert table.get_column('c4') is table.columns[3]
+        # appending to the list directly is picked up on the next lookup
+        table.columns.append(Column('c5', 'int', 't1', position=5))
+        assert table.get_column_by_position(5).name == 'c5'
+        table.columns = table.columns[:2]
+        assert table.get_column('c3') is None
+
+    def test_first_match_wins(self):
+        table = Table('t1')
+        first = Index('ix', 't1')
+        table.add_index(first)
+        table.add_index(Index('ix', 't1'))
+        assert table.get_index('ix') is first
+        table.constraints.append(Constraint('pk', type='PRIMARY KEY', table='t1'))
+        table.add_constraint(Constraint('pk', type='UNIQUE', table='t1'))
+        assert table.get_constraint('pk').type == 'PRIMARY KEY'
+
+    def test_find_constraint(self):
+        db = Database('db')
+        t1 = make_table('t1')
+        t1.add_constraint(Constraint('pk_t1', type='PRIMARY KEY', table='t1'))
+        db.add_table(t1)
+        t2 = make_table('t2')
+        db.add_table(t2)
+        fk = Constraint('fk_t2', type='FOREIGN KEY', table='t2')
+        db.add_constraint(t2, fk)
+        assert db.find_constraint('pk_t1').table == 't1'
+        assert db.find_constraint('fk_t2') is fk and t2.get_constraint('fk_t2') is fk
+        # constraints appended to a table directly are found by the scan
+        t2.constraints.append(Constraint('uq_t2', type='UNIQUE', table='t2'))
+        assert db.find_constraint('uq_t2').type == 'UNIQUE'
+        assert db.find_constraint('missing') is None
+        # replacing a table drops its constraints from the index
+        db.add_table(make_table('t1'))
+        assert db.find_constraint('pk_t1') is None
+        assert db.find_constraint('fk_t2') is fk
+
+    def test_duplicate_constraint_name(self):
+        # constraint names are only unique per table on Postgres; the constraint of
+        # the first table in table order wins, whatever order the constraints came in
+        db = Database('db')
+        t1 = make_table('t1')
+        t2 = make_table('t2')
+        db.add_table(t1)
+        db.add_table(t2)
+        check2 = Constraint('positive', type='CHECK', table='t2')
+        check1 = Constraint('positive', type='CHECK', table='t1')
+        db.add_constraint(t2, check2)
+        db.add_constraint(t1, check1)
+        assert db.find_constraint('positive') is check1
+        # a table added later does not change the match
+        t3 = make_table('t3')
+        t3.add_constraint(Constraint('positive', type='CHECK', table='t3'))
+        db.add_table(t3)
+        assert db.find_constraint('positive') is check1
+        # tables assigned directly keep the scan order too
+        db = Database('db')
+        db.tables['t1'] = make_table('t1')
+        db.tables['t2'] = make_table('t2')
+        db.add_constraint(db.tables['t2'], check2)
+        db.add_constraint(db.tables['t1'], check1)
+        assert db.find_constraint('positive') is check1
+
+    def test_schema_aware_constraint(self):
+        db = SchemaAwareDatabase('db', [ 'public' ], 'public')
+        table = make_table('t1', 'public')
+        db.add_table(table)
+        db.add_constraint(table, Constraint('pk_t1', 'public', 'PRIMARY KEY', 't1'))
+        assert db.find_constraint('pk_t1', 'public').table == 't1'
+        assert db.get_table('t1').get_constraint('pk_t1') is not None
+        with pytest.raises(ValueError):
+            db.add_constraint(make_table('t2', 'other'), Constraint('pk_t2', 'other', 'PRIMARY KEY', 't2'))
@@ -0,0 +1,96 @@
+import pytest
+from click.testing import CliRunner
+
+from datacompare import snapshot as snapshotmodule
+from datacompare.snapshot import TableSnapshot, diff_snapshot_table, diff_snapshots, is_snapshot_file, write_snapshot
+from maindata import tablediff
+from tests.memorydb import MemoryDatabase
+
+
+def make_db(name, rows, colnames=('id', 'val')):
+    db = MemoryDatabase(name)
+    db.create_table('t', list(colnames), ['id'], rows)
+    return db
+
+
+class TestSnapshot:
+    def test_write_and_read(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(snapshotmodule, 'SNAPSHOT_INDEX_INTERVAL', 10)
+        path = str(tmp_path / 't.snap')
+        # rows are written in key order regardless of the table order
+        db = make_db('db1', [ {'id':i, 'val':i * 2} for i in reversed(range(100)) ])
+        assert write_snapshot(db, 't', path) == 100
+        assert is_snapshot_file(path)
+        assert not (tmp_path / 't.snap.tmp').exists()
+        with TableSnapshot(path) as snapshot:
+            assert snapshot.rowcount == 100
+            assert snapshot.tablename == 't'
+            assert snapshot.colnames == ['id', 'val']
+            assert snapshot.pkcolnames == ['id']
+            assert snapshot.engine == 'MemoryDatabase'
+            assert not snapshot.normalized
+            assert len(snapshot.indexkeys) == 10
+            keys = [ key for key, digest in snapshot.iter_records() ]
+            assert keys == [ (i,) for i in range(100) ]
+            # the index seeks to the block holding the start key
+            assert [ key for key, digest in snapshot.iter_records((55,)) ][:2] == [ (55,), (56,) ]
+            assert list(snapshot.iter_records((1000,))) == []
+
+    def test_not_a_snapshot(self, tmp_path):
+        path = tmp_path / 'creds.env'
+        path.write_text('database=x\n')
+        assert not is_snapshot_file(str(path))
+        with pytest.raises(ValueError):
+            TableSnapshot(str(path))
+
+    def test_diff_against_live(self, tmp_path):
+        path = str(tmp_path / 't.snap')
+        write_snapshot(make_db('db1', [ {'id':i, 'val':i} for i in range(50) ]), 't', path)
+        db2 = make_db('db2', [ {'id':i, 'val':(i if i != 20 else -1)} for i in range(5, 60) ])
+        with TableSnapshot(path) as snapshot:
+            samecount, diffs, only1, only2 = diff_snapshot_table(snapshot, db2)
+        assert samecount == 44
+        assert diffs == [ {'id':20, 'val':-1} ]
+        assert only1 == [ (i,) for i in range(5) ]
+        assert [ row['id'] for row in only2 ] == list(range(50, 60))
+
+    def test_diff_against_live_added_column(self, tmp_path):
+        path = str(tmp_path / 't.snap')
+        write_snapshot(make_db('db1', [ {'id':i, 'val':i} for i in range(3) ]), 't', path)
+        db2 = make_db('db2', [ {'id':i, 'val':i, 'extra':0} for i in range(3) ], ('id', 'val', 'extra'))
+        with TableSnapshot(path) as snapshot:
+            samecount, diffs, only1, only2 = diff_snapshot_table(snapshot, db2)
+        assert samecount == 0
+        assert len(diffs) == 3
+
+    def test_diff_snapshots(self, tmp_path):
+        path1 = str(tmp_path / 'a.snap')
+        path2 = str(tmp_path / 'b.snap')
+        write_snapshot(make_db('db1', [ {'id':i, 'val':i} for i in range(10) ]), 't', path1)
+        write_snapshot(make_db('db2', [ {'id':i, 'val':(i if i != 3 else 0)} for i in range(2, 12) ]), 't', path2)
+        with TableSnapshot(path1) as snapshot1, TableSnapshot(path2) as snapshot2:
+            samecount, diffkeys, only1keys, only2keys = diff_snapshots(snapshot1, snapshot2)
+        assert samecount == 7
+        assert diffkeys == [ (3,) ]
+        assert only1keys == [ (0,), (1,) ]
+        assert only2keys == [ (10,), (11,) ]
+
+    def test_diff_other_engine_warns(self, tmp_path, capsys, monkeypatch):
+        path = str(tmp_path / 't.snap')
+        write_snapshot(make_db('db1', [ {'id':1, 'val':1} ]), 't', path)
+        with TableSnapshot(path) as snapshot:
+            diff_snapshot_table(snapshot, make_db('db2', [ {'id':1, 'val':1} ]))
+            assert 'WARNING' not in capsys.readouterr().out
+            monkeypatch.setattr(snapshot, 'engine', 'PostgresDatabase')
+            assert diff_snapshot_table(snapshot, make_db('db2', [ {'id':1, 'val':1} ]))[0] == 1
+            assert 'not normalized' in capsys.readouterr().out
+
+    def test_cli_rejects_ignored_options(self, tmp_path):
+        path = str(tmp_path / 't.snap')
+        write_snapshot(make_db('db1', [ {'id':1, 'val':1} ]), 't', path)
+        runner = CliRunner()
+        for args in [ ['--mode', 'stream'], ['--results', 'out.jsonl'], ['--lowercase', 'true'],
+                      ['--max-rows-per-second', '10'], ['--progress'], ['--profile', 'trace.json'] ]:
+            result = runner.invoke(tablediff, [ '--against-snapshot', path ] + args + [ path ])
+            assert result.exit_code == 2
+            assert 'cannot be combined with ' + args[0] in result.output
@@ -0,0 +1,71 @@
+from datacompare import spilldiff as spillmodule
+from datacompare.spilldiff import ENTRY_MEMORY_ESTIMATE, MAX_PARTITIONS, SpillDiff, parse_memory_size
+from tests.memorydb import MemoryDatabase
+
+
+class TestSpillDiff:
+    def test_parse_memory_size(self):
+        assert parse_memory_size('512') == 512
+        assert parse_memory_size('2K') == 2048
+        assert parse_memory_size('1.5G') == 1536 * 1024 * 1024
+        assert parse_memory_size('64mb') == 64 * 1024 * 1024
+
+    def test_diff_rows_spill(self, tmp_path):
+        rows1 = [ {'id':i, 'val':i} for i in range(100) ]
+        rows2 = [ {'id':i, 'val':(i if i != 50 else -1)} for i in range(5, 110) ]
+        db1 = MemoryDatabase('db1')
+        db2 = MemoryDatabase('db2')
+        db1.create_table('t', ['id', 'val'], ['id'], rows1)
+        db2.create_table('t', ['id', 'val'], ['id'], rows2)
+        # a tiny memory budget forces several partitions
+        spilldiff = SpillDiff(db1, db2, max_memory=2000, tempdir=str(tmp_path))
+        assert spilldiff.get_partition_count('t', 't') > 1
+        samecount, diffs, only1, only2 = spilldiff.diff_rows_spill('t', 't')
+        assert samecount == 94
+        assert diffs == [ {'id':50, 'val':50} ]
+        assert sorted(row['id'] for row in only1) == [0, 1, 2, 3, 4]
+        assert sorted(row['id'] for row in only2) == list(range(100, 110))
+        # partition files are cleaned up
+        assert list(tmp_path.iterdir()) == []
+
+    def test_partition_plan_counts_buffers(self):
+        budget = 64 * 1024 * 1024
+        spilldiff = SpillDiff(None, None, max_memory=budget)
+        rows = 1024 ** 3 // ENTRY_MEMORY_ESTIMATE
+        partitions = spilldiff.get_partition_plan(rows)
+        # the write buffers and one partition map fit in the budget together
+        assert partitions * spilldiff.get_buffer_size(partitions) + rows * ENTRY_MEMORY_ESTIMATE / partitions <= budget
+        assert partitions > -(-rows * ENTRY_MEMORY_ESTIMATE // budget)
+        # a budget too small for the rows stops at the cap, with smaller buffers
+        partitions = spilldiff.get_partition_plan(rows * 100)
+        assert partitions == MAX_PARTITIONS
+        assert partitions * spilldiff.get_buffer_size(partitions) <= budget // 2
+
+    def test_second_pass(self, tmp_path, monkeypatch):
+        # two partitions per pass cannot hold 1000 rows in a 100 row budget,
+        # so the partitions are split again until they fit
+        monkeypatch.setattr(spillmodule, 'MAX_PARTITIONS', 2)
+        rows1 = [ {'id':i, 'val':i} for i in range(1000) ]
+        rows2 = [ {'id':i, 'val':(i if i % 97 != 0 else -1)} for i in range(10, 1010) ]
+        db1 = MemoryDatabase('db1')
+        db2 = MemoryDatabase('db2')
+        db1.create_table('t', ['id', 'val'], ['id'], rows1)
+        db2.create_table('t', ['id', 'val'], ['id'], rows2)
+        spilldiff = SpillDiff(db1, db2, max_memory=100 * ENTRY_MEMORY_ESTIMATE, tempdir=str(tmp_path))
+        divisors = []
+        spill_records = spilldiff.spill_records
+        def record_spill(records, paths, divisor=1):
+            counts = spill_records(records, paths, divisor)
+            divisors.append(divisor)
+            if divisor > 1:
+                assert max(counts) < 1000
+            return counts
+        spilldiff.spill_records = record_spill
+        samecount, diffs, only1, only2 = spilldiff.diff_rows_spill('t', 't')
+        assert max(divisors) >= 8
+        changed = [ i for i in range(10, 1000) if i % 97 == 0 ]
+        assert sorted(row['id'] for row in diffs) == changed
+        assert sorted(row['id'] for row in only1) == list(range(10))
+        assert sorted(row['id'] for row in only2) == list(range(1000, 1010))
+        assert samecount == 990 - len(changed)
+        assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,144 @@
+import sqlite3
+
+import pytest
+
+from dbdiff.schema.sqlite import SQLiteDatabase, get_type_affinity, translate_query
+from datacompare.repair import SQLiteRepairDialect, get_repair_dialect
+from datacompare.parallel import DatabaseConnector
+from datacompare.tablediff import TableDiff
+from main import diff_schema, read_database_from_env as read_schema_database_from_env
+from maindata import diff_table, make_table_diff, read_database_from_env, repairdata
+
+SCHEMA = """
+CREATE TABLE parent (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, data BLOB);
+CREATE TABLE child (pid INTEGER NOT NULL REFERENCES parent, seq INTEGER NOT NULL, val VARCHAR(20),
+                    amount REAL, PRIMARY KEY (pid, seq));
+CREATE INDEX child_val ON child (val, amount);
+"""
+
+
+# DB2 lacks some rows, has extra rows and changed rows in both tables
+def make_file(path, side):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    parents = range(10) if side == 1 else range(2, 12)
+    conn.executemany('INSERT INTO parent VALUES (?, ?, ?)',
+                     [ (i, 'p' + str(i), bytes([i]) if side == 1 or i != 5 else b'x') for i in parents ])
+    children = [ (pid, seq, 'v' + str(pid * seq), pid / 4) for pid in parents for seq in range(3) ]
+    if side == 2:
+        children = [ (pid, seq, val if (pid, seq) != (4, 1) else 'changed', amount)
+                     for pid, seq, val, amount in children if (pid, seq) != (3, 2) ]
+    conn.executemany('INSERT INTO child VALUES (?, ?, ?, ?)', children)
+    conn.commit()
+    conn.close()
+
+
+def open_db(path):
+    db = SQLiteDatabase(path)
+    db.connect(database=path)
+    db.import_schema()
+    return db
+
+
+@pytest.fixture
+def dbfiles(tmp_path):
+    paths = []
+    for side in (1, 2):
+        path = str(tmp_path / ('db' + str(side) + '.sqlite'))
+        make_file(path, side)
+        paths.append(path)
+    return paths
+
+
+def write_env(tmp_path, name, path):
+    envpath = str(tmp_path / name)
+    with open(envpath, 'w') as file:
+        file.write('type=sqlite\ndatabase=' + path + '\n')
+    return envpath
+
+
+class TestSQLiteDatabase:
+    def test_helpers(self):
+        assert translate_query('a = %s AND b IN (%s, %s)') == 'a = ? AND b IN (?, ?)'
+        assert [ get_type_affinity(coltype) for coltype in ('BIGINT', 'VARCHAR(20)', '', 'DOUBLE', 'DECIMAL(10,2)') ] == [
+            'INTEGER', 'TEXT', 'BLOB', 'REAL', 'NUMERIC' ]
+
+    def test_import_schema(self, dbfiles):
+        db = open_db(dbfiles[0])
+        assert sorted(db.get_table_list()) == [ 'child', 'parent' ]
+        child = db.get_table('child')
+        assert [ col.name for col in child.columns ] == [ 'pid', 'seq', 'val', 'amount' ]
+        assert [ col.name for col in child.get_primary_key_columns() ] == [ 'pid', 'seq' ]
+        assert child.get_column('val').is_string_type() and child.get_column('seq').is_integer_type()
+        assert not child.get_column('pid').nullable and child.get_column('val').nullable
+        assert child.get_constraint('PRIMARY').columns == [ 'pid', 'seq' ]
+        fk = child.get_constraint('fk_child_0')
+        assert fk.is_foreign_key() and fk.reference_table == 'parent'
+        assert fk.columns == [ 'pid' ] and fk.reference_columns == [ 'id' ]
+        assert [ col['name'] for col in child.get_index('child_val').columns ] == [ 'val', 'amount' ]
+        parent = db.get_table('parent')
+        unique = [ con for con in parent.constraints if con.type == 'UNIQUE' ]
+        assert len(unique) == 1 and unique[0].columns == [ 'name' ]
+        assert parent.get_index(unique[0].name).unique
+        assert db.fetch_table_rowcount('child', 'pid < %s', (3,)) == 9
+        assert db.fetch_row_estimate('child') is None
+
+    def test_row_estimate_after_analyze(self, dbfiles):
+        conn = sqlite3.connect(dbfiles[0])
+        conn.execute('ANALYZE')
+        conn.commit()
+        conn.close()
+        assert open_db(dbfiles[0]).fetch_row_estimate('child') == 30
+
+    def test_fetch(self, dbfiles):
+        db = open_db(dbfiles[0])
+        child = db.get_table('child')
+        pklist = child.get_primary_key_columns()
+        assert db.fetch_rows_by_keys('child', pklist, [ (1, 2), (4, 0), (99, 0) ]) == [
+            {'pid':1, 'seq':2, 'val':'v2', 'amount':0.25}, {'pid':4, 'seq':0, 'val':'v0', 'amount':1.0} ]
+        assert db.fetch_key_at_offset('child', pklist, 4) == (1, 1)
+        chunk = db.fetch_key_chunk('child', pklist, (1, 1), 2)
+        assert [ (row['pid'], row['seq']) for row in chunk ] == [ (1, 2), (2, 0) ]
+        assert db.fetch_key_bounds('parent', db.get_table('parent').get_primary_key_columns()[0]) == (0, 9)
+        hashes = list(db.fetch_table_row_hashes('parent', db.get_table('parent'), orderby='id'))
+        assert len(hashes) == 10 and hashes[0][0] == (0,) and len(hashes[0][1]) == 16
+        count, checksum = db.fetch_range_checksum('parent', db.get_table('parent'), 'id < %s', (5,))
+        assert count == 5 and checksum == sum(int(digest.hex()[:15], 16) for key, digest in hashes[:5])
+
+    @pytest.mark.parametrize('mode', [ 'rows', 'stream', 'checksum', 'fingerprint', 'spill', 'serverhash' ])
+    def test_diff_modes(self, dbfiles, mode):
+        db1 = open_db(dbfiles[0])
+        db2 = open_db(dbfiles[1])
+        tablediff = make_table_diff(db1, db2, mode, options={'leafsize': 4, 'batchsize': 7})
+        assert diff_table(tablediff, 'parent', 'parent', mode) == (7, 1, 2, 2)
+        assert diff_table(tablediff, 'child', 'child', mode) == (22, 1, 7, 6)
+
+    def test_partition_with_connectors(self, dbfiles, tmp_path):
+        envs = [ write_env(tmp_path, 'db' + str(side) + '.env', path) for side, path in zip((1, 2), dbfiles) ]
+        db1, db2 = [ read_database_from_env(env) for env in envs ]
+        assert isinstance(db1, SQLiteDatabase)
+        connectors = (DatabaseConnector(envs[0], db1), DatabaseConnector(envs[1], db2))
+        tablediff = make_table_diff(db1, db2, 'partition')
+        counts = diff_table(tablediff, 'child', 'child', 'partition', {'partitions': 3, 'jobs': 2}, connectors)
+        assert counts == (22, 1, 7, 6)
+
+    def test_repair_applied(self, dbfiles):
+        db1 = open_db(dbfiles[0])
+        db2 = open_db(dbfiles[1])
+        assert isinstance(get_repair_dialect(db2), SQLiteRepairDialect)
+        repairdata(db1, db2, (), mode='stream', apply=True, statementrows=3)
+        tablediff = TableDiff(db1, db2)
+        for tablename in ('parent', 'child'):
+            samecount, diffs, only1, only2 = tablediff.diff_rows_stream(tablename, tablename)
+            assert (len(diffs), len(only1), len(only2)) == (0, 0, 0)
+
+    def test_schema_diff(self, dbfiles, tmp_path, capsys):
+        conn = sqlite3.connect(dbfiles[1])
+        conn.execute('ALTER TABLE child ADD COLUMN note TEXT')
+        conn.close()
+        db1, db2 = [ read_schema_database_from_env(write_env(tmp_path, 'db' + str(side) + '.env', path))
+                     for side, path in zip((1, 2), dbfiles) ]
+        diff_schema(db1, db2)
+        output = capsys.readouterr().out
+        assert "Only in DB2 Columns:['note']" in output
+        assert output.count('ALL CONSTRAINTS MATCH!') == 2
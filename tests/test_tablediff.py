@@ -0,0 +1,103 @@
+import pytest
+
+from datacompare.tablediff import TableDiff, merge_join
+from dbdiff.schema import SchemaAwareDatabase
+from tests.memorydb import MemoryDatabase
+
+
+def make_dbs(rows1, rows2, colnames=('id', 'val'), pkcols=('id',)):
+    db1 = MemoryDatabase('db1')
+    db2 = MemoryDatabase('db2')
+    db1.create_table('t', list(colnames), list(pkcols), rows1)
+    db2.create_table('t', list(colnames), list(pkcols), rows2)
+    return db1, db2
+
+
+class TestMergeJoin:
+    def test_merge_join(self):
+        rows1 = [1, 2, 4]
+        rows2 = [2, 3, 4, 5]
+        ident = lambda x: x
+        result = list(merge_join(iter(rows1), iter(rows2), ident, ident))
+        assert result == [(1, 1, None), (2, 2, 2), (3, None, 3), (4, 4, 4), (5, None, 5)]
+
+    def test_merge_join_out_of_order(self):
+        ident = lambda x: x
+        with pytest.raises(ValueError):
+            list(merge_join(iter([2, 1]), iter([]), ident, ident))
+
+
+class TestTableDiff:
+    rows1 = [ {'id':1, 'val':10}, {'id':2, 'val':20}, {'id':3, 'val':30} ]
+    rows2 = [ {'id':2, 'val':20}, {'id':3, 'val':31}, {'id':4, 'val':40} ]
+
+    def test_diff_rows(self):
+        db1, db2 = make_dbs(self.rows1, self.rows2)
+        sames, diffs, only1, only2 = TableDiff(db1, db2).diff_rows('t', 't')
+        assert sames == [ {'id':2, 'val':20} ]
+        assert diffs == [ {'id':3, 'val':30} ]
+        assert only1 == [ {'id':1, 'val':10} ]
+        assert only2 == [ {'id':4, 'val':40} ]
+
+    def test_diff_rows_composite_key(self):
+        rows1 = [ {'a':1, 'b':2, 'val':0}, {'a':1, 'b':1, 'val':0} ]
+        rows2 = [ {'a':1, 'b':1, 'val':1}, {'a':2, 'b':1, 'val':0} ]
+        db1, db2 = make_dbs(rows1, rows2, ('a', 'b', 'val'), ('a', 'b'))
+        sames, diffs, only1, only2 = TableDiff(db1, db2).diff_rows('t', 't')
+        assert len(sames) == 0
+        assert diffs == [ {'a':1, 'b':1, 'val':0} ]
+        assert only1 == [ {'a':1, 'b':2, 'val':0} ]
+        assert only2 == [ {'a':2, 'b':1, 'val':0} ]
+
+    def test_diff_rows_different_columns(self):
+        # an extra column on one side makes every matching key a diff
+        db1 = MemoryDatabase('db1')
+        db2 = MemoryDatabase('db2')
+        db1.create_table('t', ['id', 'val'], ['id'], [ {'id':1, 'val':1} ])
+        db2.create_table('t', ['id', 'val', 'extra'], ['id'], [ {'id':1, 'val':1, 'extra':None} ])
+        sames, diffs, only1, only2 = TableDiff(db1, db2).diff_rows('t', 't')
+        assert diffs == [ {'id':1, 'val':1} ]
+
+    def test_diff_rows_stream(self):
+        db1, db2 = make_dbs(list(reversed(self.rows1)), self.rows2)
+        samecount, diffs, only1, only2 = TableDiff(db1, db2).diff_rows_stream('t', 't', batchsize=2)
+        assert samecount == 1
+        assert diffs == [ {'id':3, 'val':30} ]
+        assert only1 == [ {'id':1, 'val':10} ]
+        assert only2 == [ {'id':4, 'val':40} ]
+
+    def test_diff_rows_stream_composite_key(self):
+        rows1 = [ {'a':1, 'b':2, 'val':0}, {'a':1, 'b':1, 'val':0} ]
+        rows2 = [ {'a':1, 'b':1, 'val':0}, {'a':2, 'b':1, 'val':0} ]
+        db1, db2 = make_dbs(rows1, rows2, ('a', 'b', 'val'), ('a', 'b'))
+        samecount, diffs, only1, only2 = TableDiff(db1, db2).diff_rows_stream('t', 't')
+        assert samecount == 1
+        assert only1 == [ {'a':1, 'b':2, 'val':0} ]
+        assert only2 == [ {'a':2, 'b':1, 'val':0} ]
+
+    def test_diff_rows_fingerprint(self):
+        db1, db2 = make_dbs(self.rows1, self.rows2)
+        samecount, diffs, only1, only2 = TableDiff(db1, db2).diff_rows_fingerprint('t', 't')
+        assert samecount == 1
+        assert diffs == [ {'id':3, 'val':30} ]
+        assert only1 == [ {'id':1, 'val':10} ]
+        assert only2 == [ {'id':4, 'val':40} ]
+
+    def test_diff_rows_serverhash(self):
+        db1, db2 = make_dbs(self.rows1, self.rows2)
+        samecount, diffs, only1, only2 = TableDiff(db1, db2).diff_rows_serverhash('t', 't')
+        assert samecount == 1
+        assert diffs == [ {'id':3, 'val':30} ]
+        assert only1 == [ {'id':1, 'val':10} ]
+        assert only2 == [ {'id':4, 'val':40} ]
+
+    def test_schema_aware_stream_fallback(self):
+        # the default stream passes where, orderby and params through to fetch_table_rows
+        class RecordingDatabase(SchemaAwareDatabase):
+            def fetch_table_rows(self, tablename, where=None, orderby=None, params=None):
+                self.call = (tablename, where, orderby, params)
+                return [ {'id':1} ]
+        db = RecordingDatabase('db', [ 'public' ], 'public')
+        rows = list(db.fetch_table_rows_stream('t', 'id > %s', 'id', params=(0,)))
+        assert rows == [ {'id':1} ]
+        assert db.call == ('t', 'id > %s', 'id', (0,))
@@ -0,0 +1,128 @@
+import pytest
+
+from dbdiff.schema import key_chunk_query
+from datacompare.tablediff import TableDiff
+from datacompare.throttle import MIN_LOAD_BACKOFF, Throttle, ThrottledDatabase
+from maindata import maindata
+from tests.memorydb import MemoryDatabase
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_throttle(**kwargs):
+    clock = FakeClock()
+    return Throttle(clock=clock.clock, sleep=clock.sleep, **kwargs), clock
+
+
+# records the key expressions of the chunk queries, the key sorts like a string key
+class ChunkRecordingDatabase(MemoryDatabase):
+    def __init__(self, name):
+        super().__init__(name)
+        self.keyexprs = []
+
+    def get_key_sort_expressions(self, pklist):
+        return [ col.name + ' COLLATE "C"' for col in pklist ]
+
+    def fetch_key_chunk(self, tablename, pklist, after, limit, where=None, params=None, keyexprs=None):
+        self.keyexprs.append(keyexprs)
+        return super().fetch_key_chunk(tablename, pklist, after, limit, where, params, keyexprs)
+
+
+def make_dbs():
+    db1 = MemoryDatabase('db1')
+    db2 = MemoryDatabase('db2')
+    db1.create_table('t', ['id', 'val'], ['id'], [ {'id':i, 'val':i} for i in range(100) ])
+    db2.create_table('t', ['id', 'val'], ['id'], [ {'id':i, 'val':(i if i != 50 else -1)} for i in range(5, 105) ])
+    return db1, db2
+
+
+class TestThrottle:
+    def test_key_chunk_query(self):
+        assert key_chunk_query('t', ['a']) == 'SELECT * FROM t ORDER BY a LIMIT %s'
+        assert key_chunk_query('t', ['a', 'b'], 'x = %s', after=True) == (
+            'SELECT * FROM t WHERE (x = %s) AND (a, b) > (%s, %s) ORDER BY a, b LIMIT %s')
+
+    def test_latency_target(self):
+        throttle, clock = make_throttle(chunksize=1000, target_latency=0.2)
+        # over the target: shrink in proportion and pause for the query time
+        assert throttle.chunk_done(1000, 1000, 0.4) == 500
+        assert clock.sleeps == [ 0.4 ]
+        # well under the target: grow, at most doubling
+        assert throttle.chunk_done(500, 500, 0.15) == 666
+        assert throttle.chunk_done(666, 666, 0.01) == 1332
+        # a short last chunk does not grow
+        assert throttle.chunk_done(1332, 10, 0.01) == 1332
+        assert throttle.stats.backoffs == 1
+        assert throttle.stats.chunks == 4
+
+    def test_rate_ceiling(self):
+        throttle, clock = make_throttle(chunksize=100, max_rows_per_second=1000)
+        for count in range(3):
+            throttle.chunk_done(100, 100, 0.0)
+        # each 100 rows costs 0.1s
+        assert clock.now == pytest.approx(0.3)
+        assert throttle.stats.ratesleep == pytest.approx(0.3)
+
+    def test_threads_running_backoff(self):
+        throttle, clock = make_throttle(max_threads_running=10)
+        db = MemoryDatabase('db')
+        readings = [ 50, 40, 5 ]
+        db.fetch_threads_running = lambda: readings.pop(0)
+        throttle.wait_for_load(db)
+        assert clock.sleeps == [ MIN_LOAD_BACKOFF, MIN_LOAD_BACKOFF * 2 ]
+        assert throttle.stats.loadwaits == 2
+        assert throttle.stats.maxthreads == 50
+        # not checked again within the load check interval
+        throttle.wait_for_load(db)
+        assert readings == []
+
+    def test_scan_chunks(self):
+        db1, db2 = make_dbs()
+        throttle, clock = make_throttle(chunksize=30)
+        db = ThrottledDatabase(db1, throttle)
+        rows = list(db.fetch_table_rows_stream('t'))
+        assert [ row['id'] for row in rows ] == list(range(100))
+        assert throttle.stats.chunks == 4
+        assert db.fetch_table_tuples('t', ['val', 'id'])[:2] == [ (0, 0), (1, 1) ]
+
+    def test_scan_key_expressions(self):
+        db = ChunkRecordingDatabase('db')
+        db.create_table('t', ['id', 'val'], ['id'], [ {'id':i, 'val':i} for i in range(10) ])
+        throttled = ThrottledDatabase(db, make_throttle(chunksize=4)[0])
+        # unordered scans page by the plain key, which the primary key index serves
+        assert len(throttled.fetch_table_rows('t')) == 10
+        assert len(throttled.fetch_table_tuples('t', ['id'])) == 10
+        assert db.keyexprs == [ ['id'] ] * 6
+        # a key order scan keeps the sort expressions the merge join needs
+        db.keyexprs = []
+        assert len(list(throttled.fetch_table_rows_stream('t', None, 'id COLLATE "C"'))) == 10
+        assert db.keyexprs == [ ['id COLLATE "C"'] ] * 3
+
+    @pytest.mark.parametrize('method', [ 'diff_rows', 'diff_rows_stream', 'diff_rows_fingerprint' ])
+    def test_throttled_diff(self, method):
+        db1, db2 = make_dbs()
+        throttle1, clock1 = make_throttle(chunksize=16, target_latency=0.2)
+        throttle2, clock2 = make_throttle(chunksize=16, target_latency=0.2)
+        tablediff = TableDiff(ThrottledDatabase(db1, throttle1), ThrottledDatabase(db2, throttle2))
+        result = getattr(tablediff, method)('t', 't')
+        counts = [ len(part) if type(part) is not int else part for part in result ]
+        assert counts == [ 94, 1, 5, 5 ]
+        assert throttle1.stats.rows >= 100 and throttle2.stats.rows >= 100
+
+    def test_maindata_summary(self, capsys):
+        db1, db2 = make_dbs()
+        maindata(db1, db2, (), mode='stream', options={'chunk_size': 25})
+        out = capsys.readouterr().out
+        assert 'THROTTLE DB1: 100 rows in 5 chunks of 25-25 rows' in out
+        assert 'THROTTLE DB2: 100 rows in 5 chunks' in out
@@ -0,0 +1,112 @@
+import json
+import sqlite3
+import threading
+
+from dbdiff import tracing
+from dbdiff.schema import Column, Database, Table
+from dbdiff.schema.compare import SchemaCompare
+from dbdiff.tracing import NULL_SPAN, fetch_all, profiled, profiling, span, start_profiling, stop_profiling
+
+
+def make_db(name, tablenames):
+    db = Database(name)
+    for tablename in tablenames:
+        table = Table(tablename)
+        table.columns.append(Column('id', 'int', position=1))
+        db.add_table(table)
+    return db
+
+
+@profiled('test')
+def build_list(count):
+    return [ bytearray(100) for i in range(count) ]
+
+
+def get_spans(trace, name=None):
+    return [ event for event in trace['traceEvents'] if event['ph'] == 'X' and (name is None or event['name'] == name) ]
+
+
+class TestTracing:
+    def test_off(self):
+        assert tracing.get_profiler() is None
+        assert span('anything', x=1) is NULL_SPAN
+        with span('anything') as nullspan:
+            nullspan.set(rows=1)
+        assert len(build_list(3)) == 3
+
+    def test_nested_spans(self):
+        profiler = start_profiling()
+        try:
+            with span('outer', 'test', table='t') as outer:
+                build_list(10000)
+                outer.set(rows=5)
+        finally:
+            stop_profiling()
+        trace = profiler.get_trace()
+        inner = get_spans(trace, 'build_list')[0]
+        outer = get_spans(trace, 'outer')[0]
+        assert outer['args']['table'] == 't' and outer['args']['rows'] == 5
+        assert outer['ts'] <= inner['ts'] and inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+        # the list built in the inner span is the peak of both spans
+        assert inner['args']['memory_peak_bytes'] >= 10000 * 100
+        assert outer['args']['memory_peak_bytes'] >= inner['args']['memory_peak_bytes']
+        assert outer['args']['memory_delta_bytes'] < 10000 * 100
+        assert profiler.get_totals()['build_list'][0] == 1
+
+    def test_threads(self):
+        profiler = start_profiling(trace_memory=False)
+        try:
+            threads = [ threading.Thread(target=build_list, args=(10,), name='worker' + str(i)) for i in range(2) ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            stop_profiling()
+        trace = profiler.get_trace()
+        names = [ event['args']['name'] for event in trace['traceEvents'] if event['ph'] == 'M' ]
+        assert sorted(names) == [ 'worker0', 'worker1' ]
+        assert len(set(event['tid'] for event in get_spans(trace))) == 2
+        assert 'memory_peak_bytes' not in get_spans(trace)[0]['args']
+
+    def test_query_span(self, tmp_path):
+        conn = sqlite3.connect(':memory:')
+        conn.execute('CREATE TABLE t (id INTEGER)')
+        conn.executemany('INSERT INTO t VALUES (?)', [ (i,) for i in range(7) ])
+        assert len(fetch_all(conn.cursor(), 'SELECT * FROM t')) == 7
+        path = str(tmp_path / 'trace.json')
+        with profiling(path):
+            rows = fetch_all(conn.cursor(), 'SELECT *\n  FROM t WHERE id < ?', (5,), 'select t')
+        assert len(rows) == 5
+        with open(path) as file:
+            trace = json.load(file)
+        query = get_spans(trace, 'select t')[0]
+        assert query['cat'] == 'query'
+        assert query['args']['sql'] == 'SELECT * FROM t WHERE id < ?'
+        assert query['args']['params'] == [ '5' ]
+        assert query['args']['rows'] == 5
+        assert tracing.get_profiler() is None
+
+    def test_error_recorded(self):
+        profiler = start_profiling(trace_memory=False)
+        try:
+            with span('failing'):
+                raise ValueError('x')
+        except ValueError:
+            pass
+        finally:
+            stop_profiling()
+        assert get_spans(profiler.get_trace(), 'failing')[0]['args']['error'] == 'ValueError'
+
+    def test_compare_spans(self):
+        db1 = make_db('db1', [ 'a', 'b' ])
+        db2 = make_db('db2', [ 'b', 'c' ])
+        profiler = start_profiling(trace_memory=False)
+        try:
+            both, only1, only2 = SchemaCompare(db1, db2).diff_table_list()
+            db1.get_table('b').diff_columns(db2.get_table('b'))
+        finally:
+            stop_profiling()
+        assert both == [ ('b', 'b') ]
+        names = [ event['name'] for event in get_spans(profiler.get_trace()) ]
+        assert names == [ 'SchemaCompare.diff_table_list', 'Table.diff_columns' ]